@@ -0,0 +1,628 @@
+"""
+HTTP JSON API for Closetly, served by asyncio. Each request borrows an
+aiomysql connection from the pool of its user's database role, so a
+handful of connections serve many concurrent clients, and a slow query
+only holds up its own request. The operations themselves are the same
+ones the command-line app runs (see service.py).
+
+Log in with POST /login {"username": ..., "password": ...} and send the
+token it returns as "Authorization: Bearer <token>" with every other
+request. Bodies are JSON; see ROUTES for every endpoint.
+
+Usage:
+    $ python3 api.py                     # http://127.0.0.1:8121
+    $ python3 api.py --host 0.0.0.0 --port 8080
+    $ python3 api.py --db sqlite:/tmp/closetly.db   # no MySQL server
+
+Needs aiomysql (pip install aiomysql) and the closetly MySQL database,
+unless it runs on an embedded SQLite database (see backends.py).
+"""
+import argparse
+import asyncio
+import datetime
+import decimal
+import json
+import re
+import sys
+import time
+from urllib.parse import parse_qs, unquote, urlsplit
+
+import backends
+import browse
+import datagen
+import pool
+import querystats
+import service
+import store_search
+import text_search
+import tokens
+import wears
+from db import AsyncDb, BlockingDb
+from service import ServiceError
+
+HOST = '127.0.0.1'
+PORT = 8121
+# Most open connections per database role
+API_POOL_SIZE = 10
+# Seconds a login token stays valid
+SESSION_TTL = 3600
+# Most checked login tokens remembered
+MAX_CHECKED_TOKENS = 100000
+# Largest request body accepted, in bytes
+MAX_BODY = 1024 * 1024
+# Seconds an idle keep-alive connection is kept open
+KEEP_ALIVE_TIMEOUT = 15
+
+REASONS = {200: 'OK', 201: 'Created', 400: 'Bad Request',
+           401: 'Unauthorized', 403: 'Forbidden', 404: 'Not Found',
+           405: 'Method Not Allowed', 409: 'Conflict',
+           413: 'Payload Too Large', 500: 'Internal Server Error'}
+
+
+class _Encoder(json.JSONEncoder):
+    """
+    Sends DECIMAL prices as numbers and dates as ISO 8601 strings.
+    """
+
+    def default(self, value):
+        if isinstance(value, decimal.Decimal):
+            return float(value)
+        if isinstance(value, (datetime.date, datetime.datetime)):
+            return value.isoformat()
+        return json.JSONEncoder.default(self, value)
+
+
+def to_json(value):
+    return json.dumps(value, cls=_Encoder).encode('utf-8')
+
+
+class Sessions:
+    """
+    Login tokens handed out by this server. Tokens are signed (see
+    tokens.py), so any server sharing the key accepts them without a
+    database lookup; tokens already checked are remembered, so most
+    requests skip even the signature check. A token expires SESSION_TTL
+    seconds after login, or when its user logs out.
+    """
+
+    def __init__(self, ttl=SESSION_TTL, signer=None):
+        self.ttl = ttl
+        self.signer = signer or tokens.Signer()
+        # token -> (Session, expiry as a Unix time), for checked tokens
+        self._checked = {}
+        # token -> expiry, for tokens whose users logged out
+        self._revoked = {}
+
+    def create(self, session):
+        return self.signer.sign(session, self.ttl)
+
+    def get(self, token):
+        entry = self._checked.get(token)
+        if entry is None:
+            if not token or token in self._revoked:
+                return None
+            entry = self.signer.verify(token)
+            if entry is None:
+                return None
+            if len(self._checked) >= MAX_CHECKED_TOKENS:
+                self._forget_expired()
+            self._checked[token] = entry
+        if entry[1] <= time.time():
+            del self._checked[token]
+            return None
+        return entry[0]
+
+    def drop(self, token):
+        entry = self._checked.pop(token, None) or \
+            self.signer.verify(token)
+        if entry is not None:
+            if len(self._revoked) >= MAX_CHECKED_TOKENS:
+                self._forget_expired()
+            self._revoked[token] = entry[1]
+
+    def _forget_expired(self):
+        now = time.time()
+        for remembered in (self._checked, self._revoked):
+            for token, entry in list(remembered.items()):
+                expires = entry[1] if isinstance(entry, tuple) else entry
+                if expires <= now:
+                    del remembered[token]
+        if len(self._checked) >= MAX_CHECKED_TOKENS:
+            # still full of live tokens: check them again as they come
+            self._checked.clear()
+
+
+# ----------------------------------------------------------------------
+# Endpoints. Each takes (db, session, request) and returns what to send.
+# ----------------------------------------------------------------------
+def _int_arg(request, name, default):
+    value = request.query.get(name, default)
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ServiceError(name + ' must be a number.')
+
+
+async def list_clothes(db, session, request):
+    return await service.browse_page(
+        db, 'clothes', _int_arg(request, 'after', 0),
+        _int_arg(request, 'limit', browse.PAGE_SIZE))
+
+
+async def list_collab(db, session, request):
+    return await service.browse_page(
+        db, 'collab', _int_arg(request, 'after', 0),
+        _int_arg(request, 'limit', browse.PAGE_SIZE))
+
+
+async def list_user_collab(db, session, request):
+    return await service.collab_items_of(db, int(request.path_args[0]))
+
+
+async def list_closet(db, session, request):
+    return await service.personal_closet(db, session)
+
+
+async def list_store(db, session, request):
+    return await service.browse_page(
+        db, 'store', _int_arg(request, 'after', 0),
+        _int_arg(request, 'limit', browse.PAGE_SIZE),
+        store_name=request.path_args[0])
+
+
+async def search(db, session, request):
+    body = request.body
+    return await service.search_stores(
+        db, body.get('filters', {}), body.get('sort', 'id'),
+        body.get('after'),
+        body.get('limit', store_search.PAGE_SIZE))
+
+
+async def keyword_search(db, session, request):
+    body = request.body
+    return await service.keyword_search(
+        db, body['text'], body.get('filters', {}), body.get('offset', 0),
+        body.get('limit', text_search.PAGE_SIZE))
+
+
+async def borrow(db, session, request):
+    return await service.borrow(db, session, request.body['clothing_id'])
+
+
+async def return_item(db, session, request):
+    return await service.return_item(db, session,
+                                     request.body['clothing_id'])
+
+
+async def join_waitlist(db, session, request):
+    return await service.join_waitlist(db, session,
+                                       request.body['clothing_id'])
+
+
+async def find_available(db, session, request):
+    return await service.find_available(db, session,
+                                        request.body['wishes'])
+
+
+async def create_outfit(db, session, request):
+    body = request.body
+    return await service.create_outfit(db, session, body['clothing_ids'],
+                                       body.get('description', ''),
+                                       body.get('vibe', ''))
+
+
+async def get_outfit(db, session, request):
+    return await service.get_outfit(db, int(request.path_args[0]))
+
+
+async def compare_item_price(db, session, request):
+    return await service.compare_prices(db, session,
+                                        [int(request.path_args[0])])
+
+
+async def compare_prices(db, session, request):
+    return await service.compare_prices(db, session,
+                                        request.body['clothing_ids'])
+
+
+async def compare_outfit_prices(db, session, request):
+    return await service.compare_outfit_prices(db, session,
+                                               int(request.path_args[0]))
+
+
+async def log_wears(db, session, request):
+    body = request.body
+    return await service.log_wears(db, session, body['clothing_ids'],
+                                   body.get('worn_on'))
+
+
+async def store_dashboard(db, session, request):
+    return await service.store_dashboard(db, session, request.path_args[0])
+
+
+async def my_store_dashboard(db, session, request):
+    return await service.store_dashboard(db, session)
+
+
+async def store_dashboards(db, session, request):
+    return await service.store_dashboards(db, session)
+
+
+async def closet_dashboard(db, session, request):
+    return await service.closet_dashboard(db, session,
+                                          int(request.path_args[0]))
+
+
+async def my_closet_dashboard(db, session, request):
+    return await service.closet_dashboard(db, session)
+
+
+async def query_stats(db, session, request):
+    return service.query_stats(session)
+
+
+async def recommend(db, session, request):
+    body = request.body
+    return await service.recommend(db, session, body.get('clothing_ids', []),
+                                   body.get('vibe'), body.get('scopes'),
+                                   body.get('user_id'), body.get('limit'))
+
+
+async def add_store_item(db, session, request):
+    body = request.body
+    return await service.add_store_item(db, session, body['clothing_id'],
+                                        body['price'],
+                                        body.get('discount', 0))
+
+
+async def remove_store_item(db, session, request):
+    return await service.remove_store_item(db, session,
+                                           int(request.path_args[0]))
+
+
+async def sell(db, session, request):
+    body = request.body
+    if 'clothing_ids' in body:
+        return await service.sell_items(db, session, body['clothing_ids'],
+                                        body['user_id'])
+    return await service.sell(db, session, body['clothing_id'],
+                              body['user_id'])
+
+
+async def quote_cart(db, session, request):
+    return await service.quote_cart(db, session, request.body['items'])
+
+
+async def checkout_cart(db, session, request):
+    return await service.checkout_cart(db, session, request.body['items'])
+
+
+async def reprice(db, session, request):
+    return await service.reprice(db, session, request.body['clothing_id'],
+                                 request.body['discount'])
+
+
+async def markdown(db, session, request):
+    body = request.body
+    return await service.markdown(db, session, body['discount'],
+                                  body.get('clothing_type'),
+                                  body.get('brand'),
+                                  body.get('clothing_ids'))
+
+
+# (method, path pattern, endpoint). Captured path parts are passed as
+# request.path_args. /login, /logout and /accounts are handled by Api.
+ROUTES = [
+    ('GET', r'/clothes', list_clothes),
+    ('GET', r'/collab', list_collab),
+    ('GET', r'/collab/users/(\d+)', list_user_collab),
+    ('GET', r'/closet', list_closet),
+    ('GET', r'/stores/([^/]+)', list_store),
+    ('POST', r'/search', search),
+    ('POST', r'/search/text', keyword_search),
+    ('POST', r'/borrow', borrow),
+    ('POST', r'/return', return_item),
+    ('POST', r'/waitlist', join_waitlist),
+    ('POST', r'/available', find_available),
+    ('POST', r'/outfits', create_outfit),
+    ('GET', r'/outfits/(\d+)', get_outfit),
+    ('POST', r'/recommend', recommend),
+    ('GET', r'/prices/(\d+)', compare_item_price),
+    ('POST', r'/prices', compare_prices),
+    ('GET', r'/prices/outfits/(\d+)', compare_outfit_prices),
+    ('POST', r'/cart', quote_cart),
+    ('POST', r'/checkout', checkout_cart),
+    ('POST', r'/wears', log_wears),
+    ('GET', r'/dashboard/store', my_store_dashboard),
+    ('GET', r'/dashboard/stores', store_dashboards),
+    ('GET', r'/dashboard/stores/([^/]+)', store_dashboard),
+    ('GET', r'/dashboard/closet', my_closet_dashboard),
+    ('GET', r'/dashboard/closets/(\d+)', closet_dashboard),
+    ('GET', r'/admin/stats', query_stats),
+    ('POST', r'/store/items', add_store_item),
+    ('DELETE', r'/store/items/(\d+)', remove_store_item),
+    ('POST', r'/sell', sell),
+    ('POST', r'/reprice', reprice),
+    ('POST', r'/markdown', markdown),
+]
+_COMPILED_ROUTES = [(method, re.compile(pattern + '$'), endpoint)
+                    for method, pattern, endpoint in ROUTES]
+
+
+class Request:
+    """
+    One parsed HTTP request.
+    """
+
+    def __init__(self, method, target, headers, body):
+        self.method = method
+        url = urlsplit(target)
+        self.path = unquote(url.path)
+        self.query = {name: values[-1]
+                      for name, values in parse_qs(url.query).items()}
+        self.headers = headers
+        self.body = body
+        self.path_args = ()
+
+    def token(self):
+        auth = self.headers.get('authorization', '')
+        if auth.lower().startswith('bearer '):
+            return auth[7:].strip()
+        return None
+
+
+class Api:
+    """
+    The API server: one aiomysql pool per database role (or one embedded
+    SQLite connection, see backends.py), and the login tokens of logged-in
+    users.
+    """
+
+    def __init__(self, settings=datagen.MYSQL_SETTINGS,
+                 pool_size=API_POOL_SIZE, backend=None):
+        self.settings = settings
+        self.pool_size = pool_size
+        self.backend = backend or backends.configured()
+        self.sessions = Sessions()
+        self._pools = {}
+        self._pool_lock = asyncio.Lock()
+        self._sqlite = None
+
+    async def _pool(self, role):
+        role = pool.normalize_role(role)
+        async with self._pool_lock:
+            if role not in self._pools:
+                # only needed when the API is served
+                import aiomysql
+                user, password = pool.ROLE_CREDENTIALS[role]
+                self._pools[role] = await aiomysql.create_pool(
+                    host=self.settings['host'],
+                    port=int(self.settings['port']),
+                    user=user, password=password,
+                    db=self.settings['database'],
+                    autocommit=True, minsize=1, maxsize=self.pool_size)
+            return self._pools[role]
+
+    async def run(self, role, fn, *args):
+        """
+        Runs fn(db, *args) on a connection from the role's pool.
+        """
+        if backends.is_sqlite(self.backend):
+            # SQLite never makes an operation wait, so each one runs to the
+            # end before the next starts and they can share a connection
+            if self._sqlite is None:
+                self._sqlite = backends.connect(self.backend, None, None)
+            return await fn(BlockingDb(self._sqlite), *args)
+        role_pool = await self._pool(role)
+        async with role_pool.acquire() as conn:
+            return await fn(AsyncDb(conn), *args)
+
+    async def roll_up_wears(self, interval=wears.ROLLUP_INTERVAL):
+        """
+        Adds the logged wears up into the closets every `interval` seconds
+        (see wears.py), until cancelled.
+        """
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                with querystats.operation('wear roll-up'):
+                    await self.run('appadmin', wears.roll_up_all)
+            except Exception as err:
+                print('Error rolling up wears: ' + repr(err),
+                      file=sys.stderr)
+
+    async def close(self):
+        for role_pool in self._pools.values():
+            role_pool.close()
+            await role_pool.wait_closed()
+        self._pools = {}
+        if self._sqlite is not None:
+            self._sqlite.close()
+            self._sqlite = None
+
+    async def dispatch(self, request):
+        """
+        Returns (HTTP status, JSON-able response) for a request.
+        """
+        if request.path == '/login' and request.method == 'POST':
+            with querystats.operation('POST /login'):
+                session = await self.run(
+                    'appadmin', service.login, request.body['username'],
+                    request.body['password'])
+            return 200, dict(session._asdict(),
+                             token=self.sessions.create(session))
+        if request.path == '/accounts' and request.method == 'POST':
+            body = request.body
+            with querystats.operation('POST /accounts'):
+                session = await self.run(
+                    'appadmin', service.create_account, body.get('name'),
+                    body.get('username'), body.get('password'),
+                    body.get('account_type'))
+            return 201, dict(session._asdict(),
+                             token=self.sessions.create(session))
+        if request.path == '/logout' and request.method == 'POST':
+            self.sessions.drop(request.token())
+            return 200, {'logged_out': True}
+
+        allowed = False
+        for method, pattern, endpoint in _COMPILED_ROUTES:
+            match = pattern.match(request.path)
+            if match is None:
+                continue
+            allowed = True
+            if method == request.method:
+                break
+        else:
+            if allowed:
+                return 405, {'error': 'Method not allowed.'}
+            return 404, {'error': 'No such endpoint.'}
+        session = self.sessions.get(request.token())
+        if session is None:
+            raise ServiceError('Please log in first.', 401)
+        request.path_args = match.groups()
+        # statements are counted per route, whatever IDs are in the path
+        with querystats.operation(method + ' ' + pattern.pattern[:-1]):
+            return 200, await self.run(session.role, endpoint, session,
+                                       request)
+
+    async def handle(self, request):
+        try:
+            return await self.dispatch(request)
+        except ServiceError as err:
+            return err.status, {'error': err.message}
+        except KeyError as err:
+            return 400, {'error': 'Missing field: ' + str(err)}
+        except (TypeError, ValueError) as err:
+            return 400, {'error': 'Bad request: ' + str(err)}
+        except Exception as err:
+            print('Error serving ' + request.method + ' ' + request.path +
+                  ': ' + repr(err), file=sys.stderr)
+            return 500, {'error': 'An error occurred, please contact the '
+                                  'administrator.'}
+
+    async def serve_connection(self, reader, writer):
+        """
+        Serves the requests of one HTTP/1.1 client until it closes the
+        connection or stays idle for KEEP_ALIVE_TIMEOUT seconds.
+        """
+        try:
+            while True:
+                try:
+                    request_line = await asyncio.wait_for(
+                        reader.readline(), KEEP_ALIVE_TIMEOUT)
+                except asyncio.TimeoutError:
+                    break
+                if not request_line.strip():
+                    break
+                parts = request_line.decode('latin-1').split()
+                if len(parts) != 3:
+                    break
+                method, target, version = parts
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if not line.strip():
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                keep_alive = headers.get('connection', '').lower() != \
+                    'close' and version == 'HTTP/1.1'
+                try:
+                    length = int(headers.get('content-length', 0))
+                except ValueError:
+                    length = -1
+                if length < 0:
+                    # the body cannot be told from the next request, so
+                    # the connection is closed after answering
+                    status, payload = 400, \
+                        {'error': 'Content-Length must be a whole number.'}
+                    keep_alive = False
+                elif length > MAX_BODY:
+                    status, payload = 413, {'error': 'Body is too large.'}
+                    keep_alive = False
+                else:
+                    raw = await reader.readexactly(length) if length else b''
+                    try:
+                        body = json.loads(raw) if raw else {}
+                    except ValueError:
+                        body = None
+                    if not isinstance(body, dict):
+                        status, payload = 400, \
+                            {'error': 'The body must be a JSON object.'}
+                    else:
+                        status, payload = await self.handle(
+                            Request(method, target, headers, body))
+                data = to_json(payload)
+                writer.write(('HTTP/1.1 ' + str(status) + ' ' +
+                              REASONS.get(status, '') + '\r\n' +
+                              'Content-Type: application/json\r\n' +
+                              'Content-Length: ' + str(len(data)) + '\r\n' +
+                              'Connection: ' +
+                              ('keep-alive' if keep_alive else 'close') +
+                              '\r\n\r\n').encode('latin-1') + data)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+async def start(host=HOST, port=PORT, settings=datagen.MYSQL_SETTINGS,
+                pool_size=API_POOL_SIZE, backend=None):
+    """
+    Starts serving the API and returns (Api, asyncio server).
+    """
+    api = Api(settings, pool_size, backend)
+    server = await asyncio.start_server(api.serve_connection, host, port)
+    return api, server
+
+
+async def serve(host=HOST, port=PORT, pool_size=API_POOL_SIZE, backend=None):
+    api, server = await start(host, port, pool_size=pool_size,
+                              backend=backend)
+    print('Serving the Closetly API on http://' + host + ':' + str(port))
+    rollups = asyncio.create_task(api.roll_up_wears())
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        rollups.cancel()
+        await api.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve the Closetly API.')
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--pool-size', type=int, default=API_POOL_SIZE,
+                        help='most connections per database role '
+                             '(default ' + str(API_POOL_SIZE) + ')')
+    parser.add_argument('--stats-file', metavar='PATH',
+                        help='dump query statistics to PATH every ' +
+                             str(querystats.DUMP_INTERVAL) + ' seconds')
+    parser.add_argument('--explain-ms', type=float,
+                        help='capture the plans of statements slower than '
+                             'this many ms')
+    parser.add_argument('--db', metavar='BACKEND',
+                        help="'mysql' or 'sqlite:PATH' (default: "
+                             "$CLOSETLY_DB, else mysql)")
+    args = parser.parse_args()
+    if args.db:
+        try:
+            backends.parse(args.db)
+        except ValueError as err:
+            parser.error(str(err))
+    if args.stats_file:
+        querystats.start_dumps(args.stats_file)
+    if args.explain_ms is not None:
+        querystats.set_explain_threshold(args.explain_ms)
+    try:
+        asyncio.run(serve(args.host, args.port, args.pool_size, args.db))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,240 @@
+"""
+Load test of the HTTP JSON API (api.py). Fills the local MySQL database
+with synthetic data (see datagen.py), starts the API in this process (or
+uses one already running), and runs many concurrent client sessions. Each
+session logs in as a generated user and keeps browsing, searching,
+looking at its closet and borrowing/returning items. Reports requests per
+second overall and the latency percentiles of each endpoint.
+
+Usage:
+    $ python3 api_loadtest.py --sessions 64 --seconds 20
+    $ python3 api_loadtest.py --url http://127.0.0.1:8121 --scale 100000
+    $ python3 api_loadtest.py --standin /tmp/closetly.db
+
+Load tests replace the contents of the closetly database, and need
+aiomysql and a local MySQL server unless they run on a stand-in (an
+embedded SQLite database, which serves one request at a time).
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from urllib.parse import urlsplit
+
+import api
+import benchmark
+import datagen
+
+# Concurrent client sessions
+SESSIONS = 32
+# Relative frequency of each action a session takes
+ACTIONS = {
+    'browse_clothes': 4,
+    'browse_collab': 2,
+    'search_stores': 3,
+    'closet': 2,
+    'borrow_return': 2,
+}
+
+
+class HttpClient:
+    """
+    A keep-alive HTTP/1.1 client for one session.
+    """
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.token = None
+        self._reader = None
+        self._writer = None
+
+    async def request(self, method, path, body=None):
+        """
+        Sends one request and returns (status, decoded JSON response).
+        """
+        if self._writer is None:
+            self._reader, self._writer = await asyncio.open_connection(
+                self.host, self.port)
+        data = json.dumps(body).encode('utf-8') if body is not None else b''
+        head = method + ' ' + path + ' HTTP/1.1\r\nHost: ' + self.host + \
+            '\r\nContent-Type: application/json\r\nContent-Length: ' + \
+            str(len(data)) + '\r\n'
+        if self.token:
+            head += 'Authorization: Bearer ' + self.token + '\r\n'
+        self._writer.write((head + '\r\n').encode('latin-1') + data)
+        await self._writer.drain()
+        status = int((await self._reader.readline()).split()[1])
+        headers = {}
+        while True:
+            line = await self._reader.readline()
+            if not line.strip():
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        payload = await self._reader.readexactly(
+            int(headers.get('content-length', 0)))
+        if headers.get('connection', '').lower() == 'close':
+            self.close()
+        return status, json.loads(payload) if payload else None
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+class Results:
+    """
+    Latencies of every request, by endpoint, and the failed requests.
+    """
+
+    def __init__(self):
+        self.latencies = {}
+        self.errors = []
+
+    async def timed(self, client, name, method, path, body=None,
+                    expected=(200,)):
+        start = time.perf_counter()
+        status, payload = await client.request(method, path, body)
+        self.latencies.setdefault(name, []).append(
+            time.perf_counter() - start)
+        if status not in expected:
+            self.errors.append((name, status, payload))
+        return status, payload
+
+
+async def run_session(host, port, data, results, deadline, seed):
+    rng = random.Random(seed)
+    client = HttpClient(host, port)
+    items = datagen.Zipf(max(len(data.collab_items), 1), rng)
+    names = list(ACTIONS)
+    weights = [ACTIONS[name] for name in names]
+    try:
+        username = rng.choice(data.shoppers)
+        status, session = await results.timed(
+            client, 'login', 'POST', '/login',
+            {'username': username,
+             'password': datagen.password_for(username)})
+        if status != 200:
+            return
+        client.token = session['token']
+        personal = session['role'] == 'personal'
+        while time.monotonic() < deadline:
+            action = rng.choices(names, weights)[0]
+            if action == 'browse_clothes':
+                after = rng.randrange(data.max_clothing_id)
+                await results.timed(client, 'GET /clothes', 'GET',
+                                    '/clothes?after=' + str(after))
+            elif action == 'browse_collab':
+                after = rng.randrange(data.max_clothing_id)
+                await results.timed(client, 'GET /collab', 'GET',
+                                    '/collab?after=' + str(after))
+            elif action == 'search_stores':
+                filters = {'clothing_type': rng.choice(datagen.CLOTHING_TYPES),
+                           'max_price': rng.choice([25, 50, 100])}
+                await results.timed(client, 'POST /search', 'POST',
+                                    '/search', {'filters': filters,
+                                                'sort': 'price'})
+            elif action == 'closet':
+                await results.timed(client, 'GET /closet', 'GET', '/closet')
+            elif personal and data.collab_items:
+                clothing_id = items.choice(data.collab_items)
+                _, borrowed = await results.timed(
+                    client, 'POST /borrow', 'POST', '/borrow',
+                    {'clothing_id': clothing_id})
+                if borrowed and borrowed.get('borrowed'):
+                    await results.timed(client, 'POST /return', 'POST',
+                                        '/return',
+                                        {'clothing_id': clothing_id})
+        await results.timed(client, 'logout', 'POST', '/logout')
+    except (ConnectionError, asyncio.IncompleteReadError, ValueError) as e:
+        results.errors.append(('connection', None, str(e)))
+    finally:
+        client.close()
+
+
+async def run(host, port, data, sessions, seconds, seed, serve=True,
+              backend=None):
+    """
+    Runs `sessions` concurrent sessions for `seconds`, starting the API in
+    this process first (on the given backend) if `serve`. Returns
+    (Results, wall seconds).
+    """
+    server_api = server = None
+    if serve:
+        server_api, server = await api.start(host, port, backend=backend)
+    results = Results()
+    start = time.perf_counter()
+    deadline = time.monotonic() + seconds
+    await asyncio.gather(*[run_session(host, port, data, results, deadline,
+                                       seed + i)
+                           for i in range(sessions)])
+    elapsed = time.perf_counter() - start
+    if serve:
+        server.close()
+        await server.wait_closed()
+        await server_api.close()
+    return results, elapsed
+
+
+def print_results(results, elapsed):
+    total = sum(len(latencies) for latencies in results.latencies.values())
+    print('endpoint'.ljust(16) + 'n'.rjust(8) + 'p50 ms'.rjust(10) +
+          'p95 ms'.rjust(10) + 'p99 ms'.rjust(10) + 'req/s'.rjust(10))
+    for name in sorted(results.latencies):
+        summary = benchmark.summarize(results.latencies[name], elapsed)
+        print(name.ljust(16) + str(summary['n']).rjust(8) +
+              ('%.2f' % summary['p50_ms']).rjust(10) +
+              ('%.2f' % summary['p95_ms']).rjust(10) +
+              ('%.2f' % summary['p99_ms']).rjust(10) +
+              str(int(summary['ops_per_s'])).rjust(10))
+    print('Served ' + str(total) + ' requests in ' +
+          str(round(elapsed, 1)) + ' s (' + str(int(total / elapsed)) +
+          ' req/s), ' + str(len(results.errors)) + ' failed.')
+    for error in results.errors[:5]:
+        print('  failed: ' + str(error))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the HTTP API.')
+    datagen.add_size_arguments(parser)
+    parser.add_argument('--sessions', type=int, default=SESSIONS,
+                        help='concurrent client sessions (default ' +
+                             str(SESSIONS) + ')')
+    parser.add_argument('--seconds', type=float, default=10,
+                        help='seconds to run (default 10)')
+    parser.add_argument('--url',
+                        help='load test an API that is already running '
+                             '(default: start one in this process on port ' +
+                             str(api.PORT) + ')')
+    args = parser.parse_args()
+    if args.standin == ':memory:':
+        parser.error('the stand-in must be a file the API can open')
+    if args.standin and args.url:
+        parser.error('--url and --standin cannot be used together')
+
+    conn = datagen.connect(args.standin)
+    print('Generating data...')
+    data = datagen.populate(conn, datagen.sizes_from_args(args), args.seed)
+    conn.close()
+    if not data.shoppers:
+        parser.error('no user accounts were generated')
+
+    if args.url:
+        url = urlsplit(args.url)
+        host, port, serve = url.hostname, url.port or 80, False
+    else:
+        host, port, serve = api.HOST, api.PORT, True
+    backend = 'sqlite:' + args.standin if args.standin else 'mysql'
+    results, elapsed = asyncio.run(run(host, port, data, args.sessions,
+                                       args.seconds, args.seed, serve,
+                                       backend))
+    print_results(results, elapsed)
+    if results.errors:
+        raise SystemExit('Some requests failed.')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,36 +1,72 @@
 """
 Python app to interface with Closetly MySQL database
 """
+import os  # to read where query statistics are dumped
 import sys  # to print error messages to sys.stderr
-import mysql.connector
-# To get error codes from the connector, useful for user-friendly
-# error-handling
-import mysql.connector.errorcode as errorcode
-import pandas as pd # cleans up output + adds some extra python functionality
+import threading # connects to the database while the login prompt shows
+# The MySQL connector is imported by get_conn, on a background thread, so
+# the login prompt shows without waiting for it (see connect_in_background)
+import backends # MySQL or an embedded SQLite database
+from pool import PoolManager # reuses connections across logins/role switches
+import tables # prints rows as aligned text tables as they arrive
+import browse # page-at-a-time browsing of large listings
+import store_search # composable, index-friendly store inventory search
+import text_search # ranked keyword search with facet counts
+import cache # read-through cache for rarely-changing lookups
+import checkout # one-transaction sales of carts of store items
+import outfits # atomic, batched outfit creation
+import prices # cheapest store of each piece, from the best_price table
+import db # runs the shared service operations on this app's connection
+import service # logging in, borrowing, outfits, selling (shared with api.py)
+import querystats # latency, rows and plans of every statement, per operation
+import mirror # offline copy of a personal user's closets, synced in deltas
+from service import ServiceError
 
 # Debugging flag to print errors when debugging that shouldn't be visible
 # to an actual client. Set to False when done testing.
 DEBUG = False # MAKE FALSE WHEN SUBMITTING  
 
+# Session (see service.py) of the logged-in user
+session = None
+# Connection of the logged-in user's database role (see change_connection)
+conn = None
+# Offline mirror (see mirror.py) of the logged-in personal user's closets,
+# if MIRROR_FILE is set
+offline = None
+
+# Most values of each facet shown above keyword search results
+FACET_VALUES_SHOWN = 5
+
+# File the query statistics are dumped to (as JSON) every
+# querystats.DUMP_INTERVAL seconds and on quitting; unset to not dump
+STATS_FILE = os.environ.get('CLOSETLY_STATS_FILE')
+
+# File personal users' closets are mirrored to (see mirror.py), so they are
+# read without asking the database; unset to read everything from it
+MIRROR_FILE = os.environ.get('CLOSETLY_MIRROR')
+
+# Database the app runs on: 'mysql' (the default) or 'sqlite:PATH' for an
+# embedded database, from CLOSETLY_DB (see backends.py)
+DB = backends.configured()
+
 def get_conn(user, password):
     """"
-    Returns a connected MySQL connector instance, if connection is successful.
-    If unsuccessful, exits.
+    Returns a connection to the database (see DB), if connection is
+    successful. If unsuccessful, exits.
     """
+    if backends.is_sqlite(DB):
+        # an embedded database has no users or passwords to check
+        return backends.connect(DB, user, password)
+    import mysql.connector
     try:
-        conn = mysql.connector.connect(
-          host='localhost',
-          user=user,
-          # Find port in MAMP or MySQL Workbench GUI or with
-          # SHOW VARIABLES WHERE variable_name LIKE 'port';
-          port='3306',
-          password=password,
-          database='closetly'
-        )
+        conn = backends.connect(DB, user, password)
         if DEBUG:
             print('Successfully connected.')
         return conn
     except mysql.connector.Error as err:
+        # To get error codes from the connector, useful for user-friendly
+        # error-handling
+        import mysql.connector.errorcode as errorcode
         # Remember that this is specific to _database_ users, not
         # application users. So is probably irrelevant to a client in your
         # simulated program. Their user information would be in a users table
@@ -45,46 +81,49 @@ def get_conn(user, password):
             sys.stderr('An error occurred, please contact the administrator.')
         sys.exit(1)
 
+def call(fn, *args, **kwargs):
+    """
+    Runs a service operation (see service.py) on the current connection and
+    returns its result. Its statements count for the app function that
+    called it, or for the operation itself if called from a menu.
+    """
+    with querystats.operation(fn.__name__):
+        return db.call(conn, fn, *args, **kwargs)
+
 # ----------------------------------------------------------------------
 # Functions for Logging Users In
 # ----------------------------------------------------------------------
+@querystats.measured
 def check_username(username):
     """
     Checks if a username already exists in the app. 
     Returns True if it already exists, False if it is a new username.
     """
-    # access user_info to obtain the set of all usernames available
-    sql = "SELECT COUNT(*) FROM (SELECT username FROM user_info" +\
-          " WHERE username='" + username + "') as matches;"
-    cursor = conn.cursor(buffered=True)
-    cursor.execute(sql)
-    # check if the given username exists in the username table
+    # check if the given username exists in the user_info table
     # return true if it does exist and false if not
-    a=cursor.fetchone()[0]
-    return bool(a)
-    # return bool(cursor.fetchone()[0])
+    return call(service.username_exists, username)
 
+@querystats.measured
 def authenticate_login(username, password):
     """
     Authenticates login by matching the username and password with the
-    encrypted passwords. 
+    encrypted passwords. Returns the user's Session, or None if the
+    password is wrong.
     """
-    sql = 'SELECT authenticate (%s, %s);'
-    cursor = conn.cursor()
-    cursor.execute(sql, (username, password))
-    return bool(cursor.fetchone()[0])
+    try:
+        return call(service.login, username, password)
+    except ServiceError:
+        return None
 
-def add_user(name, username, password):
+@querystats.measured
+def add_user(name, username, password, account_type):
     """
     Calls SQL procedures to add a new user to the database as well
-    as binding passwords to the username. 
+    as binding passwords to the username and giving it its account type.
+    Returns the new user's Session.
     """
-    cursor = conn.cursor()
-    cursor.callproc('sp_add_user', args=(username, password))
-    conn.commit()
-    cursor.callproc('add_to_user', args=(name, username))
-    conn.commit()
-    return username
+    return call(service.create_account, name, username, password,
+                account_type)
 
 def get_account_type():
     """
@@ -104,36 +143,51 @@ def get_account_type():
     else:
         return 'personal'
 
+def connect_in_background():
+    """
+    Checks out the first (appadmin) connection on a background thread, which
+    imports the MySQL connector and logs in to the server while the user
+    types their username. Returns a function that waits for the connection
+    and returns it (or raises whatever stopped it from connecting).
+    """
+    result = {}
+    def connect():
+        try:
+            result['conn'] = pools.checkout('appadmin')
+        except BaseException as err:
+            result['error'] = err
+    thread = threading.Thread(target=connect, name='connect', daemon=True)
+    thread.start()
+    def wait():
+        thread.join()
+        if 'error' in result:
+            raise result['error']
+        return result['conn']
+    return wait
+
 def change_connection(account_type):
     """
     Given the account type (personal, stylist, store owner, admin) of a user,
     changes the connection so that the right privileges are granted. 
     """
-    # changes connection based on permission level
-    conn.close()
-    if account_type == 'storeowner':
-        return get_conn('storeowner', 'storeownerpw')
-    elif account_type == 'stylist':
-        return get_conn('stylist', 'stylistpw')
-    elif account_type == 'personal':
-        return get_conn('personal', 'personalpw')
-    elif account_type == 'admin':
-        return get_conn('appadmin', 'adminpw')
-    else: 
-        # give general 'appclient' privileges
-        return get_conn('personal', 'personalpw')
+    # returns the current connection to its pool and checks out one for
+    # the new permission level (unknown types get 'personal' privileges)
+    return pools.switch(conn, account_type)
 
+@querystats.measured
 def get_permission(username):
     """
     Gets the user type (personal, stylist, store owner, or admin) of the
     given user based on the username.  
     """
-    sql = "SELECT role FROM permissions WHERE username='"+username+"';"
-    cursor = conn.cursor()
-    cursor.execute(sql)
-    # check if the given username exists in the username table
-    # return true if it does exist and false if not
-    return cursor.fetchone()[0]
+    return call(service.account_lookup, 'get_permission', username)
+
+@querystats.measured
+def get_user_id(username):
+    """
+    Gets the user_id of the closet belonging to the given username.
+    """
+    return call(service.account_lookup, 'get_user_id', username)
 
 def login():
     """
@@ -144,17 +198,20 @@ def login():
     Updates the connection based on what user type has logged in. 
     """
     # conn = get_conn('appadmin', 'adminpw')
+    global conn, session
     username = input("Enter username: ")
+    if conn is None:
+        # the first connection was opened while the user typed
+        conn = first_connection()
     valid_username = check_username(username)
-    global conn
     if valid_username == True:
         # initiate password authentication & continue 
         password = input("Enter password: ")
-        if authenticate_login(username, password): # authenticated 
+        session = authenticate_login(username, password)
+        if session: # authenticated 
             # change connection type 
-            perma = get_permission(username)
-            print(perma)
-            conn = change_connection(perma)
+            print(session.role)
+            conn = change_connection(session.role)
             return username
         print("Incorrect login")
         quit_ui()
@@ -164,26 +221,26 @@ def login():
         if create_new_acc.upper() == 'Y':
             name = input('What is your name (first and last)?\n')
 
-            if len(username) > 20:
+            if len(username) > service.MAX_USERNAME:
                 username = input('Username is too long. \
                                   Must be 20 characters or less.\n')
                 return login()
 
             # handle different account types
             account_type = get_account_type()
-            # add account type to user information
-            cursor = conn.cursor()
-            cursor.callproc('user_add_permission', \
-                            args=(username, account_type))
-            conn.commit()
-            # change connection to the correct user 
-            conn = change_connection(account_type)
 
             new_password = input("What would you like your password to be?\n")
-            while len(new_password) > 20:
+            while len(new_password) > service.MAX_PASSWORD:
                 new_password = input('Password is too long. Must be 20 \
                                       characters or less:\n')
-            add_user(name, username, new_password)
+            # add the account with its type and password
+            try:
+                session = add_user(name, username, new_password, account_type)
+            except ServiceError as err:
+                print(err.message)
+                quit_ui()
+            # change connection to the correct user 
+            conn = change_connection(account_type)
             return username
             
         elif create_new_acc.upper() == 'N':
@@ -199,6 +256,7 @@ def login():
 # Functions for Command-Line Options/Query Execution
 # ----------------------------------------------------------------------
 
+@querystats.measured
 def show_all_clothes():
     """
     Shows a list of all the clothing in the database. Includes all clothes
@@ -206,34 +264,55 @@ def show_all_clothes():
     """
     print('This is all the clothing items in the personal, collaborative, ' + \
           'and store closets:\n')
-    sql = 'SELECT * FROM clothes;'
-    cursor = conn.cursor()
-    cursor.execute(sql)
-    rows = cursor.fetchall()
-    df = pd.DataFrame(rows, columns=['clothing_id','clothing_type','size',\
-                                     'gender','color','brand','description',\
-                                     'image_url','aesthetic','store_name'])
-    print(df)
+    browse.browse(conn, 'all_clothes_page', browse.ALL_CLOTHES_COLUMNS)
 
+@querystats.measured
 def show_personal_clothes(username):
     """
     Shows a list of all the clothing in the user's personal closet.
     """
     print('This is all the clothing items in your personal closet:\n')
-    sql = """SELECT clothing_id, clothing_type, size, gender, color, brand,
-           description, image_url, aesthetic, is_clean, shared, num_wears
-           FROM clothes NATURAL JOIN personal_closet NATURAL JOIN user
-           WHERE username = '""" + username + "';"
-    cursor = conn.cursor()
-    cursor.execute(sql)
-    rows = cursor.fetchall()
-    df = pd.DataFrame(rows, columns=['clothing_id','clothing_type','size',\
-                                     'gender','color','brand','description',\
-                                     'image_url','aesthetic','is_clean',\
-                                     'shared', 'num_wears'])
-    print(df)
-
-def borrow_from_collab_closet(user_id):
+    rows = offline.personal_closet() if offline else \
+        call(service.personal_closet, session)
+    tables.print_table(rows, service.PERSONAL_COLUMNS)
+
+@querystats.measured
+def log_todays_outfit():
+    """
+    Logs that the user is wearing pieces of their personal closet today,
+    and adds the wear up into their closet right away.
+    """
+    clothing_ids = input('Clothing IDs of the pieces you are wearing ' +
+                         'today (separated by spaces): ').split()
+    if offline:
+        # logged in the mirror, and in the database at the next sync
+        try:
+            logged = offline.log_wears(clothing_ids)
+        except ValueError as err:
+            print(str(err))
+            return
+        skipped = [i for i in clothing_ids if int(i) not in logged]
+        if skipped:
+            print('These are not in your closet: ' + ', '.join(skipped))
+        if logged:
+            print('Logged ' + str(len(logged)) + ' of your pieces ' +
+                  'for today.')
+            sync_if_due()
+        return
+    try:
+        result = call(service.log_wears, session, clothing_ids)
+    except ServiceError as err:
+        print(err.message)
+        return
+    if result['not_in_closet']:
+        print('These are not in your closet: ' +
+              ', '.join(map(str, result['not_in_closet'])))
+    if result['logged']:
+        print('Logged ' + str(len(result['logged'])) + ' of your pieces ' +
+              'for today.')
+
+@querystats.measured
+def borrow_from_collab_closet():
     """
     Lets a user borrow a clothing item from the collaborative closet
     if they are not the original owner and it is not currently being 
@@ -241,35 +320,81 @@ def borrow_from_collab_closet(user_id):
     """
     clothing_id = input("What is the clothing ID of the item you " + \
                         "would like to borrow?\n")
-    sql = 'SELECT borrow_item(%s, %s);'
-    cursor = conn.cursor(buffered=True)
-    cursor.execute(sql, (user_id, clothing_id))
-    res = cursor.fetchone()[0]
-    if res == 1:
-        print('Item successfully borrowed!')
+    if offline:
+        # borrowed in the mirror, and from the server at the next sync
+        try:
+            if offline.borrow(clothing_id):
+                print('Item borrowed! It is yours once your closet syncs.')
+                sync_if_due()
+                return
+        except ValueError:
+            print('Clothing ID must be a number.')
+            return
     else:
-        print('Sorry, you cannot borrow this item :(')
+        try:
+            if call(service.borrow, session, clothing_id)['borrowed']:
+                print('Item successfully borrowed!')
+                return
+        except ServiceError as err:
+            print(err.message)
+            return
+    print('Sorry, you cannot borrow this item :(')
+    ans = input('Would you like to join the waitlist for it? (y/n) ')
+    if ans and ans[0].lower() == 'y':
+        try:
+            place = call(service.join_waitlist, session,
+                         clothing_id)['position']
+        except ServiceError as err:
+            print('Sorry, ' + err.message[0].lower() + err.message[1:])
+            return
+        print('You are number ' + str(place) + ' in line. It will ' + \
+              'be lent to you as soon as it is your turn.')
 
+@querystats.measured
+def return_to_collab_closet():
+    """
+    Lets a user return an item they borrowed from the collaborative closet.
+    If someone is waiting for it, it is lent to them straight away.
+    """
+    clothing_id = input("What is the clothing ID of the item you " + \
+                        "are returning?\n")
+    if offline:
+        try:
+            returned = offline.return_item(clothing_id)
+        except ValueError:
+            print('Clothing ID must be a number.')
+            return
+        if returned:
+            print('Item returned, thank you!')
+            sync_if_due()
+        else:
+            print('Sorry, you are not borrowing this item.')
+        return
+    try:
+        next_borrower = call(service.return_item, session,
+                             clothing_id)['next_borrower']
+    except ServiceError as err:
+        print('Sorry, ' + err.message[0].lower() + err.message[1:])
+        return
+    if next_borrower is None:
+        print('Item returned, thank you!')
+    else:
+        print('Item returned, thank you! It has been lent to user ' + \
+              str(next_borrower) + ', who was waiting for it.')
+
+@querystats.measured
 def show_collaborative_clothes():
     """
     Shows a list of all the clothing in the collaborative closet.
     """
     print('This is all the clothing items you can borrow from the' + \
           ' colaborative closet:\n')
-    sql = """SELECT user_id, clothing_id, clothing_type, size, gender, color, \
-             brand, description, image_url, aesthetic, curr_condition, \
-             is_available, current_borrower
-             FROM collab_closet NATURAL JOIN clothes;"""
-    cursor = conn.cursor()
-    cursor.execute(sql)
-    rows = cursor.fetchall()
-    df = pd.DataFrame(rows, columns=['user_id','clothing_id','clothing_type',\
-                                     'size','gender','color','brand',\
-                                     'description','image_url','aesthetic',\
-                                     'curr_condition','is_available',\
-                                     'current_borrower'])
-    print(df)
+    if offline:
+        tables.print_table(offline.collab_closet(), browse.COLLAB_COLUMNS)
+        return
+    browse.browse(conn, 'collab_clothes_page', browse.COLLAB_COLUMNS)
 
+@querystats.measured
 def show_user_in_collab(user_id):
     """
     Shows all the clothing a specific user is loaning in the collaborative
@@ -277,80 +402,107 @@ def show_user_in_collab(user_id):
     """
     print('This is all the clothing items ' + user_id\
            + ' has in the colaborative' + ' closet:\n')
-    sql = """SELECT clothing_id, clothing_type, size, gender, color,
-           brand, description, image_url, aesthetic, curr_condition,
-           is_available, current_borrower
-           FROM collab_closet NATURAL JOIN clothes 
-           WHERE user_id = '""" + user_id + "';"
-    cursor = conn.cursor()
-    cursor.execute(sql)
-    rows = cursor.fetchall()
-    df = pd.DataFrame(rows, columns=['clothing_id','clothing_type','size',\
-                                     'gender','color','brand','description',\
-                                     'image_url','aesthetic','curr_condition',\
-                                     'is_available','curr_borrower'])
-    print(df)
+    if offline and user_id.isdigit():
+        rows = offline.collab_items_of(user_id)
+    else:
+        rows = call(service.collab_items_of, user_id)
+    tables.print_table(rows, service.USER_COLLAB_COLUMNS)
+
+def open_offline_closet():
+    """
+    Opens the personal user's offline closet (see mirror.py) and brings it
+    up to date, if MIRROR_FILE is set.
+    """
+    global offline
+    if MIRROR_FILE and session.role == 'personal':
+        offline = mirror.Mirror(MIRROR_FILE, session.user_id)
+        sync_offline_closet()
+
+@querystats.measured
+def sync_offline_closet():
+    """
+    Sends the borrows, returns and wears made in the offline closet to the
+    database, says which of them could not be made, and brings the offline
+    closet up to date.
+    """
+    try:
+        result = call(mirror.sync, offline)
+    except Exception as err:
+        # the database cannot be reached: the changes stay queued
+        print('Could not sync your offline closet. Your changes will be ' + \
+              'sent next time.')
+        if DEBUG:
+            print(err)
+        return
+    for conflict in result['conflicts']:
+        item = str(conflict.clothing_id)
+        if conflict.operation == 'borrow':
+            print('Sorry, someone else borrowed item ' + item + ' first.')
+        elif conflict.operation == 'return':
+            print('You were no longer borrowing item ' + item + '.')
+        else:
+            print('Item ' + item + ' is no longer in your closet, so ' + \
+                  'wearing it was not logged.')
+    if DEBUG:
+        print('Offline closet synced: ' + str(result['rows']) + \
+              ' rows fetched.')
+
+def sync_if_due():
+    """
+    Syncs the offline closet once enough changes are queued for a batch.
+    """
+    if offline.pending() >= mirror.REPLAY_AFTER:
+        sync_offline_closet()
 
+@querystats.measured
+def keep_store_offline():
+    """
+    Adds a store to the favorites whose inventories the offline closet
+    keeps.
+    """
+    store_name = input('Enter the name of a store to keep in your ' + \
+                       'offline closet: ')
+    count = call(mirror.add_favorite, offline, store_name)
+    print(store_name + "'s " + str(count) + ' items are now in your ' + \
+          'offline closet.')
+
+@querystats.measured
 def show_store_inventory(store_name):
     """
     Shows a list of all the clothing in the given store's inventory.
     """
     print('This is all the clothing items currently being sold at '\
            + store_name + ':\n')
-    sql = """SELECT clothing_id, price, discount, clothing_type, size, 
-           gender, color, brand, description, image_url, aesthetic 
-           FROM store_closet NATURAL JOIN clothes
-           WHERE store_name = '""" + store_name + "';"
-    cursor = conn.cursor()
-    cursor.execute(sql)
-    rows = cursor.fetchall()
-    df = pd.DataFrame(rows, columns=['clothing_id','price', 'discount',\
-                                     'clothing_type','size','gender','color',\
-                                     'brand','description','image_url',\
-                                     'aesthetic'])
-    print(df)
+    rows = offline.store_inventory(store_name) if offline else None
+    if rows is not None:
+        tables.print_table(rows, browse.STORE_COLUMNS)
+        return
+    browse.browse(conn, 'store_inventory_page', browse.STORE_COLUMNS,
+                  (store_name,))
 
+@querystats.measured
 def filter_store_by_price(store_name, min_price, max_price):
     """
     Shows a list of all the clothing being sold in the provided price range
     in a given store.
     """
     print('This is all the clothing items currently being sold at '\
-           + store_name + 'for under $' + max_price + ':\n')
-    sql = """SELECT clothing_id, price, discount, clothing_type, size,
-           gender, color, brand, description, image_url, aesthetic 
-           FROM store_closet NATURAL JOIN clothes
-           WHERE store_name='""" + store_name + "' AND price <= '" + max_price +\
-           "' AND price >= '" + min_price + "' ORDER BY price;"
-    cursor = conn.cursor()
-    cursor.execute(sql)
-    rows = cursor.fetchall()
-    df = pd.DataFrame(rows, columns=['clothing_id','price', 'discount',\
-                                     'clothing_type','size','gender','color',\
-                                     'brand','description','image_url',\
-                                     'aesthetic'])
-    print(df)
+           + store_name + ' for under $' + str(max_price) + ':\n')
+    show_store_search({'store_name': store_name, 'min_price': min_price,
+                       'max_price': max_price}, sort='price')
 
+@querystats.measured
 def filter_store_by_type(store_name, clothing_type):
     """
     Shows a list of all the clothing of a certain type (sweatshirt, dress, etc.)
     in a given store.
     """
     print('This is all the clothing items of the type (' + clothing_type + \
-          ') currently being sold at' + store_name + ':\n')
-    sql = """SELECT clothing_id, price, discount, clothing_type, size,
-           gender, color, brand, description, image_url, aesthetic 
-           FROM store_closet NATURAL JOIN clothes
-           WHERE clothing_type = '""" + clothing_type + "';"
-    cursor = conn.cursor()
-    cursor.execute(sql)
-    rows = cursor.fetchall()
-    df = pd.DataFrame(rows, columns=['clothing_id','price', 'discount',\
-                                     'clothing_type','size','gender','color',\
-                                     'brand','description','image_url',\
-                                     'aesthetic'])
-    print(df)
+          ') currently being sold at ' + store_name + ':\n')
+    show_store_search({'store_name': store_name,
+                       'clothing_type': clothing_type})
 
+@querystats.measured
 def filter_store_by_discount(store_name, min_discount, max_discount):
     """
     Shows a list of all the clothing items being solid within a given discount
@@ -358,36 +510,145 @@ def filter_store_by_discount(store_name, min_discount, max_discount):
     """
     print('This is all the clothing items currently being sold in the' +\
           ' designated discount range at ' + store_name + ':\n')
-    sql = """SELECT clothing_id, price, discount, clothing_type, size,
-           gender, color, brand, description, image_url, aesthetic 
-           FROM store_closet NATURAL JOIN clothes
-           WHERE discount >= '""" + min_discount + "' AND discount <= '"\
-           + max_discount + "' ORDER BY discount;"
-    cursor = conn.cursor()
-    cursor.execute(sql)
-    rows = cursor.fetchall()
-    df = pd.DataFrame(rows, columns=['clothing_id','price', 'discount',\
-                                     'clothing_type','size','gender','color',\
-                                     'brand','description','image_url',\
-                                     'aesthetic'])
-    print(df)
-
-def check_outfit_id(id):
-    """
-    Checks if the outfit id already exists in the database. 
-    Returns True if it does exist, False if it does not. 
-    """
-    # access styled_outfits to obtain the set of all usernames available
-    sql = "SELECT COUNT(*) FROM (SELECT DISTINCT outfit_id FROM"\
-           + " styled_outfits WHERE outfit_id='"\
-           + id + "') as matches;"
-    cursor = conn.cursor(buffered=True)
-    cursor.execute(sql)
-    # check if the given outfit id exists in the styled_outfits table
-    # return true if it does exist and false if not
-    a=cursor.fetchone()[0]
-    return bool(a)
+    show_store_search({'store_name': store_name, 'min_discount': min_discount,
+                       'max_discount': max_discount}, sort='discount')
+
+@querystats.measured
+def show_store_search(filters, sort='id'):
+    """
+    Shows the store items matching the given search filters (see
+    store_search.build_search) one page at a time.
+    """
+    pages = store_search.iter_search_pages(conn, filters, sort)
+    browse.page_through(pages, store_search.SEARCH_COLUMNS, can_jump=False)
+
+@querystats.measured
+def search_store_inventory(store_name):
+    """
+    Lets the user combine any of the search filters (price, discount, type,
+    size, color, gender, aesthetic) on a store's inventory, or on every
+    store if no store name is given, and shows the matching items.
+    """
+    filters = {}
+    if store_name:
+        filters['store_name'] = store_name
+    chosen = input('Filter by price (p), discount (d), clothing type (t), '\
+                   + 'size (s), color (c), gender (g), and/or aesthetic (a)? '\
+                   + 'Enter any combination (e.g. "pt"), or nothing to see '\
+                   + 'everything: ').lower()
+    try:
+        if 'p' in chosen:
+            filters['min_price'] = float(input('Minimum price (in USD): $')
+                                         or 0)
+            max_price = input('Maximum price (in USD): $')
+            if max_price:
+                filters['max_price'] = float(max_price)
+        if 'd' in chosen:
+            filters['min_discount'] = float(input('Minimum discount (%): ')
+                                            or 0)
+            max_discount = input('Maximum discount (%): ')
+            if max_discount:
+                filters['max_discount'] = float(max_discount)
+    except ValueError:
+        print('Prices and discounts must be numbers.')
+        return
+    if 't' in chosen:
+        filters['clothing_type'] = input('Clothing type: ')
+    if 's' in chosen:
+        filters['size'] = input('Size: ')
+    if 'c' in chosen:
+        filters['color'] = input('Color: ')
+    if 'g' in chosen:
+        filters['gender'] = input('Gender (W, M, U): ').upper()
+    if 'a' in chosen:
+        filters['aesthetic'] = input('Aesthetic: ')
+    sort = input('Sort by clothing ID (i), price (p), price high to low (P), '\
+                 + 'discount (d), or discount high to low (D)? ')[:1]
+    sort = {'p': 'price', 'P': 'price_desc', 'd': 'discount',
+            'D': 'discount_desc'}.get(sort, 'id')
+    if store_name and len(filters) == 1 and sort == 'id':
+        # no filters: plain inventory browsing, which can also jump to IDs
+        show_store_inventory(store_name)
+    else:
+        show_store_search(filters, sort)
+
+@querystats.measured
+def keyword_search(store_name=''):
+    """
+    Lets the user search every piece of clothing (or one store's) by words
+    in its description, brand or aesthetic. Shows how many matches there
+    are of each type, size, color, store and price range, then the best
+    matches one page at a time.
+    """
+    text = input('Search for (e.g. "vintage denim jacket"): ')
+    filters = {'store_name': store_name} if store_name else {}
+    try:
+        result = call(service.keyword_search, text, filters)
+    except ServiceError as err:
+        print(err.message)
+        return
+    print(str(result['total']) + ' matching items.')
+    for facet, counts in result['facets'].items():
+        if counts:
+            print('  ' + facet + ': ' + ', '.join(
+                str(value) + ' (' + str(count) + ')'
+                for value, count in counts[:FACET_VALUES_SHOWN]))
+    browse.page_through(keyword_pages(text, filters, result),
+                        text_search.TEXT_COLUMNS, can_jump=False)
+
+def keyword_pages(text, filters, result):
+    """
+    Yields the pages of a keyword search as rows, starting from the
+    already-fetched first page and fetching each later page when asked.
+    """
+    while result['items']:
+        yield [[item[column] for column in text_search.TEXT_COLUMNS]
+               for item in result['items']]
+        if result['next_offset'] is None:
+            return
+        result = call(service.keyword_search, text, filters,
+                      result['next_offset'])
+
+@querystats.measured
+def check_available(username):
+    """
+    Lets a user check whether they have (or can borrow) an item of a given
+    type, size and color. Several items can be entered at once as a wish
+    list, and they are all checked in one query.
+    """
+    print('Enter each item you are looking for as "type, size, color" ' + \
+          '(e.g. jeans, 6, blue). Enter nothing when you are done.')
+    wishes = []
+    while True:
+        line = input('Item: ')
+        if not line.strip():
+            break
+        parts = line.split(',')
+        if len(parts) != 3:
+            print('Please enter a type, size and color separated by commas.')
+            continue
+        wishes.append(parts)
+    if not wishes:
+        return
+    try:
+        results = call(service.find_available, session, wishes)
+    except ServiceError as err:
+        print(err.message)
+        return
+    for result in results:
+        item = result['color'] + ' ' + result['clothing_type'] + \
+            ' in size ' + result['size']
+        if result['source'] == 'personal':
+            print('You have a clean ' + item + ' (clothing ID ' + \
+                  str(result['clothing_id']) + ').')
+        elif result['source'] == 'collab':
+            print('You can borrow a ' + item + ' (clothing ID ' + \
+                  str(result['clothing_id']) + \
+                  ') from the collaborative closet.')
+        else:
+            print('Sorry, there is no ' + item + ' available to you.')
 
+@querystats.measured
 def create_outfit():
     """
     Lets any user create an outfit using clothes from their own personal
@@ -398,54 +659,271 @@ def create_outfit():
                                        "you would like it to consist of? " +
                                        "Separate them with spaces (e.g. 1 2 4)"
                                        + "\n").split()))
-    while True:
-      outfit_id = input('Assign an outfit ID (integer) to this outfit: ')
-      if not check_outfit_id(outfit_id):
-          break
     description = input('How would you describe this outfit? '\
                          + '(250 characters or less)\n')
     vibe = input('What is the "vibe" of this outfit? ' +
                  '(i.e.: business casual, going out, etc.)\n')
-    for clothing_id in clothing_ids:
-        sql = "INSERT INTO styled_outfits (outfit_id, clothing_id, outfit_desc,\
-               vibe) VALUES ('" + str(outfit_id) + "', '" + str(clothing_id) + \
-               "', '" + description + "', '" + vibe + "');"
-        cursor = conn.cursor()
-        cursor.execute(sql)
-    new_sql = 'SELECT * FROM styled_outfits'
-    cursor.execute(new_sql)
-    rows = cursor.fetchall()
-    df = pd.DataFrame(rows, columns=['outfit_id', 'clothing_id',\
-                                     'outfit_des', 'vibe'])
-    print(df)
+    try:
+        outfit = call(service.create_outfit, session, clothing_ids,
+                      description, vibe)
+    except ServiceError as err:
+        print('Sorry, ' + err.message[0].lower() + err.message[1:])
+        return
+    print('Created outfit ' + str(outfit['outfit_id']) + ':')
+    tables.print_table([(outfit['outfit_id'], clothing_id,
+                         outfit['outfit_desc'], outfit['vibe'])
+                        for clothing_id in outfit['clothing_ids']],
+                       outfits.OUTFIT_COLUMNS)
+
+@querystats.measured
+def recommend_pieces():
+    """
+    Recommends pieces that go with some pieces and/or fit a vibe, from the
+    user's personal closet (a stylist can name whose), the collaborative
+    closet and the stores, and lets the user style an outfit from them.
+    """
+    seeds = input('Clothing IDs of the pieces to build around, separated ' +
+                  'by spaces (or nothing): ').split()
+    vibe = input('Vibe to match (e.g. going out, or nothing): ').strip()
+    user_id = None
+    if session.role != 'personal':
+        user_id = input('User ID of the user you are styling (or nothing): ')
+    try:
+        found = call(service.recommend, session, seeds, vibe or None,
+                     user_id=user_id)
+    except ServiceError as err:
+        print(err.message)
+        return
+    if not found:
+        print('Sorry, there is nothing to recommend yet.')
+        return
+    tables.print_table(found, list(found[0]))
+    picked = input('Clothing IDs of the pieces to style into an outfit ' +
+                   'with the ones you gave (or nothing): ').split()
+    if not picked:
+        return
+    description = input('How would you describe this outfit? '\
+                         + '(250 characters or less)\n')
+    try:
+        outfit = call(service.create_outfit, session, seeds + picked,
+                      description, vibe)
+    except ServiceError as err:
+        print('Sorry, ' + err.message[0].lower() + err.message[1:])
+        return
+    print('Created outfit ' + str(outfit['outfit_id']) + '.')
+
+@querystats.measured
+def compare_prices():
+    """
+    Finds the cheapest store for some pieces, or every piece of an outfit:
+    the lowest price of each piece, and the best price of any piece of the
+    same type, brand, size and color.
+    """
+    outfit_id = input('Outfit ID to price (or nothing to give clothing ' +
+                      'IDs): ').strip()
+    try:
+        if outfit_id:
+            result = call(service.compare_outfit_prices, session, outfit_id)
+        else:
+            clothing_ids = input('Clothing IDs of the pieces to price ' +
+                                 '(separated by spaces): ').split()
+            result = call(service.compare_prices, session, clothing_ids)
+    except ServiceError as err:
+        print(err.message)
+        return
+    tables.print_table(([piece[column] for column in prices.PRICE_COLUMNS]
+                        for piece in result['pieces']),
+                       prices.PRICE_COLUMNS)
+    print('Together at the best prices: $' +
+          format(result['total'], ',.2f'))
+    if result['not_for_sale']:
+        print('No store sells these or anything like them: ' +
+              ', '.join(map(str, result['not_for_sale'])))
+
+@querystats.measured
+def check_out_cart():
+    """
+    Lets a user buy several store items, from any stores, at once: they
+    fill a cart, see what it costs, and buy every item in it in one
+    checkout (see checkout.py).
+    """
+    print('Add items to your cart as "<store name> <clothing ID>", one ' +
+          'per line, and an empty line when you are done.')
+    items = []
+    while True:
+        line = input('> ').strip()
+        if not line:
+            break
+        store_name, _, clothing_id = line.rpartition(' ')
+        items.append((store_name.strip(), clothing_id))
+    if not items:
+        return
+    try:
+        quoted = call(service.quote_cart, session, items)
+    except ServiceError as err:
+        print(err.message)
+        return
+    tables.print_table(([item[column] for column in checkout.CART_COLUMNS]
+                        for item in quoted['items']), checkout.CART_COLUMNS)
+    for_sale = [item for item in quoted['items'] if item['price'] is not None]
+    if len(for_sale) < len(quoted['items']):
+        print('Items without a price are not for sale at that store.')
+    if not for_sale:
+        return
+    answer = input('Buy ' + str(len(for_sale)) + ' items for $' +
+                   format(quoted['total'], ',.2f') + '? [Y/N]\n')
+    if answer.upper() != 'Y':
+        return
+    try:
+        sale = call(service.checkout_cart, session, for_sale)
+    except ServiceError as err:
+        print(err.message)
+        return
+    print('Bought ' + str(len(sale['items'])) + ' items for $' +
+          format(sale['total'], ',.2f') + '. They are in your closet.')
+
+@querystats.measured
+def sell_items():
+    """
+    Sells items of the store owner's inventory to a user, all in one
+    checkout at their current prices.
+    """
+    clothing_ids = input('Clothing IDs of the items being sold (separated ' +
+                         'by spaces): ').split()
+    user_id = input('User ID of user the items are being sold to: ')
+    try:
+        sale = call(service.sell_items, session, clothing_ids, user_id)
+    except ServiceError as err:
+        print(err.message)
+        return
+    if sale['not_for_sale']:
+        print('Not in your inventory: ' +
+              ', '.join(map(str, sale['not_for_sale'])))
+    if sale['sold']:
+        print('Sold ' + str(len(sale['sold'])) + ' items for $' +
+              format(sale['total'], ',.2f') + '.')
 
+@querystats.measured
+def import_outfits():
+    """
+    Lets a stylist create many outfits at once from a CSV file laid out like
+    styled_outfits.csv. All of the outfits are created in one transaction.
+    """
+    path = input('Path of the CSV file of outfits to import: ')
+    try:
+        new_outfits = outfits.read_outfits_csv(path)
+        outfit_ids = call(outfits.import_outfits, new_outfits)
+    except OSError:
+        print('Sorry, that file could not be read.')
+        return
+    except ValueError as err:
+        print('Sorry, no outfits were imported: ' + str(err))
+        return
+    print('Imported ' + str(len(outfit_ids)) + ' outfits (IDs ' +
+          ', '.join(map(str, outfit_ids)) + ').')
+
+@querystats.measured
 def change_sale(username, clothing_id, new_discount):
     """
     Change the discount and thus price of a specific clothing item 
     in the store inventory.
     """
     # Different stores could be selling the same clothing item for
-    # different prices, so must check that you're obtaining the 
-    # price for the item from right store:
-    get_price_discount = "SELECT price, discount FROM store_closet \
-                          WHERE clothing_id = '" + clothing_id \
-                          + "' AND store_name = '" + username + "';"
-    cursor = conn.cursor(buffered=True)
-    cursor.execute(get_price_discount)
-    row = cursor.fetchone()
-    old_price = row[0]
-    old_discount = row[1]
-    get_orig_price = "SELECT find_original_price(%s, %s);"
-    cursor = conn.cursor(buffered=True)
-    cursor.execute(get_orig_price, (old_price, old_discount))
-    orig_price = cursor.fetchone()[0]
-    new_price = float(orig_price) * (float(new_discount) / 100)
-    sql = "UPDATE store_closet SET price = '" + str(round(new_price, 2)) \
-          + "', discount = '" + new_discount \
-          + "' WHERE clothing_id = '" + clothing_id \
-          + "' AND store_name = '" + username + "';"
-    cursor.execute(sql)
-                   
+    # different prices, so the update is always scoped to this store. The
+    # new price is computed from the stored original price by the UPDATE.
+    try:
+        result = call(service.reprice, session, clothing_id, new_discount)
+    except ServiceError as err:
+        print(err.message)
+        return
+    if result['rows'] == 0:
+        print('No item with that clothing ID is for sale at ' + username +
+              ' (or it already has that discount).')
+    else:
+        print('Updated ' + str(result['rows']) + ' item in ' +
+              str(round(result['seconds'] * 1000, 1)) + ' ms.')
+
+@querystats.measured
+def markdown_items(username):
+    """
+    Applies one discount to many items of the store at once: every item,
+    or only those of a clothing type, a brand, and/or a list of clothing
+    IDs.
+    """
+    discount = input('Discount for the markdown (%): ')
+    print('Leave any of the following blank to include every item.')
+    clothing_type = input('Only this clothing type: ') or None
+    brand = input('Only this brand: ') or None
+    clothing_ids = input('Only these clothing IDs (separated by spaces): ')
+    try:
+        clothing_ids = list(map(int, clothing_ids.split())) or None
+        result = call(service.markdown, session, discount,
+                      clothing_type=clothing_type, brand=brand,
+                      clothing_ids=clothing_ids)
+    except ValueError:
+        print('Clothing IDs must be numbers.')
+        return
+    except ServiceError as err:
+        print(err.message)
+        return
+    print('Marked down ' + str(result['rows']) + ' items in ' +
+          str(round(result['seconds'] * 1000, 1)) + ' ms.')
+
+@querystats.measured
+def show_store_dashboard(store_name):
+    """
+    Prints a store's dashboard: its totals, and its items by clothing type
+    and size. It is read from the summary tables (see summaries.py), so it
+    takes the same time however big the store is.
+    """
+    try:
+        dashboard = call(service.store_dashboard, session, store_name)
+    except ServiceError as err:
+        print(err.message)
+        return
+    print(dashboard['store_name'] + ': ' + str(dashboard['items']) +
+          ' items worth $' + format(dashboard['retail_value'], ',.2f') +
+          ' ($' + format(dashboard['full_value'], ',.2f') +
+          ' at full price)')
+    print(str(dashboard['discounted_items']) + ' items on sale, ' +
+          'average discount ' + str(dashboard['average_discount']) + '%')
+    tables.print_table(([row['clothing_type'], row['size'], row['items']]
+                        for row in dashboard['by_type']),
+                       ['clothing_type', 'size', 'items'])
+
+@querystats.measured
+def show_store_dashboards():
+    """
+    Prints the totals of every store, one store per row.
+    """
+    try:
+        dashboards = call(service.store_dashboards, session)
+    except ServiceError as err:
+        print(err.message)
+        return
+    columns = ['store_name', 'items', 'retail_value', 'full_value',
+               'average_discount', 'discounted_items']
+    tables.print_table(([row[column] for column in columns]
+                        for row in dashboards), columns)
+
+@querystats.measured
+def show_closet_dashboard(user_id):
+    """
+    Prints how a user's personal closet is used: its pieces, their wears,
+    and how many are clean, dirty and shared.
+    """
+    try:
+        dashboard = call(service.closet_dashboard, session, user_id)
+    except ServiceError as err:
+        print(err.message)
+        return
+    print('Closet of user ' + str(dashboard['user_id']) + ': ' +
+          str(dashboard['items']) + ' pieces worn ' +
+          str(dashboard['total_wears']) + ' times (' +
+          str(dashboard['average_wears']) + ' each on average)')
+    print(str(dashboard['clean']) + ' clean, ' + str(dashboard['dirty']) +
+          ' dirty, ' + str(dashboard['shared']) + ' shared')
+
 
 # ----------------------------------------------------------------------
 # Command-Line Functionality
@@ -455,7 +933,8 @@ def show_options(username):
     Redirects the program to show the options based on what type of
     user is using the program (store owner, stylist, or personal user).
     """
-    permission = get_permission(username)
+    # the role was found when the user logged in (see service.login)
+    permission = session.role
     if permission == 'storeowner':
         show_storeowner_options(username)
     elif permission == 'stylist':
@@ -478,6 +957,11 @@ def show_admin_options(username):
     print('  (a) Personal options')
     print('  (b) Store owner options')
     print('  (c) Stylist options')
+    print('  (r) query performance report')
+    print('  (t) capture query plans of slow statements')
+    print('  (z) reset query statistics')
+    print('  (d) dashboards of every store')
+    print('  (u) dashboard of a store or closet')
     print('  (q) - quit')
 
     while True: 
@@ -488,9 +972,40 @@ def show_admin_options(username):
             show_storeowner_options(username)
         elif action =='c':
             show_stylist_options(username)
+        elif action == 'r':
+            querystats.print_report()
+        elif action == 't':
+            set_explain_threshold()
+        elif action == 'z':
+            querystats.stats.reset()
+            print('Query statistics reset.')
+        elif action == 'd':
+            show_store_dashboards()
+        elif action == 'u':
+            store_name = input('Store name (nothing to see a personal ' +
+                               'closet instead): ').strip()
+            if store_name:
+                show_store_dashboard(store_name)
+            else:
+                show_closet_dashboard(input('User ID of the closet: '))
         else:
             quit_ui()
 
+def set_explain_threshold():
+    """
+    Lets an admin choose how slow (in ms) a statement must be for its
+    EXPLAIN plan to be captured and shown in the report.
+    """
+    ms = input('Capture the plans of statements slower than how many ms? ' +
+               '(nothing to stop capturing): ').strip()
+    try:
+        querystats.set_explain_threshold(float(ms) if ms else None)
+    except ValueError:
+        print('Please enter a number of milliseconds.')
+        return
+    print('Capturing plans of statements slower than ' + ms + ' ms.' if ms
+          else 'Not capturing plans.')
+
 def show_personal_options(username):
     """
     Show all the possible functionalities of the personal type user.
@@ -504,6 +1019,16 @@ def show_personal_options(username):
     print('  (c) borrow from collaborative closet')
     print('  (d) style an outfit')
     print('  (e) show store inventories')
+    print('  (f) check if you have or can borrow an item')
+    print('  (g) return a borrowed item')
+    print('  (h) search clothes by keyword')
+    print('  (i) get outfit recommendations')
+    print("  (j) log today's outfit")
+    print('  (p) compare prices across stores')
+    print('  (k) buy store items')
+    if offline:
+        print('  (s) sync your offline closet')
+        print('  (v) keep a store in your offline closet')
     print('  (q) quit')
 
     while True: 
@@ -516,31 +1041,32 @@ def show_personal_options(username):
                              'available ' + 'clothes you would like to see: ')
             show_user_in_collab(user_id)
         elif action == 'c':
-            sql = "SELECT user_id FROM user WHERE username='" + username + "';"
-            cursor = conn.cursor(buffered=True)
-            cursor.execute(sql)
-            res = cursor.fetchone()[0]
-            user_id = int(res)
-            print(user_id)
-            borrow_from_collab_closet(user_id)
+            print(session.user_id)
+            borrow_from_collab_closet()
         elif action == 'd':
             create_outfit()
         elif action == 'e':
-            store_name = input('Enter a store name: ')
-            show_store_inventory(store_name)
-            filter = input('Would you like to filter by price (p), clothing '\
-                            + 'type (t), or discount (d)? ')
-            if filter == 'p':
-                min_price = input('Minimum price (in USD): $')
-                max_price = input('Maximum price (in USD): $')
-                filter_store_by_price(store_name, min_price, max_price)
-            elif filter == 't':
-                clothing_type = input('Clothing type: ')
-                filter_store_by_type(store_name, clothing_type)
-            elif filter == 'd':
-                min_discount = input('Minimum discount (%): ')
-                max_discount = input('Maximum disocunt (%): ')
-                filter_store_by_discount(store_name, min_discount, max_discount)
+            store_name = input('Enter a store name (or nothing to ' + \
+                               'search every store): ')
+            search_store_inventory(store_name)
+        elif action == 'f':
+            check_available(username)
+        elif action == 'g':
+            return_to_collab_closet()
+        elif action == 'h':
+            keyword_search()
+        elif action == 'i':
+            recommend_pieces()
+        elif action == 'j':
+            log_todays_outfit()
+        elif action == 'p':
+            compare_prices()
+        elif action == 'k':
+            check_out_cart()
+        elif action == 's' and offline:
+            sync_offline_closet()
+        elif action == 'v' and offline:
+            keep_store_offline()
         else:
             quit_ui()
 
@@ -556,53 +1082,45 @@ def show_storeowner_options(username):
     print('  (a) show inventory')
     print('  (b) add item to inventory')
     print('  (c) remove item from inventory')
-    print('  (s) sell clothing item to user')
+    print('  (s) sell clothing items to user')
     print('  (e) change discount on item')
+    print('  (m) mark down many items')
+    print('  (k) search inventory by keyword')
+    print('  (d) store dashboard')
     print('  (q) quit')
 
     while True:
         action = input('Enter an option: ')[0].lower()
         if action == 'a':
             # store owner's username is just the store name
-            show_store_inventory(username)
-            filter = input('Would you like to filter by price (p), '\
-                            + 'clothing type (t), or discount (d)? ')
-            if filter == 'p':
-                min_price = input('Minimum price (in USD): $')
-                max_price = input('Maximum price (in USD): $')
-                filter_store_by_price(username, min_price, max_price)
-            elif filter == 't':
-                clothing_type = input('Clothing type: ')
-                filter_store_by_type(username, clothing_type)
-            elif filter == 'd':
-                min_discount = input('Minimum discount (%): ')
-                max_discount = input('Maximum disocunt (%): ')
-                filter_store_by_discount(username, min_discount, max_discount)
+            search_store_inventory(username)
         elif action == 'b':
             clothing_id = input('Clothing ID: ')
-            price = input('Price of item: $')
+            price = input('Full (undiscounted) price of item: $')
             discount = input('Discount (%): ')
-            sql = "INSERT INTO store_closet VALUES ('" + username + "', "\
-                  + str(clothing_id) + ", " + str(price) + ", "\
-                  + str(discount) + ");"
-            cursor = conn.cursor(buffered=True)
-            cursor.execute(sql)
+            try:
+                call(service.add_store_item, session, clothing_id, price,
+                     discount)
+            except ServiceError as err:
+                print(err.message)
         elif action == 'c':
             clothing_id = input('Clothing ID of item you want to remove: ')
-            sql = "DELETE FROM store_closet WHERE clothing_id = '" +\
-                  clothing_id + "' AND store_name = '" + username +"';"
-            cursor = conn.cursor(buffered=True)
-            cursor.execute(sql)
+            try:
+                call(service.remove_store_item, session, clothing_id)
+            except ServiceError as err:
+                print(err.message)
         elif action == 's':
-            clothing_id = input('Clothing ID of item being sold: ')
-            user_id = input('User ID of user the item is being sold to: ')
-            sql = 'CALL sell_to_user(%s, %s);'
-            cursor = conn.cursor(buffered=True)
-            cursor.execute(sql, (clothing_id, user_id))
+            sell_items()
         elif action == 'e':
             clothing_id = input('Clothing ID of item: ')
             new_discount = input('Desired discount (%): ')
             change_sale(username, clothing_id, new_discount)
+        elif action == 'm':
+            markdown_items(username)
+        elif action == 'k':
+            keyword_search(username)
+        elif action == 'd':
+            show_store_dashboard(username)
         else:
             quit_ui()
 
@@ -614,6 +1132,10 @@ def show_stylist_options(username):
     print('  (a) show collaborative clothes')
     print('  (b) show store inventories')
     print('  (c) style an outfit for anyone')
+    print('  (d) import outfits from a CSV file')
+    print('  (e) search clothes by keyword')
+    print('  (f) get outfit recommendations')
+    print('  (p) compare prices across stores')
     print('  (q) quit')
 
     while True: 
@@ -624,23 +1146,19 @@ def show_stylist_options(username):
                              'available clothes you would like to see: ')
             show_user_in_collab(user_id)
         elif action == 'b':
-            store_name = input('Enter a store name: ')
-            show_store_inventory(store_name)
-            filter = input('Would you like to filter by price (p), clothing '\
-                            + 'type (t), or discount (d)? ')
-            if filter == 'p':
-                min_price = input('Minimum price (in USD): $')
-                max_price = input('Maximum price (in USD): $')
-                filter_store_by_price(store_name, min_price, max_price)
-            elif filter == 't':
-                clothing_type = input('Clothing type: ')
-                filter_store_by_type(store_name, clothing_type)
-            elif filter == 'd':
-                min_discount = input('Minimum discount (%): ')
-                max_discount = input('Maximum disocunt (%): ')
-                filter_store_by_discount(store_name, min_discount, max_discount)
+            store_name = input('Enter a store name (or nothing to ' + \
+                               'search every store): ')
+            search_store_inventory(store_name)
         elif action == 'c':
             create_outfit()
+        elif action == 'd':
+            import_outfits()
+        elif action == 'e':
+            keyword_search()
+        elif action == 'f':
+            recommend_pieces()
+        elif action == 'p':
+            compare_prices()
         else:
             quit_ui()
 
@@ -667,7 +1185,19 @@ def quit_ui():
     Quits the program, printing a good bye message to the user.
     """
     print('Good bye!')
-    conn.close()
+    if offline:
+        if offline.pending():
+            sync_offline_closet()
+        offline.close()
+    pools.checkin(conn)
+    if STATS_FILE:
+        querystats.dump(STATS_FILE)
+    if DEBUG:
+        for role, stats in pools.stats().items():
+            print(role, stats)
+        print('cache', cache.query_cache.stats())
+        querystats.print_report()
+    pools.close_all()
     exit()
 
 def main():
@@ -675,8 +1205,13 @@ def main():
     Main function for starting things up.
     """
     username = login()
+    open_offline_closet()
     show_options(username)
 
 if __name__ == '__main__':
-    conn = get_conn('appadmin', 'adminpw')
+    # one pool of connections per database role
+    pools = PoolManager(get_conn)
+    first_connection = connect_in_background()
+    if STATS_FILE:
+        querystats.start_dumps(STATS_FILE)
     main()
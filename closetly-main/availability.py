@@ -0,0 +1,101 @@
+"""
+Answers "is there a <type> in <size> and <color> I can wear?" for a user:
+either a clean piece in their own closet, or a piece someone else shares in
+the collaborative closet that nobody is borrowing. Each question is an
+EXISTS-style lookup on the (clothing_type, size, color) index that stops at
+the first match, and a whole wish list is checked in one query.
+
+The lookups are coroutines taking a Db (see db.py).
+"""
+from collections import namedtuple
+
+from statements import STATEMENTS
+
+# Answer for one wish: the first matching clothing_id and whether it is in
+# the user's own closet ('personal') or borrowable ('collab'), or None and
+# None if nothing matches
+Availability = namedtuple('Availability', ['clothing_type', 'size', 'color',
+                                           'clothing_id', 'source'])
+
+# Most wishes checked by one query; longer lists are split
+MAX_BATCH = 100
+
+# Finds a match for every wish in a derived table of wishes. Each scalar
+# subquery is an idx_type_size_color lookup for one wish.
+_MATCH_PERSONAL = """(SELECT c.clothing_id
+        FROM clothes AS c JOIN personal_closet AS p
+            ON p.clothing_id = c.clothing_id
+        WHERE c.clothing_type = w.clothing_type AND c.size = w.size
+            AND c.color = w.color AND p.user_id = %s AND p.is_clean = 1
+        LIMIT 1)"""
+_MATCH_COLLAB = """(SELECT c.clothing_id
+        FROM clothes AS c JOIN collab_closet AS cc
+            ON cc.clothing_id = c.clothing_id
+        WHERE c.clothing_type = w.clothing_type AND c.size = w.size
+            AND c.color = w.color AND cc.user_id <> %s
+            AND cc.is_available = 1
+        LIMIT 1)"""
+
+
+def _wish(clothing_type, size, color):
+    """
+    Trims the criteria of one wish, raising ValueError if any is missing.
+    """
+    wish = tuple(str(value).strip() for value in (clothing_type, size, color))
+    if not all(wish):
+        raise ValueError('A clothing type, size and color are all needed.')
+    return wish
+
+
+async def find_available(db, user_id, clothing_type, size, color):
+    """
+    Returns the Availability of one type/size/color for a user.
+    """
+    wish = _wish(clothing_type, size, color)
+    row = await db.fetch_one(STATEMENTS['find_available'],
+                             wish + (user_id,) + wish + (user_id,))
+    if row is None:
+        return Availability(*wish, clothing_id=None, source=None)
+    return Availability(*wish, clothing_id=row[0], source=row[1])
+
+
+async def find_available_many(db, user_id, wishes):
+    """
+    Returns the Availability of every (type, size, color) in a wish list,
+    in order, checking up to MAX_BATCH wishes per query.
+    """
+    wishes = [_wish(*wish) for wish in wishes]
+    results = []
+    for start in range(0, len(wishes), MAX_BATCH):
+        results.extend(await _find_batch(db, user_id,
+                                         wishes[start:start + MAX_BATCH]))
+    return results
+
+
+async def _find_batch(db, user_id, wishes):
+    if not wishes:
+        return []
+    wish_rows = ' UNION ALL '.join(
+        ['SELECT %s AS wish, %s AS clothing_type, %s AS size, %s AS color'] +
+        ['SELECT %s, %s, %s, %s'] * (len(wishes) - 1))
+    sql = 'SELECT w.wish, ' + _MATCH_PERSONAL + ', ' + _MATCH_COLLAB + \
+        ' FROM (' + wish_rows + ') AS w ORDER BY w.wish'
+    params = [user_id, user_id]
+    for i, wish in enumerate(wishes):
+        params.append(i)
+        params.extend(wish)
+    # the same number of wishes always gives the same SQL text, so the
+    # prepared statement is reused
+    rows = await db.fetch_all(sql, params)
+    results = []
+    for i, personal_id, collab_id in rows:
+        if personal_id is not None:
+            results.append(Availability(*wishes[i], clothing_id=personal_id,
+                                        source='personal'))
+        elif collab_id is not None:
+            results.append(Availability(*wishes[i], clothing_id=collab_id,
+                                        source='collab'))
+        else:
+            results.append(Availability(*wishes[i], clothing_id=None,
+                                        source=None))
+    return results
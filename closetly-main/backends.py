@@ -0,0 +1,104 @@
+"""
+Storage backends Closetly can run on. The statements (statements.py) and
+operations (service.py, routines.py) are written so the same code runs on
+either of them:
+
+    mysql            the closetly database on the local MySQL server
+                     (the default), set up with setup.sql and friends
+    sqlite:PATH      an embedded SQLite database in a file, created from
+                     setup-sqlite.sql if it has no tables yet
+    sqlite::memory:  an embedded SQLite database in memory, shared by
+                     every connection the process opens
+
+The app and the API pick a backend with the CLOSETLY_DB environment
+variable (or api.py --db). SQLite databases need no server and each file
+is a database of its own, so benchmarks and load tests can run side by
+side on one machine. SQLite has no database users, so the role a
+connection is opened for only matters on MySQL.
+"""
+import os
+
+# Environment variable naming the backend, and the backend otherwise used
+ENV_VARIABLE = 'CLOSETLY_DB'
+DEFAULT = 'mysql'
+
+# Where the local MySQL database is. Find the port in MAMP or MySQL
+# Workbench, or with SHOW VARIABLES WHERE variable_name LIKE 'port';
+MYSQL_SETTINGS = {
+    'host': 'localhost',
+    'port': '3306',
+    'database': 'closetly',
+}
+
+# SQLite URI of the in-memory database; while any connection to it is
+# open, every other connection of the process sees the same data
+MEMORY_URI = 'file:closetly?mode=memory&cache=shared'
+
+
+def configured():
+    """
+    Returns the backend named by CLOSETLY_DB, or the default.
+    """
+    return os.environ.get(ENV_VARIABLE) or DEFAULT
+
+
+def parse(spec):
+    """
+    Returns ('mysql', None) or ('sqlite', path) for a backend spec, raising
+    ValueError if it names no backend.
+    """
+    if spec == 'mysql':
+        return 'mysql', None
+    kind, _, path = spec.partition(':')
+    if kind == 'sqlite' and path:
+        return 'sqlite', path
+    raise ValueError("Unknown backend " + repr(spec) + ": use 'mysql' or " +
+                     "'sqlite:PATH' (or 'sqlite::memory:').")
+
+
+def is_sqlite(spec):
+    return parse(spec)[0] == 'sqlite'
+
+
+def connect(spec, user, password):
+    """
+    Opens a connection to the backend as the given database user. SQLite
+    databases get the Closetly schema the first time they are opened.
+    """
+    kind, path = parse(spec)
+    if kind == 'mysql':
+        # only needed when talking to a real MySQL server
+        import mysql.connector
+        return mysql.connector.connect(user=user, password=password,
+                                       **MYSQL_SETTINGS)
+    # only needed for SQLite, so starting the app on MySQL skips it
+    import standin
+    if path == ':memory:':
+        path = MEMORY_URI
+    conn = standin.connect(path, create_schema=False)
+    if not conn.has_schema():
+        conn.create_schema()
+    return conn
+
+
+def error_class(conn):
+    """
+    Returns the base class of the errors a connection raises.
+    """
+    if getattr(conn, 'is_standin', False):
+        import sqlite3
+        return sqlite3.Error
+    import mysql.connector
+    return mysql.connector.Error
+
+
+def integrity_error(conn):
+    """
+    Returns the class of the errors a connection raises when a statement
+    breaks a key or foreign key constraint.
+    """
+    if getattr(conn, 'is_standin', False):
+        import sqlite3
+        return sqlite3.IntegrityError
+    import mysql.connector
+    return mysql.connector.IntegrityError
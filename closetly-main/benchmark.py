@@ -0,0 +1,600 @@
+"""
+Reproducible benchmark suite for Closetly. Generates synthetic data with
+datagen.py, times every query path the app uses (and the stored routines,
+on MySQL), and reports p50/p95/p99 latency and throughput per operation.
+Results can be saved as a JSON baseline and compared with a later run.
+
+Usage:
+    $ python3 benchmark.py --scale 100000 --out baseline.json
+    $ python3 benchmark.py --scale 100000 --compare baseline.json
+    $ python3 benchmark.py --standin :memory:       # no MySQL server needed
+
+The writes pay for the triggers that keep the dashboard summaries, the
+best prices and the change log up to date. To see what they cost, run the
+write cases again with a group of triggers dropped and compare:
+
+    $ python3 benchmark.py --case markdown_store --out triggers.json
+    $ python3 benchmark.py --case markdown_store --without-triggers \
+          best_price --compare triggers.json
+
+Benchmarks against MySQL replace the contents of the closetly database;
+after --without-triggers, run setup-routines.sql again.
+"""
+import argparse
+import json
+import platform
+import random
+import sys
+import tempfile
+import time
+
+import availability
+import borrowing
+import checkout
+import datagen
+import db
+import mirror
+import outfits
+import prices
+import repricing
+import routines
+import standin
+import statements as stmts
+import store_search
+import summaries
+import text_search
+import wears
+
+# Registered benchmark cases: name -> (function, runs on the stand-in)
+CASES = {}
+
+# Triggers that keep derived tables up to date, by group, as name prefixes
+# (see setup-routines.sql and setup-sqlite.sql)
+DERIVED_TRIGGERS = {
+    'summaries': ('store_summary_', 'store_type_summary_',
+                  'closet_summary_', 'summaries_'),
+    'best_price': ('best_price_',),
+    'change_log': ('change_log_',),
+}
+
+
+def case(name, standin_ok=True):
+    """
+    Registers a benchmark case. The function is called as fn(conn, data,
+    rng) and runs one operation.
+    """
+    def register(fn):
+        CASES[name] = (fn, standin_ok)
+        return fn
+    return register
+
+
+# ----------------------------------------------------------------------
+# Logging users in
+# ----------------------------------------------------------------------
+@case('check_username')
+def bench_check_username(conn, data, rng):
+    stmts.fetch_value(conn, 'check_username', (rng.choice(data.usernames),))
+
+
+@case('get_permission')
+def bench_get_permission(conn, data, rng):
+    stmts.fetch_value(conn, 'get_permission', (rng.choice(data.usernames),))
+
+
+@case('get_user_id')
+def bench_get_user_id(conn, data, rng):
+    stmts.fetch_value(conn, 'get_user_id', (rng.choice(data.usernames),))
+
+
+@case('authenticate', standin_ok=False)
+def bench_authenticate(conn, data, rng):
+    username = rng.choice(data.usernames)
+    stmts.fetch_value(conn, 'authenticate',
+                      (username, datagen.password_for(username)))
+
+
+@case('login')
+def bench_login(conn, data, rng):
+    username = rng.choice(data.usernames)
+    stmts.fetch_one(conn, 'login', (datagen.password_for(username), username))
+
+
+# ----------------------------------------------------------------------
+# Closets
+# ----------------------------------------------------------------------
+@case('personal_clothes')
+def bench_personal_clothes(conn, data, rng):
+    stmts.fetch_all(conn, 'personal_clothes', (rng.choice(data.shoppers),))
+
+
+@case('user_in_collab')
+def bench_user_in_collab(conn, data, rng):
+    stmts.fetch_all(conn, 'user_in_collab', (rng.choice(data.user_ids),))
+
+
+# offline mirror (see mirror.py) of a shopper's closets, made on first use
+_mirror = None
+
+
+def _mirrored(conn, data):
+    global _mirror
+    if _mirror is None:
+        # the first shoppers own the most (see datagen.Zipf); one from the
+        # middle has a typical closet
+        shopper = data.shoppers[len(data.shoppers) // 2]
+        user_id = stmts.fetch_value(conn, 'get_user_id', (shopper,))
+        _mirror = mirror.Mirror(':memory:', user_id)
+        db.call(conn, mirror.sync, _mirror)
+    return _mirror
+
+
+@case('mirrored_personal_clothes')
+def bench_mirrored_personal_clothes(conn, data, rng):
+    _mirrored(conn, data).personal_closet()
+
+
+@case('mirror_sync')
+def bench_mirror_sync(conn, data, rng):
+    # a delta sync, of whatever the cases run before it changed
+    db.call(conn, mirror.sync, _mirrored(conn, data))
+
+
+@case('all_clothes_page')
+def bench_all_clothes_page(conn, data, rng):
+    stmts.fetch_all(conn, 'all_clothes_page',
+                    (rng.randrange(data.max_clothing_id), 20))
+
+
+@case('collab_clothes_page')
+def bench_collab_clothes_page(conn, data, rng):
+    stmts.fetch_all(conn, 'collab_clothes_page',
+                    (rng.randrange(data.max_clothing_id), 20))
+
+
+def _wish(rng):
+    clothing_type = rng.choice(datagen.CLOTHING_TYPES)
+    if clothing_type in ('shoes', 'boots'):
+        size = rng.choice(datagen.SHOE_SIZES)
+    elif clothing_type in ('pants', 'jeans', 'skirt', 'dress'):
+        size = rng.choice(datagen.NUMBER_SIZES)
+    else:
+        size = rng.choice(datagen.LETTER_SIZES)
+    return clothing_type, size, rng.choice(datagen.COLORS)
+
+
+@case('find_available')
+def bench_find_available(conn, data, rng):
+    db.call(conn, availability.find_available, rng.choice(data.user_ids),
+            *_wish(rng))
+
+
+@case('find_available_wish_list')
+def bench_find_available_wish_list(conn, data, rng):
+    db.call(conn, availability.find_available_many,
+            rng.choice(data.user_ids), [_wish(rng) for _ in range(10)])
+
+
+# ----------------------------------------------------------------------
+# Store inventories
+# ----------------------------------------------------------------------
+@case('store_inventory_page')
+def bench_store_inventory_page(conn, data, rng):
+    store, clothing_id = rng.choice(data.store_items)
+    stmts.fetch_all(conn, 'store_inventory_page', (store, clothing_id, 20))
+
+
+@case('search_store_by_price')
+def bench_search_store_by_price(conn, data, rng):
+    low = rng.choice([0, 20, 40, 60])
+    list(store_search.search_store(
+        conn, {'store_name': rng.choice(data.stores), 'min_price': low,
+               'max_price': low + 30}, sort='price'))
+
+
+@case('search_all_stores_by_type')
+def bench_search_all_stores_by_type(conn, data, rng):
+    list(store_search.search_store(
+        conn, {'clothing_type': rng.choice(datagen.CLOTHING_TYPES),
+               'size': rng.choice(datagen.LETTER_SIZES)}, sort='price'))
+
+
+@case('search_all_stores_by_discount')
+def bench_search_all_stores_by_discount(conn, data, rng):
+    list(store_search.search_store(
+        conn, {'min_discount': rng.choice(datagen.DISCOUNTS)},
+        sort='discount_desc'))
+
+
+# ----------------------------------------------------------------------
+# Dashboards (summary tables, and the scan they replace)
+# ----------------------------------------------------------------------
+@case('store_dashboard')
+def bench_store_dashboard(conn, data, rng):
+    db.call(conn, summaries.store_dashboard, rng.choice(data.stores))
+
+
+@case('all_store_dashboards')
+def bench_all_store_dashboards(conn, data, rng):
+    db.call(conn, summaries.store_dashboards)
+
+
+@case('all_store_totals_by_scan')
+def bench_all_store_totals_by_scan(conn, data, rng):
+    cursor = conn.cursor()
+    cursor.execute(summaries.SUMMARIES[0][2])
+    cursor.fetchall()
+    cursor.close()
+
+
+@case('closet_dashboard')
+def bench_closet_dashboard(conn, data, rng):
+    db.call(conn, summaries.closet_dashboard, rng.choice(data.user_ids))
+
+
+# ----------------------------------------------------------------------
+# Price comparison (best_price, and the join over the stores it replaces)
+# ----------------------------------------------------------------------
+# The cheapest listing of pieces like a piece, found by joining its
+# product's pieces to their listings
+BEST_PRICE_BY_JOIN = """SELECT MIN(s.price)
+FROM clothes AS o
+    JOIN clothes AS c ON c.clothing_type = o.clothing_type
+        AND c.size = o.size AND c.color = o.color AND c.brand = o.brand
+    JOIN store_closet AS s ON s.clothing_id = c.clothing_id
+WHERE o.clothing_id = %s"""
+
+
+@case('item_best_price')
+def bench_item_best_price(conn, data, rng):
+    db.call(conn, prices.compare_item, rng.randint(1, data.max_clothing_id))
+
+
+@case('item_best_price_by_join')
+def bench_item_best_price_by_join(conn, data, rng):
+    cursor = conn.cursor()
+    cursor.execute(BEST_PRICE_BY_JOIN, (rng.randint(1, data.max_clothing_id),))
+    cursor.fetchall()
+    cursor.close()
+
+
+@case('outfit_best_prices')
+def bench_outfit_best_prices(conn, data, rng):
+    db.call(conn, prices.compare_outfit,
+            rng.randint(1, data.sizes['outfits']))
+
+
+def _keywords(rng):
+    return rng.choice(datagen.COLORS) + ' ' + \
+        rng.choice(datagen.CLOTHING_TYPES)
+
+
+@case('keyword_search')
+def bench_keyword_search(conn, data, rng):
+    db.call(conn, text_search.search, _keywords(rng), facets=False)
+
+
+@case('keyword_search_with_facets')
+def bench_keyword_search_with_facets(conn, data, rng):
+    db.call(conn, text_search.search, _keywords(rng))
+
+
+@case('keyword_search_in_store')
+def bench_keyword_search_in_store(conn, data, rng):
+    db.call(conn, text_search.search, _keywords(rng),
+            {'store_name': rng.choice(data.stores)})
+
+
+# Recommendation model of this run, kept out of the app's model directory
+_recommend_model = None
+
+
+def _recommend(conn, **kwargs):
+    global _recommend_model
+    # numpy is only needed by these cases
+    import recommend
+    if _recommend_model is None:
+        _recommend_model = recommend.Model(tempfile.mkdtemp(
+            prefix='closetly-recommend-'))
+    db.call(conn, recommend.recommend, model=_recommend_model, **kwargs)
+
+
+@case('recommend_for_item')
+def bench_recommend_for_item(conn, data, rng):
+    _recommend(conn, seed_ids=[rng.randint(1, data.max_clothing_id)],
+               scopes=['collab', 'store'])
+
+
+@case('recommend_for_vibe')
+def bench_recommend_for_vibe(conn, data, rng):
+    _recommend(conn, vibe=rng.choice(datagen.AESTHETICS),
+               user_id=rng.choice(data.user_ids))
+
+
+@case('find_original_price', standin_ok=False)
+def bench_find_original_price(conn, data, rng):
+    cursor = stmts.execute_sql(conn, 'SELECT find_original_price(%s, %s)',
+                               (rng.uniform(5, 200),
+                                rng.choice(datagen.DISCOUNTS)))
+    cursor.fetchall()
+
+
+# ----------------------------------------------------------------------
+# Writes (run last, since they change the data)
+# ----------------------------------------------------------------------
+@case('reprice_item')
+def bench_reprice_item(conn, data, rng):
+    store, clothing_id = rng.choice(data.store_items)
+    db.call(conn, repricing.set_discount, store, clothing_id,
+            rng.choice([0] + datagen.DISCOUNTS))
+
+
+@case('markdown_by_type')
+def bench_markdown_by_type(conn, data, rng):
+    db.call(conn, repricing.markdown, rng.choice([0] + datagen.DISCOUNTS),
+            store_name=rng.choice(data.stores),
+            clothing_type=rng.choice(datagen.CLOTHING_TYPES))
+
+
+@case('markdown_store')
+def bench_markdown_store(conn, data, rng):
+    db.call(conn, repricing.markdown, rng.choice([0] + datagen.DISCOUNTS),
+            store_name=rng.choice(data.stores))
+
+
+@case('create_outfit')
+def bench_create_outfit(conn, data, rng):
+    clothing_ids = rng.sample(range(1, data.max_clothing_id + 1), 3)
+    db.call(conn, outfits.create_outfit, clothing_ids, 'benchmark outfit',
+            'casual')
+
+
+@case('borrow_item', standin_ok=False)
+def bench_borrow_item(conn, data, rng):
+    stmts.fetch_value(conn, 'borrow_item', (rng.choice(data.user_ids),
+                                            rng.choice(data.collab_items)))
+    conn.commit()
+
+
+@case('borrow_and_return')
+def bench_borrow_and_return(conn, data, rng):
+    user_id = rng.choice(data.user_ids)
+    clothing_id = rng.choice(data.collab_items)
+    if db.call(conn, borrowing.borrow, user_id, clothing_id):
+        db.call(conn, borrowing.return_item, user_id, clothing_id)
+
+
+@case('sell_to_user')
+def bench_sell_to_user(conn, data, rng):
+    store, clothing_id = rng.choice(data.store_items)
+    db.call(conn, routines.sell_to_user, store, clothing_id,
+            rng.choice(data.user_ids))
+
+
+@case('checkout_10_items')
+def bench_checkout_10_items(conn, data, rng):
+    # one listing of each piece
+    picked = dict((clothing_id, store)
+                  for store, clothing_id in rng.sample(data.store_items, 10))
+    quoted = db.call(conn, checkout.quote,
+                     [(store, clothing_id, None)
+                      for clothing_id, store in picked.items()])
+    try:
+        db.call(conn, checkout.checkout, rng.choice(data.user_ids),
+                [item for item in quoted if item.price is not None])
+    except ValueError:
+        # every item was sold by earlier runs, or an earlier sale already
+        # put one of the pieces in this closet
+        pass
+
+
+@case('add_account')
+def bench_add_account(conn, data, rng):
+    username = 'bench' + str(rng.randrange(10 ** 12))
+    db.call(conn, routines.add_account, 'Benchmark User', username,
+            datagen.password_for(username), 'personal')
+
+
+# pieces of personal closets by user_id, loaded on first use
+_closets = None
+
+
+def _closet_pieces(conn):
+    global _closets
+    if _closets is None:
+        _closets = {}
+        cursor = conn.cursor()
+        cursor.execute('SELECT user_id, clothing_id FROM personal_closet ' +
+                       'LIMIT ' + str(datagen.SAMPLE_SIZE))
+        for user_id, clothing_id in cursor.fetchall():
+            _closets.setdefault(user_id, []).append(clothing_id)
+        cursor.close()
+    return _closets
+
+
+@case('log_outfit')
+def bench_log_outfit(conn, data, rng):
+    closets = _closet_pieces(conn)
+    user_id = rng.choice(list(closets))
+    pieces = closets[user_id]
+    db.call(conn, wears.log_outfit, user_id,
+            rng.sample(pieces, min(3, len(pieces))))
+
+
+@case('log_and_roll_up_100_wears')
+def bench_log_and_roll_up_100_wears(conn, data, rng):
+    closets = _closet_pieces(conn)
+    users = rng.sample(list(closets), min(100, len(closets)))
+    db.call(conn, wears.record, [(user_id, rng.choice(closets[user_id]),
+                                  None) for user_id in users])
+    db.call(conn, wears.roll_up_all)
+
+
+# ----------------------------------------------------------------------
+# Running and reporting
+# ----------------------------------------------------------------------
+def drop_triggers(conn, groups):
+    """
+    Drops the triggers of the given DERIVED_TRIGGERS groups, so the write
+    cases can be timed without them. Returns the names dropped.
+    """
+    prefixes = tuple(prefix for group in groups
+                     for prefix in DERIVED_TRIGGERS[group])
+    cursor = conn.cursor()
+    if standin.is_standin(conn):
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = " +
+                       "'trigger'")
+    else:
+        cursor.execute('SELECT TRIGGER_NAME FROM information_schema.' +
+                       'TRIGGERS WHERE TRIGGER_SCHEMA = DATABASE()')
+    names = [row[0] for row in cursor.fetchall()
+             if row[0].startswith(prefixes)]
+    for name in names:
+        cursor.execute('DROP TRIGGER ' + name)
+    cursor.close()
+    conn.commit()
+    return names
+
+
+def percentile(sorted_values, p):
+    """
+    Returns the p-th percentile (nearest rank) of an already sorted list.
+    """
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1,
+                      int(round(p / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+
+def summarize(latencies, wall_seconds):
+    """
+    Returns the latency percentiles (in ms) and throughput of one case.
+    """
+    latencies = sorted(latencies)
+    return {
+        'n': len(latencies),
+        'p50_ms': 1000 * percentile(latencies, 50),
+        'p95_ms': 1000 * percentile(latencies, 95),
+        'p99_ms': 1000 * percentile(latencies, 99),
+        'mean_ms': 1000 * sum(latencies) / len(latencies),
+        'ops_per_s': len(latencies) / wall_seconds if wall_seconds else 0.0,
+    }
+
+
+def run_case(fn, conn, data, iterations, seed, warmup=10):
+    """
+    Runs one case `warmup` times untimed, then `iterations` times timed.
+    """
+    rng = random.Random(seed)
+    for _ in range(warmup):
+        fn(conn, data, rng)
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(iterations):
+        t = time.perf_counter()
+        fn(conn, data, rng)
+        latencies.append(time.perf_counter() - t)
+    return summarize(latencies, time.perf_counter() - start)
+
+
+def run(conn, data, iterations, names=None, seed=121):
+    """
+    Runs every registered case (or just the named ones) that the database
+    supports, returning {case name: summary}.
+    """
+    on_standin = standin.is_standin(conn)
+    results = {}
+    for name, (fn, standin_ok) in CASES.items():
+        if names and name not in names:
+            continue
+        if on_standin and not standin_ok:
+            continue
+        results[name] = run_case(fn, conn, data, iterations, seed)
+    return results
+
+
+def print_results(results, baseline=None):
+    """
+    Prints a table of results, with the change in p50/p95 relative to a
+    baseline's results if one is given.
+    """
+    header = 'case'.ljust(30) + 'p50 ms'.rjust(9) + 'p95 ms'.rjust(9) + \
+        'p99 ms'.rjust(9) + 'ops/s'.rjust(10)
+    if baseline:
+        header += 'p50 chg'.rjust(10) + 'p95 chg'.rjust(10)
+    print(header)
+    for name, r in results.items():
+        line = name.ljust(30) + ('%9.3f%9.3f%9.3f%10.0f' % (
+            r['p50_ms'], r['p95_ms'], r['p99_ms'], r['ops_per_s']))
+        old = (baseline or {}).get(name)
+        if old:
+            line += _change(old['p50_ms'], r['p50_ms']).rjust(10)
+            line += _change(old['p95_ms'], r['p95_ms']).rjust(10)
+        print(line)
+
+
+def _change(old, new):
+    if not old:
+        return 'n/a'
+    return '%+.1f%%' % (100 * (new - old) / old)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark every Closetly query path.')
+    datagen.add_size_arguments(parser)
+    parser.add_argument('--iterations', type=int, default=200,
+                        help='timed runs per case (default 200)')
+    parser.add_argument('--case', action='append', dest='cases',
+                        help='only run this case (may be repeated)')
+    parser.add_argument('--out', help='save results as a JSON baseline')
+    parser.add_argument('--compare', metavar='BASELINE',
+                        help='compare with a saved JSON baseline')
+    parser.add_argument('--without-triggers', action='append',
+                        metavar='GROUP', choices=sorted(DERIVED_TRIGGERS),
+                        help='drop the triggers maintaining a derived table '
+                             '(' + ', '.join(sorted(DERIVED_TRIGGERS)) +
+                             ') after loading the data; may be repeated')
+    args = parser.parse_args()
+
+    conn = datagen.connect(args.standin)
+    sizes = datagen.sizes_from_args(args)
+    print('Generating data for ' + str(sizes['clothes']) + ' clothes...')
+    data = datagen.populate(conn, sizes, args.seed)
+    print('Loaded ' + str(sum(data.counts.values())) + ' rows in ' +
+          str(round(data.load_seconds, 1)) + ' s.')
+    if args.without_triggers:
+        print('Dropped ' + str(len(drop_triggers(
+            conn, args.without_triggers))) + ' triggers.')
+    results = run(conn, data, args.iterations, args.cases, args.seed)
+    conn.close()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+    print_results(results, baseline)
+
+    if args.out:
+        report = {
+            'meta': {
+                'backend': 'standin' if args.standin else 'mysql',
+                'sizes': sizes,
+                'counts': data.counts,
+                'seed': args.seed,
+                'iterations': args.iterations,
+                'without_triggers': args.without_triggers or [],
+                'python': sys.version.split()[0],
+                'platform': platform.platform(),
+                'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            },
+            'results': results,
+        }
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2)
+        print('Saved results to ' + args.out)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,212 @@
+"""
+Multi-threaded load test of collaborative-closet borrowing. Each client
+thread has its own connection and keeps borrowing a random item (popular
+items far more often, so clients fight over them) and returning it a moment
+later. It checks that no item is ever lent to two users at once, and
+reports borrows per second for each number of concurrent clients.
+
+Usage:
+    $ python3 borrow_loadtest.py --scale 100000
+    $ python3 borrow_loadtest.py --clients 1,8,64 --seconds 10
+    $ python3 borrow_loadtest.py --standin /tmp/closetly.db
+
+Load tests against MySQL replace the contents of the closetly database.
+The stand-in must be a file (not ':memory:') so every client can open it,
+and SQLite lets only one client write at a time.
+"""
+import argparse
+import random
+import threading
+import time
+
+import borrowing
+import datagen
+import db
+import standin
+
+# Numbers of concurrent clients measured by default
+CLIENT_COUNTS = [1, 8, 64]
+# Chance that a client returns an item on its next turn instead of
+# borrowing another
+RETURN_CHANCE = 0.5
+
+
+def reset(conn):
+    """
+    Makes every collaborative closet item available and empties the
+    waitlists.
+    """
+    cursor = conn.cursor()
+    cursor.execute("""UPDATE collab_closet
+        SET is_available = 1, current_borrower = NULL""")
+    cursor.execute('DELETE FROM borrow_waitlist')
+    conn.commit()
+    cursor.close()
+
+
+class Ledger:
+    """
+    Who the clients have been told holds each item. An item being lent to
+    someone while the ledger says another client holds it is a double
+    booking.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._holders = {}
+        self.double_bookings = []
+
+    def borrowed(self, clothing_id, user_id):
+        with self._lock:
+            holder = self._holders.get(clothing_id)
+            if holder is not None:
+                self.double_bookings.append((clothing_id, holder, user_id))
+            self._holders[clothing_id] = user_id
+
+    def returning(self, clothing_id):
+        # cleared before the return commits, so a client borrowing the item
+        # right after the return never sees a stale holder
+        with self._lock:
+            self._holders.pop(clothing_id, None)
+
+    def holders(self):
+        with self._lock:
+            return dict(self._holders)
+
+
+class Client(threading.Thread):
+    """
+    One client: a connection that borrows and returns items as a random
+    user until told to stop.
+    """
+
+    def __init__(self, connect, data, ledger, stop, seed):
+        threading.Thread.__init__(self, daemon=True)
+        self._connect = connect
+        self._data = data
+        self._ledger = ledger
+        self._done = stop
+        self._rng = random.Random(seed)
+        self.attempts = 0
+        self.borrows = 0
+        self.returns = 0
+        self.error = None
+
+    def run(self):
+        conn = self._connect()
+        rng = self._rng
+        items = datagen.Zipf(len(self._data.collab_items), rng)
+        held = []
+        try:
+            while not self._done.is_set():
+                if held and rng.random() < RETURN_CHANCE:
+                    user_id, clothing_id = held.pop(rng.randrange(len(held)))
+                    self._ledger.returning(clothing_id)
+                    if db.call(conn, borrowing.return_item, user_id,
+                               clothing_id)[0]:
+                        self.returns += 1
+                    continue
+                user_id = rng.choice(self._data.user_ids)
+                clothing_id = items.choice(self._data.collab_items)
+                self.attempts += 1
+                if db.call(conn, borrowing.borrow, user_id, clothing_id):
+                    self._ledger.borrowed(clothing_id, user_id)
+                    held.append((user_id, clothing_id))
+                    self.borrows += 1
+        except Exception as e:
+            self.error = e
+        finally:
+            conn.close()
+
+
+def run_clients(connect, data, clients, seconds, seed):
+    """
+    Runs `clients` client threads for `seconds` and returns
+    (attempts, borrows, returns, Ledger, seconds, client errors).
+    """
+    ledger = Ledger()
+    stop = threading.Event()
+    threads = [Client(connect, data, ledger, stop, seed + i)
+               for i in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    errors = [thread.error for thread in threads if thread.error]
+    return (sum(t.attempts for t in threads), sum(t.borrows for t in threads),
+            sum(t.returns for t in threads), ledger, elapsed, errors)
+
+
+def check_database(conn, ledger):
+    """
+    Returns the items whose borrower in the database is not the client
+    that last borrowed them, or that are marked unavailable with nobody
+    borrowing them.
+    """
+    holders = ledger.holders()
+    cursor = conn.cursor()
+    cursor.execute("""SELECT clothing_id, current_borrower, is_available
+        FROM collab_closet
+        WHERE is_available = 0 OR current_borrower IS NOT NULL""")
+    wrong = []
+    for clothing_id, borrower, is_available in cursor.fetchall():
+        if is_available or borrower is None or \
+                holders.get(clothing_id) != borrower:
+            wrong.append((clothing_id, borrower, is_available))
+    cursor.close()
+    return wrong
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Load test collaborative-closet borrowing.')
+    datagen.add_size_arguments(parser)
+    parser.add_argument('--clients', default=','.join(map(str, CLIENT_COUNTS)),
+                        help='comma-separated numbers of concurrent clients '
+                             '(default 1,8,64)')
+    parser.add_argument('--seconds', type=float, default=10,
+                        help='seconds to run each number of clients '
+                             '(default 10)')
+    args = parser.parse_args()
+    if args.standin == ':memory:':
+        parser.error('the stand-in must be a file for several clients')
+
+    conn = datagen.connect(args.standin)
+    print('Generating data...')
+    data = datagen.populate(conn, datagen.sizes_from_args(args), args.seed)
+    if not data.collab_items:
+        parser.error('no collaborative closet items were generated')
+
+    def connect():
+        if args.standin:
+            return standin.connect(args.standin, create_schema=False)
+        return datagen.connect()
+
+    print('clients'.rjust(8) + 'attempts'.rjust(10) + 'borrows'.rjust(10) +
+          'borrows/s'.rjust(11) + 'double-booked'.rjust(15))
+    failed = False
+    for clients in [int(n) for n in args.clients.split(',')]:
+        reset(conn)
+        attempts, borrows, _, ledger, elapsed, errors = run_clients(
+            connect, data, clients, args.seconds, args.seed)
+        wrong = check_database(conn, ledger)
+        double_booked = len(ledger.double_bookings) + len(wrong)
+        print(str(clients).rjust(8) + str(attempts).rjust(10) +
+              str(borrows).rjust(10) +
+              str(int(borrows / elapsed)).rjust(11) +
+              str(double_booked).rjust(15))
+        for e in errors[:3]:
+            print('  client error: ' + str(e))
+        failed = failed or double_booked > 0 or bool(errors)
+    conn.close()
+    if failed:
+        raise SystemExit('Borrowing was not safe under load.')
+    print('No item was ever lent to two users at once.')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+"""
+Borrowing from the collaborative closet. An item is claimed by one
+conditional UPDATE that only matches while the item is still available, so
+when several users try to borrow the same item at once the row lock lets
+exactly one UPDATE match and the others see it is gone; nothing is read
+first and then written. Users who miss out can join a waitlist, and a
+returned item goes straight to the first user waiting for it.
+
+Every function is a coroutine taking a Db (see db.py), so the command-line
+app and the HTTP API share it; from blocking code use
+db.call(conn, borrowing.borrow, user_id, clothing_id).
+"""
+from statements import STATEMENTS
+
+
+async def borrow(db, user_id, clothing_id):
+    """
+    Borrows an item for a user if it is available and they are not its
+    owner. Returns whether the item was borrowed.
+    """
+    async with db.transaction():
+        claimed = await db.execute(STATEMENTS['claim_item'],
+                                   (user_id, clothing_id, user_id))
+        if claimed.rowcount > 0:
+            # a user who was waiting for the item no longer is
+            await db.execute(STATEMENTS['leave_waitlist'],
+                             (clothing_id, user_id))
+    return claimed.rowcount > 0
+
+
+async def borrow_many(db, user_id, clothing_ids, all_or_nothing=False):
+    """
+    Borrows every available item of a list in one UPDATE (e.g. all the
+    pieces of an outfit), returning the list of clothing IDs borrowed. With
+    all_or_nothing, nothing is borrowed unless every item can be.
+    """
+    clothing_ids = sorted(set(int(clothing_id) for clothing_id in clothing_ids))
+    if not clothing_ids:
+        return []
+    in_list = '(' + ', '.join(['%s'] * len(clothing_ids)) + ')'
+    # not prepared: the IN list changes length from call to call
+    try:
+        async with db.transaction():
+            # Rows are locked in clothing_id order, so two batch borrows
+            # that overlap cannot deadlock
+            claimed = await db.execute("""UPDATE collab_closet
+                SET is_available = 0, current_borrower = %s
+                WHERE clothing_id IN """ + in_list + """
+                    AND is_available = 1 AND user_id <> %s""",
+                                       [user_id] + clothing_ids + [user_id],
+                                       prepared=False)
+            if all_or_nothing and claimed.rowcount < len(clothing_ids):
+                raise _NotAll()
+            rows = await db.fetch_all("""SELECT clothing_id FROM collab_closet
+                WHERE clothing_id IN """ + in_list + """
+                    AND current_borrower = %s AND is_available = 0""",
+                                      clothing_ids + [user_id],
+                                      prepared=False)
+            borrowed = sorted(row[0] for row in rows)
+            if borrowed:
+                await db.execute("""DELETE FROM borrow_waitlist
+                    WHERE user_id = %s AND clothing_id IN (""" +
+                                 ', '.join(['%s'] * len(borrowed)) + ')',
+                                 [user_id] + borrowed, prepared=False)
+    except _NotAll:
+        return []
+    return borrowed
+
+
+class _NotAll(Exception):
+    """
+    Rolls back an all-or-nothing batch borrow that could not get every item.
+    """
+
+
+async def return_item(db, user_id, clothing_id):
+    """
+    Returns an item a user borrowed. If anyone is waiting for it, it goes
+    to the first of them in the same transaction, so nobody can take it in
+    between. Returns (whether the item was returned, user_id of its next
+    borrower or None).
+    """
+    async with db.transaction():
+        released = await db.execute(STATEMENTS['release_item'],
+                                    (clothing_id, user_id))
+        if released.rowcount == 0:
+            return False, None
+        next_borrower = await _hand_to_waitlist(db, clothing_id)
+    return True, next_borrower
+
+
+async def _hand_to_waitlist(db, clothing_id):
+    """
+    Lends a just-released item to the first user waiting for it, skipping
+    entries that have gone away. Returns their user_id, or None.
+    """
+    while True:
+        next_user = await db.fetch_value(STATEMENTS['waitlist_head'],
+                                         (clothing_id,))
+        if next_user is None:
+            return None
+        # deleting the entry first means a user who leaves the waitlist at
+        # the same moment is never lent the item
+        left = await db.execute(STATEMENTS['leave_waitlist'],
+                                (clothing_id, next_user))
+        if left.rowcount:
+            claimed = await db.execute(STATEMENTS['claim_item'],
+                                       (next_user, clothing_id, next_user))
+            if claimed.rowcount:
+                return next_user
+
+
+async def join_waitlist(db, user_id, clothing_id):
+    """
+    Adds a user to the waitlist of an item they do not own and are not
+    already borrowing. Returns their place in line (1 is next), or 0 if
+    they cannot wait for the item.
+    """
+    async with db.transaction():
+        await db.execute(STATEMENTS['join_waitlist'],
+                         (user_id, clothing_id, user_id, user_id,
+                          clothing_id, user_id))
+    return await waitlist_position(db, user_id, clothing_id)
+
+
+async def leave_waitlist(db, user_id, clothing_id):
+    """
+    Takes a user off the waitlist of an item. Returns whether they were on
+    it.
+    """
+    async with db.transaction():
+        left = await db.execute(STATEMENTS['leave_waitlist'],
+                                (clothing_id, user_id))
+    return left.rowcount > 0
+
+
+async def waitlist_position(db, user_id, clothing_id):
+    """
+    Returns a user's place in line for an item (1 is next), or 0 if they
+    are not waiting for it.
+    """
+    return await db.fetch_value(STATEMENTS['waitlist_position'],
+                                (clothing_id, clothing_id, user_id))
@@ -0,0 +1,134 @@
+"""
+Keyset-paginated browsing of the clothes catalog, the collaborative closet
+and store inventories. Only one screenful of rows is ever fetched from the
+server at a time, so large catalogs show their first page right away and
+never have to fit in memory.
+"""
+import statements as stmts
+import tables
+from cache import query_cache
+
+# Number of rows shown per page
+PAGE_SIZE = 20
+
+# Column names of each paginated statement, and the position of the
+# clothing_id (the pagination key) within them
+ALL_CLOTHES_COLUMNS = ['clothing_id', 'clothing_type', 'size', 'gender',
+                       'color', 'brand', 'description', 'image_url',
+                       'aesthetic', 'store_name']
+COLLAB_COLUMNS = ['user_id', 'clothing_id', 'clothing_type', 'size',
+                  'gender', 'color', 'brand', 'description', 'image_url',
+                  'aesthetic', 'curr_condition', 'is_available',
+                  'current_borrower']
+STORE_COLUMNS = ['clothing_id', 'price', 'discount', 'clothing_type',
+                 'size', 'gender', 'color', 'brand', 'description',
+                 'image_url', 'aesthetic']
+
+# Cache tags (see cache.py) of a page of each statement, given the
+# statement's parameters and the page. Pages of statements not listed here
+# are always read from the database.
+PAGE_TAGS = {
+    'store_inventory_page':
+        lambda params, page: [('store', params[0])],
+    'collab_clothes_page':
+        lambda params, page: [('collab_item', row[1]) for row in page],
+}
+
+
+def iter_page(conn, name, params=(), after=0, page_size=PAGE_SIZE):
+    """
+    Yields the rows of one page of the named keyset-paginated statement,
+    starting after the clothing_id `after`, as they arrive from the server.
+    """
+    return stmts.stream(conn, name, tuple(params) + (after, page_size))
+
+
+def fetch_page(conn, name, params=(), after=0, page_size=PAGE_SIZE):
+    """
+    Returns one page of the named statement as a list, from the cache if
+    the statement's pages are cacheable.
+    """
+    if name not in PAGE_TAGS:
+        return list(iter_page(conn, name, params, after, page_size))
+    params = tuple(params)
+    return query_cache.get_or_load(
+        name, params + (after, page_size),
+        lambda: list(iter_page(conn, name, params, after, page_size)),
+        tags=lambda page: PAGE_TAGS[name](params, page))
+
+
+def iter_pages(conn, name, params=(), key_index=0, after=0,
+               page_size=PAGE_SIZE):
+    """
+    Yields successive pages (lists of at most page_size rows) of the named
+    statement, fetching each page only when it is asked for. Sending a
+    clothing_id into the generator jumps so the next page starts at that ID.
+    """
+    while True:
+        page = fetch_page(conn, name, params, after, page_size)
+        if not page:
+            return
+        jump = yield page
+        if jump is not None:
+            after = jump - 1
+        elif len(page) < page_size:
+            return
+        else:
+            after = page[-1][key_index]
+
+
+def render_page(page, columns):
+    """
+    Prints one page of rows as a table.
+    """
+    tables.print_table(page, columns)
+
+
+def browse(conn, name, columns, params=(), page_size=PAGE_SIZE):
+    """
+    Interactive page-by-page browsing of the named statement. The user can
+    move to the next page, jump to a clothing ID, or go back to the menu.
+    """
+    key_index = columns.index('clothing_id')
+    page_through(iter_pages(conn, name, params, key_index,
+                            page_size=page_size), columns)
+
+
+def page_through(pages, columns, can_jump=True):
+    """
+    Shows the pages of a page generator one at a time, asking the user
+    what to do after each one. Jumping to a clothing ID is only offered for
+    generators that accept one (see iter_pages).
+    """
+    prompt = '(n) next page, '
+    if can_jump:
+        prompt += '(j) jump to clothing ID, '
+    prompt += '(q) back to menu: '
+    page = next(pages, None)
+    while page is not None:
+        render_page(page, columns)
+        action = input(prompt)[:1].lower()
+        if action == 'j' and can_jump:
+            try:
+                clothing_id = int(input('Clothing ID to jump to: '))
+            except ValueError:
+                print('Clothing IDs are whole numbers.')
+                continue
+            page = _advance(pages, clothing_id)
+        elif action == 'n' or action == '':
+            page = _advance(pages)
+        else:
+            pages.close()
+            return
+    print('No more items.')
+
+
+def _advance(pages, jump=None):
+    """
+    Returns the next page from iter_pages (optionally jumping to a
+    clothing ID), or None once there are no more rows.
+    """
+    try:
+        return pages.send(jump)
+    except StopIteration:
+        return None
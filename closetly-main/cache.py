@@ -0,0 +1,177 @@
+"""
+In-process read-through cache for data that is read far more often than it
+changes: permissions, user_id lookups, store inventories and collaborative
+closet pages. Entries expire after a time-to-live, the least recently used
+entries are evicted once the cache is full, and the app's write paths
+invalidate exactly the entries they make stale through tags.
+
+Tags used by the app:
+    ('user', username)          permission/user_id/username lookups
+    ('store', store_name)       pages and searches of one store
+    ('all_stores',)             searches across every store
+    ('collab_item', clothing_id) collaborative closet rows of one item
+"""
+import threading
+import time
+from collections import OrderedDict
+
+# Maximum number of cached results
+MAX_ENTRIES = 2048
+# Default number of seconds a cached result stays valid
+DEFAULT_TTL = 60
+
+
+class QueryCache:
+    """
+    A thread-safe TTL + LRU cache keyed by (statement name, parameters).
+    """
+
+    def __init__(self, max_entries=MAX_ENTRIES, ttl=DEFAULT_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        # key -> (value, expiry time, tags), least recently used first
+        self._entries = OrderedDict()
+        # tag -> set of keys carrying that tag
+        self._tagged = {}
+        self._lock = threading.Lock()
+        # metrics
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get_or_load(self, name, params, loader, tags=(), ttl=None):
+        """
+        Returns the cached result of the named query with the given
+        parameters, or calls loader() to run it and caches what it returns.
+        tags is either a list of tags or a function that returns the tags
+        of a loaded result (e.g. one per row).
+        """
+        found, value = self.lookup(name, params)
+        if found:
+            return value
+        value = loader()
+        if callable(tags):
+            tags = tags(value)
+        self.put((name, tuple(params)), value, tags, ttl)
+        return value
+
+    def lookup(self, name, params):
+        """
+        Returns (True, cached result) of the named query with the given
+        parameters, or (False, None) if it is not cached. Callers that
+        cannot pass a loader (e.g. coroutines) look up, load, then put.
+        """
+        key = (name, tuple(params))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires, _ = entry
+                if expires > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return True, value
+                self.expirations += 1
+                self._remove(key)
+            self.misses += 1
+        return False, None
+
+    def put(self, key, value, tags=(), ttl=None):
+        """
+        Caches a value under key, evicting the least recently used entries
+        if the cache is full.
+        """
+        expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+        tags = frozenset(tags)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, expires, tags)
+            for tag in tags:
+                self._tagged.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def invalidate(self, name, params=()):
+        """
+        Drops the cached result of one query.
+        """
+        with self._lock:
+            if self._remove((name, tuple(params))):
+                self.invalidations += 1
+
+    def invalidate_tag(self, *tag):
+        """
+        Drops every cached result carrying the given tag.
+        """
+        with self._lock:
+            for key in list(self._tagged.get(tag, ())):
+                self._remove(key)
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tagged.clear()
+
+    def stats(self):
+        """
+        Returns a dictionary of the cache's usage metrics. Every miss is one
+        database round trip; every hit is one round trip saved.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations,
+            }
+
+    def _remove(self, key):
+        """
+        Removes an entry and its tag references. Must be called with the
+        lock held. Returns whether the key was present.
+        """
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return False
+        for tag in entry[2]:
+            keys = self._tagged.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tagged[tag]
+        return True
+
+
+# Cache shared by the whole app
+query_cache = QueryCache()
+
+
+def invalidate_user(username):
+    """
+    Call after a user's account, permission or closet user_id changes.
+    """
+    query_cache.invalidate_tag('user', username)
+
+
+def invalidate_store(store_name):
+    """
+    Call after any item of the store is added, removed, repriced or sold.
+    """
+    query_cache.invalidate_tag('store', store_name)
+    query_cache.invalidate_tag('all_stores')
+
+
+def invalidate_collab_item(clothing_id):
+    """
+    Call after an item in the collaborative closet is borrowed or returned.
+    """
+    query_cache.invalidate_tag('collab_item', int(clothing_id))
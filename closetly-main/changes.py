@@ -0,0 +1,357 @@
+"""
+Change log of the closets, stores and outfits. Triggers (in
+setup-routines.sql, and setup-sqlite.sql on SQLite) append a row to
+change_log for every insert, update and delete of user, clothes,
+personal_closet, collab_closet, store_closet, outfits and styled_outfits,
+naming the table and the row's primary key. Change IDs only go up, so
+anything derived from the tables (a cache, a search index, an export)
+can keep a checkpoint, the last change it has handled, and catch up on
+what changed since instead of rescanning the tables:
+
+    for batch in changes.tail(conn, 'search-index'):
+        for change in batch:
+            ... look change.key up in change.table_name again ...
+
+tail hands out changes at least once: a batch's checkpoint is saved when
+the next batch is asked for, so a consumer that stops part way through a
+batch gets the whole batch again. A change only says that a row changed;
+consumers look the row up again (it is gone if that finds nothing), which
+makes handling a change twice harmless.
+
+Change IDs are handed out when a change is made, not when it commits, so
+a transaction still running can commit a change below IDs already read.
+A Feed remembers such gaps, as ranges of change IDs, and picks their
+changes up once they commit; a gap whose next change is over GAP_WAIT
+seconds old is taken to be a transaction that rolled back, and only the
+MAX_GAPS newest gaps are waited for at all. The saved checkpoint stays
+below the oldest open gap.
+
+Changes every consumer has handled can be pruned:
+
+    $ python3 changes.py --status
+    $ python3 changes.py --tail CONSUMER
+    $ python3 changes.py --prune
+
+The operations are coroutines taking a Db (see db.py); from blocking code
+use db.call(conn, changes.next_batch, feed).
+"""
+import datetime
+import time
+from collections import namedtuple
+
+import db
+from statements import CHANGE_COLUMNS, STATEMENTS
+
+# Primary key of each table in the change log
+KEYS = {
+    'user': ['user_id'],
+    'clothes': ['clothing_id'],
+    'personal_closet': ['user_id', 'clothing_id'],
+    'collab_closet': ['user_id', 'clothing_id'],
+    'store_closet': ['store_name', 'clothing_id'],
+    'outfits': ['outfit_id'],
+    'styled_outfits': ['outfit_id', 'clothing_id'],
+}
+
+# Most changes in one batch
+BATCH_SIZE = 1000
+# Seconds a gap in the change IDs is waited for before it is taken to be
+# a rolled-back transaction; longer than any transaction runs
+GAP_WAIT = 300
+# Most gaps a feed waits for at once; older ones are given up on first.
+# Rolled-back transactions and auto-increment locking leave holes in the
+# change IDs that never fill, so there must be a limit
+MAX_GAPS = 100
+# Seconds tail waits before looking for new changes when there are none
+POLL_INTERVAL = 1
+
+# Changes that filled gaps in the change IDs read before; one
+# 'change_id BETWEEN %s AND %s' per gap is appended, joined by OR
+CHANGES_IN = 'SELECT ' + CHANGE_COLUMNS + ' FROM change_log WHERE '
+
+
+class Change(namedtuple('Change', ['change_id', 'table_name', 'operation',
+                                   'user_id', 'clothing_id', 'outfit_id',
+                                   'store_name', 'changed_at'])):
+    """
+    A change_log row. operation is 'I', 'U' or 'D'.
+    """
+    __slots__ = ()
+
+    @property
+    def key(self):
+        """
+        The changed row's primary key, in KEYS order.
+        """
+        return tuple(getattr(self, column)
+                     for column in KEYS[self.table_name])
+
+
+class Feed:
+    """
+    A consumer's place in the change log: the last change read, and the
+    gaps below it still waited for, in change ID order, as [first change
+    ID, last change ID, changed_at of the change after the gap] lists
+    (which round-trip through JSON unchanged).
+    """
+
+    def __init__(self, consumer, after, gaps=None):
+        self.consumer = consumer
+        self.after = after
+        self.gaps = sorted([int(start), int(end), seen]
+                           for start, end, seen in gaps or [])
+
+    @property
+    def checkpoint(self):
+        """
+        The last change up to which every change has been read.
+        """
+        return self.gaps[0][0] - 1 if self.gaps else self.after
+
+    def add_gap(self, start, end, seen):
+        """
+        Waits for the changes start to end, which were missing when a
+        change made at seen was read. Gives up on the oldest gaps once
+        there are more than MAX_GAPS.
+        """
+        if start <= end:
+            self.gaps.append([start, end, str(seen)])
+            self.gaps.sort()
+            del self.gaps[:-MAX_GAPS]
+
+    def fill(self, change_id):
+        """
+        Stops waiting for a change that has turned up, splitting its gap.
+        """
+        for i, (start, end, seen) in enumerate(self.gaps):
+            if start <= change_id <= end:
+                self.gaps[i:i + 1] = [
+                    gap for gap in ([start, change_id - 1, seen],
+                                    [change_id + 1, end, seen])
+                    if gap[0] <= gap[1]]
+                return
+
+
+def _time(value):
+    # SQLite returns timestamps as text
+    if isinstance(value, str):
+        return datetime.datetime.fromisoformat(value)
+    return value
+
+
+async def _close_gaps(db, feed):
+    """
+    Forgets the gaps whose next change was made over GAP_WAIT seconds ago.
+    """
+    if feed.gaps:
+        now = _time(await db.fetch_value('SELECT CURRENT_TIMESTAMP',
+                                         prepared=False))
+        wait = datetime.timedelta(seconds=GAP_WAIT)
+        feed.gaps = [gap for gap in feed.gaps
+                     if now - _time(gap[2]) <= wait]
+
+
+def _read(feed, changes):
+    """
+    Moves the feed past changes read after feed.after, noting the gaps
+    between them.
+    """
+    for change in changes:
+        feed.add_gap(feed.after + 1, change.change_id - 1, change.changed_at)
+        feed.after = change.change_id
+
+
+async def open_feed(db, consumer):
+    """
+    Returns a consumer's Feed, starting after its saved checkpoint; a new
+    consumer starts at the oldest change still in the log.
+    """
+    after = await db.fetch_value(STATEMENTS['change_checkpoint'],
+                                 (consumer,))
+    if after is None:
+        first = await db.fetch_value(STATEMENTS['first_change'])
+        after = first - 1 if first else 0
+    return Feed(consumer, after)
+
+
+async def feed_at_end(db, consumer):
+    """
+    Returns a Feed after the latest change, for a consumer that has just
+    read the tables whole (in the same transaction). Gaps among the
+    changes of the last GAP_WAIT seconds are still waited for.
+    """
+    last = await db.fetch_value(STATEMENTS['last_change'])
+    feed = Feed(consumer, last or 0)
+    if not last:
+        return feed
+    now = _time(await db.fetch_value('SELECT CURRENT_TIMESTAMP',
+                                     prepared=False))
+    wait = datetime.timedelta(seconds=GAP_WAIT)
+    recent = []
+    before = last
+    while True:
+        rows = await db.fetch_all(STATEMENTS['recent_changes'],
+                                  (before, BATCH_SIZE))
+        recent += [row for row in rows if now - _time(row[1]) <= wait]
+        if len(rows) < BATCH_SIZE or now - _time(rows[-1][1]) > wait:
+            break
+        before = rows[-1][0] - 1
+    recent.reverse()
+    for (change_id, changed_at), (next_id, next_at) in zip(recent,
+                                                           recent[1:]):
+        feed.add_gap(change_id + 1, next_id - 1, next_at)
+    return feed
+
+
+async def pruned_after(db, change_id):
+    """
+    Returns whether changes after change_id have been pruned from the log,
+    so a consumer that got that far cannot catch up from it.
+    """
+    first = await db.fetch_value(STATEMENTS['first_change'])
+    return first is not None and first > change_id + 1
+
+
+async def next_batch(db, feed, limit=BATCH_SIZE):
+    """
+    Returns the next changes of a feed, up to limit of them, in change ID
+    order, and moves the feed past them. Changes that filled gaps since
+    the last batch come first.
+    """
+    await _close_gaps(db, feed)
+    late = []
+    if feed.gaps:
+        # not prepared: the number of gaps changes from batch to batch
+        late = sorted(Change(*row) for row in await db.fetch_all(
+            CHANGES_IN + ' OR '.join(['change_id BETWEEN %s AND %s'] *
+                                     len(feed.gaps)),
+            [bound for start, end, _ in feed.gaps for bound in (start, end)],
+            prepared=False))
+    for change in late:
+        feed.fill(change.change_id)
+    changes = [Change(*row) for row in await db.fetch_all(
+        STATEMENTS['changes_after'], (feed.after, limit))]
+    _read(feed, changes)
+    return late + changes
+
+
+async def save_checkpoint(db, feed):
+    """
+    Saves how far the feed's consumer has got (see Feed.checkpoint).
+    """
+    async with db.transaction():
+        if await db.fetch_value(STATEMENTS['change_checkpoint'],
+                                (feed.consumer,)) is None:
+            await db.execute(STATEMENTS['add_change_checkpoint'],
+                             (feed.checkpoint, feed.consumer))
+        else:
+            await db.execute(STATEMENTS['move_change_checkpoint'],
+                             (feed.checkpoint, feed.consumer))
+
+
+async def _poll(db, feed, limit):
+    # each poll is its own transaction, so it sees what committed since
+    async with db.transaction():
+        return await next_batch(db, feed, limit)
+
+
+def tail(conn, consumer, batch=BATCH_SIZE, interval=POLL_INTERVAL,
+         stop=None):
+    """
+    Yields batches of changes for a consumer from its checkpoint on, as
+    they are made, until stop (a threading.Event) is set. The checkpoint
+    of each batch is saved once the consumer asks for the next one.
+    """
+    feed = db.call(conn, open_feed, consumer)
+    while stop is None or not stop.is_set():
+        changes = db.call(conn, _poll, feed, batch)
+        if changes:
+            yield changes
+            db.call(conn, save_checkpoint, feed)
+        elif stop is not None:
+            stop.wait(interval)
+        else:
+            time.sleep(interval)
+
+
+async def prune(db):
+    """
+    Deletes the changes every consumer has handled, and returns how many.
+    Nothing is deleted while there are no consumers.
+    """
+    async with db.transaction():
+        oldest = await db.fetch_value(
+            'SELECT MIN(change_id) FROM change_checkpoint', prepared=False)
+        if oldest is None:
+            return 0
+        deleted = await db.execute(
+            'DELETE FROM change_log WHERE change_id <= %s', (oldest,),
+            prepared=False)
+    return deleted.rowcount
+
+
+async def status(db):
+    """
+    Returns the first and last change in the log and each consumer's
+    checkpoint, as {consumer: change_id}.
+    """
+    return {
+        'first_change': await db.fetch_value(STATEMENTS['first_change']),
+        'last_change': await db.fetch_value(STATEMENTS['last_change']),
+        'consumers': dict(await db.fetch_all(
+            'SELECT consumer, change_id FROM change_checkpoint ' +
+            'ORDER BY consumer', prepared=False)),
+    }
+
+
+def main():
+    # only needed when run as a script, not when the app imports this
+    import argparse
+    import backends
+    import pool
+    parser = argparse.ArgumentParser(
+        description='Look at, follow or prune the change log.')
+    parser.add_argument('--status', action='store_true',
+                        help="show the log's extent and every consumer's "
+                             "checkpoint (the default)")
+    parser.add_argument('--tail', metavar='CONSUMER',
+                        help='print changes as they are made, from the '
+                             "consumer's checkpoint on")
+    parser.add_argument('--prune', action='store_true',
+                        help='delete the changes every consumer has handled')
+    parser.add_argument('--db', metavar='BACKEND',
+                        help="'mysql' or 'sqlite:PATH' (default: "
+                             "$CLOSETLY_DB, else mysql)")
+    args = parser.parse_args()
+    spec = args.db or backends.configured()
+    try:
+        backends.parse(spec)
+    except ValueError as err:
+        parser.error(str(err))
+
+    conn = backends.connect(spec, *pool.ROLE_CREDENTIALS['appadmin'])
+    try:
+        if args.prune:
+            print('Pruned ' + str(db.call(conn, prune)) + ' changes.')
+        if args.tail:
+            try:
+                for batch in tail(conn, args.tail):
+                    for change in batch:
+                        print(str(change.change_id).rjust(10) + ' ' +
+                              change.operation + ' ' +
+                              change.table_name.ljust(16) +
+                              ', '.join(map(str, change.key)))
+            except KeyboardInterrupt:
+                pass
+        if args.status or not (args.prune or args.tail):
+            info = db.call(conn, status)
+            print('Changes ' + str(info['first_change']) + ' to ' +
+                  str(info['last_change']) + ' are in the log.')
+            for consumer, change_id in info['consumers'].items():
+                print('  ' + consumer + ': up to ' + str(change_id))
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
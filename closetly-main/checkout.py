@@ -0,0 +1,173 @@
+"""
+Checking out a cart: a buyer's items from one or more stores are sold in
+one transaction with one DELETE from store_closet and one multi-row INSERT
+into the buyer's personal closet, however many items the cart holds.
+
+Prices are checked optimistically. Nothing is locked while the buyer looks
+at the cart: quote reads the current prices, and the DELETE only matches
+listings still at the price the buyer was quoted. If a store repriced or
+sold an item in between, fewer rows match, the whole sale is rolled back
+and CartChanged says which items changed, so the buyer can look at the new
+prices and check out again. Two buyers of the same item cannot both get
+it: the second DELETE finds the listing gone. A buyer buying the same
+piece from two stores at once gets it once; the other checkout breaks the
+closet's primary key, is rolled back and raises AlreadyOwned.
+
+Every function is a coroutine taking a Db (see db.py); from blocking code
+use db.call(conn, checkout.checkout, user_id, items).
+"""
+from collections import namedtuple
+
+from statements import STATEMENTS
+
+# An item in a cart: the store selling it, and the price the buyer was
+# quoted (None until quoted)
+CartItem = namedtuple('CartItem', ['store_name', 'clothing_id', 'price'])
+
+CART_COLUMNS = ['store_name', 'clothing_id', 'price']
+
+# Most items in one cart
+MAX_CART = 100
+
+
+class CartChanged(Exception):
+    """
+    Some items of a cart were repriced or sold since they were quoted, so
+    nothing was sold. changes holds each such item as a CartItem with its
+    current price (None if no longer for sale).
+    """
+
+    def __init__(self, changes):
+        Exception.__init__(self, 'Some items were repriced or sold.')
+        self.changes = changes
+
+
+class AlreadyOwned(ValueError):
+    """
+    The buyer already has some of the cart's pieces, so nothing was sold.
+    clothing_ids holds them.
+    """
+
+    def __init__(self, clothing_ids):
+        ValueError.__init__(self, 'You already have ' +
+                            ', '.join(map(str, clothing_ids)) + '.')
+        self.clothing_ids = clothing_ids
+
+
+class _Changed(Exception):
+    """
+    Rolls back a checkout that did not find every item at its quoted price.
+    """
+
+
+def _cart(items):
+    """
+    Returns the cart's items as CartItems in (store_name, clothing_id)
+    order, raising ValueError if it is empty, too big, or has the same
+    piece twice (a closet holds each piece once).
+    """
+    # prices are in cents, so a quoted price is rounded to them
+    cart = sorted(CartItem(str(item[0]), int(item[1]),
+                           None if item[2] is None
+                           else round(float(item[2]), 2))
+                  for item in items)
+    if not cart:
+        raise ValueError('The cart is empty.')
+    if len(cart) > MAX_CART:
+        raise ValueError('A cart holds at most ' + str(MAX_CART) +
+                         ' items.')
+    if len({item.clothing_id for item in cart}) < len(cart):
+        raise ValueError('The cart has the same clothing item twice.')
+    return cart
+
+
+def _listings(cart, priced=False):
+    """
+    Returns a condition matching the cart's listings (at their quoted
+    prices, if priced), and its parameters. It is an OR of primary key
+    equalities rather than a row-value IN list, which SQLite would answer
+    with a scan of store_closet; both backends look each listing up by
+    its primary key. Prices are passed as text with two decimals, which
+    both backends compare with the NUMERIC(10, 2) column exactly, where a
+    float need not round-trip to the stored value.
+    """
+    match = 'store_name = %s AND clothing_id = %s'
+    if priced:
+        match += ' AND price = %s'
+    params = []
+    for item in cart:
+        params += list(item[:2])
+        if priced:
+            params.append(format(item.price, '.2f'))
+    return '(' + ' OR '.join(['(' + match + ')'] * len(cart)) + ')', params
+
+
+async def quote(db, items):
+    """
+    Returns the current price of each (store_name, clothing_id) of a cart,
+    as CartItems in the cart's order, with one primary key lookup per item.
+    Items that are not for sale have price None.
+    """
+    cart = _cart((item[0], item[1], None) for item in items)
+    listings, params = _listings(cart)
+    # not prepared: the condition changes length from cart to cart
+    rows = await db.fetch_all(
+        'SELECT store_name, clothing_id, price FROM store_closet WHERE ' +
+        listings, params, prepared=False)
+    prices = {(row[0], row[1]): float(row[2]) for row in rows}
+    return [item._replace(price=prices.get(item[:2])) for item in cart]
+
+
+async def _owned(db, user_id, clothing_ids):
+    """
+    Returns which of the pieces the user already has in their closet.
+    """
+    rows = await db.fetch_all(
+        'SELECT clothing_id FROM personal_closet WHERE user_id = %s ' +
+        'AND clothing_id IN (' + ', '.join(['%s'] * len(clothing_ids)) +
+        ')', [user_id] + clothing_ids, prepared=False)
+    return sorted(row[0] for row in rows)
+
+
+async def checkout(db, user_id, items):
+    """
+    Sells every item of a cart, given as (store_name, clothing_id, quoted
+    price), to a user in one transaction, moving the items into their
+    personal closet. Returns the items sold and their total. Raises
+    CartChanged (and sells nothing) if any item is no longer for sale at
+    its quoted price, AlreadyOwned if the user already has one of the
+    pieces, and ValueError if the cart is not valid.
+    """
+    cart = _cart(items)
+    if any(item.price is None for item in cart):
+        raise ValueError('Every item in the cart needs its quoted price.')
+    clothing_ids = [item.clothing_id for item in cart]
+    owned = await _owned(db, user_id, clothing_ids)
+    if owned:
+        raise AlreadyOwned(owned)
+    listings, params = _listings(cart, priced=True)
+    try:
+        async with db.transaction():
+            # the listings are locked in primary key order, so checkouts
+            # of overlapping carts wait for each other rather than
+            # deadlocking on them
+            sold = await db.execute('DELETE FROM store_closet WHERE ' +
+                                    listings, params, prepared=False)
+            if sold.rowcount < len(cart):
+                raise _Changed()
+            await db.executemany(STATEMENTS['add_bought_item'],
+                                 [(user_id, clothing_id)
+                                  for clothing_id in clothing_ids])
+    except _Changed:
+        current = await quote(db, cart)
+        raise CartChanged([now for now, then in zip(current, cart)
+                           if now.price != then.price])
+    except db.integrity_error:
+        # another checkout gave the user one of the pieces since the check
+        # above; anything else (the user was deleted) is passed on
+        owned = await _owned(db, user_id, clothing_ids)
+        if not owned:
+            raise
+        raise AlreadyOwned(owned)
+    return {'items': cart,
+            'total': round(sum(item.price for item in cart), 2)}
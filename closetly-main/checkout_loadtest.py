@@ -0,0 +1,356 @@
+"""
+Multi-threaded load test of checking out carts (see checkout.py). Each
+client thread has its own connection and keeps buying carts of random
+store listings for random buyers: it quotes the cart, then checks it out.
+Clients that pick the same listing at once make the later checkout find
+it gone, and with --reprices stores reprice random listings as well, so
+some carts change between quote and checkout; those are counted as
+conflicts. Everything is run for each cart size and number of concurrent
+clients, reporting carts and items sold per second and p50/p95/p99
+checkout latency, and checking afterwards that every item sold left its
+store and reached its buyer's closet exactly once. The items sold are put
+back on sale after each run, so every run starts from the same stores.
+
+With --single it also runs the way items used to be sold for comparison:
+one sell_to_user transaction per item.
+
+Usage:
+    $ python3 checkout_loadtest.py --scale 100000
+    $ python3 checkout_loadtest.py --carts 1,10,100 --clients 1,8,32 --single
+    $ python3 checkout_loadtest.py --standin /tmp/closetly.db --reprices 50
+
+Load tests against MySQL replace the contents of the closetly database.
+The stand-in must be a file (not ':memory:') so every client can open it,
+and SQLite lets only one client write at a time.
+"""
+import argparse
+import random
+import threading
+import time
+
+import benchmark
+import checkout
+import datagen
+import db
+import repricing
+import routines
+import standin
+
+# Numbers of concurrent clients measured by default
+CLIENT_COUNTS = [1, 8, 32]
+# Cart sizes measured by default
+CART_SIZES = [1, 10, 100]
+
+RELIST = """INSERT INTO store_closet (store_name, clothing_id, price,
+    discount, original_price) VALUES (%s, %s, %s, %s, %s)"""
+UNBUY = 'DELETE FROM personal_closet WHERE user_id = %s AND clothing_id = %s'
+
+
+class Listings:
+    """
+    The listings still for sale, shared by the clients, who pick carts
+    from them and take out what they sold.
+    """
+
+    def __init__(self, rows):
+        self._lock = threading.Lock()
+        self._for_sale = {(row[0], row[1]) for row in rows}
+        self._keys = list(self._for_sale)
+
+    def pick(self, rng, n):
+        """
+        Returns up to n random listings still for sale, one per piece.
+        """
+        with self._lock:
+            picked = {}
+            # a few tries to get past pieces picked twice
+            tries = n * 2
+            while len(picked) < n and self._keys and tries:
+                i = rng.randrange(len(self._keys))
+                store_name, clothing_id = self._keys[i]
+                if (store_name, clothing_id) not in self._for_sale:
+                    # sold: drop it from the keys too
+                    self._keys[i] = self._keys[-1]
+                    self._keys.pop()
+                elif clothing_id in picked:
+                    tries -= 1
+                else:
+                    picked[clothing_id] = store_name
+            return [(store_name, clothing_id, None)
+                    for clothing_id, store_name in picked.items()]
+
+    def sold(self, items):
+        with self._lock:
+            for item in items:
+                self._for_sale.discard((item[0], item[1]))
+
+
+def load_listings(conn):
+    cursor = conn.cursor()
+    cursor.execute('SELECT store_name, clothing_id, price, discount, ' +
+                   'original_price FROM store_closet')
+    rows = cursor.fetchall()
+    cursor.close()
+    return rows
+
+
+def count_rows(conn, table):
+    cursor = conn.cursor()
+    cursor.execute('SELECT COUNT(*) FROM ' + table)
+    count = cursor.fetchall()[0][0]
+    cursor.close()
+    return count
+
+
+def check_out(conn, user_id, cart):
+    """
+    Quotes a cart and checks out whatever is still for sale, at the quoted
+    prices. Returns (items sold, seconds the checkout took).
+    """
+    quoted = [item for item in db.call(conn, checkout.quote, cart)
+              if item.price is not None]
+    if not quoted:
+        return [], 0.0
+    start = time.perf_counter()
+    sale = db.call(conn, checkout.checkout, user_id, quoted)
+    return sale['items'], time.perf_counter() - start
+
+
+def sell_singly(conn, user_id, cart):
+    """
+    Sells the cart's items the old way, one transaction each. Like
+    checkout, it sells nothing if the buyer already has one of the pieces.
+    """
+    clothing_ids = [clothing_id for _, clothing_id, _ in cart]
+    cursor = conn.cursor()
+    cursor.execute('SELECT clothing_id FROM personal_closet WHERE ' +
+                   'user_id = %s AND clothing_id IN (' +
+                   ', '.join(['%s'] * len(cart)) + ')',
+                   [user_id] + clothing_ids)
+    owned = cursor.fetchall()
+    cursor.close()
+    if owned:
+        raise ValueError('The buyer already has ' + str(owned[0][0]) + '.')
+    sold = []
+    start = time.perf_counter()
+    for store_name, clothing_id, _ in cart:
+        if db.call(conn, routines.sell_to_user, store_name, clothing_id,
+                   user_id):
+            sold.append((store_name, clothing_id))
+    return sold, time.perf_counter() - start
+
+
+class Client(threading.Thread):
+    """
+    One client: a connection that buys carts until told to stop.
+    """
+
+    def __init__(self, connect, buy, listings, buyers, cart_size, stop,
+                 seed):
+        threading.Thread.__init__(self, daemon=True)
+        self._connect = connect
+        self._buy = buy
+        self._listings = listings
+        self._buyers = buyers
+        self._cart_size = cart_size
+        self._done = stop
+        self._rng = random.Random(seed)
+        self.latencies = []
+        # (user_id, store_name, clothing_id) of every item sold
+        self.sales = []
+        self.conflicts = 0
+        self.rejected = 0
+        self.ran_out = False
+        self.error = None
+
+    def run(self):
+        conn = self._connect()
+        rng = self._rng
+        try:
+            while not self._done.is_set():
+                cart = self._listings.pick(rng, self._cart_size)
+                if not cart:
+                    self.ran_out = True
+                    return
+                user_id = rng.choice(self._buyers)
+                try:
+                    sold, seconds = self._buy(conn, user_id, cart)
+                except checkout.CartChanged:
+                    self.conflicts += 1
+                    continue
+                except ValueError:
+                    # the buyer already has one of the pieces (bought from
+                    # another store)
+                    self.rejected += 1
+                    continue
+                if sold:
+                    self.latencies.append(seconds)
+                    self._listings.sold(sold)
+                    self.sales += [(user_id, item[0], item[1])
+                                   for item in sold]
+        except Exception as e:
+            self.error = e
+        finally:
+            conn.close()
+
+
+class Repricer(threading.Thread):
+    """
+    Reprices `per_second` random listings a second until told to stop.
+    """
+
+    def __init__(self, connect, listings, per_second, stop, seed):
+        threading.Thread.__init__(self, daemon=True)
+        self._connect = connect
+        self._listings = listings
+        self._interval = 1 / per_second
+        self._done = stop
+        self._rng = random.Random(seed)
+        self.repriced = 0
+        self.error = None
+
+    def run(self):
+        conn = self._connect()
+        try:
+            while not self._done.wait(self._interval):
+                for store_name, clothing_id, _ in self._listings.pick(
+                        self._rng, 1):
+                    db.call(conn, repricing.set_discount, store_name,
+                            clothing_id,
+                            self._rng.choice([0] + datagen.DISCOUNTS))
+                    self.repriced += 1
+        except Exception as e:
+            self.error = e
+        finally:
+            conn.close()
+
+
+def restock(conn, listings, sales):
+    """
+    Takes the items sold back out of their buyers' closets and puts them
+    back on sale at the price they had before the run.
+    """
+    cursor = conn.cursor()
+    cursor.executemany(UNBUY, [(user_id, clothing_id)
+                               for user_id, _, clothing_id in sales])
+    cursor.executemany(RELIST, [(store_name, clothing_id) +
+                                tuple(listings[(store_name, clothing_id)])
+                                for _, store_name, clothing_id in sales])
+    conn.commit()
+    cursor.close()
+
+
+def run_clients(connect, buy, listings, buyers, cart_size, clients, seconds,
+                reprices, seed):
+    """
+    Runs `clients` client threads (and a repricer, if reprices) for
+    `seconds`. Returns (summary of the latencies, the client threads,
+    listings repriced, errors).
+    """
+    stop = threading.Event()
+    threads = [Client(connect, buy, listings, buyers, cart_size, stop,
+                      seed + i) for i in range(clients)]
+    repricer = Repricer(connect, listings, reprices, stop, seed - 1) \
+        if reprices else None
+    everyone = threads + ([repricer] if repricer else [])
+    start = time.perf_counter()
+    for thread in everyone:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in everyone:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    latencies = [s for thread in threads for s in thread.latencies]
+    errors = [thread.error for thread in everyone if thread.error]
+    return (benchmark.summarize(latencies, elapsed) if latencies else None,
+            threads, repricer.repriced if repricer else 0, errors)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test checkouts.')
+    datagen.add_size_arguments(parser)
+    parser.add_argument('--carts', default=','.join(map(str, CART_SIZES)),
+                        help='comma-separated cart sizes (default 1,10,100)')
+    parser.add_argument('--clients', default=','.join(map(str, CLIENT_COUNTS)),
+                        help='comma-separated numbers of concurrent clients '
+                             '(default 1,8,32)')
+    parser.add_argument('--seconds', type=float, default=5,
+                        help='seconds to run each cart size and number of '
+                             'clients (default 5)')
+    parser.add_argument('--reprices', type=float, default=0,
+                        help='listings repriced per second while clients '
+                             'buy (default 0)')
+    parser.add_argument('--single', action='store_true',
+                        help='also time selling each item in its own '
+                             'transaction')
+    args = parser.parse_args()
+    if args.standin == ':memory:':
+        parser.error('the stand-in must be a file for several clients')
+
+    conn = datagen.connect(args.standin)
+    print('Generating data...')
+    data = datagen.populate(conn, datagen.sizes_from_args(args), args.seed)
+
+    def connect():
+        if args.standin:
+            return standin.connect(args.standin, create_schema=False)
+        return datagen.connect()
+
+    paths = [('cart', check_out)]
+    if args.single:
+        paths.append(('single', sell_singly))
+
+    print('path'.ljust(8) + 'cart'.rjust(6) + 'clients'.rjust(8) +
+          'carts/s'.rjust(9) + 'items/s'.rjust(9) + 'p50 ms'.rjust(9) +
+          'p95 ms'.rjust(9) + 'p99 ms'.rjust(9) + 'conflicts'.rjust(11))
+    failed = False
+    for name, buy in paths:
+        for cart_size in [int(n) for n in args.carts.split(',')]:
+            for clients in [int(n) for n in args.clients.split(',')]:
+                rows = load_listings(conn)
+                # the listings as they were before the run, to restock
+                stock = {(row[0], row[1]): row[2:] for row in rows}
+                listings = Listings(rows)
+                before = (count_rows(conn, 'store_closet'),
+                          count_rows(conn, 'personal_closet'))
+                summary, threads, repriced, errors = run_clients(
+                    connect, buy, listings, data.user_ids, cart_size,
+                    clients, args.seconds, args.reprices, args.seed)
+                sales = [sale for thread in threads for sale in thread.sales]
+                carts = sum(len(thread.latencies) for thread in threads)
+                print(name.ljust(8) + str(cart_size).rjust(6) +
+                      str(clients).rjust(8) +
+                      str(int(carts / args.seconds)).rjust(9) +
+                      str(int(len(sales) / args.seconds)).rjust(9) +
+                      ''.join(('%.2f' % summary[p]).rjust(9) if summary
+                              else '-'.rjust(9)
+                              for p in ('p50_ms', 'p95_ms', 'p99_ms')) +
+                      str(sum(t.conflicts for t in threads)).rjust(11))
+                if repriced:
+                    print('  listings repriced: ' + str(repriced))
+                if any(thread.ran_out for thread in threads):
+                    print('  ran out of listings; use a larger --scale')
+                for e in errors[:3]:
+                    print('  client error: ' + str(e))
+                # every item sold left its store and reached its buyer once
+                after = (count_rows(conn, 'store_closet'),
+                         count_rows(conn, 'personal_closet'))
+                lost = (before[0] - after[0] != len(sales) or
+                        after[1] - before[1] != len(sales) or
+                        len(set(sales)) != len(sales))
+                if lost:
+                    print('  ' + str(len(sales)) + ' items sold, but ' +
+                          str(before[0] - after[0]) + ' left the stores ' +
+                          'and ' + str(after[1] - before[1]) +
+                          ' reached closets')
+                failed = failed or lost or bool(errors)
+                restock(conn, stock, sales)
+    conn.close()
+    if failed:
+        raise SystemExit('Some sales were lost or made twice.')
+    print('Every item sold left its store and reached its buyer once.')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,401 @@
+"""
+Synthetic data generator for benchmarking Closetly. Fills users, accounts,
+clothes, personal/collaborative closets, store inventories and outfits at a
+configurable scale (10k to 10M clothes), with the skew real data has: a few
+users own most of the clothes, a few stores carry most of the inventory,
+and a few types, colors, brands and pieces are far more popular than the
+rest. The same seed always generates the same data.
+
+Usage:
+    $ python3 datagen.py --scale 100000             # into local MySQL
+    $ python3 datagen.py --scale 100000 --standin closetly.db
+"""
+import argparse
+import hashlib
+import random
+import time
+
+import backends
+import standin
+
+# Connection settings for the local MySQL database, as appadmin
+MYSQL_SETTINGS = dict(backends.MYSQL_SETTINGS, user='appadmin',
+                      password='adminpw')
+
+# Rows sent per multi-row INSERT
+BATCH_SIZE = 5000
+# Number of sample keys kept for benchmarks to pick parameters from
+SAMPLE_SIZE = 10000
+
+CLOTHING_TYPES = ['shirt', 'pants', 'dress', 'sweatshirt', 'jacket', 'shoes',
+                  'skirt', 'shorts', 'sweater', 'socks', 'coat', 'hat',
+                  'leggings', 'blouse', 'jeans', 'boots', 'scarf', 'bag']
+LETTER_SIZES = ['XS', 'S', 'M', 'L', 'XL', 'XXL']
+NUMBER_SIZES = ['0', '2', '4', '6', '8', '10', '12', '14']
+SHOE_SIZES = ['5', '6', '6.5', '7', '7.5', '8', '8.5', '9', '10', '10.5', '11']
+COLORS = ['black', 'white', 'blue', 'grey', 'beige', 'navy', 'red', 'green',
+          'brown', 'pink', 'cream', 'olive', 'purple', 'yellow', 'orange',
+          'burgundy', 'lavender', 'teal', 'silver', 'gold']
+BASE_BRANDS = ['Lululemon', 'Zara', 'Free People', 'Urban Outfitters',
+               'Nike', 'Adidas', "Levi's", 'Uniqlo', 'H&M', 'Aritzia',
+               'Madewell', 'Patagonia', 'Everlane', 'J.Crew', 'Gap']
+AESTHETICS = ['casual', 'athleisure', 'athletic', 'business casual',
+              'streetwear', 'boho', 'minimalist', 'preppy', 'vintage',
+              'going out', 'cottagecore', 'grunge']
+CONDITIONS = ['new', 'good', 'used', 'poor']
+DISCOUNTS = [10, 15, 20, 25, 30, 40, 50, 70]
+
+
+class Zipf:
+    """
+    Samples indexes 0..n-1 with probability roughly proportional to
+    1 / (i+1)^s, so low indexes are picked far more often than high ones.
+    Uses the inverse of the continuous power-law distribution, so it needs
+    no lookup tables even for millions of items.
+    """
+
+    def __init__(self, n, rng, s=1.1):
+        self._n = n
+        self._rng = rng
+        self._s = s
+
+    def index(self):
+        u = self._rng.random()
+        if self._s == 1:
+            x = (self._n + 1) ** u
+        else:
+            a = 1 - self._s
+            x = (((self._n + 1) ** a - 1) * u + 1) ** (1 / a)
+        return min(int(x) - 1, self._n - 1)
+
+    def choice(self, items):
+        return items[self.index()]
+
+
+def default_sizes(scale):
+    """
+    Returns the table sizes for a catalog of `scale` clothes.
+    """
+    return {
+        'clothes': scale,
+        'users': max(10, scale // 20),
+        'stores': max(3, scale // 2000),
+        # fraction of clothes that are store inventory (the rest are in
+        # personal closets)
+        'store_fraction': 0.4,
+        # fraction of store items also carried by a second store
+        'multi_store_fraction': 0.05,
+        # fraction of personal clothes shared in the collaborative closet
+        'share_fraction': 0.25,
+        # fraction of shared clothes currently borrowed
+        'borrowed_fraction': 0.2,
+        'stylist_fraction': 0.02,
+        'outfits': max(5, scale // 10),
+    }
+
+
+def password_for(username):
+    """
+    Password of every generated account, so benchmarks can log in.
+    """
+    return username + 'pw'
+
+
+def store_name(i):
+    return 'store' + str(i).zfill(5)
+
+
+def username(i):
+    return 'user' + str(i).zfill(7)
+
+
+class Dataset:
+    """
+    Summary of generated data that benchmarks sample parameters from.
+    """
+
+    def __init__(self, sizes, seed):
+        self.sizes = sizes
+        self.seed = seed
+        self.counts = {}
+        # samples of every account, and of personal/stylist accounts and
+        # their user_ids
+        self.usernames = []
+        self.shoppers = []
+        self.user_ids = []
+        self.stores = []
+        self.max_clothing_id = 0
+        # (store_name, clothing_id) pairs
+        self.store_items = []
+        # clothing_ids in the collaborative closet
+        self.collab_items = []
+        self.load_seconds = 0.0
+
+
+def clear(conn):
+    """
+    Deletes every row from the Closetly tables.
+    """
+    # best_price goes first, so the stand-in's triggers do not look for
+    # new best prices as the listings go
+    tables = ['best_price', 'borrow_waitlist', 'styled_outfits', 'outfits',
+              'collab_closet', 'store_closet', 'personal_closet', 'clothes',
+              'permissions', 'user_info', 'user', 'store_summary',
+              'store_type_summary', 'closet_summary', 'wear_log',
+              'wear_rollup', 'change_log', 'change_checkpoint']
+    cursor = conn.cursor()
+    if standin.is_standin(conn):
+        for table in tables:
+            cursor.execute('DELETE FROM ' + table)
+    else:
+        cursor.execute('SET FOREIGN_KEY_CHECKS = 0')
+        for table in tables:
+            cursor.execute('TRUNCATE TABLE ' + table)
+        cursor.execute('SET FOREIGN_KEY_CHECKS = 1')
+    conn.commit()
+    cursor.close()
+
+
+class _BatchWriter:
+    """
+    Buffers rows per table and writes them with multi-row INSERTs. Tables
+    are always flushed in the order they were registered, so rows are
+    written after the rows their foreign keys point to.
+    """
+
+    def __init__(self, conn, batch_size):
+        self._conn = conn
+        self._cursor = conn.cursor()
+        self._batch_size = batch_size
+        self._sql = {}
+        self._rows = {}
+        self.counts = {}
+
+    def table(self, name, columns):
+        self._sql[name] = 'INSERT INTO ' + name + ' (' + \
+            ', '.join(columns) + ') VALUES (' + \
+            ', '.join(['%s'] * len(columns)) + ')'
+        self._rows[name] = []
+        self.counts[name] = 0
+
+    def add(self, name, row):
+        rows = self._rows[name]
+        rows.append(row)
+        if len(rows) >= self._batch_size:
+            self.flush()
+
+    def flush(self):
+        for name, rows in self._rows.items():
+            if rows:
+                self._cursor.executemany(self._sql[name], rows)
+                self.counts[name] += len(rows)
+                rows.clear()
+        self._conn.commit()
+
+    def close(self):
+        self.flush()
+        self._cursor.close()
+
+
+def _reservoir(sample, item, seen, rng, size=SAMPLE_SIZE):
+    """
+    Keeps a uniform random sample of at most `size` items of a stream.
+    """
+    if len(sample) < size:
+        sample.append(item)
+    else:
+        j = rng.randrange(seen)
+        if j < size:
+            sample[j] = item
+
+
+def populate(conn, sizes, seed=121, batch_size=BATCH_SIZE, progress=None):
+    """
+    Clears the database and fills it with synthetic data of the given sizes
+    (see default_sizes). Returns a Dataset describing what was generated.
+    progress, if given, is called with (table, rows written so far).
+    """
+    rng = random.Random(seed)
+    data = Dataset(sizes, seed)
+    start = time.perf_counter()
+    clear(conn)
+
+    writer = _BatchWriter(conn, batch_size)
+    writer.table('user', ['user_id', 'name', 'username'])
+    writer.table('user_info', ['username', 'salt', 'password_hash'])
+    writer.table('permissions', ['username', 'role'])
+    writer.table('clothes', ['clothing_id', 'clothing_type', 'size', 'gender',
+                             'color', 'brand', 'description', 'image_url',
+                             'aesthetic', 'store_name'])
+    writer.table('personal_closet', ['user_id', 'clothing_id', 'is_clean',
+                                     'shared', 'num_wears'])
+    writer.table('collab_closet', ['user_id', 'clothing_id',
+                                   'curr_condition', 'is_available',
+                                   'current_borrower'])
+    writer.table('store_closet', ['store_name', 'clothing_id', 'price',
+                                  'discount', 'original_price'])
+    writer.table('outfits', ['outfit_id', 'outfit_desc', 'vibe'])
+    writer.table('styled_outfits', ['outfit_id', 'clothing_id',
+                                    'outfit_desc', 'vibe'])
+
+    # Accounts: the first accounts are the stores (a store owner's username
+    # is the store name), then stylists and personal users.
+    n_stores = sizes['stores']
+    n_users = sizes['users']
+    data.stores = [store_name(i) for i in range(1, n_stores + 1)]
+    for user_id in range(1, n_stores + n_users + 1):
+        if user_id <= n_stores:
+            name = data.stores[user_id - 1]
+            role = 'storeowner'
+        else:
+            name = username(user_id - n_stores)
+            role = 'stylist' if rng.random() < sizes['stylist_fraction'] \
+                else 'personal'
+            _reservoir(data.shoppers, name, user_id - n_stores, rng)
+            _reservoir(data.user_ids, user_id, user_id - n_stores, rng)
+        salt = ''.join(chr(32 + rng.randrange(95)) for _ in range(8))
+        password_hash = hashlib.sha256(
+            (salt + password_for(name)).encode()).hexdigest()
+        writer.add('user', (user_id, name, name))
+        writer.add('user_info', (name, salt, password_hash))
+        writer.add('permissions', (name, role))
+        _reservoir(data.usernames, name, user_id, rng)
+
+    # Clothes, and the closet or store each piece belongs to
+    types = Zipf(len(CLOTHING_TYPES), rng)
+    colors = Zipf(len(COLORS), rng)
+    brand_names = BASE_BRANDS + ['Brand ' + str(i).zfill(4)
+                                 for i in range(1, 500)]
+    brands = Zipf(len(brand_names), rng)
+    aesthetics = Zipf(len(AESTHETICS), rng)
+    owners = Zipf(n_users, rng, s=0.9)
+    store_picker = Zipf(n_stores, rng, s=1.0)
+    n_store_items = 0
+    n_collab = 0
+    for clothing_id in range(1, sizes['clothes'] + 1):
+        clothing_type = types.choice(CLOTHING_TYPES)
+        if clothing_type in ('shoes', 'boots'):
+            size = rng.choice(SHOE_SIZES)
+        elif clothing_type in ('pants', 'jeans', 'skirt', 'dress'):
+            size = rng.choice(NUMBER_SIZES)
+        else:
+            size = rng.choice(LETTER_SIZES)
+        gender = rng.choices('WMU', weights=(6, 3, 1))[0]
+        color = colors.choice(COLORS)
+        brand = brands.choice(brand_names)
+        in_store = rng.random() < sizes['store_fraction']
+        store = store_picker.choice(data.stores) if in_store else None
+        writer.add('clothes', (clothing_id, clothing_type, size, gender,
+                               color, brand, color + ' ' + brand + ' ' +
+                               clothing_type, None,
+                               aesthetics.choice(AESTHETICS), store))
+        if in_store:
+            listings = [store]
+            if rng.random() < sizes['multi_store_fraction']:
+                other = rng.choice(data.stores)
+                if other != store:
+                    listings.append(other)
+            original = round(rng.lognormvariate(3.7, 0.6), 2)
+            for listing in listings:
+                discount = 0 if rng.random() < 0.7 else rng.choice(DISCOUNTS)
+                price = round(original * (100 - discount) / 100, 2)
+                writer.add('store_closet', (listing, clothing_id, price,
+                                            discount, original))
+                n_store_items += 1
+                _reservoir(data.store_items, (listing, clothing_id),
+                           n_store_items, rng)
+        else:
+            owner = n_stores + 1 + owners.index()
+            shared = rng.random() < sizes['share_fraction']
+            num_wears = None if rng.random() < 0.1 \
+                else int(rng.paretovariate(1.2)) - 1
+            writer.add('personal_closet', (owner, clothing_id,
+                                           int(rng.random() < 0.8),
+                                           int(shared), num_wears))
+            if shared:
+                borrower = None
+                if rng.random() < sizes['borrowed_fraction']:
+                    borrower = n_stores + 1 + rng.randrange(n_users)
+                    if borrower == owner:
+                        borrower = None
+                writer.add('collab_closet', (owner, clothing_id,
+                                             rng.choice(CONDITIONS),
+                                             int(borrower is None), borrower))
+                n_collab += 1
+                _reservoir(data.collab_items, clothing_id, n_collab, rng)
+        if progress and clothing_id % 100000 == 0:
+            progress('clothes', clothing_id)
+    data.max_clothing_id = sizes['clothes']
+
+    # Outfits of 2-5 pieces, with popular pieces in many outfits
+    pieces = Zipf(sizes['clothes'], rng, s=0.8)
+    for outfit_id in range(1, sizes['outfits'] + 1):
+        vibe = aesthetics.choice(AESTHETICS)
+        description = 'synthetic ' + vibe + ' outfit ' + str(outfit_id)
+        writer.add('outfits', (outfit_id, description, vibe))
+        clothing_ids = {1 + pieces.index() for _ in range(rng.randint(2, 5))}
+        for clothing_id in sorted(clothing_ids):
+            writer.add('styled_outfits', (outfit_id, clothing_id,
+                                          description, vibe))
+
+    writer.close()
+    data.counts = writer.counts
+    data.load_seconds = time.perf_counter() - start
+    return data
+
+
+def connect(standin_path=None):
+    """
+    Connects to the local MySQL database as appadmin, or to an embedded
+    stand-in database if a path (or ':memory:') is given.
+    """
+    if standin_path:
+        return standin.connect(standin_path)
+    # only needed when talking to a real MySQL server
+    import mysql.connector
+    return mysql.connector.connect(**MYSQL_SETTINGS)
+
+
+def add_size_arguments(parser):
+    """
+    Adds the data size options shared by the benchmark scripts.
+    """
+    parser.add_argument('--scale', type=int, default=10000,
+                        help='number of clothes rows (default 10000)')
+    parser.add_argument('--users', type=int,
+                        help='number of personal/stylist users')
+    parser.add_argument('--stores', type=int, help='number of stores')
+    parser.add_argument('--outfits', type=int, help='number of outfits')
+    parser.add_argument('--seed', type=int, default=121)
+    parser.add_argument('--standin', metavar='PATH',
+                        help="use an embedded SQLite stand-in database at "
+                             "PATH (or ':memory:') instead of MySQL")
+
+
+def sizes_from_args(args):
+    sizes = default_sizes(args.scale)
+    for name in ('users', 'stores', 'outfits'):
+        if getattr(args, name) is not None:
+            sizes[name] = getattr(args, name)
+    return sizes
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Fill the Closetly database with synthetic data.')
+    add_size_arguments(parser)
+    args = parser.parse_args()
+    conn = connect(args.standin)
+    data = populate(conn, sizes_from_args(args), args.seed,
+                    progress=lambda table, n: print(table, n))
+    total = sum(data.counts.values())
+    for table, count in data.counts.items():
+        print(table.ljust(16), count)
+    print('Loaded ' + str(total) + ' rows in ' +
+          str(round(data.load_seconds, 1)) + ' s (' +
+          str(int(total / data.load_seconds)) + ' rows/s).')
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
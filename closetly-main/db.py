@@ -0,0 +1,269 @@
+"""
+One small database interface for code that is shared by the blocking
+command-line app and the asyncio HTTP API (api.py). Shared operations are
+written once as coroutines against a Db:
+
+    async def borrow(db, user_id, clothing_id):
+        async with db.transaction():
+            result = await db.execute(sql, params)
+            ...
+
+and run on either kind of connection:
+
+    - BlockingDb wraps a mysql.connector (or stand-in) connection. Its
+      methods never suspend, so call() runs the coroutine to completion
+      right away without an event loop.
+    - AsyncDb wraps an aiomysql connection and really awaits the server.
+
+Every statement run through either is timed and counted (see
+querystats.py).
+"""
+from collections import namedtuple
+
+import backends
+import querystats
+import statements as stmts
+
+# Result of a write: rows changed and the AUTO_INCREMENT ID generated
+WriteResult = namedtuple('WriteResult', ['rowcount', 'lastrowid'])
+
+
+class _Transaction:
+    """
+    async with db.transaction(): commits if the block succeeds and rolls
+    back if it raises.
+    """
+
+    def __init__(self, db):
+        self._db = db
+
+    async def __aenter__(self):
+        await self._db.begin()
+        return self._db
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            await self._db.commit()
+        else:
+            await self._db.rollback()
+        return False
+
+
+class BlockingDb:
+    """
+    Db over a blocking DB-API connection. Statements run through the
+    connection's cached prepared cursors (see statements.py) unless
+    prepared=False is passed, e.g. for IN lists whose length varies.
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    @property
+    def integrity_error(self):
+        """
+        The class of the errors raised when a statement breaks a key or
+        foreign key constraint.
+        """
+        return backends.integrity_error(self.conn)
+
+    def _cursor(self, sql, params, prepared):
+        if prepared:
+            return stmts.execute_sql(self.conn, sql, params)
+        cursor = self.conn.cursor()
+        cursor.execute(sql, tuple(params))
+        return cursor
+
+    async def fetch_all(self, sql, params=(), prepared=True):
+        timer = querystats.Timer(sql, params)
+        try:
+            cursor = self._cursor(sql, params, prepared)
+            rows = cursor.fetchall()
+        except Exception:
+            timer.finish(error=True)
+            raise
+        if not prepared:
+            cursor.close()
+        timer.fetched(rows)
+        timer.finish(self.conn)
+        return rows
+
+    async def fetch_one(self, sql, params=(), prepared=True):
+        rows = await self.fetch_all(sql, params, prepared)
+        return rows[0] if rows else None
+
+    async def fetch_value(self, sql, params=(), prepared=True):
+        row = await self.fetch_one(sql, params, prepared)
+        return row[0] if row else None
+
+    async def execute(self, sql, params=(), prepared=True):
+        timer = querystats.Timer(sql, params)
+        try:
+            cursor = self._cursor(sql, params, prepared)
+        except Exception:
+            timer.finish(error=True)
+            raise
+        result = WriteResult(cursor.rowcount, cursor.lastrowid)
+        if not prepared:
+            cursor.close()
+        timer.finish(self.conn)
+        return result
+
+    async def executemany(self, sql, rows):
+        # a plain cursor turns executemany of an INSERT into one multi-row
+        # INSERT
+        timer = querystats.Timer(sql)
+        cursor = self.conn.cursor()
+        try:
+            cursor.executemany(sql, rows)
+            timer.finish()
+            return cursor.rowcount
+        except Exception:
+            timer.finish(error=True)
+            raise
+        finally:
+            cursor.close()
+
+    async def callproc(self, name, args=()):
+        timer = querystats.Timer('CALL ' + name)
+        cursor = self.conn.cursor()
+        try:
+            cursor.callproc(name, args=tuple(args))
+            timer.finish()
+        except Exception:
+            timer.finish(error=True)
+            raise
+        finally:
+            cursor.close()
+
+    def transaction(self):
+        return _Transaction(self)
+
+    async def begin(self):
+        # mysql.connector starts a transaction with the first statement
+        pass
+
+    async def commit(self):
+        self.conn.commit()
+
+    async def rollback(self):
+        self.conn.rollback()
+
+
+class AsyncDb:
+    """
+    Db over an aiomysql connection from a pool created with
+    autocommit=True, so reads always see the latest data and writes are
+    grouped by transaction().
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    @property
+    def integrity_error(self):
+        """
+        The class of the errors raised when a statement breaks a key or
+        foreign key constraint.
+        """
+        import aiomysql
+        return aiomysql.IntegrityError
+
+    async def _finish(self, timer, error=False):
+        # the plan of a slow statement is captured on this connection
+        if timer.finish(error=error):
+            explain = querystats.explain_sql(timer.sql, False)
+            if explain is not None:
+                async with self.conn.cursor() as cursor:
+                    await cursor.execute(explain, tuple(timer.params))
+                    querystats.stats.add_plan(
+                        querystats.statement_key(timer.sql), timer.seconds,
+                        await cursor.fetchall())
+
+    async def fetch_all(self, sql, params=(), prepared=True):
+        timer = querystats.Timer(sql, params)
+        try:
+            async with self.conn.cursor() as cursor:
+                await cursor.execute(sql, tuple(params))
+                rows = await cursor.fetchall()
+        except Exception:
+            await self._finish(timer, error=True)
+            raise
+        timer.fetched(rows)
+        await self._finish(timer)
+        return rows
+
+    async def fetch_one(self, sql, params=(), prepared=True):
+        rows = await self.fetch_all(sql, params)
+        return rows[0] if rows else None
+
+    async def fetch_value(self, sql, params=(), prepared=True):
+        row = await self.fetch_one(sql, params)
+        return row[0] if row else None
+
+    async def execute(self, sql, params=(), prepared=True):
+        timer = querystats.Timer(sql, params)
+        try:
+            async with self.conn.cursor() as cursor:
+                await cursor.execute(sql, tuple(params))
+                result = WriteResult(cursor.rowcount, cursor.lastrowid)
+        except Exception:
+            await self._finish(timer, error=True)
+            raise
+        await self._finish(timer)
+        return result
+
+    async def executemany(self, sql, rows):
+        timer = querystats.Timer(sql)
+        try:
+            async with self.conn.cursor() as cursor:
+                await cursor.executemany(sql, rows)
+                count = cursor.rowcount
+        except Exception:
+            timer.finish(error=True)
+            raise
+        timer.finish()
+        return count
+
+    async def callproc(self, name, args=()):
+        timer = querystats.Timer('CALL ' + name)
+        try:
+            async with self.conn.cursor() as cursor:
+                await cursor.callproc(name, tuple(args))
+        except Exception:
+            timer.finish(error=True)
+            raise
+        timer.finish()
+
+    def transaction(self):
+        return _Transaction(self)
+
+    async def begin(self):
+        await self.conn.begin()
+
+    async def commit(self):
+        await self.conn.commit()
+
+    async def rollback(self):
+        await self.conn.rollback()
+
+
+def run_blocking(coro):
+    """
+    Runs a coroutine that only awaits a BlockingDb to completion and
+    returns its result.
+    """
+    try:
+        coro.send(None)
+    except StopIteration as done:
+        return done.value
+    coro.close()
+    raise RuntimeError('A blocking database call tried to suspend.')
+
+
+def call(conn, fn, *args, **kwargs):
+    """
+    Runs a shared operation fn(db, *args, **kwargs) on a blocking
+    connection, e.g. call(conn, borrowing.borrow, user_id, clothing_id).
+    """
+    return run_blocking(fn(BlockingDb(conn), *args, **kwargs))
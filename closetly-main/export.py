@@ -0,0 +1,526 @@
+"""
+Columnar export of the closets for offline reporting. clothes,
+personal_closet, collab_closet, store_closet and styled_outfits are
+streamed from the database in chunks (never fetched whole) into compressed
+Parquet or Arrow IPC files, laid out in Hive-style partitions by snapshot
+date and, for clothes and store_closet, by store:
+
+    exports/manifest.json
+    exports/store_closet/date=2024-05-01/snapshot=1/store=zara/part-00000.parquet
+    exports/personal_closet/date=2024-05-01/snapshot=1/part-00000.parquet
+
+so tools that read partitioned datasets (pyarrow.dataset, DuckDB, Spark)
+can skip the stores and days they do not need. Every table is read in one
+read-only transaction, so a snapshot is consistent across tables.
+
+The first export of a directory is full. Later ones are incremental:
+they read the change log (see changes.py) from where the last snapshot
+left off, in the same transaction, and write only the rows changed since,
+looked up by primary key, with the keys of deleted rows in a _deleted
+file. The export directory is a change log consumer of its own, so
+changes.py --prune keeps the changes it has yet to export. open_table
+puts a table back together from the last full snapshot and the changes
+since, memory-mapping the files rather than reading them in, and report
+summarizes the closets from the files alone, without connecting to the
+database.
+
+Usage:
+    $ python3 export.py --out exports                   # full, then changes
+    $ python3 export.py --out exports --full
+    $ python3 export.py --out exports --format arrow --compression none
+    $ python3 export.py --report exports
+    $ python3 export.py --out exports --db sqlite:/tmp/closetly.db
+
+Needs pyarrow (pip3 install pyarrow). Arrow IPC files written with
+--compression none are mapped straight into memory with no copying.
+"""
+import datetime
+import glob
+import json
+import os
+import shutil
+from collections import OrderedDict, namedtuple
+from decimal import Decimal
+from urllib.parse import quote
+
+import changes
+import db
+import ingest
+import standin
+
+# A table exported: its primary key, and the column it is partitioned by
+# besides the snapshot date (None if only by date)
+ExportTable = namedtuple('ExportTable', ['name', 'keys', 'partition'])
+
+TABLES = [
+    ExportTable('clothes', changes.KEYS['clothes'], 'store_name'),
+    ExportTable('personal_closet', changes.KEYS['personal_closet'], None),
+    ExportTable('collab_closet', changes.KEYS['collab_closet'], None),
+    ExportTable('store_closet', changes.KEYS['store_closet'], 'store_name'),
+    ExportTable('styled_outfits', changes.KEYS['styled_outfits'], None),
+]
+TABLES_BY_NAME = {table.name: table for table in TABLES}
+
+# Columns exported as integers and as floating point; the rest are strings
+INTEGER_COLUMNS = {'user_id', 'clothing_id', 'outfit_id', 'is_clean',
+                   'shared', 'num_wears', 'is_available', 'current_borrower'}
+FLOAT_COLUMNS = {'price', 'discount', 'original_price'}
+
+# Rows fetched from the database at a time, which is also the most rows in
+# one row group (Parquet) or record batch (Arrow IPC)
+CHUNK_SIZE = 50000
+# Changed rows an incremental export looks up at a time
+KEY_CHUNK = 500
+# Most partition files written to at once
+MAX_OPEN_FILES = 32
+
+# File format -> file extension
+FORMATS = {'parquet': '.parquet', 'arrow': '.arrow'}
+DEFAULT_FORMAT = 'parquet'
+DEFAULT_COMPRESSION = 'zstd'
+
+MANIFEST = 'manifest.json'
+# Directory name of a partition whose store is NULL, as Hive names it
+NULL_PARTITION = '__HIVE_DEFAULT_PARTITION__'
+SNAPSHOT_COLUMN = '_snapshot'
+
+
+def _schema(columns):
+    import pyarrow as pa
+    return pa.schema([
+        pa.field(column, pa.int64() if column in INTEGER_COLUMNS
+                 else pa.float64() if column in FLOAT_COLUMNS
+                 else pa.string())
+        for column in columns])
+
+
+def _value(value):
+    """
+    Returns a database value as the type it is exported as.
+    """
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (bytes, bytearray)):
+        return value.decode()
+    return value
+
+
+def _writer(path, schema, fmt, compression):
+    """
+    Opens a Parquet or Arrow IPC file for writing; both writers have
+    write_table and close.
+    """
+    import pyarrow as pa
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if fmt == 'parquet':
+        import pyarrow.parquet as pq
+        return pq.ParquetWriter(path, schema, compression=compression)
+    options = pa.ipc.IpcWriteOptions(
+        compression=None if compression == 'none' else compression)
+    return pa.ipc.new_file(path, schema, options=options)
+
+
+def _write(path, columns, rows, fmt, compression):
+    """
+    Writes rows (tuples in column order) to a new file.
+    """
+    import pyarrow as pa
+    schema = _schema(columns)
+    writer = _writer(path, schema, fmt, compression)
+    try:
+        writer.write_table(pa.Table.from_pydict(
+            dict(zip(columns, map(list, zip(*rows)))) if rows
+            else {column: [] for column in columns}, schema=schema))
+    finally:
+        writer.close()
+
+
+def read_file(path):
+    """
+    Reads an exported file, memory-mapped rather than read in.
+    """
+    import pyarrow as pa
+    if path.endswith(FORMATS['parquet']):
+        import pyarrow.parquet as pq
+        return pq.read_table(path, memory_map=True)
+    # the table's buffers point into the mapping, which they keep open
+    return pa.ipc.open_file(pa.memory_map(path, 'r')).read_all()
+
+
+def load_manifest(out):
+    """
+    Returns the manifest of an export directory: every snapshot taken, in
+    order.
+    """
+    path = os.path.join(out, MANIFEST)
+    if not os.path.exists(path):
+        return {'snapshots': []}
+    with open(path) as f:
+        return json.load(f)
+
+
+def _save_manifest(out, manifest):
+    # replaced in one step, so a failed export leaves the last one intact
+    path = os.path.join(out, MANIFEST)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(path + '.tmp', path)
+
+
+def _partition_dir(value):
+    if value is None or value == '':
+        return 'store=' + NULL_PARTITION
+    return 'store=' + quote(str(value), safe='')
+
+
+def _begin_reading(conn):
+    """
+    Starts a read-only transaction, so every table is read as of the same
+    moment.
+    """
+    if standin.is_standin(conn):
+        cursor = conn.cursor()
+        cursor.execute('BEGIN')
+        cursor.close()
+    else:
+        conn.start_transaction(consistent_snapshot=True, readonly=True)
+
+
+class _PartWriter:
+    """
+    Writes a table's rows into a file for each partition under base (a
+    directory relative to out), CHUNK_SIZE rows at a time. At most
+    MAX_OPEN_FILES files are open at once; rows of a partition whose file
+    was closed go to another file of that partition.
+    """
+
+    def __init__(self, out, base, table, fmt, compression):
+        self._out = out
+        self._base = base
+        self._columns = ingest.COLUMNS[table.name]
+        self._schema = _schema(self._columns)
+        self._part_at = self._columns.index(table.partition) \
+            if table.partition else None
+        self._fmt = fmt
+        self._compression = compression
+        # partition -> [writer, rows not yet written], least recently
+        # written first
+        self._open = OrderedDict()
+        # partition -> files started
+        self._parts = {}
+        self.files = []
+        self.rows = 0
+
+    def add(self, row):
+        partition = None if self._part_at is None else row[self._part_at]
+        entry = self._open.get(partition)
+        if entry is None:
+            if len(self._open) >= MAX_OPEN_FILES:
+                self._close(next(iter(self._open)))
+            n = self._parts.get(partition, 0)
+            self._parts[partition] = n + 1
+            directory = self._base if self._part_at is None else \
+                os.path.join(self._base, _partition_dir(partition))
+            self.files.append(os.path.join(
+                directory, 'part-' + str(n).zfill(5) + FORMATS[self._fmt]))
+            entry = self._open[partition] = [
+                _writer(os.path.join(self._out, self.files[-1]),
+                        self._schema, self._fmt, self._compression), []]
+        else:
+            self._open.move_to_end(partition)
+        entry[1].append(row)
+        self.rows += 1
+        if len(entry[1]) >= CHUNK_SIZE:
+            self._flush(entry)
+
+    def _flush(self, entry):
+        import pyarrow as pa
+        if entry[1]:
+            entry[0].write_table(pa.Table.from_pydict(
+                dict(zip(self._columns, map(list, zip(*entry[1])))),
+                schema=self._schema))
+            entry[1] = []
+
+    def _close(self, partition):
+        entry = self._open.pop(partition)
+        self._flush(entry)
+        entry[0].close()
+
+    def close(self):
+        for partition in list(self._open):
+            self._close(partition)
+
+
+def _row(row):
+    return tuple(_value(value) for value in row)
+
+
+def export_table(conn, out, table, base, fmt, compression):
+    """
+    Streams every row of a table into files under base (a directory
+    relative to out). Returns what was written, as recorded in the
+    manifest.
+    """
+    columns = ingest.COLUMNS[table.name]
+    order = ([table.partition] if table.partition else []) + table.keys
+    writer = _PartWriter(out, base, table, fmt, compression)
+    # ordered by partition, so each partition is written to one file
+    cursor = conn.cursor()
+    cursor.execute('SELECT ' + ', '.join(columns) + ' FROM ' + table.name +
+                   ' ORDER BY ' + ', '.join(order))
+    try:
+        while True:
+            chunk = cursor.fetchmany(CHUNK_SIZE)
+            if not chunk:
+                break
+            for row in chunk:
+                writer.add(_row(row))
+    finally:
+        cursor.close()
+        writer.close()
+    return {'rows': writer.rows, 'changed': writer.rows, 'deleted': 0,
+            'files': writer.files, 'deletes': None}
+
+
+def export_changes(conn, out, table, base, keys, fmt, compression):
+    """
+    Writes the current rows of a table with the given primary keys into
+    files under base, looking them up KEY_CHUNK at a time, and the keys
+    that are no longer in the table into a _deleted file. Returns what
+    was written, as recorded in the manifest.
+    """
+    columns = ingest.COLUMNS[table.name]
+    key_at = [columns.index(key) for key in table.keys]
+    # an OR of primary key equalities, which both backends look up by key
+    match = '(' + ' AND '.join(key + ' = %s' for key in table.keys) + ')'
+    writer = _PartWriter(out, base, table, fmt, compression)
+    keys = sorted(keys, key=str)
+    deleted = []
+    cursor = conn.cursor()
+    try:
+        for start in range(0, len(keys), KEY_CHUNK):
+            chunk = keys[start:start + KEY_CHUNK]
+            cursor.execute('SELECT ' + ', '.join(columns) + ' FROM ' +
+                           table.name + ' WHERE ' +
+                           ' OR '.join([match] * len(chunk)),
+                           [value for key in chunk for value in key])
+            found = set()
+            for row in cursor.fetchall():
+                row = _row(row)
+                found.add(tuple(row[i] for i in key_at))
+                writer.add(row)
+            deleted += [key for key in chunk if key not in found]
+    finally:
+        cursor.close()
+        writer.close()
+    written = {'rows': None, 'changed': writer.rows,
+               'deleted': len(deleted), 'files': writer.files,
+               'deletes': None}
+    if deleted:
+        written['deletes'] = os.path.join(base, '_deleted' + FORMATS[fmt])
+        _write(os.path.join(out, written['deletes']), table.keys, deleted,
+               fmt, compression)
+    return written
+
+
+def _consumer(out):
+    """
+    The export directory's name as a change log consumer.
+    """
+    return 'export:' + os.path.abspath(out)
+
+
+def _changed_keys(conn, feed):
+    """
+    Reads the change log from a feed to its end, and returns the keys of
+    the rows changed in each exported table, as {table: {key}}.
+    """
+    keys = {table.name: set() for table in TABLES}
+    while True:
+        batch = db.call(conn, changes.next_batch, feed)
+        if not batch:
+            return keys
+        for change in batch:
+            if change.table_name in keys:
+                keys[change.table_name].add(change.key)
+
+
+def export(conn, out, full=False, fmt=DEFAULT_FORMAT,
+           compression=DEFAULT_COMPRESSION):
+    """
+    Takes a snapshot of every table into the export directory out: every
+    row if full or if out has no snapshots yet, else only the rows changed
+    since the last snapshot. Returns the snapshot, as recorded in the
+    manifest.
+    """
+    if fmt not in FORMATS:
+        raise ValueError('Export as one of ' + ', '.join(FORMATS) + '.')
+    manifest = load_manifest(out)
+    previous = manifest['snapshots'][-1] if manifest['snapshots'] else None
+    snapshot_id = previous['id'] + 1 if previous else 1
+    now = datetime.datetime.now()
+    snapshot = {'id': snapshot_id,
+                'taken_at': now.isoformat(timespec='seconds'),
+                'date': now.date().isoformat(), 'full': True,
+                'format': fmt, 'tables': {}}
+    # files an export that failed part way left behind
+    for stale in glob.glob(os.path.join(out, '*', 'date=*',
+                                        'snapshot=' + str(snapshot_id))):
+        shutil.rmtree(stale)
+
+    _begin_reading(conn)
+    try:
+        # incremental unless the changes since the last snapshot were
+        # pruned
+        if full or previous is None or \
+                previous.get('change_id') is None or \
+                db.call(conn, changes.pruned_after, previous['change_id']):
+            feed = db.call(conn, changes.feed_at_end, _consumer(out))
+            keys = None
+        else:
+            snapshot['full'] = False
+            feed = changes.Feed(_consumer(out), previous['change_id'],
+                                previous['gaps'])
+            keys = _changed_keys(conn, feed)
+        for table in TABLES:
+            base = os.path.join(table.name, 'date=' + snapshot['date'],
+                                'snapshot=' + str(snapshot_id))
+            snapshot['tables'][table.name] = \
+                export_table(conn, out, table, base, fmt, compression) \
+                if keys is None else \
+                export_changes(conn, out, table, base, keys[table.name],
+                               fmt, compression)
+    finally:
+        conn.rollback()
+    snapshot['change_id'] = feed.after
+    snapshot['gaps'] = feed.gaps
+
+    manifest['snapshots'].append(snapshot)
+    _save_manifest(out, manifest)
+    db.call(conn, changes.save_checkpoint, feed)
+    return snapshot
+
+
+def open_table(out, name, as_of=None):
+    """
+    Returns an exported table (a pyarrow Table) as of a snapshot (the
+    latest by default): the rows of the last full snapshot before it,
+    updated with the changes of the snapshots since.
+    """
+    import pyarrow as pa
+    table = TABLES_BY_NAME[name]
+    columns = ingest.COLUMNS[name]
+    snapshots = [snapshot for snapshot in load_manifest(out)['snapshots']
+                 if as_of is None or snapshot['id'] <= as_of]
+    if not snapshots:
+        raise ValueError('There is no snapshot in ' + out + '.')
+    start = max(i for i, snapshot in enumerate(snapshots)
+                if snapshot['full'])
+    rows = []
+    events = []
+    for snapshot in snapshots[start:]:
+        written = snapshot['tables'][name]
+        for path in written['files']:
+            part = read_file(os.path.join(out, path))
+            part = part.append_column(SNAPSHOT_COLUMN, pa.array(
+                [snapshot['id']] * part.num_rows, pa.int64()))
+            rows.append(part)
+            events.append(part.select(table.keys + [SNAPSHOT_COLUMN]))
+        if written['deletes']:
+            deleted = read_file(os.path.join(out, written['deletes']))
+            events.append(deleted.append_column(SNAPSHOT_COLUMN, pa.array(
+                [snapshot['id']] * deleted.num_rows, pa.int64())))
+    if not rows:
+        return _schema(columns).empty_table()
+    rows = pa.concat_tables(rows)
+    if len(snapshots) - start == 1:
+        return rows.select(columns)
+    # a row is current if its latest change wrote it (rather than deleted
+    # it), and it was written in the snapshot of that change
+    latest = pa.concat_tables(events).group_by(table.keys).aggregate(
+        [(SNAPSHOT_COLUMN, 'max')])
+    latest = pa.table({column: latest.column(column) for column in
+                       table.keys + [SNAPSHOT_COLUMN + '_max']})
+    latest = latest.rename_columns(table.keys + [SNAPSHOT_COLUMN])
+    return rows.join(latest, keys=table.keys + [SNAPSHOT_COLUMN],
+                     join_type='inner').select(columns)
+
+
+def report(out, as_of=None):
+    """
+    Prints a summary of the closets from the exported files alone: the
+    rows of every table, and each store's items and their value.
+    """
+    import tables
+    snapshots = load_manifest(out)['snapshots']
+    if not snapshots:
+        raise ValueError('There is no snapshot in ' + out + '.')
+    snapshot = snapshots[-1] if as_of is None else \
+        [s for s in snapshots if s['id'] <= as_of][-1]
+    print('Snapshot ' + str(snapshot['id']) + ' taken at ' +
+          snapshot['taken_at'] + ':\n')
+    tables.print_table(([table.name, open_table(out, table.name,
+                                                snapshot['id']).num_rows]
+                        for table in TABLES), ['table', 'rows'])
+    stores = open_table(out, 'store_closet', snapshot['id'])
+    by_store = stores.group_by('store_name').aggregate(
+        [('clothing_id', 'count'), ('price', 'sum'),
+         ('original_price', 'sum')]).sort_by([('price_sum', 'descending')])
+    print('\nStores by value of their inventory:\n')
+    tables.print_table(([row['store_name'], row['clothing_id_count'],
+                         round(row['price_sum'], 2),
+                         round(row['original_price_sum'], 2)]
+                        for row in by_store.to_pylist()),
+                       ['store_name', 'items', 'value', 'full_price'])
+
+
+def main():
+    # only needed when run as a script
+    import argparse
+    import backends
+    import pool
+    parser = argparse.ArgumentParser(
+        description='Export the closets to columnar files.')
+    parser.add_argument('--out', metavar='DIR',
+                        help='export directory to add a snapshot to')
+    parser.add_argument('--full', action='store_true',
+                        help='export every row, not only the changes')
+    parser.add_argument('--format', choices=sorted(FORMATS),
+                        default=DEFAULT_FORMAT,
+                        help='file format (default ' + DEFAULT_FORMAT + ')')
+    parser.add_argument('--compression', default=DEFAULT_COMPRESSION,
+                        help="zstd, lz4, snappy (Parquet only) or 'none' "
+                             "(default " + DEFAULT_COMPRESSION + ")")
+    parser.add_argument('--report', metavar='DIR',
+                        help='summarize an export directory, without '
+                             'connecting to the database')
+    parser.add_argument('--db', metavar='BACKEND',
+                        help="'mysql' or 'sqlite:PATH' (default: "
+                             "$CLOSETLY_DB, else mysql)")
+    args = parser.parse_args()
+    if not args.out and not args.report:
+        parser.error('give --out to export, or --report to summarize')
+    spec = args.db or backends.configured()
+    try:
+        backends.parse(spec)
+    except ValueError as err:
+        parser.error(str(err))
+
+    if args.out:
+        conn = backends.connect(spec, *pool.ROLE_CREDENTIALS['appadmin'])
+        try:
+            snapshot = export(conn, args.out, args.full, args.format,
+                              args.compression)
+        finally:
+            conn.close()
+        print(('Full' if snapshot['full'] else 'Incremental') +
+              ' snapshot ' + str(snapshot['id']) + ':')
+        for name, written in snapshot['tables'].items():
+            print('  ' + name + ': ' + str(written['changed']) +
+                  ' rows written, ' + str(written['deleted']) + ' deleted')
+    if args.report:
+        report(args.report)
+
+
+if __name__ == '__main__':
+    main()
@@ -20,9 +20,14 @@ GRANT SELECT ON closetly.* TO 'appclient'@'localhost';
 
 GRANT SELECT, UPDATE, INSERT, DELETE ON closetly.store_closet TO 'storeowner'@'localhost';
 GRANT SELECT, INSERT ON closetly.styled_outfits TO 'storeowner'@'localhost';
+GRANT SELECT, INSERT ON closetly.outfits TO 'storeowner'@'localhost';
 GRANT SELECT ON closetly.permissions TO 'storeowner'@'localhost';
 GRANT SELECT ON closetly.user TO 'storeowner'@'localhost';
 GRANT SELECT ON closetly.clothes TO 'storeowner'@'localhost';
+GRANT SELECT ON closetly.store_summary TO 'storeowner'@'localhost';
+GRANT SELECT ON closetly.store_type_summary TO 'storeowner'@'localhost';
+-- selling items moves them into the buyer's personal closet
+GRANT SELECT, INSERT ON closetly.personal_closet TO 'storeowner'@'localhost';
 
 GRANT EXECUTE ON PROCEDURE sp_add_user TO 'storeowner'@'localhost';
 GRANT EXECUTE ON PROCEDURE add_to_user TO 'storeowner'@'localhost';
@@ -36,7 +41,9 @@ GRANT EXECUTE ON FUNCTION find_original_price TO 'storeowner'@'localhost'
 GRANT SELECT ON closetly.collab_closet TO 'stylist'@'localhost';
 GRANT SELECT ON closetly.personal_closet TO 'stylist'@'localhost';
 GRANT SELECT on closetly.store_closet TO 'stylist'@'localhost';
+GRANT SELECT ON closetly.best_price TO 'stylist'@'localhost';
 GRANT SELECT, UPDATE, INSERT ON closetly.styled_outfits TO 'stylist'@'localhost';
+GRANT SELECT, UPDATE, INSERT ON closetly.outfits TO 'stylist'@'localhost';
 GRANT SELECT ON closetly.permissions TO 'stylist'@'localhost';
 GRANT SELECT ON closetly.user TO 'stylist'@'localhost';
 GRANT SELECT ON closetly.clothes TO 'stylist'@'localhost';
@@ -50,15 +57,25 @@ GRANT EXECUTE ON PROCEDURE add_to_user TO 'stylist'@'localhost';
 -- as create new outfits in styled_outfits 
 
 GRANT SELECT, UPDATE, INSERT, DELETE ON closetly.personal_closet TO 'personal'@'localhost';
-GRANT SELECT ON closetly.store_closet TO 'personal'@'localhost';
+GRANT SELECT ON closetly.closet_summary TO 'personal'@'localhost';
+GRANT SELECT, INSERT, UPDATE ON closetly.wear_log TO 'personal'@'localhost';
+GRANT SELECT, INSERT, UPDATE ON closetly.wear_rollup TO 'personal'@'localhost';
+-- checking out a cart deletes the listings bought (see checkout.py)
+GRANT SELECT, DELETE ON closetly.store_closet TO 'personal'@'localhost';
+GRANT SELECT ON closetly.best_price TO 'personal'@'localhost';
 GRANT SELECT ON closetly.clothes TO 'personal'@'localhost';
 GRANT SELECT, UPDATE ON closetly.collab_closet TO 'personal'@'localhost';
+GRANT SELECT, INSERT, DELETE ON closetly.borrow_waitlist TO 'personal'@'localhost';
 GRANT SELECT, UPDATE, INSERT ON closetly.styled_outfits TO 'personal'@'localhost';
+GRANT SELECT, UPDATE, INSERT ON closetly.outfits TO 'personal'@'localhost';
 GRANT SELECT ON closetly.permissions TO 'personal'@'localhost';
 GRANT SELECT ON closetly.user TO 'personal'@'localhost';
 GRANT SELECT ON closetly.clothes TO 'personal'@'localhost';
+-- offline mirrors (see mirror.py) catch up by reading the change log
+GRANT SELECT ON closetly.change_log TO 'personal'@'localhost';
 
 GRANT EXECUTE ON FUNCTION borrow_item TO 'personal'@'localhost';
+GRANT EXECUTE ON FUNCTION find_available TO 'personal'@'localhost';
 GRANT EXECUTE ON PROCEDURE sp_add_user TO 'personal'@'localhost';
 GRANT EXECUTE ON PROCEDURE add_to_user TO 'personal'@'localhost';
 
@@ -0,0 +1,583 @@
+"""
+Bulk loader for the Closetly CSVs, and for any other CSV laid out the same
+way (such as a partner store's catalog). It replaces load-data.sql:
+
+    - CSVs of any size are streamed in chunks, never read whole.
+    - Rows are validated and normalized in a pool of worker processes:
+      whitespace is trimmed, NULL and the -1 "no value" sentinels become
+      real NULLs, and rows that would not fit the schema are rejected with
+      their line number instead of failing (or being truncated in) the load.
+    - Rows are written with multi-row INSERTs, with foreign key and unique
+      checks off and the table's secondary indexes dropped, then the
+      indexes are rebuilt once at the end.
+    - Every chunk is committed together with a checkpoint row, so a load
+      that is interrupted resumes where it stopped when run again.
+
+Rows are loaded in file order, so clothes and users given NULL IDs get the
+same AUTO_INCREMENT IDs they would from load-data.sql, as long as no row
+before them is rejected.
+
+Usage:
+    $ python3 ingest.py                        # every CSV in this directory
+    $ python3 ingest.py --file clothes=partner.csv \\
+          --file store_closet=partner_prices.csv
+    $ python3 ingest.py --fresh                # ignore earlier checkpoints
+    $ python3 ingest.py --standin closetly.db  # into a stand-in database
+"""
+import argparse
+import csv
+import itertools
+import os
+import time
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from decimal import Decimal, InvalidOperation
+
+import datagen
+import standin
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# CSV rows per chunk, which is also the number of rows per INSERT and per
+# commit
+CHUNK_SIZE = 5000
+# Most rejected rows whose reasons are kept for the report
+MAX_REPORTED_REJECTS = 20
+
+# Table -> columns filled from the CSV, in CSV column order
+COLUMNS = {
+    'user': ['user_id', 'name', 'username'],
+    'clothes': ['clothing_id', 'clothing_type', 'size', 'gender', 'color',
+                'brand', 'description', 'image_url', 'aesthetic',
+                'store_name'],
+    'personal_closet': ['user_id', 'clothing_id', 'is_clean', 'shared',
+                        'num_wears'],
+    'store_closet': ['store_name', 'clothing_id', 'price', 'discount',
+                     'original_price'],
+    'collab_closet': ['user_id', 'clothing_id', 'curr_condition',
+                      'is_available', 'current_borrower'],
+    'outfits': ['outfit_id', 'outfit_desc', 'vibe'],
+    'styled_outfits': ['outfit_id', 'clothing_id', 'outfit_desc', 'vibe'],
+}
+
+# Tables whose CSV repeats rows that should only be loaded once: every
+# piece of an outfit repeats the outfit's description and vibe
+IGNORE_DUPLICATES = {'outfits'}
+
+# The CSVs load-data.sql loads, in an order that satisfies foreign keys
+DEFAULT_FILES = [
+    ('clothes', 'clothes.csv'),
+    ('user', 'user.csv'),
+    ('personal_closet', 'personal_closet.csv'),
+    ('store_closet', 'store_closet.csv'),
+    ('collab_closet', 'collab_closet.csv'),
+    ('outfits', 'styled_outfits.csv'),
+    ('styled_outfits', 'styled_outfits.csv'),
+]
+
+# Result of loading one file
+IngestResult = namedtuple('IngestResult', ['table', 'path', 'rows_read',
+                                           'rows_loaded', 'rows_rejected',
+                                           'rejects', 'seconds'])
+
+
+# ----------------------------------------------------------------------
+# Validating and normalizing rows (runs in the worker processes)
+# ----------------------------------------------------------------------
+def _text(value, limit, required=False):
+    """
+    Trims a text field. Empty and NULL fields become None, except that a
+    required (NOT NULL) column keeps an empty value and rejects NULL.
+    """
+    value = value.strip()
+    if value == 'NULL' and required:
+        raise ValueError('missing value')
+    if value == '' or value == 'NULL':
+        return '' if required else None
+    if len(value) > limit:
+        raise ValueError('longer than ' + str(limit) + ' characters: ' +
+                         value[:20] + '...')
+    return value
+
+
+def _int(value, required=False, sentinel=None):
+    """
+    Parses an integer field. Empty and NULL fields (and the sentinel, if
+    the CSV uses one for "no value") become None, unless required.
+    """
+    value = value.strip()
+    if value in ('', 'NULL') or (sentinel is not None and
+                                 value == str(sentinel)):
+        if required:
+            raise ValueError('missing value')
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError('not a whole number: ' + value)
+
+
+def _flag(value, default):
+    """
+    Parses a 0/1 field, using the column default when it is empty.
+    """
+    value = _int(value)
+    if value is None:
+        return default
+    if value not in (0, 1):
+        raise ValueError('not 0 or 1: ' + str(value))
+    return value
+
+
+def _decimal(value):
+    value = value.strip()
+    try:
+        number = Decimal(value)
+    except InvalidOperation:
+        raise ValueError('not a number: ' + value)
+    if not number.is_finite() or number < 0:
+        raise ValueError('not a non-negative number: ' + value)
+    return number
+
+
+def _user(row):
+    return (_int(row[0]), _text(row[1], 80, required=True),
+            _text(row[2], 20))
+
+
+def _clothes(row):
+    gender = _text(row[3], 1)
+    if gender is not None:
+        gender = gender.upper()
+        if gender not in ('W', 'M', 'U'):
+            raise ValueError('gender is not W, M or U: ' + gender)
+    return (_int(row[0]), _text(row[1], 100, required=True),
+            _text(row[2], 20, required=True), gender, _text(row[4], 50),
+            _text(row[5], 150), _text(row[6], 250), _text(row[7], 250),
+            _text(row[8], 200), _text(row[9], 100))
+
+
+def _personal_closet(row):
+    num_wears = _int(row[4], sentinel=-1)
+    if num_wears is not None and num_wears < 0:
+        raise ValueError('negative number of wears: ' + str(num_wears))
+    return (_int(row[0], required=True), _int(row[1], required=True),
+            _flag(row[2], 1), _flag(row[3], 0), num_wears)
+
+
+def _store_closet(row):
+    price = _decimal(row[2])
+    discount = _decimal(row[3])
+    if discount >= 100:
+        raise ValueError('discount is not below 100%: ' + str(discount))
+    # the CSV holds the current (discounted) price, so the original price
+    # is worked back out from the discount
+    original = price * 100 / (100 - discount)
+    return (_text(row[0], 100, required=True), _int(row[1], required=True),
+            float(price.quantize(Decimal('0.01'))),
+            float(discount.quantize(Decimal('0.1'))),
+            float(original.quantize(Decimal('0.01'))))
+
+
+def _collab_closet(row):
+    return (_int(row[0], required=True), _int(row[1], required=True),
+            _text(row[2], 50), _flag(row[3], 1),
+            _int(row[4], sentinel=-1))
+
+
+def _outfits(row):
+    return (_int(row[0], required=True), _text(row[2], 250),
+            _text(row[3], 250))
+
+
+def _styled_outfits(row):
+    return (_int(row[0], required=True), _int(row[1], required=True),
+            _text(row[2], 250), _text(row[3], 250))
+
+
+# Table -> (number of CSV columns, function turning a CSV row into a row
+# of COLUMNS[table])
+NORMALIZERS = {
+    'user': (3, _user),
+    'clothes': (10, _clothes),
+    'personal_closet': (5, _personal_closet),
+    'store_closet': (4, _store_closet),
+    'collab_closet': (5, _collab_closet),
+    'outfits': (4, _outfits),
+    'styled_outfits': (4, _styled_outfits),
+}
+
+
+def normalize_chunk(task):
+    """
+    Validates and normalizes one chunk of CSV rows for a table. task is
+    (table, [(line number, CSV row), ...]). Returns (rows read, normalized
+    rows, [(line number, reason), ...] for the rejected rows).
+    """
+    table, lines = task
+    width, normalize = NORMALIZERS[table]
+    rows = []
+    rejects = []
+    seen = set()
+    for line_num, row in lines:
+        if not row or row == ['']:
+            # blank line
+            continue
+        if len(row) != width:
+            rejects.append((line_num, 'expected ' + str(width) +
+                            ' fields, found ' + str(len(row))))
+            continue
+        try:
+            normalized = normalize(row)
+        except ValueError as e:
+            rejects.append((line_num, str(e)))
+            continue
+        if table in IGNORE_DUPLICATES:
+            if normalized[0] in seen:
+                continue
+            seen.add(normalized[0])
+        rows.append(normalized)
+    return len(lines), rows, rejects
+
+
+# ----------------------------------------------------------------------
+# Reading CSVs
+# ----------------------------------------------------------------------
+def read_chunks(path, table, chunk_size=CHUNK_SIZE, skip=0):
+    """
+    Streams the data rows of a CSV (after its header) as normalize_chunk
+    tasks of at most chunk_size rows, skipping the first `skip` data rows.
+    """
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        reader = csv.reader(f)
+        next(reader, None)
+        rows = itertools.islice(reader, skip, None)
+        while True:
+            lines = [(reader.line_num, row)
+                     for row in itertools.islice(rows, chunk_size)]
+            if not lines:
+                return
+            yield table, lines
+
+
+def _normalized(tasks, workers):
+    """
+    Normalizes tasks in order, in up to `workers` processes. At most two
+    chunks per worker are read ahead, so memory use does not grow with the
+    size of the file.
+    """
+    if workers <= 1:
+        for task in tasks:
+            yield normalize_chunk(task)
+        return
+    with ProcessPoolExecutor(workers) as pool:
+        pending = deque()
+        for task in tasks:
+            pending.append(pool.submit(normalize_chunk, task))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+# ----------------------------------------------------------------------
+# Checkpoints
+# ----------------------------------------------------------------------
+def get_checkpoint(conn, table, path):
+    """
+    Returns (rows read, rows loaded, rows rejected, finished) of an earlier
+    load of path into table, or None.
+    """
+    cursor = conn.cursor()
+    cursor.execute("""SELECT rows_read, rows_loaded, rows_rejected, finished
+        FROM ingest_checkpoint WHERE table_name = %s AND file_name = %s""",
+                   (table, path))
+    row = cursor.fetchone()
+    cursor.close()
+    return row
+
+
+def _save_checkpoint(cursor, table, path, read, loaded, rejected, finished):
+    cursor.execute("""REPLACE INTO ingest_checkpoint
+        (table_name, file_name, rows_read, rows_loaded, rows_rejected,
+         finished)
+        VALUES (%s, %s, %s, %s, %s, %s)""",
+                   (table, path, read, loaded, rejected, int(finished)))
+
+
+def clear_checkpoints(conn):
+    """
+    Forgets every earlier load, so the next load starts from the top of
+    each file.
+    """
+    cursor = conn.cursor()
+    cursor.execute('DELETE FROM ingest_checkpoint')
+    conn.commit()
+    cursor.close()
+
+
+# ----------------------------------------------------------------------
+# Secondary indexes
+# ----------------------------------------------------------------------
+def _find_secondary_indexes(conn, table):
+    """
+    Returns [(index name, 'col1, col2', index type)] for the non-unique
+    indexes of a table that can be dropped during a load. Indexes that start
+    with a foreign key column are kept, since MySQL needs them for the key.
+    """
+    cursor = conn.cursor()
+    if standin.is_standin(conn):
+        cursor.execute("""SELECT name FROM sqlite_master
+            WHERE type = 'index' AND tbl_name = %s AND sql IS NOT NULL""",
+                       (table,))
+        names = [row[0] for row in cursor.fetchall()]
+        indexes = []
+        for name in names:
+            cursor.execute('PRAGMA index_info(' + name + ')')
+            columns = [row[2] for row in sorted(cursor.fetchall())]
+            indexes.append((name, ', '.join(columns), 'BTREE'))
+        cursor.close()
+        return indexes
+
+    cursor.execute("""SELECT column_name FROM information_schema.key_column_usage
+        WHERE table_schema = DATABASE() AND table_name = %s
+            AND referenced_table_name IS NOT NULL""", (table,))
+    foreign_keys = {row[0] for row in cursor.fetchall()}
+    cursor.execute("""SELECT index_name,
+            GROUP_CONCAT(column_name ORDER BY seq_in_index SEPARATOR ', '),
+            MIN(non_unique), MIN(CASE WHEN seq_in_index = 1
+                                      THEN column_name END),
+            MIN(index_type)
+        FROM information_schema.statistics
+        WHERE table_schema = DATABASE() AND table_name = %s
+            AND index_name <> 'PRIMARY'
+        GROUP BY index_name""", (table,))
+    indexes = [(name, columns, index_type)
+               for name, columns, non_unique, first, index_type
+               in cursor.fetchall()
+               if non_unique and first not in foreign_keys]
+    cursor.close()
+    return indexes
+
+
+def drop_indexes(conn, table):
+    """
+    Drops the secondary indexes of a table, first recording them in
+    ingest_index so rebuild_indexes can restore them, even after a crash.
+    """
+    cursor = conn.cursor()
+    for name, columns, index_type in _find_secondary_indexes(conn, table):
+        cursor.execute("""REPLACE INTO ingest_index
+            (table_name, index_name, index_columns, index_type)
+            VALUES (%s, %s, %s, %s)""", (table, name, columns, index_type))
+        conn.commit()
+        if standin.is_standin(conn):
+            cursor.execute('DROP INDEX ' + name)
+        else:
+            cursor.execute('DROP INDEX ' + name + ' ON ' + table)
+    conn.commit()
+    cursor.close()
+
+
+def rebuild_indexes(conn, table):
+    """
+    Recreates the indexes drop_indexes dropped from a table. On MySQL they
+    are all added by one ALTER TABLE, which reads the table once.
+    """
+    cursor = conn.cursor()
+    cursor.execute("""SELECT index_name, index_columns, index_type
+        FROM ingest_index WHERE table_name = %s""", (table,))
+    indexes = cursor.fetchall()
+    if indexes:
+        if standin.is_standin(conn):
+            for name, columns, _ in indexes:
+                cursor.execute('CREATE INDEX ' + name + ' ON ' + table +
+                               ' (' + columns + ')')
+        else:
+            # FULLTEXT indexes (e.g. ft_clothes_text) are rebuilt as such
+            cursor.execute('ALTER TABLE ' + table + ' ' + ', '.join(
+                'ADD ' + ('FULLTEXT ' if index_type == 'FULLTEXT' else '') +
+                'INDEX ' + name + ' (' + columns + ')'
+                for name, columns, index_type in indexes))
+        cursor.execute('DELETE FROM ingest_index WHERE table_name = %s',
+                       (table,))
+        conn.commit()
+    cursor.close()
+
+
+def _set_checks(conn, on):
+    """
+    Turns foreign key (and, on MySQL, unique) checks on or off for this
+    session.
+    """
+    cursor = conn.cursor()
+    if standin.is_standin(conn):
+        cursor.execute('PRAGMA foreign_keys = ' + ('ON' if on else 'OFF'))
+    else:
+        cursor.execute('SET SESSION unique_checks = %s, ' +
+                       'foreign_key_checks = %s', (int(on), int(on)))
+    cursor.close()
+
+
+# ----------------------------------------------------------------------
+# Loading
+# ----------------------------------------------------------------------
+def _insert_sql(conn, table):
+    columns = COLUMNS[table]
+    verb = 'INSERT INTO '
+    if table in IGNORE_DUPLICATES:
+        verb = 'INSERT OR IGNORE INTO ' if standin.is_standin(conn) \
+            else 'INSERT IGNORE INTO '
+    return verb + table + ' (' + ', '.join(columns) + ') VALUES (' + \
+        ', '.join(['%s'] * len(columns)) + ')'
+
+
+def ingest_file(conn, table, path, chunk_size=CHUNK_SIZE, workers=None,
+                progress=None):
+    """
+    Loads one CSV into a table, resuming from its checkpoint if an earlier
+    load of the same file stopped part way. Returns an IngestResult for
+    the rows handled by this call. progress, if given, is called with
+    (table, rows read so far) after every chunk.
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    path = os.path.abspath(path)
+    start = time.perf_counter()
+    read = loaded = rejected = 0
+    checkpoint = get_checkpoint(conn, table, path)
+    if checkpoint:
+        if checkpoint[3]:
+            # in case the load stopped before its indexes were rebuilt
+            rebuild_indexes(conn, table)
+            return IngestResult(table, path, 0, 0, 0, [], 0.0)
+        read, loaded, rejected = checkpoint[0], checkpoint[1], checkpoint[2]
+    rows_before = (read, loaded, rejected)
+
+    drop_indexes(conn, table)
+    sql = _insert_sql(conn, table)
+    cursor = conn.cursor()
+    rejects = []
+    try:
+        tasks = read_chunks(path, table, chunk_size, skip=read)
+        for n_read, rows, chunk_rejects in _normalized(tasks, workers):
+            if rows:
+                cursor.executemany(sql, rows)
+            read += n_read
+            loaded += len(rows)
+            rejected += len(chunk_rejects)
+            rejects.extend(chunk_rejects[:MAX_REPORTED_REJECTS -
+                                         len(rejects)])
+            # the checkpoint commits with the rows, so a resumed load
+            # never loads a chunk twice
+            _save_checkpoint(cursor, table, path, read, loaded, rejected,
+                             False)
+            conn.commit()
+            if progress:
+                progress(table, read)
+        _save_checkpoint(cursor, table, path, read, loaded, rejected, True)
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+    rebuild_indexes(conn, table)
+    return IngestResult(table, path, read - rows_before[0],
+                        loaded - rows_before[1], rejected - rows_before[2],
+                        rejects, time.perf_counter() - start)
+
+
+def ingest(conn, files, chunk_size=CHUNK_SIZE, workers=None, progress=None):
+    """
+    Loads each (table, CSV path) in order, with foreign key and unique
+    checks off for the whole load. Returns a list of IngestResults.
+    """
+    for table, path in files:
+        if table not in COLUMNS:
+            raise ValueError('Cannot load into unknown table ' + table + '.')
+    _set_checks(conn, False)
+    try:
+        # indexes left dropped by a load that crashed are rebuilt by the
+        # resumed load of their table
+        return [ingest_file(conn, table, path, chunk_size, workers, progress)
+                for table, path in files]
+    finally:
+        _set_checks(conn, True)
+
+
+def print_report(results):
+    """
+    Prints rows loaded, rejected and per second for every file, with the
+    reasons for the first rejected rows.
+    """
+    print('table'.ljust(16) + 'file'.ljust(24) + 'loaded'.rjust(10) +
+          'rejected'.rjust(10) + 'seconds'.rjust(9) + 'rows/s'.rjust(10))
+    total_read = 0
+    total_seconds = 0.0
+    for r in results:
+        if not r.rows_read:
+            print(r.table.ljust(16) + os.path.basename(r.path).ljust(24) +
+                  '  already loaded')
+            continue
+        rate = r.rows_read / r.seconds if r.seconds else 0.0
+        print(r.table.ljust(16) + os.path.basename(r.path).ljust(24) +
+              ('%10d%10d%9.1f%10.0f' % (r.rows_loaded, r.rows_rejected,
+                                        r.seconds, rate)))
+        total_read += r.rows_read
+        total_seconds += r.seconds
+    if total_seconds:
+        print('Read ' + str(total_read) + ' rows in ' +
+              str(round(total_seconds, 1)) + ' s (' +
+              str(int(total_read / total_seconds)) + ' rows/s).')
+    for r in results:
+        for line_num, reason in r.rejects:
+            print('Rejected ' + os.path.basename(r.path) + ' line ' +
+                  str(line_num) + ': ' + reason)
+
+
+def _file_argument(value):
+    table, sep, path = value.partition('=')
+    if not sep or table not in COLUMNS:
+        raise argparse.ArgumentTypeError(
+            'expected TABLE=PATH with TABLE one of ' + ', '.join(COLUMNS))
+    return table, path
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Load CSVs into the Closetly database.')
+    parser.add_argument('--file', action='append', dest='files',
+                        type=_file_argument, metavar='TABLE=PATH',
+                        help='load this CSV into this table (may be '
+                             'repeated; default: every Closetly CSV)')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE,
+                        help='rows per chunk, INSERT and commit '
+                             '(default ' + str(CHUNK_SIZE) + ')')
+    parser.add_argument('--workers', type=int,
+                        help='validating processes (default: one per CPU; '
+                             '1 validates in this process)')
+    parser.add_argument('--fresh', action='store_true',
+                        help='ignore checkpoints of earlier loads')
+    parser.add_argument('--standin', metavar='PATH',
+                        help='load into an embedded SQLite stand-in '
+                             'database at PATH instead of MySQL')
+    args = parser.parse_args()
+
+    files = args.files or [(table, os.path.join(HERE, name))
+                           for table, name in DEFAULT_FILES]
+    if args.standin:
+        conn = standin.connect(args.standin,
+                               create_schema=not os.path.exists(args.standin))
+    else:
+        conn = datagen.connect()
+    if args.fresh:
+        clear_checkpoints(conn)
+    results = ingest(conn, files, args.chunk_size, args.workers,
+                     progress=lambda table, n: print(table, n))
+    print_report(results)
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
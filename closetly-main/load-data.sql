@@ -17,8 +17,14 @@ SET num_wears = NULLIF(num_wears, -1);
 
 -- Load all stores' (clothes.store_name != NULL) inventory data into the 
 -- store_closet table.
+-- The CSV holds the current (discounted) price, so the original price is
+-- worked back out from the discount. A discount of 100% or more leaves no
+-- original price to work out, so it is NULL rather than a division by zero.
 LOAD DATA LOCAL INFILE 'store_closet.csv' INTO TABLE store_closet
-FIELDS TERMINATED BY ',' ENCLOSED BY '"' LINES TERMINATED BY '\r\n' IGNORE 1 ROWS;
+FIELDS TERMINATED BY ',' ENCLOSED BY '"' LINES TERMINATED BY '\r\n' IGNORE 1 ROWS
+(store_name, clothing_id, price, discount)
+SET original_price = CASE WHEN discount < 100
+                          THEN ROUND(price * 100 / (100 - discount), 2) END;
 
 -- Load all data into the collab_closet for items that users are willing
 -- to share (personal_closet.shared = 1) from their personal closet. If no one is
@@ -28,6 +34,13 @@ FIELDS TERMINATED BY ',' ENCLOSED BY '"' LINES TERMINATED BY '\r\n' IGNORE 1 ROW
 (user_id, clothing_id, curr_condition, is_available, current_borrower) 
 SET current_borrower = NULLIF(current_borrower, -1);
 
+-- Load one header row per outfit into the outfits table. Every piece of
+-- an outfit repeats its description and vibe, so IGNORE skips the
+-- duplicate outfit IDs after the first piece.
+LOAD DATA LOCAL INFILE 'styled_outfits.csv' IGNORE INTO TABLE outfits
+FIELDS TERMINATED BY ',' ENCLOSED BY '"' LINES TERMINATED BY '\r\n' IGNORE 1 ROWS
+(outfit_id, @clothing_id, outfit_desc, vibe);
+
 -- Load all data for each styled outfit into the styled_outfits table.
 LOAD DATA LOCAL INFILE 'styled_outfits.csv' INTO TABLE styled_outfits
 FIELDS TERMINATED BY ',' ENCLOSED BY '"' LINES TERMINATED BY '\r\n' IGNORE 1 ROWS;
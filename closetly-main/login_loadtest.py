@@ -0,0 +1,221 @@
+"""
+Multi-threaded login storm. Each client thread has its own connection and
+keeps logging in as a random account, with the wrong password one time in
+WRONG_PASSWORD_EVERY, the way the API's POST /login does: one statement
+checks the password and finds the role and closet (service.login), then a
+signed token is handed out (tokens.py). It checks that every right
+password was accepted and every wrong one refused, and reports logins per
+second and p50/p95/p99 latency for each number of concurrent clients.
+
+With --separate it also runs the statements login used to take one after
+another (check_username, authenticate, get_permission, get_user_id and
+get_permission again), without the account cache, for comparison. That
+needs MySQL's authenticate routine, so it is skipped on the stand-in.
+
+Usage:
+    $ python3 login_loadtest.py --scale 100000
+    $ python3 login_loadtest.py --clients 1,8,64 --seconds 10 --separate
+    $ python3 login_loadtest.py --standin /tmp/closetly.db
+
+Load tests against MySQL replace the contents of the closetly database.
+The stand-in must be a file (not ':memory:') so every client can open it.
+"""
+import argparse
+import random
+import threading
+import time
+
+import api
+import benchmark
+import datagen
+import db
+import service
+import standin
+import statements as stmts
+import tokens
+from service import ServiceError
+
+# Numbers of concurrent clients measured by default
+CLIENT_COUNTS = [1, 8, 64]
+# One login in this many uses the wrong password
+WRONG_PASSWORD_EVERY = 10
+# Times each kind of token check is timed
+TOKEN_CHECKS = 100000
+
+
+def single_login(conn, signer, username, password):
+    """
+    Logs in with one statement and returns a signed token, or None if the
+    password is wrong.
+    """
+    try:
+        session = db.call(conn, service.login, username, password)
+    except ServiceError:
+        return None
+    if session.role is None or session.user_id is None:
+        raise AssertionError('no role or closet for ' + username)
+    return signer.sign(session, api.SESSION_TTL)
+
+
+def separate_login(conn, signer, username, password):
+    """
+    Logs in with the statements login used to run one after another.
+    """
+    if not stmts.fetch_value(conn, 'check_username', (username,)):
+        return None
+    if not stmts.fetch_value(conn, 'authenticate', (username, password)):
+        return None
+    role = stmts.fetch_value(conn, 'get_permission', (username,))
+    user_id = stmts.fetch_value(conn, 'get_user_id', (username,))
+    # show_options looked the role up again
+    stmts.fetch_value(conn, 'get_permission', (username,))
+    return signer.sign(service.Session(username, role, user_id),
+                       api.SESSION_TTL)
+
+
+class Client(threading.Thread):
+    """
+    One client: a connection that logs in as random accounts until told
+    to stop.
+    """
+
+    def __init__(self, connect, login, data, signer, stop, seed):
+        threading.Thread.__init__(self, daemon=True)
+        self._connect = connect
+        self._login = login
+        self._data = data
+        self._signer = signer
+        self._done = stop
+        self._rng = random.Random(seed)
+        self.latencies = []
+        self.wrong_answers = 0
+        self.error = None
+
+    def run(self):
+        conn = self._connect()
+        rng = self._rng
+        try:
+            while not self._done.is_set():
+                username = rng.choice(self._data.usernames)
+                right = rng.randrange(WRONG_PASSWORD_EVERY) != 0
+                password = datagen.password_for(username)
+                if not right:
+                    password = 'not ' + password
+                start = time.perf_counter()
+                token = self._login(conn, self._signer, username, password)
+                self.latencies.append(time.perf_counter() - start)
+                if (token is not None) != right:
+                    self.wrong_answers += 1
+        except Exception as e:
+            self.error = e
+        finally:
+            conn.close()
+
+
+def run_clients(connect, login, data, clients, seconds, seed):
+    """
+    Runs `clients` client threads for `seconds` and returns (summary of
+    the login latencies, logins answered wrongly, client errors).
+    """
+    signer = tokens.Signer()
+    stop = threading.Event()
+    threads = [Client(connect, login, data, signer, stop, seed + i)
+               for i in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    latencies = [s for thread in threads for s in thread.latencies]
+    errors = [thread.error for thread in threads if thread.error]
+    return (benchmark.summarize(latencies, elapsed),
+            sum(t.wrong_answers for t in threads), errors)
+
+
+def time_token_checks(data):
+    """
+    Returns the microseconds one API request spends checking its token
+    the first time it is seen (signature check) and after that (cache).
+    """
+    sessions = api.Sessions()
+    token = sessions.create(service.Session(data.usernames[0], 'personal',
+                                            1))
+    signer = sessions.signer
+    start = time.perf_counter()
+    for _ in range(TOKEN_CHECKS):
+        signer.verify(token)
+    first = time.perf_counter() - start
+    sessions.get(token)
+    start = time.perf_counter()
+    for _ in range(TOKEN_CHECKS):
+        sessions.get(token)
+    repeat = time.perf_counter() - start
+    return first / TOKEN_CHECKS * 1e6, repeat / TOKEN_CHECKS * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test logging in.')
+    datagen.add_size_arguments(parser)
+    parser.add_argument('--clients', default=','.join(map(str, CLIENT_COUNTS)),
+                        help='comma-separated numbers of concurrent clients '
+                             '(default 1,8,64)')
+    parser.add_argument('--seconds', type=float, default=10,
+                        help='seconds to run each number of clients '
+                             '(default 10)')
+    parser.add_argument('--separate', action='store_true',
+                        help='also time the separate statements login '
+                             'used to run (MySQL only)')
+    args = parser.parse_args()
+    if args.standin == ':memory:':
+        parser.error('the stand-in must be a file for several clients')
+
+    conn = datagen.connect(args.standin)
+    print('Generating data...')
+    data = datagen.populate(conn, datagen.sizes_from_args(args), args.seed)
+    conn.close()
+
+    def connect():
+        if args.standin:
+            return standin.connect(args.standin, create_schema=False)
+        return datagen.connect()
+
+    paths = [('single', single_login)]
+    if args.separate:
+        if args.standin:
+            print('Skipping --separate: the stand-in has no authenticate '
+                  'routine.')
+        else:
+            paths.append(('separate', separate_login))
+
+    print('path'.ljust(10) + 'clients'.rjust(8) + 'logins'.rjust(10) +
+          'logins/s'.rjust(10) + 'p50 ms'.rjust(9) + 'p95 ms'.rjust(9) +
+          'p99 ms'.rjust(9) + 'wrong'.rjust(7))
+    failed = False
+    for name, login in paths:
+        for clients in [int(n) for n in args.clients.split(',')]:
+            summary, wrong, errors = run_clients(
+                connect, login, data, clients, args.seconds, args.seed)
+            print(name.ljust(10) + str(clients).rjust(8) +
+                  str(summary['n']).rjust(10) +
+                  str(int(summary['ops_per_s'])).rjust(10) +
+                  ('%.2f' % summary['p50_ms']).rjust(9) +
+                  ('%.2f' % summary['p95_ms']).rjust(9) +
+                  ('%.2f' % summary['p99_ms']).rjust(9) +
+                  str(wrong).rjust(7))
+            for e in errors[:3]:
+                print('  client error: ' + str(e))
+            failed = failed or wrong > 0 or bool(errors)
+
+    first, repeat = time_token_checks(data)
+    print('Checking a token: %.1f us the first time, %.2f us after that.'
+          % (first, repeat))
+    if failed:
+        raise SystemExit('Some logins were answered wrongly.')
+    print('Every right password was accepted and every wrong one refused.')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,533 @@
+"""
+Offline mirror of a personal user's closets: an SQLite file on the user's
+own machine holding their personal closet, the collaborative closet and
+the inventories of the stores they keep as favorites. Reads are answered
+from the file, without a round trip to the server:
+
+    local = mirror.Mirror('closet.db', session.user_id)
+    db.call(conn, mirror.sync, local)
+    local.personal_closet()
+
+sync brings the file up to date in deltas. It reads the change log (see
+changes.py) from where the last sync stopped and fetches again only the
+rows those changes touched. Every mirrored row has a version: the change
+ID it is current as of. The first sync copies the closets whole, and so
+does any sync after the log was pruned past the mirror. Mirrors keep no
+checkpoint on the server, so a mirror that stays offline never holds back
+pruning.
+
+Borrowing, returning and logging wears are done to the mirror at once and
+queued in the file, and the next sync replays the queue in batches. All
+queued borrows are claimed with one UPDATE (see borrowing.borrow_many)
+and each day's wears are logged with one INSERT. The claim only matches
+items still available, so a queued borrow of an item someone else took in
+the meantime (or that left the collaborative closet) is a conflict: sync
+returns it, and the delta that follows puts the item's row back the way
+the server has it.
+
+The server operations are coroutines taking a Db (see db.py) and the
+Mirror; from blocking code use db.call(conn, mirror.sync, local).
+"""
+import itertools
+import json
+import sqlite3
+from collections import namedtuple
+from decimal import Decimal
+
+import borrowing
+import browse
+import cache
+import changes
+import wears
+from service import PERSONAL_COLUMNS, USER_COLLAB_COLUMNS
+from statements import STATEMENTS
+
+# Most clothing IDs in one statement, on the server and in the file
+KEY_CHUNK = 500
+# Queued writes after which the app syncs without being asked
+REPLAY_AFTER = 10
+# Name the mirror's Feed (see changes.py) goes by; it is never saved
+CONSUMER = 'mirror'
+
+# Mirrored rows, keyed by the table they come from
+TABLES = ['personal', 'collab', 'store']
+COLUMNS = {
+    'personal': PERSONAL_COLUMNS,
+    'collab': browse.COLLAB_COLUMNS,
+    'store': ['store_name'] + browse.STORE_COLUMNS,
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS mirror_state (
+    name    TEXT PRIMARY KEY,
+    value   TEXT
+);
+CREATE TABLE IF NOT EXISTS favorite_store (
+    store_name  TEXT PRIMARY KEY
+);
+CREATE TABLE IF NOT EXISTS personal (
+    clothing_id     INTEGER PRIMARY KEY,
+    clothing_type   TEXT,
+    size            TEXT,
+    gender          TEXT,
+    color           TEXT,
+    brand           TEXT,
+    description     TEXT,
+    image_url       TEXT,
+    aesthetic       TEXT,
+    is_clean        INTEGER,
+    shared          INTEGER,
+    num_wears       INTEGER,
+    version         INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS collab (
+    user_id         INTEGER,
+    clothing_id     INTEGER,
+    clothing_type   TEXT,
+    size            TEXT,
+    gender          TEXT,
+    color           TEXT,
+    brand           TEXT,
+    description     TEXT,
+    image_url       TEXT,
+    aesthetic       TEXT,
+    curr_condition  TEXT,
+    is_available    INTEGER,
+    current_borrower INTEGER,
+    version         INTEGER NOT NULL,
+    PRIMARY KEY (user_id, clothing_id)
+);
+CREATE INDEX IF NOT EXISTS idx_collab_clothing ON collab (clothing_id);
+CREATE TABLE IF NOT EXISTS store (
+    store_name      TEXT,
+    clothing_id     INTEGER,
+    price           REAL,
+    discount        INTEGER,
+    clothing_type   TEXT,
+    size            TEXT,
+    gender          TEXT,
+    color           TEXT,
+    brand           TEXT,
+    description     TEXT,
+    image_url       TEXT,
+    aesthetic       TEXT,
+    version         INTEGER NOT NULL,
+    PRIMARY KEY (store_name, clothing_id)
+);
+CREATE INDEX IF NOT EXISTS idx_store_clothing ON store (clothing_id);
+CREATE TABLE IF NOT EXISTS pending (
+    op_id       INTEGER PRIMARY KEY AUTOINCREMENT,
+    operation   TEXT NOT NULL,
+    clothing_id INTEGER NOT NULL,
+    worn_on     TEXT
+);
+"""
+
+# A queued write the server would not take: a 'borrow' of an item someone
+# else got first, a 'return' of an item the user no longer has, or a
+# 'wear' of a piece no longer in their closet
+Conflict = namedtuple('Conflict', ['operation', 'clothing_id'])
+
+
+def _local(value):
+    """
+    Returns a database value as SQLite stores it.
+    """
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (bytes, bytearray)):
+        return value.decode()
+    return value
+
+
+def _chunks(values):
+    values = sorted(values)
+    for start in range(0, len(values), KEY_CHUNK):
+        yield values[start:start + KEY_CHUNK]
+
+
+def _in(chunk, mark='%s'):
+    # the server's statements take %s; the file's sqlite3 takes ?
+    return ' IN (' + ', '.join([mark] * len(chunk)) + ')'
+
+
+class Mirror:
+    """
+    The mirror file of one user. Opening a file that mirrored someone else
+    empties it first.
+    """
+
+    def __init__(self, path, user_id):
+        self.path = path
+        self.user_id = int(user_id)
+        self._conn = sqlite3.connect(path)
+        self._conn.executescript(SCHEMA)
+        if self._state('user_id') != self.user_id:
+            with self._conn:
+                for table in TABLES + ['favorite_store', 'pending',
+                                       'mirror_state']:
+                    self._conn.execute('DELETE FROM ' + table)
+                self._set_state('user_id', self.user_id)
+
+    def close(self):
+        self._conn.close()
+
+    def _state(self, name):
+        row = self._conn.execute(
+            'SELECT value FROM mirror_state WHERE name = ?', (name,)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _set_state(self, name, value):
+        self._conn.execute(
+            'INSERT OR REPLACE INTO mirror_state (name, value) VALUES (?, ?)',
+            (name, json.dumps(value)))
+
+    def _rows(self, table, columns, where='', params=()):
+        cursor = self._conn.execute(
+            'SELECT ' + ', '.join(columns) + ' FROM ' + table + where +
+            ' ORDER BY clothing_id', params)
+        return [dict(zip(columns, row)) for row in cursor]
+
+    # ------------------------------------------------------------------
+    # Reads
+    # ------------------------------------------------------------------
+    def personal_closet(self):
+        """
+        Returns every item in the user's personal closet, like
+        service.personal_closet.
+        """
+        return self._rows('personal', PERSONAL_COLUMNS)
+
+    def collab_closet(self):
+        """
+        Returns every item in the collaborative closet, in browse's
+        COLLAB_COLUMNS.
+        """
+        return self._rows('collab', COLUMNS['collab'])
+
+    def collab_items_of(self, user_id):
+        """
+        Returns every item one user shares in the collaborative closet,
+        like service.collab_items_of.
+        """
+        return self._rows('collab', USER_COLLAB_COLUMNS,
+                          ' WHERE user_id = ?', (int(user_id),))
+
+    def store_inventory(self, store_name):
+        """
+        Returns the inventory of a favorite store, in browse's
+        STORE_COLUMNS, or None if the store is not a favorite.
+        """
+        if store_name not in self.favorites():
+            return None
+        return self._rows('store', browse.STORE_COLUMNS,
+                          ' WHERE store_name = ?', (store_name,))
+
+    def favorites(self):
+        return [row[0] for row in self._conn.execute(
+            'SELECT store_name FROM favorite_store ORDER BY store_name')]
+
+    def synced_to(self):
+        """
+        Returns the change ID the mirror is current as of, or None before
+        its first sync.
+        """
+        return self._state('change_id')
+
+    def pending(self):
+        """
+        Returns the number of writes waiting for the next sync.
+        """
+        return self._conn.execute('SELECT COUNT(*) FROM pending').fetchone()[0]
+
+    # ------------------------------------------------------------------
+    # Writes, queued for the next sync
+    # ------------------------------------------------------------------
+    def borrow(self, clothing_id):
+        """
+        Borrows an item if the mirror has it available and the user is not
+        its owner. Returns whether the borrow was queued.
+        """
+        clothing_id = int(clothing_id)
+        with self._conn:
+            borrowed = self._conn.execute(
+                """UPDATE collab SET is_available = 0, current_borrower = ?
+                WHERE clothing_id = ? AND is_available = 1 AND user_id <> ?""",
+                (self.user_id, clothing_id, self.user_id))
+            if borrowed.rowcount:
+                self._queue('borrow', clothing_id)
+        return borrowed.rowcount > 0
+
+    def return_item(self, clothing_id):
+        """
+        Returns an item the mirror has the user borrowing. Returns whether
+        the return was queued.
+        """
+        clothing_id = int(clothing_id)
+        with self._conn:
+            returned = self._conn.execute(
+                """UPDATE collab SET is_available = 1, current_borrower = NULL
+                WHERE clothing_id = ? AND current_borrower = ?""",
+                (clothing_id, self.user_id))
+            if returned.rowcount:
+                self._queue('return', clothing_id)
+        return returned.rowcount > 0
+
+    def log_wears(self, clothing_ids, worn_on=None):
+        """
+        Logs that the user wore pieces of their personal closet on a day
+        (today by default). Returns the clothing IDs logged; IDs that are
+        not in the mirrored closet are skipped.
+        """
+        clothing_ids = list(dict.fromkeys(int(i) for i in clothing_ids))
+        if not clothing_ids:
+            raise ValueError('Give the clothing IDs of the pieces worn.')
+        worn_on = wears._day(worn_on)
+        logged = []
+        with self._conn:
+            for clothing_id in clothing_ids:
+                worn = self._conn.execute(
+                    """UPDATE personal
+                    SET num_wears = IFNULL(num_wears, 0) + 1, is_clean = 0
+                    WHERE clothing_id = ?""", (clothing_id,))
+                if worn.rowcount:
+                    self._queue('wear', clothing_id, worn_on)
+                    logged.append(clothing_id)
+        return logged
+
+    def _queue(self, operation, clothing_id, worn_on=None):
+        self._conn.execute(
+            """INSERT INTO pending (operation, clothing_id, worn_on)
+            VALUES (?, ?, ?)""", (operation, clothing_id, worn_on))
+
+    def _queued(self):
+        """
+        Returns the queued writes in runs of the same operation (and day),
+        in the order they were made, as (operation, worn_on, [(op_id,
+        clothing_id)]).
+        """
+        rows = self._conn.execute(
+            """SELECT op_id, operation, clothing_id, worn_on FROM pending
+            ORDER BY op_id""").fetchall()
+        return [(operation, worn_on, [(row[0], row[2]) for row in run])
+                for (operation, worn_on), run in itertools.groupby(
+                    rows, lambda row: (row[1], row[3]))]
+
+    def _dequeue(self, op_ids):
+        with self._conn:
+            for chunk in _chunks(op_ids):
+                self._conn.execute(
+                    'DELETE FROM pending WHERE op_id' +
+                    _in(chunk, '?'), chunk)
+
+    # ------------------------------------------------------------------
+    # Mirrored rows, as fetched from the server
+    # ------------------------------------------------------------------
+    def _present(self, table, clothing_ids):
+        present = set()
+        for chunk in _chunks(clothing_ids):
+            present.update(row[0] for row in self._conn.execute(
+                'SELECT clothing_id FROM ' + table + ' WHERE clothing_id' +
+                _in(chunk, '?'), chunk))
+        return present
+
+    def _insert(self, table, rows, version):
+        columns = COLUMNS[table] + ['version']
+        self._conn.executemany(
+            'INSERT OR REPLACE INTO ' + table + ' (' + ', '.join(columns) +
+            ') VALUES (' + ', '.join(['?'] * len(columns)) + ')',
+            [tuple(_local(value) for value in row) + (version,)
+             for row in rows])
+
+    def _refresh(self, fetched, feed, touched=None):
+        """
+        Replaces the mirrored rows of the clothing IDs in touched ({table:
+        set of clothing IDs}; every row, if None) with the rows fetched
+        from the server ({table: rows}), as of the feed's last change, and
+        remembers where the feed got to.
+        """
+        with self._conn:
+            for table in TABLES:
+                if touched is None:
+                    self._conn.execute('DELETE FROM ' + table)
+                else:
+                    for chunk in _chunks(touched[table]):
+                        self._conn.execute(
+                            'DELETE FROM ' + table + ' WHERE clothing_id' +
+                            _in(chunk, '?'), chunk)
+                self._insert(table, fetched[table], feed.after)
+            self._set_state('change_id', feed.after)
+            self._set_state('gaps', feed.gaps)
+
+    def _add_favorite(self, store_name, rows):
+        with self._conn:
+            self._conn.execute(
+                'INSERT OR IGNORE INTO favorite_store (store_name) ' +
+                'VALUES (?)', (store_name,))
+            # the rows are at least as new as the rest of the mirror; the
+            # next sync fetches any changed since again
+            self._insert('store', rows, self.synced_to() or 0)
+
+    def remove_favorite(self, store_name):
+        """
+        Stops keeping a store's inventory in the mirror.
+        """
+        with self._conn:
+            self._conn.execute(
+                'DELETE FROM favorite_store WHERE store_name = ?',
+                (store_name,))
+            self._conn.execute('DELETE FROM store WHERE store_name = ?',
+                               (store_name,))
+
+
+async def _fetch(db, local, table, clothing_ids):
+    """
+    Returns the rows of a mirrored table with the given clothing IDs, as
+    the server has them now.
+    """
+    rows = []
+    for chunk in _chunks(clothing_ids):
+        # not prepared: the IN list changes length from sync to sync
+        if table == 'personal':
+            rows += await db.fetch_all(
+                STATEMENTS['mirror_personal'] + ' AND clothing_id' +
+                _in(chunk), [local.user_id] + chunk, prepared=False)
+        elif table == 'collab':
+            rows += await db.fetch_all(
+                STATEMENTS['mirror_collab'] + ' WHERE clothing_id' +
+                _in(chunk), chunk, prepared=False)
+        else:
+            for store_name in local.favorites():
+                rows += await db.fetch_all(
+                    STATEMENTS['mirror_store'] + ' AND clothing_id' +
+                    _in(chunk), [store_name] + chunk, prepared=False)
+    return rows
+
+
+async def _copy(db, local):
+    """
+    Copies the closets and favorite stores whole into the mirror.
+    """
+    personal = await db.fetch_all(STATEMENTS['mirror_personal'],
+                                  (local.user_id,))
+    collab = await db.fetch_all(STATEMENTS['mirror_collab'])
+    store = []
+    for store_name in local.favorites():
+        store += await db.fetch_all(STATEMENTS['mirror_store'],
+                                    (store_name,))
+    feed = await changes.feed_at_end(db, CONSUMER)
+    local._refresh({'personal': personal, 'collab': collab, 'store': store},
+                   feed)
+    return len(personal) + len(collab) + len(store)
+
+
+def _touched(local, batch, favorites, touched):
+    """
+    Adds the clothing IDs of the mirrored rows a batch of changes touched
+    to touched ({table: set of clothing IDs}).
+    """
+    clothes = set()
+    for change in batch:
+        if change.table_name == 'personal_closet':
+            if change.user_id == local.user_id:
+                touched['personal'].add(change.clothing_id)
+        elif change.table_name == 'collab_closet':
+            touched['collab'].add(change.clothing_id)
+        elif change.table_name == 'store_closet':
+            if change.store_name in favorites:
+                touched['store'].add(change.clothing_id)
+        elif change.table_name == 'clothes':
+            clothes.add(change.clothing_id)
+    # a piece's own changes only matter where the mirror has it
+    for table in TABLES:
+        touched[table] |= local._present(table, clothes)
+
+
+async def pull(db, local):
+    """
+    Brings the mirror up to date with the server, fetching again only the
+    rows changed since the last sync (or everything, on the first sync or
+    once the changes since were pruned). Returns {'full': whether it
+    copied everything, 'rows': rows fetched}.
+    """
+    after = local.synced_to()
+    # one transaction, so the changes and the rows fetched agree
+    async with db.transaction():
+        if after is None or await changes.pruned_after(db, after):
+            return {'full': True, 'rows': await _copy(db, local)}
+        feed = changes.Feed(CONSUMER, after, local._state('gaps'))
+        favorites = set(local.favorites())
+        touched = {table: set() for table in TABLES}
+        while True:
+            batch = await changes.next_batch(db, feed)
+            if not batch:
+                break
+            _touched(local, batch, favorites, touched)
+        fetched = {table: await _fetch(db, local, table, touched[table])
+                   for table in TABLES}
+    local._refresh(fetched, feed, touched)
+    return {'full': False,
+            'rows': sum(len(rows) for rows in fetched.values())}
+
+
+async def replay(db, local):
+    """
+    Replays the queued writes against the server, a run of the same
+    operation at a time, and returns the Conflicts. Each run leaves the
+    queue once the server has it. Wears are only logged; the scheduled
+    roll-up (see wears.py) adds them up.
+    """
+    conflicts = []
+    for operation, worn_on, run in local._queued():
+        clothing_ids = [clothing_id for _, clothing_id in run]
+        done = []
+        # every queued wear is logged, so a piece worn twice in a day counts
+        # twice on the server as it did in the mirror
+        for chunk in _chunks(clothing_ids if operation == 'wear'
+                             else set(clothing_ids)):
+            if operation == 'borrow':
+                done += await borrowing.borrow_many(db, local.user_id, chunk)
+            elif operation == 'return':
+                for clothing_id in chunk:
+                    returned, _ = await borrowing.return_item(
+                        db, local.user_id, clothing_id)
+                    if returned:
+                        done.append(clothing_id)
+            else:
+                owned = await wears.in_closet(db, local.user_id, chunk)
+                worn_pieces = [i for i in chunk if i in owned]
+                await wears.record(db, [(local.user_id, clothing_id, worn_on)
+                                        for clothing_id in worn_pieces])
+                done += worn_pieces
+        if operation != 'wear':
+            for clothing_id in clothing_ids:
+                cache.invalidate_collab_item(clothing_id)
+        done = set(done)
+        conflicts += [Conflict(operation, clothing_id)
+                      for clothing_id in clothing_ids
+                      if clothing_id not in done]
+        local._dequeue([op_id for op_id, _ in run])
+    return conflicts
+
+
+async def sync(db, local):
+    """
+    Replays the queued writes, then pulls the changes since the last
+    sync. Returns {'conflicts': [Conflict], 'full': ..., 'rows': ...} (see
+    pull).
+    """
+    conflicts = await replay(db, local)
+    result = await pull(db, local)
+    result['conflicts'] = conflicts
+    return result
+
+
+async def add_favorite(db, local, store_name):
+    """
+    Keeps a store's inventory in the mirror from now on, copying it in.
+    Returns the number of items it has.
+    """
+    rows = await db.fetch_all(STATEMENTS['mirror_store'], (store_name,))
+    local._add_favorite(store_name, rows)
+    return len(rows)
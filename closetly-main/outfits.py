@@ -0,0 +1,103 @@
+"""
+Outfit creation for the Closetly app. An outfit is created in one
+transaction: all of its clothing IDs are validated with a single query, the
+outfits table hands out the new outfit ID, and every piece is inserted with
+one batched INSERT.
+
+The database operations are coroutines taking a Db (see db.py).
+"""
+import csv
+
+from statements import STATEMENTS
+
+INSERT_OUTFIT = 'INSERT INTO outfits (outfit_desc, vibe) VALUES (%s, %s)'
+
+INSERT_PIECE = """INSERT INTO styled_outfits (outfit_id, clothing_id,
+    outfit_desc, vibe) VALUES (%s, %s, %s, %s)"""
+
+OUTFIT_COLUMNS = ['outfit_id', 'clothing_id', 'outfit_desc', 'vibe']
+
+
+async def find_missing_clothes(db, clothing_ids):
+    """
+    Returns the clothing IDs (in the given order) that do not exist in the
+    clothes table, using one query for the whole list.
+    """
+    clothing_ids = list(dict.fromkeys(clothing_ids))
+    if not clothing_ids:
+        return []
+    sql = 'SELECT clothing_id FROM clothes WHERE clothing_id IN (' + \
+          ', '.join(['%s'] * len(clothing_ids)) + ')'
+    found = {row[0] for row in await db.fetch_all(sql, clothing_ids)}
+    return [clothing_id for clothing_id in clothing_ids
+            if clothing_id not in found]
+
+
+async def create_outfit(db, clothing_ids, description, vibe):
+    """
+    Creates an outfit out of the given clothing IDs and returns its new
+    outfit ID. Raises ValueError (and creates nothing) if the list is empty
+    or any of the clothing IDs does not exist.
+    """
+    return (await import_outfits(db, [(clothing_ids, description, vibe)]))[0]
+
+
+async def import_outfits(db, outfits):
+    """
+    Creates many outfits at once. outfits is a list of (clothing_ids,
+    description, vibe) tuples. Every clothing ID is validated with a single
+    query, and all outfits are created in one transaction, so either every
+    outfit is created or none are. Returns the new outfit IDs in order.
+    """
+    outfits = [([int(i) for i in dict.fromkeys(clothing_ids)], desc, vibe)
+               for clothing_ids, desc, vibe in outfits]
+    for clothing_ids, _, _ in outfits:
+        if not clothing_ids:
+            raise ValueError('An outfit needs at least one clothing ID.')
+    missing = await find_missing_clothes(db, [clothing_id
+                                              for clothing_ids, _, _ in outfits
+                                              for clothing_id in clothing_ids])
+    if missing:
+        raise ValueError('These clothing IDs do not exist: ' +
+                         ', '.join(map(str, missing)))
+
+    async with db.transaction():
+        outfit_ids = []
+        pieces = []
+        for clothing_ids, description, vibe in outfits:
+            created = await db.execute(INSERT_OUTFIT, (description, vibe),
+                                       prepared=False)
+            outfit_ids.append(created.lastrowid)
+            pieces.extend((created.lastrowid, clothing_id, description, vibe)
+                          for clothing_id in clothing_ids)
+        # executemany of an INSERT is sent as a single multi-row INSERT, so
+        # every piece goes over in one round trip
+        await db.executemany(INSERT_PIECE, pieces)
+    return outfit_ids
+
+
+def read_outfits_csv(path):
+    """
+    Reads outfits to import from a CSV file laid out like styled_outfits.csv
+    (outfit_id, clothing_id, outfit_desc, vibe). The outfit_id column only
+    groups the rows of one outfit together; the imported outfits get new IDs.
+    """
+    outfits = {}
+    with open(path, newline='') as f:
+        reader = csv.reader(f)
+        next(reader, None) # skip the header
+        for row in reader:
+            if not row:
+                continue
+            label, clothing_id, description, vibe = row[:4]
+            if label not in outfits:
+                outfits[label] = ([], description, vibe)
+            outfits[label][0].append(int(clothing_id))
+    return list(outfits.values())
+
+
+async def get_outfit(db, outfit_id):
+    """
+    Returns the pieces of one outfit.
+    """
+    return await db.fetch_all(STATEMENTS['outfit_pieces'], (outfit_id,))
@@ -0,0 +1,334 @@
+"""
+Connection pooling for the Closetly app. Keeps one bounded pool of MySQL
+connections per database role (storeowner, stylist, personal, appadmin) so
+that logging in or switching roles checks out an already-authenticated
+connection instead of dialing and authenticating a brand-new one.
+"""
+import threading
+import time
+from collections import deque
+
+import backends
+
+# Database login for each app role. These must match the accounts created
+# in grant-permissions.sql.
+ROLE_CREDENTIALS = {
+    'appadmin': ('appadmin', 'adminpw'),
+    'storeowner': ('storeowner', 'storeownerpw'),
+    'stylist': ('stylist', 'stylistpw'),
+    'personal': ('personal', 'personalpw'),
+}
+
+# Other names the app uses for the same roles.
+ROLE_ALIASES = {
+    'admin': 'appadmin',
+}
+
+# Role used for users without a recognized role (same as the old
+# change_connection fallback).
+DEFAULT_ROLE = 'personal'
+
+# Maximum number of open connections per role.
+POOL_SIZE = 5
+# Seconds a connection may sit unused before it is closed and replaced.
+IDLE_TIMEOUT = 300
+# Idle connections older than this many seconds are pinged before reuse.
+HEALTH_CHECK_INTERVAL = 30
+# Seconds to wait for a free connection before giving up.
+CHECKOUT_TIMEOUT = 10
+
+
+class PoolTimeout(Exception):
+    """
+    Raised when no connection became free within the checkout timeout.
+    """
+
+
+class PoolClosed(Exception):
+    """
+    Raised when a connection is checked out of a pool that has been closed.
+    """
+
+
+class RolePool:
+    """
+    A bounded pool of connections that all log in as the same database
+    user. Connections are created lazily, up to max_size.
+    """
+
+    def __init__(self, role, connect, max_size=POOL_SIZE,
+                 idle_timeout=IDLE_TIMEOUT,
+                 health_check_interval=HEALTH_CHECK_INTERVAL):
+        self.role = role
+        # connect() returns a new connection for this role
+        self._connect = connect
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.health_check_interval = health_check_interval
+        # (connection, time it was checked in), most recently used last
+        self._idle = deque()
+        # number of open connections, idle or checked out
+        self._size = 0
+        self._cond = threading.Condition()
+        # set by close(); no connections are handed out or kept after that
+        self._closed = False
+        # metrics
+        self.hits = 0
+        self.misses = 0
+        self.timeouts = 0
+        self.recycled = 0
+        self.failed_checks = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def checkout(self, timeout=CHECKOUT_TIMEOUT):
+        """
+        Returns a healthy connection from the pool, opening a new one if
+        none are idle and the pool is not full. Waits up to timeout seconds
+        for a connection to be checked back in, then raises PoolTimeout.
+        Raises PoolClosed once the pool has been closed.
+        """
+        start = time.monotonic()
+        deadline = start + timeout
+        while True:
+            with self._cond:
+                conn, last_used = self._take_idle(deadline, timeout)
+            if conn is None:
+                break
+            # the health check and the close are round trips to the server,
+            # so they run without the lock, which other checkouts need
+            idle_for = time.monotonic() - last_used
+            if idle_for > self.idle_timeout:
+                with self._cond:
+                    self.recycled += 1
+            elif idle_for > self.health_check_interval and \
+                    not _is_healthy(conn):
+                with self._cond:
+                    self.failed_checks += 1
+            else:
+                with self._cond:
+                    self.hits += 1
+                    self._record_wait(start)
+                return conn
+            self._discard(conn)
+        try:
+            conn = self._connect()
+        except BaseException:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            closed = self._closed
+        if closed:
+            # the pool was closed while this connection was being opened
+            self._discard(conn)
+            raise PoolClosed('The ' + self.role + ' pool is closed')
+        with self._cond:
+            self.misses += 1
+            self._record_wait(start)
+        return conn
+
+    def checkin(self, conn):
+        """
+        Returns a connection to the pool. Any uncommitted work is rolled
+        back so the next user gets a clean connection, just as if it had
+        been closed. Once the pool is closed the connection is closed instead.
+        """
+        with self._cond:
+            closed = self._closed
+        if closed:
+            self._discard(conn)
+            return
+        try:
+            conn.rollback()
+        except backends.error_class(conn):
+            self._discard(conn)
+            return
+        with self._cond:
+            if not self._closed:
+                self._idle.append((conn, time.monotonic()))
+                self._cond.notify()
+                return
+        self._discard(conn)
+
+    def close(self):
+        """
+        Closes every idle connection. Checked-out connections are closed
+        when they are next checked in, and later checkouts (including any
+        still waiting) raise PoolClosed.
+        """
+        with self._cond:
+            self._closed = True
+            idle = [conn for conn, _ in self._idle]
+            self._idle.clear()
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for conn in idle:
+            _close_quietly(conn)
+
+    def stats(self):
+        """
+        Returns a dictionary of the pool's usage metrics.
+        """
+        with self._cond:
+            checkouts = self.hits + self.misses
+            return {
+                'role': self.role,
+                'size': self._size,
+                'idle': len(self._idle),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / checkouts if checkouts else 0.0,
+                'timeouts': self.timeouts,
+                'recycled': self.recycled,
+                'failed_checks': self.failed_checks,
+                'avg_wait_ms': 1000 * self.total_wait / checkouts
+                               if checkouts else 0.0,
+                'max_wait_ms': 1000 * self.max_wait,
+            }
+
+    def _take_idle(self, deadline, timeout):
+        """
+        Waits until a connection is idle or the pool has room for another.
+        Returns the most recently used idle connection and when it was
+        checked in, or (None, None) after reserving a slot for a new
+        connection, which is opened outside the lock. Must be called with
+        the lock held.
+        """
+        while True:
+            if self._closed:
+                raise PoolClosed('The ' + self.role + ' pool is closed')
+            if self._idle:
+                return self._idle.pop()
+            if self._size < self.max_size:
+                self._size += 1
+                return None, None
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self.timeouts += 1
+                raise PoolTimeout('No ' + self.role + ' connection ' +
+                                  'available after ' + str(timeout) + 's')
+            self._cond.wait(remaining)
+
+    def _discard(self, conn):
+        """
+        Closes a broken, stale or unwanted connection (outside the lock)
+        and frees its slot in the pool.
+        """
+        _close_quietly(conn)
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+
+    def _record_wait(self, start):
+        waited = time.monotonic() - start
+        self.total_wait += waited
+        self.max_wait = max(self.max_wait, waited)
+
+
+class PoolManager:
+    """
+    Holds one RolePool per database role and remembers which pool each
+    checked-out connection came from.
+    """
+
+    def __init__(self, connect, max_size=POOL_SIZE):
+        # connect(user, password) returns a new connection
+        self._connect = connect
+        self._max_size = max_size
+        self._pools = {}
+        # id(connection) -> pool it was checked out from
+        self._owners = {}
+        self._lock = threading.Lock()
+
+    def pool(self, role):
+        """
+        Returns the pool for the given role, creating it on first use.
+        """
+        role = normalize_role(role)
+        with self._lock:
+            if role not in self._pools:
+                user, password = ROLE_CREDENTIALS[role]
+                self._pools[role] = RolePool(
+                    role, lambda: self._connect(user, password),
+                    max_size=self._max_size)
+            return self._pools[role]
+
+    def checkout(self, role, timeout=CHECKOUT_TIMEOUT):
+        """
+        Checks out a connection logged in with the given role's privileges.
+        """
+        pool = self.pool(role)
+        conn = pool.checkout(timeout)
+        with self._lock:
+            self._owners[id(conn)] = pool
+        return conn
+
+    def checkin(self, conn):
+        """
+        Returns a connection to the pool it was checked out from. Connections
+        that did not come from this manager are simply closed.
+        """
+        with self._lock:
+            pool = self._owners.pop(id(conn), None)
+        if pool is None:
+            _close_quietly(conn)
+        else:
+            pool.checkin(conn)
+
+    def switch(self, conn, role, timeout=CHECKOUT_TIMEOUT):
+        """
+        Checks in conn and checks out a connection for the given role.
+        """
+        if conn is not None:
+            self.checkin(conn)
+        return self.checkout(role, timeout)
+
+    def close_all(self):
+        """
+        Closes every pool. Connections still checked out are closed when
+        they are checked in.
+        """
+        with self._lock:
+            pools = list(self._pools.values())
+        for pool in pools:
+            pool.close()
+
+    def stats(self):
+        """
+        Returns the usage metrics of every pool, keyed by role.
+        """
+        with self._lock:
+            pools = list(self._pools.values())
+        return {pool.role: pool.stats() for pool in pools}
+
+
+def normalize_role(role):
+    """
+    Maps an app role (as stored in the permissions table) to the database
+    role whose pool should be used.
+    """
+    role = ROLE_ALIASES.get(role, role)
+    if role not in ROLE_CREDENTIALS:
+        return DEFAULT_ROLE
+    return role
+
+
+def _is_healthy(conn):
+    """
+    Pings the server to check that a connection is still alive.
+    """
+    try:
+        conn.ping(reconnect=False)
+        return True
+    except (backends.error_class(conn), AttributeError):
+        return False
+
+
+def _close_quietly(conn):
+    try:
+        conn.close()
+    except backends.error_class(conn):
+        pass
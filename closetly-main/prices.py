@@ -0,0 +1,158 @@
+"""
+Price comparison across every store. Different stores sell the same item
+at different prices, and pieces of the same clothing type, brand, size and
+color (a product) are interchangeable to a shopper, so the best_price
+table keeps the cheapest listing of each product in any store. The
+triggers in setup-routines.sql (setup-sqlite.sql on SQLite) keep it
+current as items are listed, repriced and sold: a cheaper listing takes
+the product's place with one upsert, and only selling, removing or raising
+the price of the cheapest listing itself looks the product's listings up
+again. Comparing the prices of a piece or of a whole outfit is then one
+query of primary key lookups, however many stores there are.
+
+Changes to the type, brand, size or color of listed clothes get past the
+triggers. check reports every product whose best price is wrong and
+rebuild recomputes them all:
+
+    $ python3 prices.py --check
+    $ python3 prices.py --rebuild --db sqlite:/tmp/closetly.db
+
+The operations are coroutines taking a Db (see db.py); from blocking code
+use db.call(conn, prices.compare_outfit, ...).
+"""
+import time
+
+import summaries
+from statements import BEST_PRICE_COLUMNS, BEST_PRICE_JOIN, STATEMENTS
+
+# The cheapest listing of every product, computed from the stores
+BEST_PRICES = """SELECT clothing_type, brand, size, color, price,
+    store_name, clothing_id
+FROM (SELECT c.clothing_type, IFNULL(c.brand, '') AS brand, c.size,
+          IFNULL(c.color, '') AS color, s.price, s.store_name,
+          s.clothing_id,
+          ROW_NUMBER() OVER (
+              PARTITION BY c.clothing_type, IFNULL(c.brand, ''), c.size,
+                  IFNULL(c.color, '')
+              ORDER BY s.price, s.store_name, s.clothing_id) AS n
+      FROM store_closet AS s JOIN clothes AS c
+          ON c.clothing_id = s.clothing_id) AS ranked
+WHERE n = 1"""
+
+PRICE_COLUMNS = ['clothing_id', 'clothing_type', 'brand', 'size', 'color',
+                 'item_price', 'best_price', 'best_store',
+                 'best_clothing_id']
+
+# Most pieces compared at once
+MAX_PIECES = 100
+
+
+def _money(value):
+    return None if value is None else round(float(value), 2)
+
+
+def _piece(row):
+    piece = dict(zip(PRICE_COLUMNS, row))
+    piece['item_price'] = _money(piece['item_price'])
+    piece['best_price'] = _money(piece['best_price'])
+    return piece
+
+
+def _total(pieces):
+    """
+    Returns the pieces with their best prices, what they cost together at
+    those prices, and the pieces no store sells.
+    """
+    return {
+        'pieces': pieces,
+        'total': round(sum((piece['best_price'] for piece in pieces
+                            if piece['best_price'] is not None), 0.0), 2),
+        'not_for_sale': [piece['clothing_id'] for piece in pieces
+                         if piece['best_price'] is None],
+    }
+
+
+async def compare_item(db, clothing_id):
+    """
+    Returns the lowest price of a piece in any store (item_price, None if
+    no store sells it) and the best price of its product: the cheapest
+    listing of any piece of the same type, brand, size and color. Returns
+    None if there is no such piece.
+    """
+    row = await db.fetch_one(STATEMENTS['item_best_price'], (clothing_id,))
+    return _piece(row) if row else None
+
+
+async def compare_pieces(db, clothing_ids):
+    """
+    Compares the prices of several pieces (see compare_item) in one query.
+    Returns them (in the given order, without pieces that do not exist)
+    with their total at the best prices.
+    """
+    clothing_ids = list(dict.fromkeys(int(i) for i in clothing_ids))
+    if not clothing_ids:
+        raise ValueError('Give the clothing IDs of the pieces to compare.')
+    if len(clothing_ids) > MAX_PIECES:
+        raise ValueError('At most ' + str(MAX_PIECES) + ' pieces can be ' +
+                         'compared at once.')
+    sql = 'SELECT ' + BEST_PRICE_COLUMNS + ' FROM clothes AS c ' + \
+          BEST_PRICE_JOIN + ' WHERE c.clothing_id IN (' + \
+          ', '.join(['%s'] * len(clothing_ids)) + ')'
+    found = {row[0]: _piece(row)
+             for row in await db.fetch_all(sql, clothing_ids,
+                                           prepared=False)}
+    return _total([found[clothing_id] for clothing_id in clothing_ids
+                   if clothing_id in found])
+
+
+async def compare_outfit(db, outfit_id):
+    """
+    Compares the prices of every piece of an outfit (see compare_item) in
+    one query. Returns None if the outfit has no pieces.
+    """
+    rows = await db.fetch_all(STATEMENTS['outfit_best_prices'], (outfit_id,))
+    if not rows:
+        return None
+    result = {'outfit_id': outfit_id}
+    result.update(_total([_piece(row) for row in rows]))
+    return result
+
+
+async def rebuild(db):
+    """
+    Recomputes the best price of every product, in one transaction.
+    Returns the seconds it took.
+    """
+    start = time.perf_counter()
+    async with db.transaction():
+        await db.execute('DELETE FROM best_price', prepared=False)
+        await db.execute('INSERT INTO best_price ' + BEST_PRICES,
+                         prepared=False)
+    return time.perf_counter() - start
+
+
+async def check(db):
+    """
+    Compares best_price with the stores and returns the key (type, brand,
+    size, color) of every product whose best price differs. A tie may be
+    kept by a different listing, so only the prices are compared.
+    """
+    computed = {row[:4]: float(row[4])
+                for row in await db.fetch_all(BEST_PRICES, prepared=False)}
+    stored = {row[:4]: float(row[4])
+              for row in await db.fetch_all(
+                  'SELECT clothing_type, brand, size, color, price ' +
+                  'FROM best_price', prepared=False)}
+    return [key for key in sorted(set(computed) | set(stored), key=str)
+            if key not in computed or key not in stored
+            or abs(computed[key] - stored[key]) > 0.005]
+
+
+def main():
+    summaries.run_command(
+        'best prices', 'best price', 'stores', rebuild, check,
+        lambda key: 'best price of ' + ', '.join(map(str, key)))
+
+
+if __name__ == '__main__':
+    main()
@@ -47,6 +47,9 @@ WHERE clothing_id IN (
 
 -- Insert a new outfit into styled_outfits. (Equivalent to RA 
 -- expression #5)
+INSERT INTO outfits VALUES
+  (7, "All Lululemon women's athletic outfit for colder weather", 
+   "sporty");
 INSERT INTO styled_outfits VALUES
   (7, 4, "All Lululemon women's athletic outfit for colder weather", 
    "sporty"),
@@ -0,0 +1,425 @@
+"""
+Query instrumentation. Every statement the app and the API run through
+db.py or statements.py is timed and counted here, grouped by the
+operation it ran for (an app menu function such as show_personal_clothes,
+or an API endpoint) and by the statement itself. For each pair this keeps
+a latency histogram, the rows returned and an estimate of the bytes
+fetched. Statements slower than a threshold can also have their EXPLAIN
+plan captured the first time (and whenever they get slower).
+
+    @querystats.measured              # statements in here count for it
+    def show_personal_clothes(username):
+        ...
+
+    with querystats.operation('GET /closet'):
+        ...
+
+report() returns everything as plain data, print_report() shows it as a
+table, and start_dumps() writes it to a JSON file every few seconds.
+"""
+import contextvars
+import functools
+import os
+import re
+import sys
+import threading
+import time
+
+# Upper bounds (in ms) of the latency histogram buckets; the last bucket
+# is open
+BUCKETS_MS = [0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000,
+              2500]
+# Statements slower than this (in ms) have their plan captured; None
+# turns capturing off. Also set by set_explain_threshold() or the
+# CLOSETLY_EXPLAIN_MS environment variable.
+EXPLAIN_THRESHOLD_MS = None
+# Seconds between dumps started by start_dumps()
+DUMP_INTERVAL = 60
+# Longest statement text shown in reports
+LABEL_LENGTH = 60
+
+# Operation statements are counted for when no operation is running
+NO_OPERATION = 'other'
+
+_operation = contextvars.ContextVar('operation', default=None)
+
+# "IN (%s, %s, %s)" of any length counts as one statement
+_PLACEHOLDER_LIST = re.compile(r'%s(?:\s*,\s*%s)+')
+# SQL text -> statement key, for the most recent distinct statements
+_keys = {}
+MAX_KEYS = 4096
+
+
+class _Histogram:
+    """
+    Latencies, rows and bytes of one statement run for one operation.
+    """
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS_MS) + 1)
+        self.n = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.rows = 0
+        self.bytes = 0
+        self.errors = 0
+
+    def add(self, seconds, rows, nbytes):
+        ms = seconds * 1000
+        i = 0
+        while i < len(BUCKETS_MS) and ms > BUCKETS_MS[i]:
+            i += 1
+        self.counts[i] += 1
+        self.n += 1
+        self.seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+        self.rows += rows
+        self.bytes += nbytes
+
+    def percentile_ms(self, p):
+        """
+        Returns the upper bound of the bucket holding the p-th percentile
+        (the longest latency seen, for the open last bucket).
+        """
+        if self.n == 0:
+            return 0.0
+        rank = p / 100 * self.n
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                if i < len(BUCKETS_MS):
+                    return min(BUCKETS_MS[i], self.max_seconds * 1000)
+                break
+        return self.max_seconds * 1000
+
+
+class QueryStats:
+    """
+    Thread-safe statistics of every statement, by (operation, statement),
+    and the captured plans of slow statements.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+        # statement -> (ms when captured, plan rows)
+        self._plans = {}
+        self.started = time.time()
+        self.explain_threshold_ms = EXPLAIN_THRESHOLD_MS
+        if os.environ.get('CLOSETLY_EXPLAIN_MS'):
+            self.explain_threshold_ms = float(
+                os.environ['CLOSETLY_EXPLAIN_MS'])
+
+    def record(self, statement, seconds, rows=0, nbytes=0, error=False):
+        """
+        Adds one run of a statement to the running operation's stats.
+        Returns whether its plan should be captured (see add_plan).
+        """
+        key = (_operation.get() or NO_OPERATION, statement)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = _Histogram()
+            if error:
+                histogram.errors += 1
+                return False
+            histogram.add(seconds, rows, nbytes)
+            if self.explain_threshold_ms is None or \
+                    seconds * 1000 < self.explain_threshold_ms:
+                return False
+            plan = self._plans.get(statement)
+            return plan is None or seconds * 1000 > plan[0]
+
+    def add_plan(self, statement, seconds, plan):
+        with self._lock:
+            self._plans[statement] = (seconds * 1000,
+                                      [list(row) for row in plan])
+
+    def reset(self):
+        with self._lock:
+            self._histograms = {}
+            self._plans = {}
+            self.started = time.time()
+
+    def report(self):
+        """
+        Returns {'since': start time, 'operations': [...], 'plans': [...]}
+        as plain data. Operations are sorted by the total time spent in
+        their statements, and so are the statements of each operation.
+        """
+        with self._lock:
+            items = [(key, _summary(histogram))
+                     for key, histogram in self._histograms.items()]
+            plans = [{'statement': label(statement), 'sql': statement,
+                      'ms': round(ms, 2), 'plan': plan}
+                     for statement, (ms, plan) in self._plans.items()]
+        operations = {}
+        for (operation, statement), summary in items:
+            summary['statement'] = label(statement)
+            summary['sql'] = statement
+            found = operations.setdefault(operation, {
+                'operation': operation, 'n': 0, 'total_ms': 0.0, 'rows': 0,
+                'bytes': 0, 'statements': []})
+            found['n'] += summary['n']
+            found['total_ms'] += summary['total_ms']
+            found['rows'] += summary['rows']
+            found['bytes'] += summary['bytes']
+            found['statements'].append(summary)
+        for found in operations.values():
+            found['total_ms'] = round(found['total_ms'], 2)
+            found['statements'].sort(key=lambda s: -s['total_ms'])
+        return {'since': self.started,
+                'operations': sorted(operations.values(),
+                                     key=lambda o: -o['total_ms']),
+                'plans': sorted(plans, key=lambda p: -p['ms'])}
+
+
+def _summary(histogram):
+    n = histogram.n
+    return {'n': n, 'errors': histogram.errors,
+            'total_ms': round(histogram.seconds * 1000, 2),
+            'mean_ms': round(histogram.seconds * 1000 / n, 3) if n else 0.0,
+            'p50_ms': round(histogram.percentile_ms(50), 3),
+            'p95_ms': round(histogram.percentile_ms(95), 3),
+            'p99_ms': round(histogram.percentile_ms(99), 3),
+            'max_ms': round(histogram.max_seconds * 1000, 3),
+            'rows': histogram.rows, 'bytes': histogram.bytes,
+            'histogram': list(histogram.counts)}
+
+
+# The statistics of this process
+stats = QueryStats()
+
+
+def statement_key(sql):
+    """
+    Returns the text a statement is counted under: its SQL with whitespace
+    collapsed and IN lists of any length folded into one.
+    """
+    key = _keys.get(sql)
+    if key is None:
+        key = _PLACEHOLDER_LIST.sub('%s, ...', ' '.join(sql.split()))
+        if len(_keys) >= MAX_KEYS:
+            _keys.clear()
+        _keys[sql] = key
+    return key
+
+
+def label(statement):
+    """
+    Returns the name of a statement from statements.STATEMENTS, or the
+    start of its SQL.
+    """
+    # imported here since statements.py imports this module
+    from statements import statement_name
+    name = statement_name(statement)
+    if name:
+        return name
+    if len(statement) > LABEL_LENGTH:
+        return statement[:LABEL_LENGTH - 3] + '...'
+    return statement
+
+
+def row_bytes(rows):
+    """
+    Estimates the bytes fetched for some rows from the first, middle and
+    last row: the length of each string or bytes value, and 8 for any
+    other value. Measuring every row would cost more than some queries.
+    """
+    if not rows:
+        return 0
+    sample = {0, len(rows) // 2, len(rows) - 1}
+    total = 0
+    for i in sample:
+        for value in rows[i]:
+            if isinstance(value, (str, bytes, bytearray)):
+                total += len(value)
+            elif value is not None:
+                total += 8
+    return total * len(rows) // len(sample)
+
+
+def explain_sql(sql, on_standin):
+    """
+    Returns the statement that explains a statement, or None for
+    statements that cannot be explained (procedure calls).
+    """
+    if not sql.lstrip().upper().startswith(('SELECT', 'UPDATE', 'DELETE',
+                                            'INSERT', 'WITH')):
+        return None
+    return ('EXPLAIN QUERY PLAN ' if on_standin else 'EXPLAIN ') + sql
+
+
+def capture_plan(conn, sql, params, seconds):
+    """
+    Captures the plan of a slow statement on a blocking connection. Never
+    raises: a plan that cannot be captured is simply left out.
+    """
+    # imported here since standin.py is only needed to tell the dialect
+    import standin
+    explain = explain_sql(sql, standin.is_standin(conn))
+    if explain is None:
+        return
+    try:
+        cursor = conn.cursor()
+        try:
+            cursor.execute(explain, tuple(params))
+            plan = cursor.fetchall()
+        finally:
+            cursor.close()
+    except Exception:
+        return
+    stats.add_plan(statement_key(sql), seconds, plan)
+
+
+class Timer:
+    """
+    Times one run of a statement, from creation to finish(). Time spent
+    by the caller between fetches of a stream can be left out with
+    pause() and resume().
+    """
+
+    __slots__ = ('sql', 'params', 'rows', 'bytes', 'seconds', '_start')
+
+    def __init__(self, sql, params=()):
+        self.sql = sql
+        self.params = params
+        self.rows = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self._start = time.perf_counter()
+
+    def fetched(self, rows):
+        self.rows += len(rows)
+        self.bytes += row_bytes(rows)
+
+    def pause(self):
+        self.seconds += time.perf_counter() - self._start
+
+    def resume(self):
+        self._start = time.perf_counter()
+
+    def finish(self, conn=None, error=False):
+        """
+        Records the run. With a blocking connection, also captures the plan
+        if the statement was slow. Returns whether a plan is wanted (for
+        callers that capture it themselves, e.g. asynchronously).
+        """
+        self.pause()
+        wanted = stats.record(statement_key(self.sql), self.seconds,
+                              self.rows, self.bytes, error)
+        if wanted and conn is not None:
+            capture_plan(conn, self.sql, self.params, self.seconds)
+        return wanted
+
+
+class operation:
+    """
+    with operation(name): counts the statements run in the block for the
+    named operation. The outermost operation wins, so helpers shared by
+    several operations are counted for whichever called them.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._token = None
+
+    def __enter__(self):
+        if _operation.get() is None:
+            self._token = _operation.set(self.name)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._token is not None:
+            _operation.reset(self._token)
+            self._token = None
+        return False
+
+
+def measured(fn):
+    """
+    Decorator counting the statements a function runs for an operation
+    named after it.
+    """
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        with operation(fn.__name__):
+            return fn(*args, **kwargs)
+    return wrapper
+
+
+def set_explain_threshold(ms):
+    """
+    Captures the plans of statements slower than `ms` from now on, or of
+    none if ms is None.
+    """
+    stats.explain_threshold_ms = ms
+
+
+def dump(path):
+    """
+    Writes the report to a JSON file, replacing it atomically.
+    """
+    # only needed once something dumps, so the app starts without it
+    import json
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(dict(stats.report(), dumped=time.time()), f, indent=1,
+                  default=str)
+    os.replace(tmp, path)
+
+
+def start_dumps(path, interval=DUMP_INTERVAL):
+    """
+    Dumps the report to a JSON file every `interval` seconds from a daemon
+    thread, until the process exits. Returns the thread.
+    """
+    def run():
+        while True:
+            time.sleep(interval)
+            try:
+                dump(path)
+            except OSError as err:
+                print('Could not dump query stats: ' + str(err),
+                      file=sys.stderr)
+    thread = threading.Thread(target=run, name='querystats-dump',
+                              daemon=True)
+    thread.start()
+    return thread
+
+
+def print_report(report=None, limit=None):
+    """
+    Prints the report as a table: each operation with its total time in the
+    database, then its statements slowest first, then the captured plans.
+    """
+    report = report or stats.report()
+    print('Query statistics since ' +
+          time.strftime('%Y-%m-%d %H:%M:%S',
+                        time.localtime(report['since'])) + ':')
+    if not report['operations']:
+        print('  no statements have run yet.')
+    header = 'statement'.ljust(40) + 'n'.rjust(7) + 'p50 ms'.rjust(9) + \
+        'p95 ms'.rjust(9) + 'p99 ms'.rjust(9) + 'max ms'.rjust(9) + \
+        'rows/run'.rjust(10) + 'KB'.rjust(9)
+    for found in report['operations'][:limit]:
+        print('\n' + found['operation'] + ': ' + str(found['n']) +
+              ' statements, ' + str(found['total_ms']) + ' ms in total')
+        print('  ' + header)
+        for s in found['statements']:
+            print('  ' + s['statement'][:39].ljust(40) +
+                  str(s['n']).rjust(7) + ('%.2f' % s['p50_ms']).rjust(9) +
+                  ('%.2f' % s['p95_ms']).rjust(9) +
+                  ('%.2f' % s['p99_ms']).rjust(9) +
+                  ('%.2f' % s['max_ms']).rjust(9) +
+                  ('%.1f' % (s['rows'] / s['n'] if s['n'] else 0)).rjust(10) +
+                  ('%.1f' % (s['bytes'] / 1024)).rjust(9) +
+                  (' (' + str(s['errors']) + ' failed)'
+                   if s['errors'] else ''))
+    for plan in report['plans'][:limit]:
+        print('\nPlan of ' + plan['statement'] + ' (' + str(plan['ms']) +
+              ' ms):')
+        print('  ' + plan['sql'])
+        for row in plan['plan']:
+            print('    ' + ' | '.join(str(value) for value in row))
@@ -0,0 +1,540 @@
+"""
+Outfit recommendations. Every piece of clothing is encoded as the IDs of
+its six feature values (type, color, aesthetic, gender, size, brand) in a
+compact NumPy matrix, and the outfits stylists have made are counted into
+a matrix of how often each pair of feature values is worn together, plus
+how often each value appears in outfits of each vibe. Pieces that go with
+a seed item (or a vibe) are scored for every piece at once with a gather
+over the feature matrix, weighted by pointwise mutual information, and the
+best-scoring pieces are then looked up in a user's personal closet, the
+collaborative closet and the stores.
+
+The matrices are memory-mapped .npy files in MODEL_DIR, so loading the
+model reads nothing up front, and refresh() only encodes the clothes and
+learns the outfits added since the last refresh. Features of clothes that
+are edited after being encoded are not updated; rebuild the model
+(python3 recommend.py --rebuild) after editing many clothes.
+
+Usage:
+    $ python3 recommend.py                    # build or refresh the model
+    $ python3 recommend.py --rebuild
+    $ python3 recommend.py --standin /tmp/closetly.db --model /tmp/model
+
+refresh() and recommend() are coroutines taking a Db (see db.py).
+"""
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+# Directory the model files are kept in
+MODEL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         'recommend-model')
+
+# Columns of clothes encoded for each piece, in feature matrix row order.
+# The matrix is stored one feature per row (indexed by clothing_id), so
+# scoring gathers from six contiguous arrays.
+FEATURES = ['clothing_type', 'color', 'aesthetic', 'gender', 'size', 'brand']
+# Row of the clothing type, used to skip pieces of the seeds' types
+TYPE_ROW = 0
+
+# Rows of clothes encoded per query, and outfit IDs learned per query
+BATCH_SIZE = 10000
+OUTFIT_BATCH_SIZE = 2000
+# Starting capacities; each file doubles when it fills up
+INITIAL_ITEMS = 1024
+INITIAL_VALUES = 256
+INITIAL_VIBES = 16
+
+# Best-scoring pieces checked against a closet or the stores per query,
+# and the most checked before giving up on filling a list
+CANDIDATE_BATCH = 500
+MAX_CANDIDATES = 20000
+# Recommendations returned by default
+RECOMMENDATIONS = 10
+# Where recommended pieces can come from
+SCOPES = ['personal', 'collab', 'store']
+
+# Exponent the counts of the values a row is compared with are raised to
+# before computing PMI; below 1 it damps the PMI of rare values
+SMOOTHING = 0.75
+
+# Seconds after which another process's refresh lock is assumed abandoned
+LOCK_TIMEOUT = 600
+
+# Value ID 0 stands for a missing value and is never counted
+_UNKNOWN = '?'
+
+# Pieces of a batch of candidates that are in a scope; collab pieces must
+# be available and not the user's own
+_SCOPE_SQL = {
+    'collab': """SELECT clothing_id FROM collab_closet
+        WHERE is_available = 1 AND user_id <> %s AND clothing_id IN """,
+    'store': 'SELECT DISTINCT clothing_id FROM store_closet ' +
+             'WHERE clothing_id IN ',
+}
+
+RECOMMEND_COLUMNS = ['clothing_id', 'clothing_type', 'size', 'color', 'brand',
+                     'aesthetic', 'description', 'source', 'score']
+
+
+def _key(feature, value):
+    return feature + '=' + str(value).strip().lower()
+
+
+class Model:
+    """
+    The feature matrix, co-occurrence counts and vibe counts in one
+    directory, with the vocabulary of feature values and how far the
+    clothes and outfits have been read in meta.json.
+    """
+
+    def __init__(self, path=MODEL_DIR):
+        self.path = path
+        self.meta = None
+        self._arrays = {}
+        self._meta_mtime = None
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def _load(self):
+        """
+        Loads meta.json (again if another process has changed it) and
+        forgets memory maps whose capacity has changed.
+        """
+        meta_file = self._file('meta.json')
+        if not os.path.exists(meta_file):
+            if self.meta is None:
+                self.meta = {'values': [_UNKNOWN], 'vibes': [],
+                             'clothes_through': 0, 'outfits_through': 0,
+                             'capacity': {'codes': INITIAL_ITEMS,
+                                          'pairs': INITIAL_VALUES,
+                                          'vibes': INITIAL_VIBES}}
+            return
+        mtime = os.path.getmtime(meta_file)
+        if mtime == self._meta_mtime:
+            return
+        with open(meta_file) as f:
+            self.meta = json.load(f)
+        self._meta_mtime = mtime
+        self._arrays = {}
+
+    def _save(self):
+        for array in self._arrays.values():
+            array.flush()
+        tmp = self._file('meta.json.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(self.meta, f)
+        os.replace(tmp, self._file('meta.json'))
+        self._meta_mtime = os.path.getmtime(self._file('meta.json'))
+
+    def _shape(self, name):
+        capacity = self.meta['capacity']
+        if name == 'codes':
+            return (len(FEATURES), capacity['codes'])
+        if name == 'pairs':
+            return (capacity['pairs'], capacity['pairs'])
+        return (capacity['vibes'], capacity['pairs'])
+
+    def _array(self, name):
+        """
+        Returns the memory map of one of the model files, creating it
+        (all zeros) if it does not exist yet.
+        """
+        if name not in self._arrays:
+            path = self._file(name + '.npy')
+            shape = self._shape(name)
+            if os.path.exists(path):
+                array = np.load(path, mmap_mode='r+')
+            else:
+                os.makedirs(self.path, exist_ok=True)
+                dtype = np.int32 if name == 'codes' else np.float32
+                array = np.lib.format.open_memmap(path, mode='w+',
+                                                  dtype=dtype, shape=shape)
+            self._arrays[name] = array
+        return self._arrays[name]
+
+    def _reserve(self, names, axis, needed):
+        """
+        Doubles a capacity until `needed` fits, copying each of the named
+        files that depend on it into a larger one.
+        """
+        capacity = self.meta['capacity']
+        if capacity[axis] >= needed:
+            return
+        # opened (or created) at the old capacity before it changes
+        olds = [(name, self._array(name)) for name in names]
+        while capacity[axis] < needed:
+            capacity[axis] *= 2
+        for name, old in olds:
+            rows, columns = old.shape
+            grown = np.lib.format.open_memmap(self._file(name + '.tmp.npy'),
+                                              mode='w+', dtype=old.dtype,
+                                              shape=self._shape(name))
+            grown[:rows, :columns] = old
+            grown.flush()
+            del self._arrays[name]
+        # the old maps are closed before their files are replaced
+        del olds, old, grown
+        for name in names:
+            os.replace(self._file(name + '.tmp.npy'),
+                       self._file(name + '.npy'))
+
+    def _value_id(self, feature, value, index):
+        if value is None or str(value).strip() == '':
+            return 0
+        key = _key(feature, value)
+        value_id = index.get(key)
+        if value_id is None:
+            value_id = len(self.meta['values'])
+            self.meta['values'].append(key)
+            index[key] = value_id
+        return value_id
+
+    # ------------------------------------------------------------------
+    # Building
+    # ------------------------------------------------------------------
+    async def refresh(self, db):
+        """
+        Encodes the clothes and learns the outfits added since the last
+        refresh. Returns (clothes encoded, outfits learned), or None if
+        another refresh holds the lock, in which case recommendations use
+        the model as it is.
+        """
+        os.makedirs(self.path, exist_ok=True)
+        lock = self._file('refresh.lock')
+        try:
+            if time.time() - os.path.getmtime(lock) > LOCK_TIMEOUT:
+                os.remove(lock)
+        except OSError:
+            pass
+        try:
+            fd = os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return None
+        try:
+            os.close(fd)
+            self._load()
+            encoded = await self._encode_clothes(db)
+            learned = await self._learn_outfits(db)
+            return encoded, learned
+        finally:
+            os.remove(lock)
+
+    async def _encode_clothes(self, db):
+        index = {key: i for i, key in enumerate(self.meta['values'])}
+        encoded = 0
+        while True:
+            rows = await db.fetch_all(
+                'SELECT clothing_id, ' + ', '.join(FEATURES) +
+                """ FROM clothes WHERE clothing_id > %s
+                ORDER BY clothing_id LIMIT %s""",
+                (self.meta['clothes_through'], BATCH_SIZE))
+            if not rows:
+                return encoded
+            ids = np.array([row[0] for row in rows], dtype=np.int64)
+            codes = np.array([[self._value_id(feature, value, index)
+                               for feature, value in zip(FEATURES, row[1:])]
+                              for row in rows], dtype=np.int32)
+            self._reserve(['codes'], 'codes', int(ids[-1]) + 1)
+            # the pair and vibe matrices have a column per feature value
+            self._reserve(['pairs', 'vibes'], 'pairs',
+                          len(self.meta['values']))
+            self._array('codes')[:, ids] = codes.T
+            self.meta['clothes_through'] = int(ids[-1])
+            encoded += len(rows)
+            self._save()
+
+    async def _learn_outfits(self, db):
+        last = await db.fetch_value(
+            'SELECT MAX(outfit_id) FROM styled_outfits')
+        learned = 0
+        while last is not None and self.meta['outfits_through'] < last:
+            start = self.meta['outfits_through']
+            end = start + OUTFIT_BATCH_SIZE
+            rows = await db.fetch_all("""SELECT outfit_id, clothing_id, vibe
+                FROM styled_outfits WHERE outfit_id > %s AND outfit_id <= %s
+                ORDER BY outfit_id""", (start, end))
+            learned += self._count(rows)
+            self.meta['outfits_through'] = min(end, last)
+            self._save()
+        return learned
+
+    def _count(self, rows):
+        """
+        Adds the pieces of whole outfits (rows of outfit_id, clothing_id,
+        vibe) to the pair and vibe counts. Returns the number of outfits.
+        """
+        outfits = {}
+        for outfit_id, clothing_id, vibe in rows:
+            outfits.setdefault(outfit_id, ([], vibe))[0].append(clothing_id)
+        codes = self._array('codes')
+        through = self.meta['clothes_through']
+        vibe_index = {vibe: i for i, vibe in enumerate(self.meta['vibes'])}
+        lefts, rights, vibe_rows, vibe_values = [], [], [], []
+        for clothing_ids, vibe in outfits.values():
+            # pieces added after the clothes were encoded are left out
+            ids = np.array([i for i in clothing_ids if 0 < i <= through],
+                           dtype=np.int64)
+            if len(ids) == 0:
+                continue
+            features = codes[:, ids].T
+            if len(ids) > 1:
+                # every feature of every piece with every feature of every
+                # other piece of the outfit
+                a, b = np.nonzero(~np.eye(len(ids), dtype=bool))
+                left = np.repeat(features[a], len(FEATURES), axis=1)
+                right = np.tile(features[b], (1, len(FEATURES)))
+                lefts.append(left.ravel())
+                rights.append(right.ravel())
+            if vibe and str(vibe).strip():
+                vibe = str(vibe).strip().lower()
+                if vibe not in vibe_index:
+                    vibe_index[vibe] = len(self.meta['vibes'])
+                    self.meta['vibes'].append(vibe)
+                vibe_values.append(features.ravel())
+                vibe_rows.append(np.full(features.size, vibe_index[vibe]))
+        if lefts:
+            left = np.concatenate(lefts)
+            right = np.concatenate(rights)
+            known = (left > 0) & (right > 0)
+            np.add.at(self._array('pairs'), (left[known], right[known]), 1)
+        if vibe_rows:
+            self._reserve(['vibes'], 'vibes', len(self.meta['vibes']))
+            values = np.concatenate(vibe_values)
+            vibe_ids = np.concatenate(vibe_rows)
+            known = values > 0
+            np.add.at(self._array('vibes'), (vibe_ids[known], values[known]),
+                      1)
+        return len(outfits)
+
+    # ------------------------------------------------------------------
+    # Scoring
+    # ------------------------------------------------------------------
+    def value_weights(self, seed_ids=(), vibe=None):
+        """
+        Returns how well each feature value goes with the seed pieces and/or
+        the vibe: the sum of the positive pointwise mutual information of
+        the value with each feature value of the seeds (and with the vibe).
+        """
+        self._load()
+        n_values = len(self.meta['values'])
+        weights = np.zeros(n_values, dtype=np.float32)
+        codes = self._array('codes')
+        seed_ids = [i for i in seed_ids
+                    if 0 < i <= self.meta['clothes_through']]
+        if seed_ids:
+            seed_values = np.unique(codes[:, seed_ids])
+            seed_values = seed_values[seed_values > 0]
+            pairs = self._array('pairs')[:n_values, :n_values]
+            weights += _ppmi(pairs, seed_values).sum(axis=0)
+        if vibe:
+            vibe = str(vibe).strip().lower()
+            if vibe not in self.meta['vibes']:
+                raise ValueError('No outfits have the vibe "' + vibe +
+                                 '" yet.')
+            vibes = self._array('vibes')[:len(self.meta['vibes']), :n_values]
+            weights += _ppmi(vibes, [self.meta['vibes'].index(vibe)])[0]
+        return weights
+
+    def score_all(self, seed_ids=(), vibe=None):
+        """
+        Returns the score of every encoded piece (indexed by clothing_id),
+        -inf for IDs with no piece, the seeds themselves and pieces of the
+        same type as a seed.
+        """
+        weights = self.value_weights(seed_ids, vibe)
+        codes = self._array('codes')[:, :self.meta['clothes_through'] + 1]
+        # the excluded types (and IDs with no piece, whose type is 0) score
+        # -inf through the weights of the type row
+        type_weights = weights.copy()
+        type_weights[0] = -np.inf
+        seed_ids = [i for i in seed_ids if 0 < i < codes.shape[1]]
+        type_weights[codes[TYPE_ROW, seed_ids]] = -np.inf
+        scores = type_weights.take(codes[TYPE_ROW])
+        for row in range(len(FEATURES)):
+            if row != TYPE_ROW:
+                scores += weights.take(codes[row])
+        return scores
+
+    def stats(self):
+        self._load()
+        return {'clothes_through': self.meta['clothes_through'],
+                'outfits_through': self.meta['outfits_through'],
+                'values': len(self.meta['values']),
+                'vibes': len(self.meta['vibes'])}
+
+
+def _ppmi(counts, rows):
+    """
+    Returns the positive pointwise mutual information of the given rows of
+    a count matrix with every column.
+    """
+    row_totals = counts.sum(axis=1)
+    # smoothed, so that rare values (e.g. a brand in one outfit) do not
+    # outscore everything else
+    column_totals = counts.sum(axis=0) ** SMOOTHING
+    total = column_totals.sum()
+    if total == 0:
+        return np.zeros((len(rows), counts.shape[1]), dtype=np.float32)
+    selected = np.asarray(counts[rows], dtype=np.float64)
+    expected = np.outer(row_totals[rows], column_totals) / total
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pmi = np.log(selected / expected)
+    pmi[~np.isfinite(pmi)] = 0
+    return np.maximum(pmi, 0).astype(np.float32)
+
+
+# Models shared by the whole app, by directory
+_models = {}
+
+
+def get_model(path=MODEL_DIR):
+    if path not in _models:
+        _models[path] = Model(path)
+    return _models[path]
+
+
+def rebuild(path=MODEL_DIR):
+    """
+    Deletes the model in a directory, so the next refresh builds it from
+    scratch.
+    """
+    for name in ('meta.json', 'codes.npy', 'pairs.npy', 'vibes.npy'):
+        try:
+            os.remove(os.path.join(path, name))
+        except FileNotFoundError:
+            pass
+    _models.pop(path, None)
+
+
+# ----------------------------------------------------------------------
+# Recommending
+# ----------------------------------------------------------------------
+async def _in_scope(db, scope, candidates, user_id):
+    """
+    Returns the set of candidate clothing IDs that are in a scope.
+    """
+    if scope == 'personal':
+        rows = await db.fetch_all(
+            'SELECT clothing_id FROM personal_closet WHERE user_id = %s',
+            (user_id,))
+        return {row[0] for row in rows}
+    # not prepared: the IN list changes length from call to call
+    sql = _SCOPE_SQL[scope] + '(' + ', '.join(['%s'] * len(candidates)) + ')'
+    params = [int(i) for i in candidates]
+    if scope == 'collab':
+        params.insert(0, user_id if user_id is not None else -1)
+    rows = await db.fetch_all(sql, params, prepared=False)
+    return {row[0] for row in rows}
+
+
+async def recommend(db, seed_ids=(), vibe=None, scopes=SCOPES, user_id=None,
+                    limit=RECOMMENDATIONS, model=None):
+    """
+    Returns up to `limit` (clothing_id, source, score) of the pieces that
+    best complement the seed pieces and/or fit the vibe, best first. Pieces
+    come from the user's personal closet, the collaborative closet (those
+    available to borrow) and/or the stores.
+    """
+    seed_ids = [int(i) for i in seed_ids]
+    if not seed_ids and not vibe:
+        raise ValueError('Give at least one clothing ID or a vibe.')
+    unknown = set(scopes) - set(SCOPES)
+    if unknown:
+        raise ValueError('Unknown scope(s): ' + ', '.join(sorted(unknown)))
+    if 'personal' in scopes and user_id is None:
+        raise ValueError('A user is needed to recommend from their closet.')
+    model = model or get_model()
+    await model.refresh(db)
+    scores = model.score_all(seed_ids, vibe)
+
+    found = []
+    for scope in scopes:
+        if scope == 'personal':
+            closet = np.array(sorted(await _in_scope(db, scope, None,
+                                                     user_id)),
+                              dtype=np.int64)
+            closet = closet[closet < len(scores)]
+            closet = closet[np.isfinite(scores[closet])]
+            best = closet[np.argsort(-scores[closet], kind='stable')[:limit]]
+            found.extend((int(i), scope, float(scores[i])) for i in best)
+            continue
+        # check the best-scoring pieces in batches until enough are in scope
+        checked = min(MAX_CANDIDATES, len(scores))
+        top = np.argpartition(-scores, checked - 1)[:checked] \
+            if checked < len(scores) else np.arange(len(scores))
+        top = top[np.argsort(-scores[top], kind='stable')]
+        top = top[np.isfinite(scores[top])]
+        matched = 0
+        for start in range(0, len(top), CANDIDATE_BATCH):
+            batch = top[start:start + CANDIDATE_BATCH]
+            in_scope = await _in_scope(db, scope, batch, user_id)
+            for i in batch:
+                if int(i) in in_scope:
+                    found.append((int(i), scope, float(scores[i])))
+                    matched += 1
+                    if matched == limit:
+                        break
+            if matched == limit:
+                break
+    found.sort(key=lambda item: -item[2])
+    return found[:limit]
+
+
+async def describe(db, recommendations):
+    """
+    Returns rows of RECOMMEND_COLUMNS for a list of recommendations.
+    """
+    if not recommendations:
+        return []
+    ids = [clothing_id for clothing_id, _, _ in recommendations]
+    rows = await db.fetch_all(
+        """SELECT clothing_id, clothing_type, size, color, brand, aesthetic,
+            description
+        FROM clothes WHERE clothing_id IN (""" +
+        ', '.join(['%s'] * len(ids)) + ')', ids, prepared=False)
+    details = {row[0]: row for row in rows}
+    return [tuple(details[clothing_id]) + (source, round(score, 3))
+            for clothing_id, source, score in recommendations
+            if clothing_id in details]
+
+
+def main():
+    # only needed when run as a script
+    import datagen
+    import db
+    import standin
+
+    parser = argparse.ArgumentParser(
+        description='Build or refresh the outfit recommendation model.')
+    parser.add_argument('--model', default=MODEL_DIR,
+                        help='model directory (default ' + MODEL_DIR + ')')
+    parser.add_argument('--rebuild', action='store_true',
+                        help='build the model from scratch')
+    parser.add_argument('--standin', metavar='PATH',
+                        help='read an embedded SQLite stand-in database')
+    args = parser.parse_args()
+    if args.rebuild:
+        rebuild(args.model)
+    if args.standin:
+        conn = standin.connect(args.standin, create_schema=False)
+    else:
+        conn = datagen.connect()
+    start = time.perf_counter()
+    result = db.call(conn, get_model(args.model).refresh)
+    conn.close()
+    if result is None:
+        raise SystemExit('Another process is refreshing the model.')
+    print('Encoded ' + str(result[0]) + ' clothes and learned ' +
+          str(result[1]) + ' outfits in ' +
+          str(round(time.perf_counter() - start, 1)) + ' s.')
+    for name, value in get_model(args.model).stats().items():
+        print(name.ljust(16), value)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""
+Repricing and bulk markdowns for store owners. Because store_closet keeps
+each item's original_price, a new discount is applied with one set-based
+UPDATE that recomputes the price on the server, whether it touches one item
+or a whole season's worth of SKUs.
+
+set_discount and markdown are coroutines taking a Db (see db.py); from
+blocking code use db.call(conn, repricing.set_discount, ...).
+"""
+import time
+from collections import namedtuple
+
+from statements import STATEMENTS
+
+# Result of a repricing: number of store_closet rows changed and how long
+# the UPDATE took, in seconds
+RepriceResult = namedtuple('RepriceResult', ['rows', 'seconds'])
+
+# Columns of clothes that a markdown can be scoped by
+MARKDOWN_FILTERS = {
+    'clothing_type': 'clothing_type',
+    'brand': 'brand',
+}
+
+
+def check_discount(discount):
+    """
+    Returns the discount as a float, raising ValueError unless it is a
+    percentage from 0 (full price) up to but not including 100.
+    """
+    discount = float(discount)
+    if not 0 <= discount < 100:
+        raise ValueError('Discount must be at least 0% and less than 100%.')
+    return discount
+
+
+async def set_discount(db, store_name, clothing_id, discount):
+    """
+    Sets the discount of one item in a store and recomputes its price from
+    the original price, in a single statement. A discount of 0 restores the
+    original price.
+    """
+    discount = check_discount(discount)
+    start = time.perf_counter()
+    async with db.transaction():
+        result = await db.execute(STATEMENTS['reprice_item'],
+                                  (discount, discount, store_name,
+                                   clothing_id))
+    return RepriceResult(result.rowcount, time.perf_counter() - start)
+
+
+async def markdown(db, discount, store_name=None, clothing_type=None, brand=None,
+             clothing_ids=None):
+    """
+    Sets the discount of every store item matching all of the given scopes
+    (store, clothing type, brand, and/or list of clothing IDs) in a single
+    UPDATE. At least one scope must be given.
+    """
+    discount = check_discount(discount)
+    where = []
+    params = [discount, discount]
+    if store_name is not None:
+        where.append('store_name = %s')
+        params.append(store_name)
+    scopes = {'clothing_type': clothing_type, 'brand': brand}
+    matches = []
+    for name, column in MARKDOWN_FILTERS.items():
+        if scopes[name] is not None:
+            matches.append(column + ' = %s')
+            params.append(scopes[name])
+    if matches:
+        # a subquery rather than UPDATE ... JOIN, which SQLite lacks
+        where.append('clothing_id IN (SELECT clothing_id FROM clothes ' +
+                     'WHERE ' + ' AND '.join(matches) + ')')
+    if clothing_ids is not None:
+        clothing_ids = list(clothing_ids)
+        if not clothing_ids:
+            return RepriceResult(0, 0.0)
+        where.append('clothing_id IN (' +
+                     ', '.join(['%s'] * len(clothing_ids)) + ')')
+        params.extend(clothing_ids)
+    if not where:
+        raise ValueError('A markdown needs a store, clothing type, brand, ' +
+                         'or list of clothing IDs.')
+
+    sql = """UPDATE store_closet
+        SET discount = %s,
+            price = ROUND(original_price * (100 - %s) / 100, 2)
+        WHERE """ + ' AND '.join(where)
+    start = time.perf_counter()
+    # not prepared: bulk markdowns are one-off statements, not worth
+    # keeping prepared
+    async with db.transaction():
+        result = await db.execute(sql, params, prepared=False)
+    return RepriceResult(result.rowcount, time.perf_counter() - start)
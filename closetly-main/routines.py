@@ -0,0 +1,104 @@
+"""
+Backend-neutral versions of the stored routines in setup-passwords.sql and
+setup-routines.sql. They are made of ordinary statements (see
+statements.py), so they run the same on MySQL and on the embedded SQLite
+database (see backends.py), which has no stored routines. The routines
+stay installed on MySQL; the app and the API use these instead:
+
+    MySQL routine                  here
+    authenticate                   authenticate (service.login also finds
+                                   the role and closet at the same time)
+    make_salt                      make_salt
+    sp_add_user, add_to_user and
+    user_add_permission            add_account
+    find_original_price            find_original_price
+    find_available                 availability.find_available
+    borrow_item                    borrowing.borrow
+    sell_to_user                   sell_to_user
+
+Operations on the database are coroutines taking a Db (see db.py); from
+blocking code use db.call(conn, routines.sell_to_user, ...).
+"""
+import decimal
+import hashlib
+import secrets
+
+from statements import STATEMENTS
+
+# Characters in a salt (user_info.salt is CHAR(8))
+SALT_CHARS = 8
+
+
+def make_salt(num_chars=SALT_CHARS):
+    """
+    Returns a random salt of printable ASCII characters (space through
+    '~'), like make_salt, which never makes more than 20.
+    """
+    return ''.join(chr(32 + secrets.randbelow(95))
+                   for _ in range(min(20, num_chars)))
+
+
+def hash_password(salt, password):
+    """
+    The hex SHA-256 hash of the salted password, as user_info stores it
+    (SHA2(CONCAT(salt, password), 256) on MySQL).
+    """
+    return hashlib.sha256((salt + password).encode('utf-8')).hexdigest()
+
+
+async def authenticate(db, username, password):
+    """
+    Returns 1 if the username exists and the password hashes to its
+    stored hash, else 0.
+    """
+    row = await db.fetch_one(STATEMENTS['login'], (password, username))
+    return 1 if row and row[0] else 0
+
+
+async def add_account(db, name, username, password, role):
+    """
+    Adds an account in one transaction: its role, its salted password hash
+    and the user (closet) that goes with it. Returns the new user_id.
+    """
+    salt = make_salt()
+    async with db.transaction():
+        await db.execute(STATEMENTS['add_permission'], (username, role))
+        await db.execute(STATEMENTS['add_password'],
+                         (username, salt, hash_password(salt, password)))
+        added = await db.execute(STATEMENTS['add_user'], (name, username))
+    return added.lastrowid
+
+
+def find_original_price(price, discount):
+    """
+    Given an item's discounted price and its discount (a percentage off,
+    e.g. 35.2), returns its original price, rounded to the cent. Like the
+    MySQL function (and load-data.sql), returns None for a discount of
+    100% or more, which leaves no price to work back from.
+    """
+    price = decimal.Decimal(str(price))
+    discount = decimal.Decimal(str(discount))
+    if discount == 0:
+        return price
+    if discount >= 100:
+        return None
+    return (price * 100 / (100 - discount)).quantize(
+        decimal.Decimal('0.01'), rounding=decimal.ROUND_HALF_UP)
+
+
+async def sell_to_user(db, store_name, clothing_id, user_id):
+    """
+    Moves an item from a store's inventory into a user's personal closet.
+    Only that store's listing is sold; other stores selling the same item
+    keep theirs. Returns whether it was sold; nothing changes if the store
+    does not have the item (or another sale took it first). To sell many
+    items at once, see checkout.py.
+    """
+    async with db.transaction():
+        sold = await db.execute(STATEMENTS['sell_item'],
+                                (store_name, clothing_id))
+        if sold.rowcount == 0:
+            return False
+        await db.execute(STATEMENTS['add_bought_item'],
+                         (user_id, clothing_id))
+    return True
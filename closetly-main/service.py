@@ -0,0 +1,702 @@
+"""
+The operations of Closetly that both the command-line app (app.py) and the
+HTTP JSON API (api.py) offer: logging in, browsing and searching closets
+and stores, borrowing, styling outfits, selling and repricing.
+
+Every operation is a coroutine taking a Db (see db.py) and returning plain
+data (dicts, lists, numbers and strings) that can be printed or sent as
+JSON. Operations that act for a logged-in user take their Session and
+check its role. Anything the caller did wrong raises ServiceError, with
+the HTTP status that describes it. Write operations also drop the cached
+reads they make stale, so both front ends always see fresh data.
+"""
+from collections import namedtuple
+
+import availability
+import borrowing
+import browse
+import cache
+import checkout
+import outfits
+import prices
+import querystats
+import repricing
+import routines
+import store_search
+import summaries
+import text_search
+import wears
+from statements import STATEMENTS
+
+# Seconds that account lookups (username, permission, user_id) are cached
+ACCOUNT_CACHE_TTL = 300
+
+# Roles a new account can have
+ACCOUNT_TYPES = ['storeowner', 'stylist', 'personal']
+# Longest username and password sp_add_user accepts
+MAX_USERNAME = 20
+MAX_PASSWORD = 20
+
+# A logged-in user
+Session = namedtuple('Session', ['username', 'role', 'user_id'])
+
+# Browsable listings: (keyset-paginated statement, column names)
+LISTINGS = {
+    'clothes': ('all_clothes_page', browse.ALL_CLOTHES_COLUMNS),
+    'collab': ('collab_clothes_page', browse.COLLAB_COLUMNS),
+    'store': ('store_inventory_page', browse.STORE_COLUMNS),
+}
+
+PERSONAL_COLUMNS = ['clothing_id', 'clothing_type', 'size', 'gender', 'color',
+                    'brand', 'description', 'image_url', 'aesthetic',
+                    'is_clean', 'shared', 'num_wears']
+USER_COLLAB_COLUMNS = ['clothing_id', 'clothing_type', 'size', 'gender',
+                       'color', 'brand', 'description', 'image_url',
+                       'aesthetic', 'curr_condition', 'is_available',
+                       'current_borrower']
+
+# Most rows one page may ask for
+MAX_PAGE_SIZE = 500
+
+
+class ServiceError(Exception):
+    """
+    An operation could not be done, with a message for the user and the
+    HTTP status that fits (400 bad input, 401 not logged in, 403 not
+    allowed, 404 not found, 409 conflict).
+    """
+
+    def __init__(self, message, status=400):
+        Exception.__init__(self, message)
+        self.message = message
+        self.status = status
+
+
+def rows_to_dicts(columns, rows):
+    return [dict(zip(columns, row)) for row in rows]
+
+
+def require_role(session, *roles):
+    """
+    Raises ServiceError unless the session's user has one of the roles.
+    Admins may do everything.
+    """
+    if session is None:
+        raise ServiceError('Please log in first.', 401)
+    if session.role not in roles and session.role != 'appadmin':
+        raise ServiceError('Your account cannot do this.', 403)
+
+
+async def _cached(name, params, load, tags, ttl=None):
+    """
+    Returns the cached result of a read, or awaits load() and caches it.
+    """
+    found, value = cache.query_cache.lookup(name, params)
+    if not found:
+        value = await load()
+        if callable(tags):
+            tags = tags(value)
+        cache.query_cache.put((name, tuple(params)), value, tags, ttl)
+    return value
+
+
+def _id(value, name='Clothing ID'):
+    """
+    Returns an ID given by the user as an int, raising ServiceError if it is
+    not a number.
+    """
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ServiceError(name + ' must be a number.')
+
+
+def _page_size(limit):
+    limit = _id(limit, 'Page size')
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        raise ServiceError('Page size must be from 1 to ' +
+                           str(MAX_PAGE_SIZE) + '.')
+    return limit
+
+
+# ----------------------------------------------------------------------
+# Accounts
+# ----------------------------------------------------------------------
+async def account_lookup(db, name, username):
+    """
+    Runs one of the single-value account lookups (check_username,
+    get_permission, get_user_id) through the cache. The cached values are
+    dropped whenever the account changes (see cache.invalidate_user).
+    """
+    return await _cached(
+        name, (username,),
+        lambda: db.fetch_value(STATEMENTS[name], (username,)),
+        [('user', username)], ACCOUNT_CACHE_TTL)
+
+
+async def username_exists(db, username):
+    return bool(await account_lookup(db, 'check_username', username))
+
+
+async def login(db, username, password):
+    """
+    Checks a username and password and returns the user's Session. The
+    password, role and closet are all checked and found by one statement.
+    """
+    row = await db.fetch_one(STATEMENTS['login'], (password, username))
+    if row is None or not row[0]:
+        raise ServiceError('Incorrect login', 401)
+    return Session(username, row[1], row[2])
+
+
+async def session_for(db, username):
+    """
+    Returns the Session of an existing account.
+    """
+    role = await account_lookup(db, 'get_permission', username)
+    user_id = await account_lookup(db, 'get_user_id', username)
+    return Session(username, role, user_id)
+
+
+async def create_account(db, name, username, password, account_type):
+    """
+    Creates an account with a closet and a role, and returns its Session.
+    """
+    if not name or not username or not password:
+        raise ServiceError('A name, username and password are all needed.')
+    if len(username) > MAX_USERNAME:
+        raise ServiceError('Username is too long. Must be ' +
+                           str(MAX_USERNAME) + ' characters or less.')
+    if len(password) > MAX_PASSWORD:
+        raise ServiceError('Password is too long. Must be ' +
+                           str(MAX_PASSWORD) + ' characters or less.')
+    if account_type not in ACCOUNT_TYPES:
+        raise ServiceError('Account type must be one of ' +
+                           ', '.join(ACCOUNT_TYPES) + '.')
+    if await username_exists(db, username):
+        raise ServiceError('That username is taken.', 409)
+    user_id = await routines.add_account(db, name, username, password,
+                                         account_type)
+    cache.invalidate_user(username)
+    return Session(username, account_type, user_id)
+
+
+# ----------------------------------------------------------------------
+# Closets and stores
+# ----------------------------------------------------------------------
+async def personal_closet(db, session):
+    """
+    Returns every item in the user's personal closet.
+    """
+    require_role(session, 'personal', 'stylist', 'storeowner')
+    rows = await db.fetch_all(STATEMENTS['personal_clothes'],
+                              (session.username,))
+    return rows_to_dicts(PERSONAL_COLUMNS, rows)
+
+
+async def browse_page(db, listing, after=0, limit=browse.PAGE_SIZE,
+                      store_name=None):
+    """
+    Returns one page of a listing ('clothes', 'collab', or 'store' with a
+    store_name) starting after the clothing_id `after`, as
+    {'items': [...], 'next_after': clothing_id to pass for the next page,
+    or None on the last page}.
+    """
+    if listing not in LISTINGS:
+        raise ServiceError('Unknown listing: ' + str(listing), 404)
+    name, columns = LISTINGS[listing]
+    params = ()
+    if listing == 'store':
+        if not store_name:
+            raise ServiceError('A store name is needed.')
+        params = (store_name,)
+    after = _id(after, 'Page start')
+    limit = _page_size(limit)
+    load = lambda: db.fetch_all(STATEMENTS[name], params + (after, limit))
+    if name in browse.PAGE_TAGS:
+        page = await _cached(name, params + (after, limit), load,
+                             lambda page: browse.PAGE_TAGS[name](params,
+                                                                 page))
+    else:
+        page = await load()
+    key_index = columns.index('clothing_id')
+    return {
+        'items': rows_to_dicts(columns, page),
+        'next_after': page[-1][key_index] if len(page) == limit else None,
+    }
+
+
+async def collab_items_of(db, user_id):
+    """
+    Returns every item one user shares in the collaborative closet.
+    """
+    rows = await _cached(
+        'user_in_collab', (user_id,),
+        lambda: db.fetch_all(STATEMENTS['user_in_collab'], (user_id,)),
+        lambda rows: [('collab_item', row[0]) for row in rows])
+    return rows_to_dicts(USER_COLLAB_COLUMNS, rows)
+
+
+async def search_stores(db, filters, sort='id', after=None,
+                        limit=store_search.PAGE_SIZE):
+    """
+    Returns one page of store items matching the filters (see
+    store_search.build_search), as {'items': [...], 'next_after': sort key
+    to pass for the next page, or None on the last page}.
+    """
+    limit = _page_size(limit)
+    try:
+        sql, params = store_search.build_search(
+            filters, sort, tuple(after) if after is not None else None, limit)
+    except ValueError as err:
+        raise ServiceError(str(err))
+    if filters.get('store_name') is not None:
+        tags = [('store', filters['store_name'])]
+    else:
+        tags = [('all_stores',)]
+    page = await _cached(sql, params, lambda: db.fetch_all(sql, params), tags)
+    return {
+        'items': rows_to_dicts(store_search.SEARCH_COLUMNS, page),
+        'next_after': list(store_search.sort_key(page[-1], sort))
+                      if len(page) == limit else None,
+    }
+
+
+async def keyword_search(db, text, filters=None, offset=0,
+                         limit=text_search.PAGE_SIZE):
+    """
+    Returns one page of clothes matching keywords, most relevant first, as
+    {'items': [...], 'next_offset': offset of the next page or None}. The
+    first page also has the facet counts of every match and their total
+    (see text_search.search).
+    """
+    offset = _id(offset, 'Page start')
+    limit = _page_size(limit)
+    try:
+        result = await text_search.search(db, text, filters or {}, offset,
+                                          limit, facets=offset == 0)
+    except ValueError as err:
+        raise ServiceError(str(err))
+    page = result['items']
+    result['items'] = rows_to_dicts(text_search.TEXT_COLUMNS, page)
+    result['next_offset'] = offset + limit if len(page) == limit and \
+        offset + limit < text_search.MAX_RESULTS else None
+    return result
+
+
+# ----------------------------------------------------------------------
+# Borrowing
+# ----------------------------------------------------------------------
+async def borrow(db, session, clothing_id):
+    """
+    Borrows an item from the collaborative closet. Returns whether it was
+    borrowed.
+    """
+    require_role(session, 'personal')
+    clothing_id = _id(clothing_id)
+    borrowed = await borrowing.borrow(db, session.user_id, clothing_id)
+    if borrowed:
+        cache.invalidate_collab_item(clothing_id)
+    return {'borrowed': borrowed}
+
+
+async def return_item(db, session, clothing_id):
+    """
+    Returns a borrowed item, lending it to the next user waiting for it.
+    """
+    require_role(session, 'personal')
+    clothing_id = _id(clothing_id)
+    returned, next_borrower = await borrowing.return_item(
+        db, session.user_id, clothing_id)
+    if not returned:
+        raise ServiceError('You are not borrowing this item.', 409)
+    cache.invalidate_collab_item(clothing_id)
+    return {'returned': True, 'next_borrower': next_borrower}
+
+
+async def join_waitlist(db, session, clothing_id):
+    """
+    Puts the user in line for an item. Returns their place in line.
+    """
+    require_role(session, 'personal')
+    position = await borrowing.join_waitlist(db, session.user_id,
+                                             _id(clothing_id))
+    if not position:
+        raise ServiceError('You cannot wait for this item.', 409)
+    return {'position': position}
+
+
+async def find_available(db, session, wishes):
+    """
+    Checks a wish list of (clothing type, size, color) for items the user
+    has or can borrow.
+    """
+    require_role(session, 'personal')
+    try:
+        if len(wishes) == 1:
+            results = [await availability.find_available(
+                db, session.user_id, *wishes[0])]
+        else:
+            results = await availability.find_available_many(
+                db, session.user_id, wishes)
+    except (TypeError, ValueError) as err:
+        raise ServiceError(str(err))
+    return [result._asdict() for result in results]
+
+
+# ----------------------------------------------------------------------
+# Outfits
+# ----------------------------------------------------------------------
+async def create_outfit(db, session, clothing_ids, description, vibe):
+    """
+    Creates an outfit and returns it with its new outfit ID.
+    """
+    require_role(session, 'personal', 'stylist')
+    try:
+        clothing_ids = [int(clothing_id) for clothing_id in clothing_ids]
+        outfit_id = await outfits.create_outfit(db, clothing_ids,
+                                                description, vibe)
+    except (TypeError, ValueError) as err:
+        raise ServiceError('This outfit could not be created: ' + str(err))
+    return await get_outfit(db, outfit_id)
+
+
+async def get_outfit(db, outfit_id):
+    """
+    Returns one outfit and its pieces.
+    """
+    rows = await outfits.get_outfit(db, _id(outfit_id, 'Outfit ID'))
+    if not rows:
+        raise ServiceError('No such outfit.', 404)
+    return {'outfit_id': rows[0][0], 'outfit_desc': rows[0][2],
+            'vibe': rows[0][3], 'clothing_ids': [row[1] for row in rows]}
+
+
+async def recommend(db, session, clothing_ids=(), vibe=None, scopes=None,
+                    user_id=None, limit=None):
+    """
+    Recommends pieces that go with the given pieces and/or fit a vibe, from
+    a user's personal closet, the collaborative closet and the stores (see
+    recommend.py). Personal users get recommendations from their own
+    closet; stylists may name the user they are styling.
+    """
+    require_role(session, 'personal', 'stylist')
+    # numpy is only loaded once someone asks for recommendations
+    import recommend
+    if session.role == 'personal':
+        user_id = session.user_id
+    elif user_id is not None and user_id != '':
+        user_id = _id(user_id, 'User ID')
+    else:
+        user_id = None
+    if scopes is None:
+        scopes = recommend.SCOPES if user_id is not None else \
+            [scope for scope in recommend.SCOPES if scope != 'personal']
+    limit = _page_size(recommend.RECOMMENDATIONS if limit is None else limit)
+    try:
+        clothing_ids = [_id(clothing_id) for clothing_id in clothing_ids]
+        found = await recommend.recommend(db, clothing_ids, vibe, scopes,
+                                          user_id, limit)
+    except (TypeError, ValueError) as err:
+        raise ServiceError(str(err))
+    return rows_to_dicts(recommend.RECOMMEND_COLUMNS,
+                         await recommend.describe(db, found))
+
+
+# ----------------------------------------------------------------------
+# Price comparison across every store (see prices.py)
+# ----------------------------------------------------------------------
+async def compare_prices(db, session, clothing_ids):
+    """
+    Returns the lowest price of each piece in any store and the best price
+    of pieces just like it, with their total.
+    """
+    require_role(session, 'personal', 'stylist')
+    try:
+        clothing_ids = [_id(clothing_id) for clothing_id in clothing_ids]
+        result = await prices.compare_pieces(db, clothing_ids)
+    except (TypeError, ValueError) as err:
+        raise ServiceError(str(err))
+    if not result['pieces']:
+        raise ServiceError('No such clothing items.', 404)
+    return result
+
+
+async def compare_outfit_prices(db, session, outfit_id):
+    """
+    Returns the best prices of every piece of an outfit (see
+    compare_prices).
+    """
+    require_role(session, 'personal', 'stylist')
+    result = await prices.compare_outfit(db, _id(outfit_id, 'Outfit ID'))
+    if result is None:
+        raise ServiceError('No such outfit.', 404)
+    return result
+
+
+# ----------------------------------------------------------------------
+# Store inventories. A store owner's username is their store name.
+# ----------------------------------------------------------------------
+async def add_store_item(db, session, clothing_id, price, discount):
+    """
+    Adds an item to the store's inventory at a full price and discount.
+    """
+    require_role(session, 'storeowner')
+    try:
+        discount = repricing.check_discount(discount)
+        price = float(price)
+        clothing_id = int(clothing_id)
+    except ValueError as err:
+        raise ServiceError(str(err))
+    if not 0 < price < float('inf'):
+        raise ServiceError('Price must be more than 0.')
+    if not await db.fetch_value(STATEMENTS['clothing_exists'],
+                                (clothing_id,)):
+        raise ServiceError('No such clothing item.', 404)
+    if await db.fetch_value(STATEMENTS['store_item_exists'],
+                            (session.username, clothing_id)):
+        raise ServiceError('Your store already sells this item.', 409)
+    async with db.transaction():
+        await db.execute(STATEMENTS['add_store_item'],
+                         (session.username, clothing_id, price,
+                          discount, price, discount))
+    cache.invalidate_store(session.username)
+    return {'added': True}
+
+
+async def remove_store_item(db, session, clothing_id):
+    """
+    Removes an item from the store's inventory.
+    """
+    require_role(session, 'storeowner')
+    async with db.transaction():
+        removed = await db.execute(STATEMENTS['remove_store_item'],
+                                   (_id(clothing_id), session.username))
+    cache.invalidate_store(session.username)
+    return {'removed': removed.rowcount > 0}
+
+
+async def _buyer(db, user_id):
+    """
+    Returns the user_id of the user items are sold to, raising ServiceError
+    if there is no such user (their closet would fail its foreign key).
+    """
+    user_id = _id(user_id, 'User ID')
+    if not await db.fetch_value(STATEMENTS['user_exists'], (user_id,)):
+        raise ServiceError('No such user.', 404)
+    return user_id
+
+
+async def sell(db, session, clothing_id, user_id):
+    """
+    Sells an item of the store to a user, moving it into their closet.
+    """
+    require_role(session, 'storeowner')
+    clothing_id = _id(clothing_id)
+    user_id = await _buyer(db, user_id)
+    sold = await routines.sell_to_user(db, session.username, clothing_id,
+                                       user_id)
+    cache.invalidate_store(session.username)
+    return {'sold': sold}
+
+
+async def sell_items(db, session, clothing_ids, user_id):
+    """
+    Sells several items of the store to a user at their current prices, in
+    one checkout (see checkout.py). Items the store does not have are left
+    out.
+    """
+    require_role(session, 'storeowner')
+    user_id = await _buyer(db, user_id)
+    try:
+        quoted = await checkout.quote(db, [(session.username, _id(i), None)
+                                           for i in clothing_ids])
+        for_sale = [item for item in quoted if item.price is not None]
+        sale = await checkout.checkout(db, user_id, for_sale) \
+            if for_sale else {'items': [], 'total': 0.0}
+    except checkout.CartChanged as changed:
+        raise ServiceError(_changes_message(changed.changes), 409)
+    except checkout.AlreadyOwned as err:
+        raise ServiceError(str(err), 409)
+    except (TypeError, ValueError) as err:
+        raise ServiceError(str(err))
+    cache.invalidate_store(session.username)
+    return {'sold': [item.clothing_id for item in sale['items']],
+            'not_for_sale': [item.clothing_id for item in quoted
+                             if item.price is None],
+            'total': sale['total']}
+
+
+async def reprice(db, session, clothing_id, discount):
+    """
+    Sets the discount of one item of the store.
+    """
+    require_role(session, 'storeowner')
+    try:
+        result = await repricing.set_discount(db, session.username,
+                                              _id(clothing_id), discount)
+    except ValueError as err:
+        raise ServiceError(str(err))
+    cache.invalidate_store(session.username)
+    return result._asdict()
+
+
+async def markdown(db, session, discount, clothing_type=None, brand=None,
+                   clothing_ids=None):
+    """
+    Applies one discount to every item of the store matching the scopes.
+    """
+    require_role(session, 'storeowner')
+    try:
+        if clothing_ids is not None:
+            clothing_ids = [int(clothing_id) for clothing_id in clothing_ids]
+        result = await repricing.markdown(
+            db, discount, store_name=session.username,
+            clothing_type=clothing_type, brand=brand,
+            clothing_ids=clothing_ids)
+    except ValueError as err:
+        raise ServiceError(str(err))
+    cache.invalidate_store(session.username)
+    return result._asdict()
+
+
+# ----------------------------------------------------------------------
+# Checkout (see checkout.py). A cart is a list of items, each a dict
+# (store_name, clothing_id and, to check out, the quoted price) or a
+# (store_name, clothing_id, price) tuple.
+# ----------------------------------------------------------------------
+def _cart_items(items):
+    try:
+        return [(item['store_name'], _id(item['clothing_id']),
+                 item.get('price')) if isinstance(item, dict)
+                else (item[0], _id(item[1]), item[2] if len(item) > 2
+                      else None)
+                for item in items]
+    except (KeyError, IndexError, TypeError):
+        raise ServiceError('Give each item of the cart as its store_name ' +
+                           'and clothing_id.')
+
+
+def _changes_message(changes):
+    return 'Nothing was sold; some items changed since they were ' + \
+        'quoted: ' + '; '.join(
+            str(item.clothing_id) + ' at ' + item.store_name +
+            (' is no longer for sale' if item.price is None
+             else ' now costs $' + format(item.price, '.2f'))
+            for item in changes) + '.'
+
+
+async def quote_cart(db, session, items):
+    """
+    Returns the current price of each item of a cart (None if it is not
+    for sale) and the total of those for sale.
+    """
+    require_role(session, 'personal')
+    try:
+        quoted = await checkout.quote(db, _cart_items(items))
+    except (TypeError, ValueError) as err:
+        raise ServiceError(str(err))
+    return {'items': [item._asdict() for item in quoted],
+            'total': round(sum((item.price for item in quoted
+                                if item.price is not None), 0.0), 2)}
+
+
+async def checkout_cart(db, session, items):
+    """
+    Buys every item of a cart at its quoted price, in one transaction, into
+    the user's personal closet. Nothing is bought if any item was repriced
+    or sold since it was quoted (409).
+    """
+    require_role(session, 'personal')
+    if session.user_id is None:
+        raise ServiceError('Your account has no closet.', 404)
+    try:
+        sale = await checkout.checkout(db, session.user_id,
+                                       _cart_items(items))
+    except checkout.CartChanged as changed:
+        raise ServiceError(_changes_message(changed.changes), 409)
+    except checkout.AlreadyOwned as err:
+        raise ServiceError(str(err), 409)
+    except (TypeError, ValueError) as err:
+        raise ServiceError(str(err))
+    for store_name in {item.store_name for item in sale['items']}:
+        cache.invalidate_store(store_name)
+    return {'items': [item._asdict() for item in sale['items']],
+            'total': sale['total']}
+
+
+# ----------------------------------------------------------------------
+# Wears (see wears.py)
+# ----------------------------------------------------------------------
+async def log_wears(db, session, clothing_ids, worn_on=None):
+    """
+    Logs that the user wore pieces of their personal closet on a day
+    (today by default). They are added up into the closet by the next
+    roll-up. Only personal users (and admins) may write wear_log.
+    """
+    require_role(session, 'personal')
+    if session.user_id is None:
+        raise ServiceError('Your account has no closet.', 404)
+    try:
+        logged = await wears.log_outfit(db, session.user_id, clothing_ids,
+                                        worn_on)
+    except (TypeError, ValueError) as err:
+        raise ServiceError(str(err))
+    skipped = [clothing_id for clothing_id in map(int, clothing_ids)
+               if clothing_id not in logged]
+    return {'logged': logged, 'not_in_closet': skipped}
+
+
+# ----------------------------------------------------------------------
+# Dashboards, read from the summary tables (see summaries.py)
+# ----------------------------------------------------------------------
+async def store_dashboard(db, session, store_name=None):
+    """
+    Returns the dashboard of a store: the store owner's own, or any store
+    for an admin.
+    """
+    require_role(session, 'storeowner')
+    if store_name is None or store_name == session.username:
+        store_name = session.username
+    elif session.role != 'appadmin':
+        raise ServiceError('You can only see the dashboard of your store.',
+                           403)
+    return await summaries.store_dashboard(db, store_name)
+
+
+async def store_dashboards(db, session):
+    """
+    Returns the totals of every store.
+    """
+    require_role(session)
+    return await summaries.store_dashboards(db)
+
+
+async def closet_dashboard(db, session, user_id=None):
+    """
+    Returns how a personal closet is used: the user's own, or anyone's for
+    an admin. Only personal users (and admins) may read closet_summary.
+    """
+    require_role(session, 'personal')
+    if user_id is None:
+        user_id = session.user_id
+    else:
+        user_id = _id(user_id, 'User ID')
+        if user_id != session.user_id and session.role != 'appadmin':
+            raise ServiceError('You can only see the dashboard of your ' +
+                               'closet.', 403)
+    if user_id is None:
+        raise ServiceError('Your account has no closet.', 404)
+    return await summaries.closet_dashboard(db, user_id)
+
+
+# ----------------------------------------------------------------------
+# Administration
+# ----------------------------------------------------------------------
+def query_stats(session):
+    """
+    Returns the latency, rows and bytes of every statement by operation,
+    and the captured plans of slow statements (see querystats.py).
+    """
+    require_role(session)
+    return querystats.stats.report()
@@ -100,20 +100,18 @@ BEGIN
     DECLARE db_pw_hash CHAR(64);
     DECLARE generated_hash CHAR(64);
     
-    -- check if username in user_info table
-    IF (username NOT IN (
-        SELECT username 
-        FROM user_info)) 
+    -- get database user salt & hash with one primary key lookup; they
+    -- stay NULL if the username is not in the user_info table
+    SELECT salt, password_hash INTO db_salt, db_pw_hash
+    FROM user_info 
+    WHERE user_info.username = username;
+
+    IF db_pw_hash IS NULL
       THEN RETURN 0;
     END IF;
 
     -- check if the provided password yields the same hash as the
     -- corresponding one in the database    
-    
-    -- get database user salt & hash 
-    SELECT salt, password_hash INTO db_salt, db_pw_hash
-    FROM user_info 
-    WHERE user_info.username = username;
 
     -- prepend salt to password and generate SHA-2 hash 
     SET generated_hash = SHA2(CONCAT(db_salt, password), 256);
@@ -4,106 +4,658 @@ DROP FUNCTION IF EXISTS find_available;
 DROP PROCEDURE IF EXISTS sell_to_user;
 DROP FUNCTION IF EXISTS borrow_item;
 DROP TRIGGER IF EXISTS condition_update;
+DROP TRIGGER IF EXISTS store_summary_insert;
+DROP TRIGGER IF EXISTS store_summary_delete;
+DROP TRIGGER IF EXISTS store_summary_update;
+DROP TRIGGER IF EXISTS closet_summary_insert;
+DROP TRIGGER IF EXISTS closet_summary_delete;
+DROP TRIGGER IF EXISTS closet_summary_update;
+DROP TRIGGER IF EXISTS summaries_clothes_delete;
+DROP TRIGGER IF EXISTS summaries_user_delete;
+DROP PROCEDURE IF EXISTS store_summary_add;
+DROP PROCEDURE IF EXISTS closet_summary_add;
+DROP TRIGGER IF EXISTS best_price_insert;
+DROP TRIGGER IF EXISTS best_price_delete;
+DROP TRIGGER IF EXISTS best_price_update;
+DROP TRIGGER IF EXISTS best_price_clothes_delete;
+DROP PROCEDURE IF EXISTS best_price_offer;
+DROP PROCEDURE IF EXISTS best_price_refresh;
+DROP TRIGGER IF EXISTS change_log_user_insert;
+DROP TRIGGER IF EXISTS change_log_user_delete;
+DROP TRIGGER IF EXISTS change_log_user_update;
+DROP TRIGGER IF EXISTS change_log_clothes_insert;
+DROP TRIGGER IF EXISTS change_log_clothes_delete;
+DROP TRIGGER IF EXISTS change_log_clothes_update;
+DROP TRIGGER IF EXISTS change_log_personal_closet_insert;
+DROP TRIGGER IF EXISTS change_log_personal_closet_delete;
+DROP TRIGGER IF EXISTS change_log_personal_closet_update;
+DROP TRIGGER IF EXISTS change_log_collab_closet_insert;
+DROP TRIGGER IF EXISTS change_log_collab_closet_delete;
+DROP TRIGGER IF EXISTS change_log_collab_closet_update;
+DROP TRIGGER IF EXISTS change_log_store_closet_insert;
+DROP TRIGGER IF EXISTS change_log_store_closet_delete;
+DROP TRIGGER IF EXISTS change_log_store_closet_update;
+DROP TRIGGER IF EXISTS change_log_outfits_insert;
+DROP TRIGGER IF EXISTS change_log_outfits_delete;
+DROP TRIGGER IF EXISTS change_log_outfits_update;
+DROP TRIGGER IF EXISTS change_log_styled_outfits_insert;
+DROP TRIGGER IF EXISTS change_log_styled_outfits_delete;
+DROP TRIGGER IF EXISTS change_log_styled_outfits_update;
+DROP TRIGGER IF EXISTS change_log_user_cascade;
+DROP TRIGGER IF EXISTS change_log_clothes_cascade;
+DROP TRIGGER IF EXISTS change_log_outfits_cascade;
 
 -- Given a clothing item's discounted price and original discount, find
--- the original price of the clothing item 
+-- the original price of the clothing item. (store_closet now also keeps
+-- original_price, which is what repricing uses.)
 DELIMITER !
 CREATE FUNCTION find_original_price (price NUMERIC(10,2), discount DECIMAL(4,1))
 RETURNS NUMERIC(10,2) DETERMINISTIC
 BEGIN
     IF discount = 0 THEN 
         RETURN price;
+    ELSEIF discount >= 100 THEN
+        -- nothing is left of the price to work the original back out from
+        RETURN NULL;
     ELSE 
-        RETURN (price / discount);
+        -- discount is a percentage off, e.g. 35.2% off
+        RETURN ROUND(price * 100 / (100 - discount), 2);
     END IF;
 END !
 DELIMITER ;
 
--- Given a clothng type, color, and size, returns if item meeting desired criteria
--- is available in personal or shared closet. 
+-- Given a user, clothing type, size, and color, returns 1 if the user has
+-- a clean item meeting the desired criteria in their personal closet or
+-- can borrow one from someone else in the collaborative closet, else 0.
+-- Each check is an EXISTS lookup on idx_type_size_color that stops at the
+-- first match, rather than a scan of every closet (see availability.py).
 DELIMITER ! 
-CREATE FUNCTION find_available (clothing_type VARCHAR(100), size VARCHAR(20), 
-    color VARCHAR(50)) 
-RETURNS TINYINT DETERMINISTIC
-BEGIN
-    -- Checks if any of the clothing ID's of clothing items that meet the
-    -- desired criteria are in the personal or shared closet. This is
-    -- determined by if the clothing is in the intersection between
-    -- similar clothes in the entire clothes database and clothes available
-    -- to the user is not an empty set.
-    IF IS_EMPTY(
-        -- Gets the set of all clothing ID's that are both the same as what
-        -- the user is looking for and also exist in the personal and/or
-        -- shared closets.
-        SELECT * FROM
-            -- Finds all clothing ID's of the same type, size, and color given.
-            ((SELECT clothing_id FROM clothes
-             WHERE clothes.clothing_type = clothing_type AND clothes.size = size
-             AND clothes.color = color) AS desired
-             NATURAL JOIN
-             -- Finds all clothing ID's in the shared or personal closets
-             -- by finding the union of the personal and collaborative closets.
-             (SELECT * FROM (
-                -- Gets all clothing ID's from personal closet
-                SELECT clothing_id FROM personal_closet AS personal
-                -- Gets all clothing ID's from collaborative closet
-                UNION 
-                SELECT clothing_id FROM collab_closet AS collab) AS avail) AS inter)
-    ) THEN RETURN 0;
-    RETURN 1;
+CREATE FUNCTION find_available (uid INTEGER, want_type VARCHAR(100),
+    want_size VARCHAR(20), want_color VARCHAR(50))
+RETURNS TINYINT READS SQL DATA
+BEGIN
+    -- A clean item of the user's own
+    IF EXISTS (SELECT 1 FROM clothes AS c JOIN personal_closet AS p
+                   ON p.clothing_id = c.clothing_id
+               WHERE c.clothing_type = want_type AND c.size = want_size
+                   AND c.color = want_color AND p.user_id = uid
+                   AND p.is_clean = 1) THEN
+        RETURN 1;
     END IF;
+    -- An item someone else shares that nobody is borrowing
+    IF EXISTS (SELECT 1 FROM clothes AS c JOIN collab_closet AS cc
+                   ON cc.clothing_id = c.clothing_id
+               WHERE c.clothing_type = want_type AND c.size = want_size
+                   AND c.color = want_color AND cc.user_id <> uid
+                   AND cc.is_available = 1) THEN
+        RETURN 1;
+    END IF;
+    RETURN 0;
 END !
 DELIMITER ;
 
 -- Procedure to remove an item from store closet and add it to
 -- a personal closet when a store sells an item of clothing to a user.
+-- Only the selling store's listing is removed (other stores may sell the
+-- same item), and nothing is added unless the store had the item. Carts
+-- of many items are sold by checkout.py.
 DELIMITER !
-CREATE PROCEDURE sell_to_user (sold_clothing_id INTEGER, buyer_user_id INTEGER) 
+CREATE PROCEDURE sell_to_user (store VARCHAR(100), sold_clothing_id INTEGER,
+    buyer_user_id INTEGER)
 BEGIN 
-    DELETE FROM store_closet WHERE clothing_id = sold_clothing_id LIMIT 1;
-    INSERT INTO personal_closet VALUES (buyer_user_id, sold_clothing_id,1,0,0);
+    DELETE FROM store_closet
+    WHERE store_name = store AND clothing_id = sold_clothing_id;
+    IF ROW_COUNT() > 0 THEN
+        INSERT INTO personal_closet VALUES (buyer_user_id, sold_clothing_id,
+                                            1, 0, 0);
+    END IF;
 END !
 DELIMITER ;
 
--- Function to check if a specific clothing item is available to borrow
--- from the collaborative closet. If it is available and the potenital borrower
--- is not the original owner of the item, then borrow it.
+-- Function to borrow a specific clothing item from the collaborative
+-- closet. If it is available and the potential borrower is not the
+-- original owner of the item, then borrow it and return 1, else return 0.
+-- The check and the claim are one conditional UPDATE, so two users
+-- borrowing the same item at once can never both get it (see borrowing.py).
 DELIMITER !
-CREATE FUNCTION borrow_item (potential_borrower_id INTEGER, clothing_id INTEGER)
-RETURNS TINYINT DETERMINISTIC
+CREATE FUNCTION borrow_item (potential_borrower_id INTEGER, item_id INTEGER)
+RETURNS TINYINT DETERMINISTIC MODIFIES SQL DATA
 BEGIN
-    DECLARE is_avail TINYINT;
-    -- need to make sure you're not borrowing from yourself
-    DECLARE item_owner INTEGER;
+    UPDATE collab_closet
+        SET is_available = 0, current_borrower = potential_borrower_id
+        WHERE clothing_id = item_id AND is_available = 1
+            -- need to make sure you're not borrowing from yourself
+            AND user_id <> potential_borrower_id;
+    RETURN ROW_COUNT() > 0;
+END !
+DELIMITER ;
 
-    SELECT user_id, is_available INTO item_owner, is_avail
-    FROM collab_closet AS c
-    WHERE c.clothing_id = clothing_id;
 
-    IF (is_avail = 1 AND item_owner <> potential_borrower_id) THEN
-        UPDATE collab_closet
-            SET is_available = 0, current_borrower = potential_borrower_id
-            WHERE collab_closet.clothing_id = clothing_id;
-        RETURN 1;
+-- Shared pieces become 'used' after 50 wears. This used to be the
+-- condition_update trigger, which ran a collab_closet UPDATE for every
+-- wear; wears are now logged in wear_log and wears.py's roll-ups add them
+-- up and mark pieces as used, a batch at a time.
+
+-- ----------------------------------------------------------------------
+-- Dashboard summaries (tables in setup.sql, read by summaries.py). Every
+-- write to store_closet or personal_closet adjusts the totals of the one
+-- store or closet it touched, so the summaries are always current and a
+-- dashboard never scans the closets. Rows deleted by ON DELETE CASCADE
+-- fire no triggers in MySQL, so deleting clothes or users takes their
+-- items off the summaries before the cascade. Anything else that gets
+-- past the triggers is fixed by python3 summaries.py --rebuild.
+-- ----------------------------------------------------------------------
+
+-- Adds one store item to (n = 1) or takes it off (n = -1) the summaries
+-- of its store
+DELIMITER !
+CREATE PROCEDURE store_summary_add (store VARCHAR(100), item_id INTEGER,
+    item_price NUMERIC(10,2), item_full_price NUMERIC(10,2),
+    item_discount DECIMAL(4,1), n INTEGER)
+BEGIN
+    INSERT INTO store_summary (store_name, item_count, retail_value,
+        full_value, discount_total, discounted_count)
+    VALUES (store, n, n * item_price, n * item_full_price,
+        n * item_discount, n * (item_discount > 0))
+    ON DUPLICATE KEY UPDATE
+        item_count = item_count + n,
+        retail_value = retail_value + n * item_price,
+        full_value = full_value + n * item_full_price,
+        discount_total = discount_total + n * item_discount,
+        discounted_count = discounted_count + n * (item_discount > 0);
+    INSERT INTO store_type_summary (store_name, clothing_type, size,
+        item_count)
+    SELECT store, c.clothing_type, c.size, n
+    FROM clothes AS c
+    WHERE c.clothing_id = item_id
+    ON DUPLICATE KEY UPDATE
+        item_count = store_type_summary.item_count + n;
+END !
+DELIMITER ;
+
+-- Adds one piece to (n = 1) or takes it off (n = -1) the summary of a
+-- personal closet
+DELIMITER !
+CREATE PROCEDURE closet_summary_add (uid INTEGER, wears INTEGER,
+    clean TINYINT, is_shared TINYINT, n INTEGER)
+BEGIN
+    INSERT INTO closet_summary (user_id, item_count, total_wears,
+        clean_count, shared_count)
+    VALUES (uid, n, n * IFNULL(wears, 0), n * IFNULL(clean, 0),
+        n * is_shared)
+    ON DUPLICATE KEY UPDATE
+        item_count = item_count + n,
+        total_wears = total_wears + n * IFNULL(wears, 0),
+        clean_count = clean_count + n * IFNULL(clean, 0),
+        shared_count = shared_count + n * is_shared;
+END !
+DELIMITER ;
+
+DELIMITER !
+CREATE TRIGGER store_summary_insert AFTER INSERT
+    ON store_closet FOR EACH ROW
+BEGIN
+    CALL store_summary_add(NEW.store_name, NEW.clothing_id, NEW.price,
+                           NEW.original_price, NEW.discount, 1);
+END !
+
+CREATE TRIGGER store_summary_delete AFTER DELETE
+    ON store_closet FOR EACH ROW
+BEGIN
+    CALL store_summary_add(OLD.store_name, OLD.clothing_id, OLD.price,
+                           OLD.original_price, OLD.discount, -1);
+END !
+
+CREATE TRIGGER store_summary_update AFTER UPDATE
+    ON store_closet FOR EACH ROW
+BEGIN
+    IF NEW.store_name = OLD.store_name
+            AND NEW.clothing_id = OLD.clothing_id THEN
+        -- a repricing: only the store's value and discounts change
+        UPDATE store_summary
+        SET retail_value = retail_value + NEW.price - OLD.price,
+            full_value = full_value + NEW.original_price
+                - OLD.original_price,
+            discount_total = discount_total + NEW.discount - OLD.discount,
+            discounted_count = discounted_count + (NEW.discount > 0)
+                - (OLD.discount > 0)
+        WHERE store_name = NEW.store_name;
     ELSE
-        RETURN 0;
+        CALL store_summary_add(OLD.store_name, OLD.clothing_id, OLD.price,
+                               OLD.original_price, OLD.discount, -1);
+        CALL store_summary_add(NEW.store_name, NEW.clothing_id, NEW.price,
+                               NEW.original_price, NEW.discount, 1);
+    END IF;
+END !
+
+CREATE TRIGGER closet_summary_insert AFTER INSERT
+    ON personal_closet FOR EACH ROW
+BEGIN
+    CALL closet_summary_add(NEW.user_id, NEW.num_wears, NEW.is_clean,
+                            NEW.shared, 1);
+END !
+
+CREATE TRIGGER closet_summary_delete AFTER DELETE
+    ON personal_closet FOR EACH ROW
+BEGIN
+    CALL closet_summary_add(OLD.user_id, OLD.num_wears, OLD.is_clean,
+                            OLD.shared, -1);
+END !
+
+CREATE TRIGGER closet_summary_update AFTER UPDATE
+    ON personal_closet FOR EACH ROW
+BEGIN
+    CALL closet_summary_add(OLD.user_id, OLD.num_wears, OLD.is_clean,
+                            OLD.shared, -1);
+    CALL closet_summary_add(NEW.user_id, NEW.num_wears, NEW.is_clean,
+                            NEW.shared, 1);
+END !
+DELIMITER ;
+
+DELIMITER !
+CREATE TRIGGER summaries_clothes_delete BEFORE DELETE
+    ON clothes FOR EACH ROW
+BEGIN
+    -- the item's store_closet and personal_closet rows are about to go
+    -- by ON DELETE CASCADE, without firing their triggers
+    UPDATE store_summary AS t
+        JOIN store_closet AS s ON s.store_name = t.store_name
+    SET t.item_count = t.item_count - 1,
+        t.retail_value = t.retail_value - s.price,
+        t.full_value = t.full_value - s.original_price,
+        t.discount_total = t.discount_total - s.discount,
+        t.discounted_count = t.discounted_count - (s.discount > 0)
+    WHERE s.clothing_id = OLD.clothing_id;
+    UPDATE store_type_summary AS t
+        JOIN store_closet AS s ON s.store_name = t.store_name
+    SET t.item_count = t.item_count - 1
+    WHERE s.clothing_id = OLD.clothing_id
+        AND t.clothing_type = OLD.clothing_type AND t.size = OLD.size;
+    UPDATE closet_summary AS t
+        JOIN personal_closet AS p ON p.user_id = t.user_id
+    SET t.item_count = t.item_count - 1,
+        t.total_wears = t.total_wears - IFNULL(p.num_wears, 0),
+        t.clean_count = t.clean_count - IFNULL(p.is_clean, 0),
+        t.shared_count = t.shared_count - p.shared
+    WHERE p.clothing_id = OLD.clothing_id;
+END !
+
+CREATE TRIGGER summaries_user_delete BEFORE DELETE
+    ON user FOR EACH ROW
+BEGIN
+    -- the user's personal_closet goes by ON DELETE CASCADE
+    DELETE FROM closet_summary WHERE user_id = OLD.user_id;
+END !
+DELIMITER ;
+
+-- Summarize what was loaded before the triggers existed
+DELETE FROM store_summary;
+DELETE FROM store_type_summary;
+DELETE FROM closet_summary;
+INSERT INTO store_summary
+SELECT store_name, COUNT(*), SUM(price), SUM(original_price),
+    SUM(discount), SUM(discount > 0)
+FROM store_closet
+GROUP BY store_name;
+INSERT INTO store_type_summary
+SELECT s.store_name, c.clothing_type, c.size, COUNT(*)
+FROM store_closet AS s JOIN clothes AS c ON c.clothing_id = s.clothing_id
+GROUP BY s.store_name, c.clothing_type, c.size;
+INSERT INTO closet_summary
+SELECT user_id, COUNT(*), SUM(IFNULL(num_wears, 0)),
+    SUM(IFNULL(is_clean, 0)), SUM(shared)
+FROM personal_closet
+GROUP BY user_id;
+
+-- ----------------------------------------------------------------------
+-- Best prices (table in setup.sql, read by prices.py). A listing cheaper
+-- than its product's best price takes its place; only selling, removing,
+-- moving or raising the price of the best listing itself looks the
+-- product's cheapest listing up again. Deleting clothes looks it up
+-- before ON DELETE CASCADE takes the item's listings without firing
+-- their triggers. python3 prices.py --rebuild fixes anything else.
+-- ----------------------------------------------------------------------
+
+-- Offers a store's listing of an item as the best price of the item's
+-- product; it only takes the place of a dearer one
+DELIMITER !
+CREATE PROCEDURE best_price_offer (store VARCHAR(100), item_id INTEGER,
+    item_price NUMERIC(10,2))
+BEGIN
+    INSERT INTO best_price (clothing_type, brand, size, color, price,
+        store_name, clothing_id)
+    SELECT c.clothing_type, IFNULL(c.brand, ''), c.size,
+        IFNULL(c.color, ''), item_price, store, item_id
+    FROM clothes AS c
+    WHERE c.clothing_id = item_id
+    -- price is set last, so the other columns compare with the old one
+    ON DUPLICATE KEY UPDATE
+        store_name = IF(item_price < best_price.price, store,
+                        best_price.store_name),
+        clothing_id = IF(item_price < best_price.price, item_id,
+                         best_price.clothing_id),
+        price = LEAST(best_price.price, item_price);
+END !
+DELIMITER ;
+
+-- Looks up the cheapest listing of an item's product again, leaving out
+-- the listings of skip_id (0 to leave none out)
+DELIMITER !
+CREATE PROCEDURE best_price_refresh (item_id INTEGER, skip_id INTEGER)
+BEGIN
+    DECLARE want_type VARCHAR(100);
+    DECLARE want_brand VARCHAR(150);
+    DECLARE want_size VARCHAR(20);
+    DECLARE want_color VARCHAR(50);
+    SELECT clothing_type, IFNULL(brand, ''), size, IFNULL(color, '')
+        INTO want_type, want_brand, want_size, want_color
+    FROM clothes WHERE clothing_id = item_id;
+    DELETE FROM best_price
+    WHERE clothing_type = want_type AND brand = want_brand
+        AND size = want_size AND color = want_color;
+    -- the product's pieces are an idx_type_size_color range (<=> also
+    -- matches NULLs, and still uses the index), and each one's listings
+    -- an idx_item_price lookup
+    INSERT INTO best_price (clothing_type, brand, size, color, price,
+        store_name, clothing_id)
+    SELECT want_type, want_brand, want_size, want_color, s.price,
+        s.store_name, s.clothing_id
+    FROM clothes AS c JOIN store_closet AS s
+        ON s.clothing_id = c.clothing_id
+    WHERE c.clothing_type = want_type AND c.size = want_size
+        AND c.color <=> NULLIF(want_color, '')
+        AND c.brand <=> NULLIF(want_brand, '')
+        AND c.clothing_id <> skip_id
+    ORDER BY s.price, s.store_name, s.clothing_id
+    LIMIT 1;
+END !
+DELIMITER ;
+
+DELIMITER !
+CREATE TRIGGER best_price_insert AFTER INSERT
+    ON store_closet FOR EACH ROW
+BEGIN
+    CALL best_price_offer(NEW.store_name, NEW.clothing_id, NEW.price);
+END !
+
+CREATE TRIGGER best_price_delete AFTER DELETE
+    ON store_closet FOR EACH ROW
+BEGIN
+    IF EXISTS (SELECT 1 FROM best_price
+               WHERE clothing_id = OLD.clothing_id
+                   AND store_name = OLD.store_name) THEN
+        CALL best_price_refresh(OLD.clothing_id, 0);
+    END IF;
+END !
+
+CREATE TRIGGER best_price_update AFTER UPDATE
+    ON store_closet FOR EACH ROW
+BEGIN
+    IF (NEW.price > OLD.price OR NEW.store_name <> OLD.store_name
+            OR NEW.clothing_id <> OLD.clothing_id)
+        AND EXISTS (SELECT 1 FROM best_price
+                    WHERE clothing_id = OLD.clothing_id
+                        AND store_name = OLD.store_name) THEN
+        CALL best_price_refresh(OLD.clothing_id, 0);
+    END IF;
+    -- a markdown, or a listing moved to another item, may be the new
+    -- best price
+    CALL best_price_offer(NEW.store_name, NEW.clothing_id, NEW.price);
+END !
+
+CREATE TRIGGER best_price_clothes_delete BEFORE DELETE
+    ON clothes FOR EACH ROW
+BEGIN
+    IF EXISTS (SELECT 1 FROM best_price
+               WHERE clothing_id = OLD.clothing_id) THEN
+        CALL best_price_refresh(OLD.clothing_id, OLD.clothing_id);
     END IF;
 END !
 DELIMITER ;
 
+-- Find the best prices of what was loaded before the triggers existed
+DELETE FROM best_price;
+INSERT INTO best_price
+SELECT clothing_type, brand, size, color, price, store_name, clothing_id
+FROM (SELECT c.clothing_type, IFNULL(c.brand, '') AS brand, c.size,
+          IFNULL(c.color, '') AS color, s.price, s.store_name,
+          s.clothing_id,
+          ROW_NUMBER() OVER (
+              PARTITION BY c.clothing_type, IFNULL(c.brand, ''), c.size,
+                  IFNULL(c.color, '')
+              ORDER BY s.price, s.store_name, s.clothing_id) AS n
+      FROM store_closet AS s JOIN clothes AS c
+          ON c.clothing_id = s.clothing_id) AS ranked
+WHERE n = 1;
+
+-- ----------------------------------------------------------------------
+-- Change log (tables in setup.sql, read by changes.py). Every insert,
+-- update and delete of the tables below appends the row's key to
+-- change_log; an update that changes a row's key also logs the old key as
+-- deleted. Rows deleted by ON DELETE CASCADE fire no triggers in MySQL, so
+-- deleting users, clothes or outfits logs the rows the cascade is about
+-- to take first. Consumers look changed rows up again, so logging a row
+-- the cascade turns out not to take does no harm.
+-- ----------------------------------------------------------------------
 
--- Trigger to update clothing item condition to 'used' after 50 wears 
 DELIMITER !
-CREATE TRIGGER condition_update AFTER UPDATE
+CREATE TRIGGER change_log_user_insert AFTER INSERT
+    ON user FOR EACH ROW
+BEGIN
+    INSERT INTO change_log (table_name, operation, user_id)
+    VALUES ('user', 'I', NEW.user_id);
+END !
+
+CREATE TRIGGER change_log_user_delete AFTER DELETE
+    ON user FOR EACH ROW
+BEGIN
+    INSERT INTO change_log (table_name, operation, user_id)
+    VALUES ('user', 'D', OLD.user_id);
+END !
+
+CREATE TRIGGER change_log_user_update AFTER UPDATE
+    ON user FOR EACH ROW
+BEGIN
+    IF NOT NEW.user_id <=> OLD.user_id THEN
+        INSERT INTO change_log (table_name, operation, user_id)
+        VALUES ('user', 'D', OLD.user_id);
+    END IF;
+    INSERT INTO change_log (table_name, operation, user_id)
+    VALUES ('user', 'U', NEW.user_id);
+END !
+
+CREATE TRIGGER change_log_clothes_insert AFTER INSERT
+    ON clothes FOR EACH ROW
+BEGIN
+    INSERT INTO change_log (table_name, operation, clothing_id)
+    VALUES ('clothes', 'I', NEW.clothing_id);
+END !
+
+CREATE TRIGGER change_log_clothes_delete AFTER DELETE
+    ON clothes FOR EACH ROW
+BEGIN
+    INSERT INTO change_log (table_name, operation, clothing_id)
+    VALUES ('clothes', 'D', OLD.clothing_id);
+END !
+
+CREATE TRIGGER change_log_clothes_update AFTER UPDATE
+    ON clothes FOR EACH ROW
+BEGIN
+    IF NOT NEW.clothing_id <=> OLD.clothing_id THEN
+        INSERT INTO change_log (table_name, operation, clothing_id)
+        VALUES ('clothes', 'D', OLD.clothing_id);
+    END IF;
+    INSERT INTO change_log (table_name, operation, clothing_id)
+    VALUES ('clothes', 'U', NEW.clothing_id);
+END !
+
+CREATE TRIGGER change_log_personal_closet_insert AFTER INSERT
     ON personal_closet FOR EACH ROW
 BEGIN
-    IF NEW.num_wears > 50 THEN
-        IF (curr_condition = 'new' OR ISNULL(curr_condition)) THEN
-            UPDATE collab_closet 
-            SET curr_condition = 'used'
-            WHERE collab_closet.clothing_id = 
-                    personal_closet.clothing_id;
-        END IF;
+    INSERT INTO change_log (table_name, operation, user_id, clothing_id)
+    VALUES ('personal_closet', 'I', NEW.user_id, NEW.clothing_id);
+END !
+
+CREATE TRIGGER change_log_personal_closet_delete AFTER DELETE
+    ON personal_closet FOR EACH ROW
+BEGIN
+    INSERT INTO change_log (table_name, operation, user_id, clothing_id)
+    VALUES ('personal_closet', 'D', OLD.user_id, OLD.clothing_id);
+END !
+
+CREATE TRIGGER change_log_personal_closet_update AFTER UPDATE
+    ON personal_closet FOR EACH ROW
+BEGIN
+    IF NOT NEW.user_id <=> OLD.user_id
+            OR NOT NEW.clothing_id <=> OLD.clothing_id THEN
+        INSERT INTO change_log (table_name, operation, user_id, clothing_id)
+        VALUES ('personal_closet', 'D', OLD.user_id, OLD.clothing_id);
+    END IF;
+    INSERT INTO change_log (table_name, operation, user_id, clothing_id)
+    VALUES ('personal_closet', 'U', NEW.user_id, NEW.clothing_id);
+END !
+
+CREATE TRIGGER change_log_collab_closet_insert AFTER INSERT
+    ON collab_closet FOR EACH ROW
+BEGIN
+    INSERT INTO change_log (table_name, operation, user_id, clothing_id)
+    VALUES ('collab_closet', 'I', NEW.user_id, NEW.clothing_id);
+END !
+
+CREATE TRIGGER change_log_collab_closet_delete AFTER DELETE
+    ON collab_closet FOR EACH ROW
+BEGIN
+    INSERT INTO change_log (table_name, operation, user_id, clothing_id)
+    VALUES ('collab_closet', 'D', OLD.user_id, OLD.clothing_id);
+END !
+
+CREATE TRIGGER change_log_collab_closet_update AFTER UPDATE
+    ON collab_closet FOR EACH ROW
+BEGIN
+    IF NOT NEW.user_id <=> OLD.user_id
+            OR NOT NEW.clothing_id <=> OLD.clothing_id THEN
+        INSERT INTO change_log (table_name, operation, user_id, clothing_id)
+        VALUES ('collab_closet', 'D', OLD.user_id, OLD.clothing_id);
+    END IF;
+    INSERT INTO change_log (table_name, operation, user_id, clothing_id)
+    VALUES ('collab_closet', 'U', NEW.user_id, NEW.clothing_id);
+END !
+
+CREATE TRIGGER change_log_store_closet_insert AFTER INSERT
+    ON store_closet FOR EACH ROW
+BEGIN
+    INSERT INTO change_log (table_name, operation, store_name, clothing_id)
+    VALUES ('store_closet', 'I', NEW.store_name, NEW.clothing_id);
+END !
+
+CREATE TRIGGER change_log_store_closet_delete AFTER DELETE
+    ON store_closet FOR EACH ROW
+BEGIN
+    INSERT INTO change_log (table_name, operation, store_name, clothing_id)
+    VALUES ('store_closet', 'D', OLD.store_name, OLD.clothing_id);
+END !
+
+CREATE TRIGGER change_log_store_closet_update AFTER UPDATE
+    ON store_closet FOR EACH ROW
+BEGIN
+    IF NOT NEW.store_name <=> OLD.store_name
+            OR NOT NEW.clothing_id <=> OLD.clothing_id THEN
+        INSERT INTO change_log (table_name, operation, store_name, clothing_id)
+        VALUES ('store_closet', 'D', OLD.store_name, OLD.clothing_id);
+    END IF;
+    INSERT INTO change_log (table_name, operation, store_name, clothing_id)
+    VALUES ('store_closet', 'U', NEW.store_name, NEW.clothing_id);
+END !
+
+CREATE TRIGGER change_log_outfits_insert AFTER INSERT
+    ON outfits FOR EACH ROW
+BEGIN
+    INSERT INTO change_log (table_name, operation, outfit_id)
+    VALUES ('outfits', 'I', NEW.outfit_id);
+END !
+
+CREATE TRIGGER change_log_outfits_delete AFTER DELETE
+    ON outfits FOR EACH ROW
+BEGIN
+    INSERT INTO change_log (table_name, operation, outfit_id)
+    VALUES ('outfits', 'D', OLD.outfit_id);
+END !
+
+CREATE TRIGGER change_log_outfits_update AFTER UPDATE
+    ON outfits FOR EACH ROW
+BEGIN
+    IF NOT NEW.outfit_id <=> OLD.outfit_id THEN
+        INSERT INTO change_log (table_name, operation, outfit_id)
+        VALUES ('outfits', 'D', OLD.outfit_id);
     END IF;
+    INSERT INTO change_log (table_name, operation, outfit_id)
+    VALUES ('outfits', 'U', NEW.outfit_id);
 END !
-DELIMITER ;
\ No newline at end of file
+
+CREATE TRIGGER change_log_styled_outfits_insert AFTER INSERT
+    ON styled_outfits FOR EACH ROW
+BEGIN
+    INSERT INTO change_log (table_name, operation, outfit_id, clothing_id)
+    VALUES ('styled_outfits', 'I', NEW.outfit_id, NEW.clothing_id);
+END !
+
+CREATE TRIGGER change_log_styled_outfits_delete AFTER DELETE
+    ON styled_outfits FOR EACH ROW
+BEGIN
+    INSERT INTO change_log (table_name, operation, outfit_id, clothing_id)
+    VALUES ('styled_outfits', 'D', OLD.outfit_id, OLD.clothing_id);
+END !
+
+CREATE TRIGGER change_log_styled_outfits_update AFTER UPDATE
+    ON styled_outfits FOR EACH ROW
+BEGIN
+    IF NOT NEW.outfit_id <=> OLD.outfit_id
+            OR NOT NEW.clothing_id <=> OLD.clothing_id THEN
+        INSERT INTO change_log (table_name, operation, outfit_id, clothing_id)
+        VALUES ('styled_outfits', 'D', OLD.outfit_id, OLD.clothing_id);
+    END IF;
+    INSERT INTO change_log (table_name, operation, outfit_id, clothing_id)
+    VALUES ('styled_outfits', 'U', NEW.outfit_id, NEW.clothing_id);
+END !
+
+CREATE TRIGGER change_log_user_cascade BEFORE DELETE
+    ON user FOR EACH ROW
+BEGIN
+    INSERT INTO change_log (table_name, operation, user_id, clothing_id)
+    SELECT 'personal_closet', 'D', user_id, clothing_id
+    FROM personal_closet WHERE user_id = OLD.user_id;
+    -- collab_closet rows go with their owner, and with the owner's
+    -- personal_closet rows
+    INSERT INTO change_log (table_name, operation, user_id, clothing_id)
+    SELECT 'collab_closet', 'D', user_id, clothing_id
+    FROM collab_closet WHERE user_id = OLD.user_id
+        OR clothing_id IN (SELECT clothing_id FROM personal_closet
+                           WHERE user_id = OLD.user_id);
+END !
+
+CREATE TRIGGER change_log_clothes_cascade BEFORE DELETE
+    ON clothes FOR EACH ROW
+BEGIN
+    INSERT INTO change_log (table_name, operation, user_id, clothing_id)
+    SELECT 'personal_closet', 'D', user_id, clothing_id
+    FROM personal_closet WHERE clothing_id = OLD.clothing_id;
+    INSERT INTO change_log (table_name, operation, user_id, clothing_id)
+    SELECT 'collab_closet', 'D', user_id, clothing_id
+    FROM collab_closet WHERE clothing_id = OLD.clothing_id;
+    INSERT INTO change_log (table_name, operation, store_name,
+                            clothing_id)
+    SELECT 'store_closet', 'D', store_name, clothing_id
+    FROM store_closet WHERE clothing_id = OLD.clothing_id;
+    INSERT INTO change_log (table_name, operation, outfit_id, clothing_id)
+    SELECT 'styled_outfits', 'D', outfit_id, clothing_id
+    FROM styled_outfits WHERE clothing_id = OLD.clothing_id;
+END !
+
+CREATE TRIGGER change_log_outfits_cascade BEFORE DELETE
+    ON outfits FOR EACH ROW
+BEGIN
+    INSERT INTO change_log (table_name, operation, outfit_id, clothing_id)
+    SELECT 'styled_outfits', 'D', outfit_id, clothing_id
+    FROM styled_outfits WHERE outfit_id = OLD.outfit_id;
+END !
+DELIMITER ;
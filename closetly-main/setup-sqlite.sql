@@ -0,0 +1,628 @@
+-- SQLite version of the Closetly schema (setup.sql, setup-passwords.sql
+-- and setup-permissions.sql), used by the embedded stand-in database in
+-- standin.py for benchmarks that run without a MySQL server.
+-- Keep this file in step with the MySQL setup files.
+
+DROP TABLE IF EXISTS change_checkpoint;
+DROP TABLE IF EXISTS change_log;
+DROP TABLE IF EXISTS best_price;
+DROP TABLE IF EXISTS wear_rollup;
+DROP TABLE IF EXISTS wear_log;
+DROP TABLE IF EXISTS closet_summary;
+DROP TABLE IF EXISTS store_type_summary;
+DROP TABLE IF EXISTS store_summary;
+DROP TABLE IF EXISTS ingest_index;
+DROP TABLE IF EXISTS ingest_checkpoint;
+DROP TABLE IF EXISTS borrow_waitlist;
+DROP TABLE IF EXISTS styled_outfits;
+DROP TABLE IF EXISTS outfits;
+DROP TABLE IF EXISTS collab_closet;
+DROP TABLE IF EXISTS store_closet;
+DROP TABLE IF EXISTS personal_closet;
+DROP TABLE IF EXISTS clothes_text;
+DROP TABLE IF EXISTS clothes;
+DROP TABLE IF EXISTS permissions;
+DROP TABLE IF EXISTS user_info;
+DROP TABLE IF EXISTS user;
+
+CREATE TABLE user (
+    user_id           INTEGER PRIMARY KEY AUTOINCREMENT,
+    name              VARCHAR(80) NOT NULL,
+    username          VARCHAR(20)
+);
+
+CREATE TABLE user_info (
+    username          VARCHAR(20) PRIMARY KEY,
+    salt              CHAR(8) NOT NULL,
+    password_hash     CHAR(64) NOT NULL
+);
+
+CREATE TABLE permissions (
+    username          VARCHAR(80) PRIMARY KEY,
+    role              VARCHAR(30)
+);
+
+CREATE TABLE clothes (
+    clothing_id       INTEGER PRIMARY KEY AUTOINCREMENT,
+    clothing_type     VARCHAR(100) NOT NULL,
+    size              VARCHAR(20) NOT NULL,
+    gender            CHAR(1),
+    color             VARCHAR(50),
+    brand             VARCHAR(150),
+    description       VARCHAR(250),
+    image_url         VARCHAR(250),
+    aesthetic         VARCHAR(200),
+    store_name        VARCHAR(100)
+);
+
+CREATE TABLE personal_closet (
+    user_id           INTEGER REFERENCES user(user_id) ON DELETE CASCADE,
+    clothing_id       INTEGER REFERENCES clothes(clothing_id) ON DELETE CASCADE,
+    is_clean          TINYINT DEFAULT 1,
+    shared            TINYINT DEFAULT 0 NOT NULL,
+    num_wears         INTEGER,
+    PRIMARY KEY (user_id, clothing_id)
+);
+
+CREATE TABLE collab_closet (
+    user_id           INTEGER REFERENCES user(user_id) ON DELETE CASCADE,
+    clothing_id       INTEGER,
+    curr_condition    VARCHAR(50),
+    is_available      TINYINT DEFAULT 1 NOT NULL,
+    current_borrower  INTEGER,
+    PRIMARY KEY (user_id, clothing_id)
+);
+
+CREATE TABLE store_closet (
+    store_name        VARCHAR(100),
+    clothing_id       INTEGER REFERENCES clothes(clothing_id) ON DELETE CASCADE,
+    price             NUMERIC(10, 2) NOT NULL,
+    discount          DECIMAL(4, 1) NOT NULL,
+    original_price    NUMERIC(10, 2) NOT NULL,
+    PRIMARY KEY (store_name, clothing_id)
+);
+
+CREATE TABLE outfits (
+    outfit_id         INTEGER PRIMARY KEY AUTOINCREMENT,
+    outfit_desc       VARCHAR(250),
+    vibe              VARCHAR(250)
+);
+
+CREATE TABLE styled_outfits (
+    outfit_id         INTEGER REFERENCES outfits(outfit_id) ON DELETE CASCADE,
+    clothing_id       INTEGER REFERENCES clothes(clothing_id) ON DELETE CASCADE,
+    outfit_desc       VARCHAR(250),
+    vibe              VARCHAR(250),
+    PRIMARY KEY (outfit_id, clothing_id)
+);
+
+CREATE TABLE borrow_waitlist (
+    waitlist_id       INTEGER PRIMARY KEY AUTOINCREMENT,
+    clothing_id       INTEGER NOT NULL,
+    user_id           INTEGER NOT NULL
+                      REFERENCES user(user_id) ON DELETE CASCADE,
+    joined_at         TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE (clothing_id, user_id)
+);
+
+CREATE TABLE ingest_checkpoint (
+    table_name        VARCHAR(64),
+    file_name         VARCHAR(255),
+    rows_read         BIGINT NOT NULL DEFAULT 0,
+    rows_loaded       BIGINT NOT NULL DEFAULT 0,
+    rows_rejected     BIGINT NOT NULL DEFAULT 0,
+    finished          TINYINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (table_name, file_name)
+);
+
+CREATE TABLE ingest_index (
+    table_name        VARCHAR(64),
+    index_name        VARCHAR(64),
+    index_columns     VARCHAR(255) NOT NULL,
+    index_type        VARCHAR(16) NOT NULL DEFAULT 'BTREE',
+    PRIMARY KEY (table_name, index_name)
+);
+
+CREATE TABLE store_summary (
+    store_name        VARCHAR(100) PRIMARY KEY,
+    item_count        INTEGER NOT NULL DEFAULT 0,
+    retail_value      NUMERIC(14, 2) NOT NULL DEFAULT 0,
+    full_value        NUMERIC(14, 2) NOT NULL DEFAULT 0,
+    discount_total    NUMERIC(14, 1) NOT NULL DEFAULT 0,
+    discounted_count  INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE store_type_summary (
+    store_name        VARCHAR(100),
+    clothing_type     VARCHAR(100),
+    size              VARCHAR(20),
+    item_count        INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (store_name, clothing_type, size)
+);
+
+CREATE TABLE closet_summary (
+    user_id           INTEGER PRIMARY KEY,
+    item_count        INTEGER NOT NULL DEFAULT 0,
+    total_wears       BIGINT NOT NULL DEFAULT 0,
+    clean_count       INTEGER NOT NULL DEFAULT 0,
+    shared_count      INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE wear_log (
+    wear_id           INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id           INTEGER NOT NULL,
+    clothing_id       INTEGER NOT NULL,
+    worn_on           DATE NOT NULL,
+    rollup_id         INTEGER
+);
+
+CREATE TABLE wear_rollup (
+    rollup_id         INTEGER PRIMARY KEY AUTOINCREMENT,
+    rolled_up_at      TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    wears             INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE best_price (
+    clothing_type     VARCHAR(100),
+    brand             VARCHAR(150),
+    size              VARCHAR(20),
+    color             VARCHAR(50),
+    price             NUMERIC(10, 2) NOT NULL,
+    store_name        VARCHAR(100) NOT NULL,
+    clothing_id       INTEGER NOT NULL,
+    PRIMARY KEY (clothing_type, brand, size, color)
+);
+
+CREATE TABLE change_log (
+    change_id         INTEGER PRIMARY KEY AUTOINCREMENT,
+    table_name        VARCHAR(64) NOT NULL,
+    operation         CHAR(1) NOT NULL,
+    user_id           INTEGER,
+    clothing_id       INTEGER,
+    outfit_id         INTEGER,
+    store_name        VARCHAR(100),
+    changed_at        TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE change_checkpoint (
+    consumer          VARCHAR(255) PRIMARY KEY,
+    change_id         BIGINT NOT NULL DEFAULT 0
+);
+
+-- MySQL creates these automatically for its foreign keys (idx_item_price
+-- below serves store_closet's)
+CREATE INDEX idx_personal_clothing ON personal_closet (clothing_id);
+CREATE INDEX idx_collab_clothing ON collab_closet (clothing_id);
+CREATE INDEX idx_outfit_clothing ON styled_outfits (clothing_id);
+CREATE INDEX idx_waitlist_user ON borrow_waitlist (user_id);
+
+-- Same indexes as setup.sql
+CREATE INDEX idx_borrower ON collab_closet (current_borrower);
+CREATE INDEX idx_user_username ON user (username);
+CREATE INDEX idx_store_price ON store_closet (store_name, price);
+CREATE INDEX idx_store_discount ON store_closet (store_name, discount);
+CREATE INDEX idx_discount ON store_closet (discount, price);
+CREATE INDEX idx_item_price ON store_closet (clothing_id, price);
+CREATE INDEX idx_type_size_color ON clothes (clothing_type, size, color,
+                                         brand);
+CREATE INDEX idx_wear_rollup ON wear_log (rollup_id, user_id, clothing_id);
+CREATE INDEX idx_best_price_listing ON best_price (clothing_id, store_name);
+
+-- Stands in for the FULLTEXT index ft_clothes_text: an FTS5 index over
+-- the text columns of clothes, kept in step by triggers
+CREATE VIRTUAL TABLE clothes_text USING fts5(
+    description, brand, aesthetic,
+    content = 'clothes', content_rowid = 'clothing_id'
+);
+
+CREATE TRIGGER clothes_text_insert AFTER INSERT ON clothes BEGIN
+    INSERT INTO clothes_text (rowid, description, brand, aesthetic)
+    VALUES (new.clothing_id, new.description, new.brand, new.aesthetic);
+END;
+
+CREATE TRIGGER clothes_text_delete AFTER DELETE ON clothes BEGIN
+    INSERT INTO clothes_text (clothes_text, rowid, description, brand,
+                              aesthetic)
+    VALUES ('delete', old.clothing_id, old.description, old.brand,
+            old.aesthetic);
+END;
+
+CREATE TRIGGER clothes_text_update
+AFTER UPDATE OF clothing_id, description, brand, aesthetic ON clothes BEGIN
+    INSERT INTO clothes_text (clothes_text, rowid, description, brand,
+                              aesthetic)
+    VALUES ('delete', old.clothing_id, old.description, old.brand,
+            old.aesthetic);
+    INSERT INTO clothes_text (rowid, description, brand, aesthetic)
+    VALUES (new.clothing_id, new.description, new.brand, new.aesthetic);
+END;
+
+-- Keep the dashboard summaries current, like the summary triggers in
+-- setup-routines.sql. SQLite has no stored procedures, so each trigger
+-- spells out the upserts; taking an item off a summary adds it with
+-- negated amounts. Unlike MySQL, SQLite fires these for rows deleted by
+-- ON DELETE CASCADE too.
+CREATE TRIGGER store_summary_insert AFTER INSERT ON store_closet BEGIN
+    INSERT INTO store_summary (store_name, item_count, retail_value,
+                               full_value, discount_total, discounted_count)
+    VALUES (new.store_name, 1, new.price, new.original_price, new.discount,
+            new.discount > 0)
+    ON CONFLICT (store_name) DO UPDATE SET
+        item_count = item_count + excluded.item_count,
+        retail_value = retail_value + excluded.retail_value,
+        full_value = full_value + excluded.full_value,
+        discount_total = discount_total + excluded.discount_total,
+        discounted_count = discounted_count + excluded.discounted_count;
+    INSERT INTO store_type_summary (store_name, clothing_type, size,
+                                    item_count)
+    SELECT new.store_name, clothing_type, size, 1 FROM clothes
+    WHERE clothing_id = new.clothing_id
+    ON CONFLICT (store_name, clothing_type, size) DO UPDATE SET
+        item_count = item_count + excluded.item_count;
+END;
+
+CREATE TRIGGER store_summary_delete AFTER DELETE ON store_closet BEGIN
+    INSERT INTO store_summary (store_name, item_count, retail_value,
+                               full_value, discount_total, discounted_count)
+    VALUES (old.store_name, -1, -old.price, -old.original_price,
+            -old.discount, -(old.discount > 0))
+    ON CONFLICT (store_name) DO UPDATE SET
+        item_count = item_count + excluded.item_count,
+        retail_value = retail_value + excluded.retail_value,
+        full_value = full_value + excluded.full_value,
+        discount_total = discount_total + excluded.discount_total,
+        discounted_count = discounted_count + excluded.discounted_count;
+    INSERT INTO store_type_summary (store_name, clothing_type, size,
+                                    item_count)
+    SELECT old.store_name, clothing_type, size, -1 FROM clothes
+    WHERE clothing_id = old.clothing_id
+    ON CONFLICT (store_name, clothing_type, size) DO UPDATE SET
+        item_count = item_count + excluded.item_count;
+END;
+
+-- A repricing only changes the store's value and discounts
+CREATE TRIGGER store_summary_reprice AFTER UPDATE ON store_closet
+WHEN new.store_name = old.store_name AND new.clothing_id = old.clothing_id
+BEGIN
+    UPDATE store_summary
+    SET retail_value = retail_value + new.price - old.price,
+        full_value = full_value + new.original_price - old.original_price,
+        discount_total = discount_total + new.discount - old.discount,
+        discounted_count = discounted_count + (new.discount > 0)
+            - (old.discount > 0)
+    WHERE store_name = new.store_name;
+END;
+
+CREATE TRIGGER store_summary_move AFTER UPDATE ON store_closet
+WHEN new.store_name <> old.store_name OR new.clothing_id <> old.clothing_id
+BEGIN
+    INSERT INTO store_summary (store_name, item_count, retail_value,
+                               full_value, discount_total, discounted_count)
+    VALUES (old.store_name, -1, -old.price, -old.original_price,
+            -old.discount, -(old.discount > 0)),
+           (new.store_name, 1, new.price, new.original_price, new.discount,
+            new.discount > 0)
+    ON CONFLICT (store_name) DO UPDATE SET
+        item_count = item_count + excluded.item_count,
+        retail_value = retail_value + excluded.retail_value,
+        full_value = full_value + excluded.full_value,
+        discount_total = discount_total + excluded.discount_total,
+        discounted_count = discounted_count + excluded.discounted_count;
+    INSERT INTO store_type_summary (store_name, clothing_type, size,
+                                    item_count)
+    SELECT old.store_name, clothing_type, size, -1 FROM clothes
+    WHERE clothing_id = old.clothing_id
+    ON CONFLICT (store_name, clothing_type, size) DO UPDATE SET
+        item_count = item_count + excluded.item_count;
+    INSERT INTO store_type_summary (store_name, clothing_type, size,
+                                    item_count)
+    SELECT new.store_name, clothing_type, size, 1 FROM clothes
+    WHERE clothing_id = new.clothing_id
+    ON CONFLICT (store_name, clothing_type, size) DO UPDATE SET
+        item_count = item_count + excluded.item_count;
+END;
+
+CREATE TRIGGER closet_summary_insert AFTER INSERT ON personal_closet BEGIN
+    INSERT INTO closet_summary (user_id, item_count, total_wears,
+                                clean_count, shared_count)
+    VALUES (new.user_id, 1, IFNULL(new.num_wears, 0),
+            IFNULL(new.is_clean, 0), new.shared)
+    ON CONFLICT (user_id) DO UPDATE SET
+        item_count = item_count + excluded.item_count,
+        total_wears = total_wears + excluded.total_wears,
+        clean_count = clean_count + excluded.clean_count,
+        shared_count = shared_count + excluded.shared_count;
+END;
+
+CREATE TRIGGER closet_summary_delete AFTER DELETE ON personal_closet BEGIN
+    INSERT INTO closet_summary (user_id, item_count, total_wears,
+                                clean_count, shared_count)
+    VALUES (old.user_id, -1, -IFNULL(old.num_wears, 0),
+            -IFNULL(old.is_clean, 0), -old.shared)
+    ON CONFLICT (user_id) DO UPDATE SET
+        item_count = item_count + excluded.item_count,
+        total_wears = total_wears + excluded.total_wears,
+        clean_count = clean_count + excluded.clean_count,
+        shared_count = shared_count + excluded.shared_count;
+END;
+
+CREATE TRIGGER closet_summary_update AFTER UPDATE ON personal_closet BEGIN
+    INSERT INTO closet_summary (user_id, item_count, total_wears,
+                                clean_count, shared_count)
+    VALUES (old.user_id, -1, -IFNULL(old.num_wears, 0),
+            -IFNULL(old.is_clean, 0), -old.shared),
+           (new.user_id, 1, IFNULL(new.num_wears, 0),
+            IFNULL(new.is_clean, 0), new.shared)
+    ON CONFLICT (user_id) DO UPDATE SET
+        item_count = item_count + excluded.item_count,
+        total_wears = total_wears + excluded.total_wears,
+        clean_count = clean_count + excluded.clean_count,
+        shared_count = shared_count + excluded.shared_count;
+END;
+
+-- By the time deleting clothes cascades to store_closet, the item's type
+-- and size are gone, so they are taken off the store's counts first
+CREATE TRIGGER store_type_summary_clothes_delete BEFORE DELETE ON clothes
+BEGIN
+    UPDATE store_type_summary SET item_count = item_count - 1
+    WHERE clothing_type = old.clothing_type AND size = old.size
+        AND store_name IN (SELECT store_name FROM store_closet
+                           WHERE clothing_id = old.clothing_id);
+END;
+
+-- Keep best_price current, like the best price triggers in
+-- setup-routines.sql. A listing cheaper than its product's best price
+-- takes its place (an upsert that only updates when it is cheaper); when
+-- the best listing is sold, removed, made dearer or moved, the product's
+-- cheapest listing is looked up again: an idx_type_size_color range (IS
+-- matches NULL colors and brands too, and still uses the index) and an
+-- idx_item_price lookup for each piece in it.
+CREATE TRIGGER best_price_insert AFTER INSERT ON store_closet BEGIN
+    INSERT INTO best_price (clothing_type, brand, size, color, price,
+                            store_name, clothing_id)
+    SELECT clothing_type, IFNULL(brand, ''), size, IFNULL(color, ''),
+        new.price, new.store_name, new.clothing_id
+    FROM clothes WHERE clothing_id = new.clothing_id
+    ON CONFLICT (clothing_type, brand, size, color) DO UPDATE SET
+        price = excluded.price,
+        store_name = excluded.store_name,
+        clothing_id = excluded.clothing_id
+    WHERE excluded.price < best_price.price;
+END;
+
+CREATE TRIGGER best_price_delete AFTER DELETE ON store_closet
+WHEN EXISTS (SELECT 1 FROM best_price
+             WHERE clothing_id = old.clothing_id
+                 AND store_name = old.store_name)
+BEGIN
+    DELETE FROM best_price
+    WHERE clothing_id = old.clothing_id AND store_name = old.store_name;
+    INSERT INTO best_price (clothing_type, brand, size, color, price,
+                            store_name, clothing_id)
+    SELECT c.clothing_type, IFNULL(c.brand, ''), c.size,
+        IFNULL(c.color, ''), s.price, s.store_name, s.clothing_id
+    FROM clothes AS o
+        JOIN clothes AS c ON c.clothing_type = o.clothing_type
+            AND c.size = o.size AND c.color IS o.color
+            AND c.brand IS o.brand
+        JOIN store_closet AS s ON s.clothing_id = c.clothing_id
+    WHERE o.clothing_id = old.clothing_id
+    ORDER BY s.price, s.store_name, s.clothing_id
+    LIMIT 1;
+END;
+
+CREATE TRIGGER best_price_update AFTER UPDATE ON store_closet
+WHEN (new.price > old.price OR new.store_name <> old.store_name
+        OR new.clothing_id <> old.clothing_id)
+    AND EXISTS (SELECT 1 FROM best_price
+                WHERE clothing_id = old.clothing_id
+                    AND store_name = old.store_name)
+BEGIN
+    DELETE FROM best_price
+    WHERE clothing_id = old.clothing_id AND store_name = old.store_name;
+    INSERT INTO best_price (clothing_type, brand, size, color, price,
+                            store_name, clothing_id)
+    SELECT c.clothing_type, IFNULL(c.brand, ''), c.size,
+        IFNULL(c.color, ''), s.price, s.store_name, s.clothing_id
+    FROM clothes AS o
+        JOIN clothes AS c ON c.clothing_type = o.clothing_type
+            AND c.size = o.size AND c.color IS o.color
+            AND c.brand IS o.brand
+        JOIN store_closet AS s ON s.clothing_id = c.clothing_id
+    WHERE o.clothing_id = old.clothing_id
+    ORDER BY s.price, s.store_name, s.clothing_id
+    LIMIT 1;
+END;
+
+-- A markdown, or a listing moved to another item, may be the new best
+-- price
+CREATE TRIGGER best_price_update_offer AFTER UPDATE ON store_closet BEGIN
+    INSERT INTO best_price (clothing_type, brand, size, color, price,
+                            store_name, clothing_id)
+    SELECT clothing_type, IFNULL(brand, ''), size, IFNULL(color, ''),
+        new.price, new.store_name, new.clothing_id
+    FROM clothes WHERE clothing_id = new.clothing_id
+    ON CONFLICT (clothing_type, brand, size, color) DO UPDATE SET
+        price = excluded.price,
+        store_name = excluded.store_name,
+        clothing_id = excluded.clothing_id
+    WHERE excluded.price < best_price.price;
+END;
+
+-- Deleting clothes cascades to their listings after the clothes row is
+-- gone, so the product's best price is looked up first, without them
+CREATE TRIGGER best_price_clothes_delete BEFORE DELETE ON clothes
+WHEN EXISTS (SELECT 1 FROM best_price WHERE clothing_id = old.clothing_id)
+BEGIN
+    DELETE FROM best_price WHERE clothing_id = old.clothing_id;
+    INSERT INTO best_price (clothing_type, brand, size, color, price,
+                            store_name, clothing_id)
+    SELECT c.clothing_type, IFNULL(c.brand, ''), c.size,
+        IFNULL(c.color, ''), s.price, s.store_name, s.clothing_id
+    FROM clothes AS c
+        JOIN store_closet AS s ON s.clothing_id = c.clothing_id
+    WHERE c.clothing_type = old.clothing_type AND c.size = old.size
+        AND c.color IS old.color AND c.brand IS old.brand
+        AND c.clothing_id <> old.clothing_id
+    ORDER BY s.price, s.store_name, s.clothing_id
+    LIMIT 1;
+END;
+
+-- Log every change of the tables change_log covers, like the change_log
+-- triggers in setup-routines.sql: an update that changes a row's key also
+-- logs the old key as deleted. SQLite fires these for rows deleted by ON
+-- DELETE CASCADE too, so deleting users, clothes or outfits needs nothing
+-- more.
+CREATE TRIGGER change_log_user_insert AFTER INSERT ON user
+BEGIN
+    INSERT INTO change_log (table_name, operation, user_id)
+    VALUES ('user', 'I', new.user_id);
+END;
+
+CREATE TRIGGER change_log_user_delete AFTER DELETE ON user
+BEGIN
+    INSERT INTO change_log (table_name, operation, user_id)
+    VALUES ('user', 'D', old.user_id);
+END;
+
+CREATE TRIGGER change_log_user_update AFTER UPDATE ON user
+BEGIN
+    INSERT INTO change_log (table_name, operation, user_id)
+    SELECT 'user', 'D', old.user_id
+    WHERE old.user_id IS NOT new.user_id;
+    INSERT INTO change_log (table_name, operation, user_id)
+    VALUES ('user', 'U', new.user_id);
+END;
+
+CREATE TRIGGER change_log_clothes_insert AFTER INSERT ON clothes
+BEGIN
+    INSERT INTO change_log (table_name, operation, clothing_id)
+    VALUES ('clothes', 'I', new.clothing_id);
+END;
+
+CREATE TRIGGER change_log_clothes_delete AFTER DELETE ON clothes
+BEGIN
+    INSERT INTO change_log (table_name, operation, clothing_id)
+    VALUES ('clothes', 'D', old.clothing_id);
+END;
+
+CREATE TRIGGER change_log_clothes_update AFTER UPDATE ON clothes
+BEGIN
+    INSERT INTO change_log (table_name, operation, clothing_id)
+    SELECT 'clothes', 'D', old.clothing_id
+    WHERE old.clothing_id IS NOT new.clothing_id;
+    INSERT INTO change_log (table_name, operation, clothing_id)
+    VALUES ('clothes', 'U', new.clothing_id);
+END;
+
+CREATE TRIGGER change_log_personal_closet_insert
+AFTER INSERT ON personal_closet
+BEGIN
+    INSERT INTO change_log (table_name, operation, user_id, clothing_id)
+    VALUES ('personal_closet', 'I', new.user_id, new.clothing_id);
+END;
+
+CREATE TRIGGER change_log_personal_closet_delete
+AFTER DELETE ON personal_closet
+BEGIN
+    INSERT INTO change_log (table_name, operation, user_id, clothing_id)
+    VALUES ('personal_closet', 'D', old.user_id, old.clothing_id);
+END;
+
+CREATE TRIGGER change_log_personal_closet_update
+AFTER UPDATE ON personal_closet
+BEGIN
+    INSERT INTO change_log (table_name, operation, user_id, clothing_id)
+    SELECT 'personal_closet', 'D', old.user_id, old.clothing_id
+    WHERE old.user_id IS NOT new.user_id
+        OR old.clothing_id IS NOT new.clothing_id;
+    INSERT INTO change_log (table_name, operation, user_id, clothing_id)
+    VALUES ('personal_closet', 'U', new.user_id, new.clothing_id);
+END;
+
+CREATE TRIGGER change_log_collab_closet_insert AFTER INSERT ON collab_closet
+BEGIN
+    INSERT INTO change_log (table_name, operation, user_id, clothing_id)
+    VALUES ('collab_closet', 'I', new.user_id, new.clothing_id);
+END;
+
+CREATE TRIGGER change_log_collab_closet_delete AFTER DELETE ON collab_closet
+BEGIN
+    INSERT INTO change_log (table_name, operation, user_id, clothing_id)
+    VALUES ('collab_closet', 'D', old.user_id, old.clothing_id);
+END;
+
+CREATE TRIGGER change_log_collab_closet_update AFTER UPDATE ON collab_closet
+BEGIN
+    INSERT INTO change_log (table_name, operation, user_id, clothing_id)
+    SELECT 'collab_closet', 'D', old.user_id, old.clothing_id
+    WHERE old.user_id IS NOT new.user_id
+        OR old.clothing_id IS NOT new.clothing_id;
+    INSERT INTO change_log (table_name, operation, user_id, clothing_id)
+    VALUES ('collab_closet', 'U', new.user_id, new.clothing_id);
+END;
+
+CREATE TRIGGER change_log_store_closet_insert AFTER INSERT ON store_closet
+BEGIN
+    INSERT INTO change_log (table_name, operation, store_name, clothing_id)
+    VALUES ('store_closet', 'I', new.store_name, new.clothing_id);
+END;
+
+CREATE TRIGGER change_log_store_closet_delete AFTER DELETE ON store_closet
+BEGIN
+    INSERT INTO change_log (table_name, operation, store_name, clothing_id)
+    VALUES ('store_closet', 'D', old.store_name, old.clothing_id);
+END;
+
+CREATE TRIGGER change_log_store_closet_update AFTER UPDATE ON store_closet
+BEGIN
+    INSERT INTO change_log (table_name, operation, store_name, clothing_id)
+    SELECT 'store_closet', 'D', old.store_name, old.clothing_id
+    WHERE old.store_name IS NOT new.store_name
+        OR old.clothing_id IS NOT new.clothing_id;
+    INSERT INTO change_log (table_name, operation, store_name, clothing_id)
+    VALUES ('store_closet', 'U', new.store_name, new.clothing_id);
+END;
+
+CREATE TRIGGER change_log_outfits_insert AFTER INSERT ON outfits
+BEGIN
+    INSERT INTO change_log (table_name, operation, outfit_id)
+    VALUES ('outfits', 'I', new.outfit_id);
+END;
+
+CREATE TRIGGER change_log_outfits_delete AFTER DELETE ON outfits
+BEGIN
+    INSERT INTO change_log (table_name, operation, outfit_id)
+    VALUES ('outfits', 'D', old.outfit_id);
+END;
+
+CREATE TRIGGER change_log_outfits_update AFTER UPDATE ON outfits
+BEGIN
+    INSERT INTO change_log (table_name, operation, outfit_id)
+    SELECT 'outfits', 'D', old.outfit_id
+    WHERE old.outfit_id IS NOT new.outfit_id;
+    INSERT INTO change_log (table_name, operation, outfit_id)
+    VALUES ('outfits', 'U', new.outfit_id);
+END;
+
+CREATE TRIGGER change_log_styled_outfits_insert AFTER INSERT ON styled_outfits
+BEGIN
+    INSERT INTO change_log (table_name, operation, outfit_id, clothing_id)
+    VALUES ('styled_outfits', 'I', new.outfit_id, new.clothing_id);
+END;
+
+CREATE TRIGGER change_log_styled_outfits_delete AFTER DELETE ON styled_outfits
+BEGIN
+    INSERT INTO change_log (table_name, operation, outfit_id, clothing_id)
+    VALUES ('styled_outfits', 'D', old.outfit_id, old.clothing_id);
+END;
+
+CREATE TRIGGER change_log_styled_outfits_update AFTER UPDATE ON styled_outfits
+BEGIN
+    INSERT INTO change_log (table_name, operation, outfit_id, clothing_id)
+    SELECT 'styled_outfits', 'D', old.outfit_id, old.clothing_id
+    WHERE old.outfit_id IS NOT new.outfit_id
+        OR old.clothing_id IS NOT new.clothing_id;
+    INSERT INTO change_log (table_name, operation, outfit_id, clothing_id)
+    VALUES ('styled_outfits', 'U', new.outfit_id, new.clothing_id);
+END;
@@ -3,7 +3,19 @@
 -- Setup file for defining and loading closet data
 
 -- Clean up old tables
+DROP TABLE IF EXISTS change_checkpoint;
+DROP TABLE IF EXISTS change_log;
+DROP TABLE IF EXISTS best_price;
+DROP TABLE IF EXISTS wear_rollup;
+DROP TABLE IF EXISTS wear_log;
+DROP TABLE IF EXISTS closet_summary;
+DROP TABLE IF EXISTS store_type_summary;
+DROP TABLE IF EXISTS store_summary;
+DROP TABLE IF EXISTS ingest_index;
+DROP TABLE IF EXISTS ingest_checkpoint;
+DROP TABLE IF EXISTS borrow_waitlist;
 DROP TABLE IF EXISTS styled_outfits;
+DROP TABLE IF EXISTS outfits;
 DROP TABLE IF EXISTS collab_closet;
 DROP TABLE IF EXISTS store_closet;
 DROP TABLE IF EXISTS personal_closet;
@@ -105,6 +117,9 @@ CREATE TABLE store_closet (
     -- cost of piece in USD, e.g. $52.10
     price             NUMERIC(10, 2) NOT NULL,
     discount          DECIMAL(4, 1) NOT NULL, -- percent discount, e.g. 35.2% off
+    -- cost of piece before any discount, so that repricing is always
+    -- price = original_price * (100 - discount) / 100
+    original_price    NUMERIC(10, 2) NOT NULL,
     PRIMARY KEY (store_name, clothing_id),
     -- Only existing clothing items can be part of a store's inventory, so
     -- must cascade
@@ -114,6 +129,15 @@ CREATE TABLE store_closet (
         ON UPDATE CASCADE
 );
 
+-- Stores one row per styled outfit. New outfits get their ID from
+-- AUTO_INCREMENT here, so nobody has to guess a free outfit ID.
+CREATE TABLE outfits (
+    outfit_id       INTEGER AUTO_INCREMENT,
+    outfit_desc     VARCHAR(250),
+    vibe            VARCHAR(250),
+    PRIMARY KEY (outfit_id)
+);
+
 -- Stores outfits created by clothing items in one or more closets
 CREATE TABLE styled_outfits (
     outfit_id       INTEGER,
@@ -123,6 +147,11 @@ CREATE TABLE styled_outfits (
     vibe            VARCHAR(250),
     -- Multiple clothing items can be a part of the same outfit
     PRIMARY KEY (outfit_id, clothing_id),
+    -- Every piece belongs to an outfit, so must cascade
+    FOREIGN KEY (outfit_id)
+        REFERENCES outfits(outfit_id)
+        ON DELETE CASCADE
+        ON UPDATE CASCADE,
     -- Only existing clothing items can be part of an outfit, so
     -- must cascade
     FOREIGN KEY (clothing_id)
@@ -131,6 +160,187 @@ CREATE TABLE styled_outfits (
         ON UPDATE CASCADE
 );
 
+-- Users waiting to borrow an item from the collaborative closet. When the
+-- item is returned it goes to the user with the lowest waitlist_id.
+CREATE TABLE borrow_waitlist (
+    -- Orders the waitlist: lower IDs joined earlier
+    waitlist_id     INTEGER AUTO_INCREMENT,
+    clothing_id     INTEGER NOT NULL,
+    user_id         INTEGER NOT NULL, -- user waiting for the item
+    joined_at       TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (waitlist_id),
+    -- A user waits for an item at most once
+    UNIQUE (clothing_id, user_id),
+    -- Only existing users can wait for items, so must cascade
+    FOREIGN KEY (user_id)
+        REFERENCES user(user_id)
+        ON DELETE CASCADE
+        ON UPDATE CASCADE
+);
+
 -- Creates an index on the current borrowers of a collaborative closet
 CREATE INDEX idx_borrower 
     ON collab_closet (current_borrower);
+
+-- Finds the closet of a username when they log in (see the login
+-- statement in statements.py)
+CREATE INDEX idx_user_username
+    ON user (username);
+
+-- Composite indexes for store searches (see store_search.py). Searches
+-- within one store use the store_name prefix with a price or discount
+-- range; searches across every store by discount use idx_discount.
+CREATE INDEX idx_store_price
+    ON store_closet (store_name, price);
+CREATE INDEX idx_store_discount
+    ON store_closet (store_name, discount);
+CREATE INDEX idx_discount
+    ON store_closet (discount, price);
+
+-- The stores selling an item, cheapest first (see prices.py)
+CREATE INDEX idx_item_price
+    ON store_closet (clothing_id, price);
+
+-- Searches by clothing type, optionally narrowed by size and color. The
+-- brand comes last so that every piece of a product is one range of it
+-- (see prices.py).
+CREATE INDEX idx_type_size_color
+    ON clothes (clothing_type, size, color, brand);
+
+-- Keyword searches over descriptions, brands and aesthetics (see
+-- text_search.py). InnoDB updates it as clothes are added or removed.
+CREATE FULLTEXT INDEX ft_clothes_text
+    ON clothes (description, brand, aesthetic);
+
+-- Progress of each CSV loaded by ingest.py. The row for a file is updated
+-- in the same transaction as every chunk of rows loaded from it, so an
+-- interrupted load resumes right after the last chunk it committed.
+CREATE TABLE ingest_checkpoint (
+    table_name      VARCHAR(64),
+    file_name       VARCHAR(255),
+    rows_read       BIGINT NOT NULL DEFAULT 0, -- CSV data rows handled
+    rows_loaded     BIGINT NOT NULL DEFAULT 0,
+    rows_rejected   BIGINT NOT NULL DEFAULT 0, -- failed validation
+    finished        TINYINT NOT NULL DEFAULT 0, -- 1 once the file is done
+    PRIMARY KEY (table_name, file_name)
+);
+
+-- Secondary indexes ingest.py dropped for a load, so they are rebuilt
+-- afterwards even if the load was interrupted
+CREATE TABLE ingest_index (
+    table_name      VARCHAR(64),
+    index_name      VARCHAR(64),
+    index_columns   VARCHAR(255) NOT NULL, -- e.g. 'store_name, price'
+    index_type      VARCHAR(16) NOT NULL DEFAULT 'BTREE', -- or FULLTEXT
+    PRIMARY KEY (table_name, index_name)
+);
+
+-- Summaries for the store and closet dashboards (see summaries.py), kept
+-- current by the triggers in setup-routines.sql, so a dashboard is a
+-- primary key lookup instead of a scan of the closets.
+
+-- Totals of each store's inventory
+CREATE TABLE store_summary (
+    store_name        VARCHAR(100),
+    item_count        INTEGER NOT NULL DEFAULT 0,
+    -- sum of the current (discounted) prices
+    retail_value      NUMERIC(14, 2) NOT NULL DEFAULT 0,
+    -- sum of the original prices
+    full_value        NUMERIC(14, 2) NOT NULL DEFAULT 0,
+    -- sum of the discounts, for the average discount
+    discount_total    NUMERIC(14, 1) NOT NULL DEFAULT 0,
+    -- items with any discount
+    discounted_count  INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (store_name)
+);
+
+-- Items of each clothing type and size in each store
+CREATE TABLE store_type_summary (
+    store_name        VARCHAR(100),
+    clothing_type     VARCHAR(100),
+    size              VARCHAR(20),
+    item_count        INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (store_name, clothing_type, size)
+);
+
+-- Use of each user's personal closet
+CREATE TABLE closet_summary (
+    user_id           INTEGER,
+    item_count        INTEGER NOT NULL DEFAULT 0,
+    total_wears       BIGINT NOT NULL DEFAULT 0,
+    clean_count       INTEGER NOT NULL DEFAULT 0,
+    shared_count      INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id)
+);
+
+-- Every time a user wore a piece of their personal closet (see wears.py).
+-- Logging a wear only appends a row here, so it never waits on a lock
+-- of the personal_closet row; roll-ups add the logged wears up into
+-- personal_closet.num_wears in batches.
+CREATE TABLE wear_log (
+    wear_id           BIGINT AUTO_INCREMENT,
+    user_id           INTEGER NOT NULL,
+    clothing_id       INTEGER NOT NULL,
+    worn_on           DATE NOT NULL,
+    -- the roll-up that added this wear up, NULL until one has
+    rollup_id         INTEGER,
+    PRIMARY KEY (wear_id),
+    -- finds the wears still to add up, and each piece's wears in a
+    -- roll-up
+    INDEX idx_wear_rollup (rollup_id, user_id, clothing_id)
+);
+
+-- Each roll-up of logged wears and how many it added up
+CREATE TABLE wear_rollup (
+    rollup_id         INTEGER AUTO_INCREMENT,
+    rolled_up_at      TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    wears             INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (rollup_id)
+);
+
+-- The cheapest listing in any store of each product: pieces of the same
+-- clothing type, brand, size and color, which are interchangeable to a
+-- shopper (a missing brand or color is ''). Triggers in
+-- setup-routines.sql keep it current as items are listed, repriced and
+-- sold, so the best price of a piece is one primary key lookup (see
+-- prices.py).
+CREATE TABLE best_price (
+    clothing_type     VARCHAR(100),
+    brand             VARCHAR(150),
+    size              VARCHAR(20),
+    color             VARCHAR(50),
+    price             NUMERIC(10, 2) NOT NULL,
+    -- the listing with that price
+    store_name        VARCHAR(100) NOT NULL,
+    clothing_id       INTEGER NOT NULL,
+    PRIMARY KEY (clothing_type, brand, size, color),
+    -- finds whether a listing is the best price of its product
+    INDEX idx_best_price_listing (clothing_id, store_name)
+);
+
+-- Every insert, update and delete of users, clothes, the closets, store
+-- inventories and outfits, in the order they were made, written by the
+-- triggers in setup-routines.sql so that caches, search indexes and
+-- exports can catch up on what changed instead of rescanning the tables
+-- (see changes.py). A change names the row by its primary key; the
+-- columns that are not part of the table's key are NULL.
+CREATE TABLE change_log (
+    change_id       BIGINT AUTO_INCREMENT,
+    table_name      VARCHAR(64) NOT NULL,
+    operation       CHAR(1) NOT NULL, -- 'I'nsert, 'U'pdate or 'D'elete
+    user_id         INTEGER,
+    clothing_id     INTEGER,
+    outfit_id       INTEGER,
+    store_name      VARCHAR(100),
+    changed_at      TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (change_id)
+);
+
+-- How far each consumer of change_log has got; changes every consumer
+-- has handled can be pruned
+CREATE TABLE change_checkpoint (
+    consumer        VARCHAR(255),
+    -- every change up to this one has been handled
+    change_id       BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (consumer)
+);
@@ -0,0 +1,145 @@
+"""
+Embedded stand-in for the Closetly MySQL database, backed by SQLite. It
+accepts the same %s-style statements and cursor options as
+mysql.connector, so statements.py and the benchmarks can run without a
+MySQL server. The schema comes from setup-sqlite.sql. MySQL stored
+routines (authenticate, borrow_item, sell_to_user, ...) are not available
+(routines.py has versions that run here), but the MySQL functions the
+statements use (SHA2, CONCAT) are. backends.py opens it for the app and
+the API.
+"""
+import hashlib
+import os
+import sqlite3
+
+SCHEMA_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           'setup-sqlite.sql')
+
+
+class StandInCursor:
+    """
+    Wraps an sqlite3 cursor to look like a mysql.connector cursor.
+    """
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def execute(self, operation, params=()):
+        self._cursor.execute(_convert(operation), tuple(params))
+
+    def executemany(self, operation, seq_params):
+        self._cursor.executemany(_convert(operation), seq_params)
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchmany(self, size=1):
+        return self._cursor.fetchmany(size)
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    @property
+    def lastrowid(self):
+        return self._cursor.lastrowid
+
+    def close(self):
+        self._cursor.close()
+
+
+class StandInConnection:
+    """
+    Wraps an sqlite3 connection to look like a mysql.connector connection.
+    """
+    # lets callers tell the stand-in apart from a real MySQL connection
+    is_standin = True
+
+    def __init__(self, path=':memory:'):
+        # 'file:' paths are URIs, e.g. of a shared in-memory database
+        self._db = sqlite3.connect(path, check_same_thread=False,
+                                   uri=path.startswith('file:'))
+        self._db.execute('PRAGMA foreign_keys = ON')
+        self._db.create_function('SHA2', 2, _sha2, deterministic=True)
+        self._db.create_function('CONCAT', -1, _concat, deterministic=True)
+
+    def cursor(self, prepared=False, buffered=False):
+        # sqlite3 caches compiled statements itself, and results are read
+        # lazily, so both options are accepted and need no extra work
+        return StandInCursor(self._db.cursor())
+
+    def create_schema(self):
+        """
+        (Re)creates every Closetly table from setup-sqlite.sql.
+        """
+        with open(SCHEMA_FILE) as f:
+            self._db.executescript(f.read())
+
+    def has_schema(self):
+        """
+        Returns whether the Closetly tables have been created.
+        """
+        return self._db.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' "
+            "AND name = 'clothes'").fetchone() is not None
+
+    def commit(self):
+        self._db.commit()
+
+    def rollback(self):
+        self._db.rollback()
+
+    def ping(self, reconnect=False):
+        self._db.execute('SELECT 1')
+
+    def is_connected(self):
+        return True
+
+    def close(self):
+        self._db.close()
+
+
+def connect(path=':memory:', create_schema=True):
+    """
+    Opens a stand-in database (in memory by default, or in a file) and,
+    unless told otherwise, creates the Closetly schema in it.
+    """
+    conn = StandInConnection(path)
+    if create_schema:
+        conn.create_schema()
+    return conn
+
+
+def is_standin(conn):
+    """
+    Returns whether conn is a stand-in rather than a MySQL connection.
+    """
+    return getattr(conn, 'is_standin', False)
+
+
+def _sha2(value, bits):
+    """
+    MySQL's SHA2(): the hex digest of a SHA-2 hash of the given length.
+    """
+    if value is None or bits not in (0, 224, 256, 384, 512):
+        return None
+    return hashlib.new('sha' + str(bits or 256), value.encode()).hexdigest()
+
+
+def _concat(*values):
+    """
+    MySQL's CONCAT(): NULL if any value is NULL.
+    """
+    if any(value is None for value in values):
+        return None
+    return ''.join(str(value) for value in values)
+
+
+def _convert(sql):
+    """
+    Converts mysql.connector's %s placeholders to sqlite3's ? placeholders.
+    """
+    return sql.replace('%s', '?')
@@ -0,0 +1,209 @@
+"""
+Cold-start benchmark of the command-line app. Starts a fresh Python
+process many times, each importing app.py the way `python3 app.py` does
+before it shows the login prompt, and reports the wall time of each start
+(p50/p95/p99), the time spent importing app itself and the peak memory of
+the process. The modules app imports are broken down by import time (from
+python -X importtime), and the dependencies the app only loads when a
+feature needs them are timed on their own, so you can see what lazy
+loading saves.
+
+Usage:
+    $ python3 startup_benchmark.py --runs 30
+    $ python3 startup_benchmark.py --runs 30 --out startup.json
+    $ python3 startup_benchmark.py --compare startup.json
+
+Needs no database: nothing is connected to until the user logs in.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import benchmark
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Runs of each measurement
+RUNS = 20
+# Modules shown in the import-time breakdown
+SHOWN_MODULES = 15
+# Dependencies only loaded when a feature needs them, and the feature
+DEFERRED = [
+    ('mysql.connector', 'connecting (on a thread, behind the login prompt)'),
+    ('numpy', 'outfit recommendations'),
+    ('pandas', 'nothing any more (tables.py prints the tables)'),
+    ('sqlite3', 'the stand-in database'),
+]
+
+# Imports a module in a fresh process and prints how long it took (in
+# seconds) and the peak memory of the process (in KB)
+_CHILD = """import time
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+import resource
+print(seconds, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)"""
+
+
+def _clean_env():
+    env = dict(os.environ)
+    # measure starts that can use the cached bytecode, as installs do
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    return env
+
+
+def cold_start(module, importtime=False):
+    """
+    Imports a module in a fresh Python process. Returns (wall seconds of
+    the whole process, seconds importing the module, peak RSS in KB, the
+    -X importtime output or None).
+    """
+    command = [sys.executable]
+    if importtime:
+        command += ['-X', 'importtime']
+    command += ['-c', _CHILD.format(module=module)]
+    start = time.perf_counter()
+    done = subprocess.run(command, cwd=HERE, env=_clean_env(),
+                          capture_output=True, text=True)
+    wall = time.perf_counter() - start
+    if done.returncode != 0:
+        raise RuntimeError(done.stderr.strip().splitlines()[-1])
+    seconds, rss = done.stdout.split()
+    return wall, float(seconds), int(rss), \
+        done.stderr if importtime else None
+
+
+def import_breakdown(importtime_output, module):
+    """
+    Returns [(module, cumulative ms)] of the modules `module` imports
+    directly (and so everything they import in turn), slowest first.
+    """
+    lines = []
+    for line in importtime_output.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, _, rest = line.partition(':')
+        _, cumulative, name = rest.split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        lines.append((depth, name.strip(), int(cumulative) / 1000))
+    # importtime lists a module after everything it imported, so the
+    # direct imports of `module` are the lines one level deeper before it
+    breakdown = []
+    for i, (depth, name, ms) in enumerate(lines):
+        if name == module:
+            root = depth
+            j = i - 1
+            while j >= 0 and lines[j][0] > root:
+                if lines[j][0] == root + 1:
+                    breakdown.append((lines[j][1], lines[j][2]))
+                j -= 1
+            break
+    return sorted(breakdown, key=lambda item: -item[1])
+
+
+def run(runs):
+    """
+    Measures `runs` cold starts of the app, a bare interpreter for
+    comparison, and each deferred dependency. Returns the results.
+    """
+    def measure(module):
+        walls, imports, rss = [], [], []
+        cold_start(module)  # writes any missing cached bytecode
+        start = time.perf_counter()
+        for _ in range(runs):
+            wall, seconds, kb = cold_start(module)[:3]
+            walls.append(wall)
+            imports.append(seconds)
+            rss.append(kb)
+        elapsed = time.perf_counter() - start
+        return {'start': benchmark.summarize(walls, elapsed),
+                'import': benchmark.summarize(imports, elapsed),
+                'peak_rss_kb': max(rss)}
+
+    results = {'python': measure('sys'), 'app': measure('app')}
+    output = cold_start('app', importtime=True)[3]
+    results['app_imports'] = [
+        {'module': name, 'ms': round(ms, 2)}
+        for name, ms in import_breakdown(output, 'app')]
+    results['deferred'] = []
+    for module, needed_for in DEFERRED:
+        try:
+            _, seconds, kb = cold_start(module)[:3]
+        except RuntimeError:
+            results['deferred'].append({'module': module,
+                                        'needed_for': needed_for,
+                                        'installed': False})
+            continue
+        results['deferred'].append({'module': module,
+                                    'needed_for': needed_for,
+                                    'installed': True,
+                                    'ms': round(seconds * 1000, 2),
+                                    'peak_rss_kb': kb})
+    return results
+
+
+def print_results(results, baseline=None):
+    print('start'.ljust(24) + 'p50 ms'.rjust(10) + 'p95 ms'.rjust(10) +
+          'p99 ms'.rjust(10) + 'peak MB'.rjust(10) + 'p50 chg'.rjust(10))
+    for name, label in (('python', 'bare interpreter'),
+                        ('app', 'python3 app.py')):
+        r = results[name]
+        line = label.ljust(24) + \
+            ('%.1f' % r['start']['p50_ms']).rjust(10) + \
+            ('%.1f' % r['start']['p95_ms']).rjust(10) + \
+            ('%.1f' % r['start']['p99_ms']).rjust(10) + \
+            ('%.1f' % (r['peak_rss_kb'] / 1024)).rjust(10)
+        if baseline:
+            line += benchmark._change(baseline[name]['start']['p50_ms'],
+                                      r['start']['p50_ms']).rjust(10)
+        print(line)
+    print('Importing app: p50 %.1f ms, p95 %.1f ms' %
+          (results['app']['import']['p50_ms'],
+           results['app']['import']['p95_ms']))
+    print('\nSlowest imports of app (cumulative ms):')
+    for item in results['app_imports'][:SHOWN_MODULES]:
+        print('  ' + item['module'].ljust(22) + ('%.2f' % item['ms']).rjust(8))
+    print('\nLoaded only when needed:')
+    for item in results['deferred']:
+        if item['installed']:
+            cost = ('%.1f ms' % item['ms']).rjust(10) + \
+                ('%.1f MB' % (item['peak_rss_kb'] / 1024)).rjust(10)
+        else:
+            cost = 'not installed'.rjust(20)
+        print('  ' + item['module'].ljust(18) + cost + '  ' +
+              item['needed_for'])
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark how fast the app starts.')
+    parser.add_argument('--runs', type=int, default=RUNS,
+                        help='cold starts per measurement (default ' +
+                             str(RUNS) + ')')
+    parser.add_argument('--out', help='save results as a JSON baseline')
+    parser.add_argument('--compare', metavar='BASELINE',
+                        help='compare with a saved JSON baseline')
+    args = parser.parse_args()
+
+    results = run(args.runs)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+    print_results(results, baseline)
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump({'meta': {'runs': args.runs,
+                                'python': sys.version.split()[0],
+                                'platform': platform.platform(),
+                                'time': time.strftime('%Y-%m-%dT%H:%M:%S')},
+                       'results': results}, f, indent=2)
+        print('Saved results to ' + args.out)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,444 @@
+"""
+Named, parameterized SQL statements used by the Closetly app, and helpers
+to run them through server-side prepared cursors.
+
+Each connection keeps one prepared cursor per statement name, so the first
+call to a statement on a connection prepares it on the server and every
+later call only sends the parameters. Because connections are reused by the
+pools in pool.py, the prepared statements live as long as the connection.
+Parameters are always sent separately from the SQL text, so user input can
+never change the meaning of a statement.
+"""
+import weakref
+
+import querystats
+
+# Column lists shared by several statements
+CLOTHES_COLUMNS = """clothing_id, clothing_type, size, gender, color, brand,
+    description, image_url, aesthetic"""
+
+STORE_ITEM_COLUMNS = """clothing_id, price, discount, clothing_type, size,
+    gender, color, brand, description, image_url, aesthetic"""
+
+# A piece, the lowest price of that exact piece in any store (an
+# idx_item_price lookup), and the best price of its product (a primary key
+# lookup on best_price), for the price comparison statements
+BEST_PRICE_COLUMNS = """c.clothing_id, c.clothing_type, c.brand, c.size,
+    c.color,
+    (SELECT MIN(s.price) FROM store_closet AS s
+     WHERE s.clothing_id = c.clothing_id) AS item_price,
+    b.price, b.store_name, b.clothing_id"""
+
+BEST_PRICE_JOIN = """LEFT JOIN best_price AS b
+    ON b.clothing_type = c.clothing_type AND b.brand = IFNULL(c.brand, '')
+        AND b.size = c.size AND b.color = IFNULL(c.color, '')"""
+
+# A change_log row, as changes.Change
+CHANGE_COLUMNS = """change_id, table_name, operation, user_id, clothing_id,
+    outfit_id, store_name, changed_at"""
+
+STATEMENTS = {
+    # ------------------------------------------------------------------
+    # Logging users in
+    # ------------------------------------------------------------------
+    'check_username':
+        'SELECT COUNT(*) FROM user_info WHERE username = %s',
+    'authenticate':
+        'SELECT authenticate(%s, %s)',
+    'get_permission':
+        'SELECT role FROM permissions WHERE username = %s',
+    'get_user_id':
+        'SELECT user_id FROM user WHERE username = %s',
+    # Creating an account (see routines.add_account)
+    'add_permission':
+        'INSERT INTO permissions (username, role) VALUES (%s, %s)',
+    'add_password':
+        """INSERT INTO user_info (username, salt, password_hash)
+        VALUES (%s, %s, %s)""",
+    'add_user':
+        'INSERT INTO user (name, username) VALUES (%s, %s)',
+    # Checks the password and finds the role and closet of an account in
+    # one round trip, by primary key on user_info and permissions and by
+    # idx_user_username on user. No row means there is no such username.
+    'login':
+        """SELECT i.password_hash = SHA2(CONCAT(i.salt, %s), 256),
+            p.role, u.user_id
+        FROM user_info AS i
+            LEFT JOIN permissions AS p ON p.username = i.username
+            LEFT JOIN user AS u ON u.username = i.username
+        WHERE i.username = %s
+        ORDER BY u.user_id
+        LIMIT 1""",
+
+    # ------------------------------------------------------------------
+    # Closets
+    # ------------------------------------------------------------------
+    'personal_clothes':
+        'SELECT ' + CLOTHES_COLUMNS + """, is_clean, shared, num_wears
+        FROM clothes NATURAL JOIN personal_closet NATURAL JOIN user
+        WHERE username = %s""",
+    'user_in_collab':
+        'SELECT ' + CLOTHES_COLUMNS + """, curr_condition, is_available,
+        current_borrower
+        FROM collab_closet NATURAL JOIN clothes
+        WHERE user_id = %s""",
+    'borrow_item':
+        'SELECT borrow_item(%s, %s)',
+
+    # ------------------------------------------------------------------
+    # Borrowing (see borrowing.py). Items are claimed and released with
+    # conditional UPDATEs on collab_closet's clothing_id index, so the row
+    # lock taken by the UPDATE is the only synchronization needed.
+    # ------------------------------------------------------------------
+    'claim_item':
+        """UPDATE collab_closet
+        SET is_available = 0, current_borrower = %s
+        WHERE clothing_id = %s AND is_available = 1 AND user_id <> %s""",
+    'release_item':
+        """UPDATE collab_closet
+        SET is_available = 1, current_borrower = NULL
+        WHERE clothing_id = %s AND current_borrower = %s""",
+    'join_waitlist':
+        """INSERT INTO borrow_waitlist (clothing_id, user_id)
+        SELECT c.clothing_id, %s FROM collab_closet AS c
+        WHERE c.clothing_id = %s AND c.user_id <> %s
+            AND (c.current_borrower IS NULL OR c.current_borrower <> %s)
+            AND NOT EXISTS (SELECT 1 FROM borrow_waitlist AS w
+                            WHERE w.clothing_id = %s AND w.user_id = %s)""",
+    'leave_waitlist':
+        'DELETE FROM borrow_waitlist WHERE clothing_id = %s AND user_id = %s',
+    'waitlist_head':
+        """SELECT user_id FROM borrow_waitlist WHERE clothing_id = %s
+        ORDER BY waitlist_id LIMIT 1""",
+    'waitlist_position':
+        """SELECT COUNT(*) FROM borrow_waitlist
+        WHERE clothing_id = %s AND waitlist_id <=
+            (SELECT waitlist_id FROM borrow_waitlist
+             WHERE clothing_id = %s AND user_id = %s)""",
+    # An item of a type, size and color that a user can wear: a clean
+    # piece of their own, else an available piece someone else shares.
+    # Each branch is an idx_type_size_color lookup that stops at the
+    # first match. Params: (type, size, color, user_id) twice.
+    'find_available':
+        """SELECT * FROM (SELECT c.clothing_id, 'personal' AS source
+            FROM clothes AS c JOIN personal_closet AS p
+                ON p.clothing_id = c.clothing_id
+            WHERE c.clothing_type = %s AND c.size = %s AND c.color = %s
+                AND p.user_id = %s AND p.is_clean = 1
+            LIMIT 1) AS mine
+        UNION ALL
+        SELECT * FROM (SELECT c.clothing_id, 'collab' AS source
+            FROM clothes AS c JOIN collab_closet AS cc
+                ON cc.clothing_id = c.clothing_id
+            WHERE c.clothing_type = %s AND c.size = %s AND c.color = %s
+                AND cc.user_id <> %s AND cc.is_available = 1
+            LIMIT 1) AS shared
+        LIMIT 1""",
+
+    # Keyset-paginated browsing: each page starts after the last
+    # clothing_id of the previous one, so every page is an index range scan
+    # no matter how deep into the catalog it is.
+    'all_clothes_page':
+        'SELECT ' + CLOTHES_COLUMNS + """, store_name FROM clothes
+        WHERE clothing_id > %s
+        ORDER BY clothing_id LIMIT %s""",
+    'collab_clothes_page':
+        'SELECT user_id, ' + CLOTHES_COLUMNS + """, curr_condition,
+        is_available, current_borrower
+        FROM collab_closet NATURAL JOIN clothes
+        WHERE clothing_id > %s
+        ORDER BY clothing_id LIMIT %s""",
+
+    # ------------------------------------------------------------------
+    # Store inventories
+    # ------------------------------------------------------------------
+    'store_inventory_page':
+        'SELECT ' + STORE_ITEM_COLUMNS + """
+        FROM store_closet NATURAL JOIN clothes
+        WHERE store_name = %s AND clothing_id > %s
+        ORDER BY clothing_id LIMIT %s""",
+    'reprice_item':
+        """UPDATE store_closet
+        SET discount = %s, price = ROUND(original_price * (100 - %s) / 100, 2)
+        WHERE store_name = %s AND clothing_id = %s""",
+    'add_store_item':
+        """INSERT INTO store_closet (store_name, clothing_id, original_price,
+            discount, price)
+        VALUES (%s, %s, %s, %s, ROUND(%s * (100 - %s) / 100, 2))""",
+    'remove_store_item':
+        'DELETE FROM store_closet WHERE clothing_id = %s AND store_name = %s',
+    # checked before listing a piece, so a missing piece or a listing
+    # the store already has is reported rather than failing a constraint
+    'clothing_exists':
+        'SELECT COUNT(*) FROM clothes WHERE clothing_id = %s',
+    'store_item_exists':
+        """SELECT COUNT(*) FROM store_closet
+        WHERE store_name = %s AND clothing_id = %s""",
+    # sell_to_user (see routines.py) and checkout.py: moving an item from
+    # a store into the buyer's closet
+    'sell_item':
+        'DELETE FROM store_closet WHERE store_name = %s AND clothing_id = %s',
+    'user_exists':
+        'SELECT COUNT(*) FROM user WHERE user_id = %s',
+    'add_bought_item':
+        """INSERT INTO personal_closet
+            (user_id, clothing_id, is_clean, shared, num_wears)
+        VALUES (%s, %s, 1, 0, 0)""",
+
+    # ------------------------------------------------------------------
+    # Dashboards (see summaries.py): primary key lookups on the summary
+    # tables, which triggers keep current
+    # ------------------------------------------------------------------
+    'store_summary':
+        """SELECT item_count, retail_value, full_value, discount_total,
+            discounted_count
+        FROM store_summary WHERE store_name = %s""",
+    'store_type_summary':
+        """SELECT clothing_type, size, item_count FROM store_type_summary
+        WHERE store_name = %s AND item_count > 0
+        ORDER BY item_count DESC, clothing_type, size""",
+    'all_store_summaries':
+        """SELECT store_name, item_count, retail_value, full_value,
+            discount_total, discounted_count
+        FROM store_summary WHERE item_count > 0
+        ORDER BY store_name""",
+    'closet_summary':
+        """SELECT item_count, total_wears, clean_count, shared_count
+        FROM closet_summary WHERE user_id = %s""",
+
+    # ------------------------------------------------------------------
+    # Wears (see wears.py). Logging a wear only appends to wear_log; a
+    # roll-up claims the wears not yet added up and adds them up with one
+    # UPDATE of personal_closet and one of collab_closet.
+    # ------------------------------------------------------------------
+    'log_wear':
+        """INSERT INTO wear_log (user_id, clothing_id, worn_on)
+        VALUES (%s, %s, %s)""",
+    'first_pending_wear':
+        'SELECT MIN(wear_id) FROM wear_log WHERE rollup_id IS NULL',
+    'start_wear_rollup':
+        'INSERT INTO wear_rollup (wears) VALUES (0)',
+    'claim_wears':
+        """UPDATE wear_log SET rollup_id = %s
+        WHERE rollup_id IS NULL AND wear_id < %s""",
+    # a subquery rather than UPDATE ... JOIN, which SQLite lacks
+    'add_wears':
+        """UPDATE personal_closet
+        SET num_wears = IFNULL(num_wears, 0) +
+                (SELECT COUNT(*) FROM wear_log AS w
+                 WHERE w.rollup_id = %s
+                    AND w.user_id = personal_closet.user_id
+                    AND w.clothing_id = personal_closet.clothing_id),
+            is_clean = 0
+        WHERE (user_id, clothing_id) IN
+            (SELECT user_id, clothing_id FROM wear_log
+             WHERE rollup_id = %s)""",
+    'wear_out_collab':
+        """UPDATE collab_closet SET curr_condition = 'used'
+        WHERE (curr_condition = 'new' OR curr_condition IS NULL)
+            AND clothing_id IN
+                (SELECT p.clothing_id
+                 FROM wear_log AS w JOIN personal_closet AS p
+                    ON p.user_id = w.user_id
+                        AND p.clothing_id = w.clothing_id
+                 WHERE w.rollup_id = %s AND p.num_wears > %s)""",
+    'finish_wear_rollup':
+        'UPDATE wear_rollup SET wears = %s WHERE rollup_id = %s',
+
+    # ------------------------------------------------------------------
+    # Price comparison (see prices.py): the best price of each piece is
+    # read from best_price, which triggers keep current, so comparing
+    # every store costs the same as looking in one
+    # ------------------------------------------------------------------
+    'item_best_price':
+        'SELECT ' + BEST_PRICE_COLUMNS + """
+        FROM clothes AS c """ + BEST_PRICE_JOIN + """
+        WHERE c.clothing_id = %s""",
+    'outfit_best_prices':
+        'SELECT ' + BEST_PRICE_COLUMNS + """
+        FROM styled_outfits AS o
+            JOIN clothes AS c ON c.clothing_id = o.clothing_id
+            """ + BEST_PRICE_JOIN + """
+        WHERE o.outfit_id = %s
+        ORDER BY c.clothing_id""",
+
+    # ------------------------------------------------------------------
+    # Change log (see changes.py): primary key range scans of change_log,
+    # which triggers append to
+    # ------------------------------------------------------------------
+    'changes_after':
+        'SELECT ' + CHANGE_COLUMNS + """
+        FROM change_log WHERE change_id > %s
+        ORDER BY change_id LIMIT %s""",
+    'recent_changes':
+        """SELECT change_id, changed_at FROM change_log
+        WHERE change_id <= %s ORDER BY change_id DESC LIMIT %s""",
+    'last_change':
+        'SELECT MAX(change_id) FROM change_log',
+    'first_change':
+        'SELECT MIN(change_id) FROM change_log',
+    'change_checkpoint':
+        'SELECT change_id FROM change_checkpoint WHERE consumer = %s',
+    'move_change_checkpoint':
+        'UPDATE change_checkpoint SET change_id = %s WHERE consumer = %s',
+    'add_change_checkpoint':
+        """INSERT INTO change_checkpoint (change_id, consumer)
+        VALUES (%s, %s)""",
+
+    # ------------------------------------------------------------------
+    # Offline mirrors (see mirror.py): the rows a mirror copies. Syncs
+    # fetch changed rows again by adding a clothing_id IN list.
+    # ------------------------------------------------------------------
+    'mirror_personal':
+        'SELECT ' + CLOTHES_COLUMNS + """, is_clean, shared, num_wears
+        FROM clothes NATURAL JOIN personal_closet
+        WHERE user_id = %s""",
+    'mirror_collab':
+        'SELECT user_id, ' + CLOTHES_COLUMNS + """, curr_condition,
+        is_available, current_borrower
+        FROM collab_closet NATURAL JOIN clothes""",
+    'mirror_store':
+        'SELECT store_name, ' + STORE_ITEM_COLUMNS + """
+        FROM store_closet NATURAL JOIN clothes
+        WHERE store_name = %s""",
+
+    # ------------------------------------------------------------------
+    # Outfits
+    # ------------------------------------------------------------------
+    'outfit_pieces':
+        """SELECT outfit_id, clothing_id, outfit_desc, vibe FROM styled_outfits
+        WHERE outfit_id = %s""",
+}
+
+# collapsed SQL text -> statement name, built on first use
+_names = None
+
+
+def statement_name(statement):
+    """
+    Returns the name of a statement given by its collapsed SQL text (see
+    querystats.statement_key), or None if it is not a named statement.
+    """
+    global _names
+    if _names is None:
+        _names = {querystats.statement_key(sql): name
+                  for name, sql in STATEMENTS.items()}
+    return _names.get(statement)
+
+
+# connection -> {statement name: prepared cursor}. Entries go away with
+# their connection.
+_cursor_cache = weakref.WeakKeyDictionary()
+
+
+def prepared_cursor(conn, name):
+    """
+    Returns the prepared cursor for the named statement on this connection,
+    creating it the first time the statement is used on the connection.
+    """
+    cursors = _cursor_cache.get(conn)
+    if cursors is None:
+        cursors = _cursor_cache[conn] = {}
+    cursor = cursors.get(name)
+    if cursor is None:
+        cursor = cursors[name] = conn.cursor(prepared=True)
+    return cursor
+
+
+def execute(conn, name, params=()):
+    """
+    Runs the named statement with the given parameters and returns the
+    cursor (e.g. to read rowcount after an INSERT/UPDATE/DELETE).
+    """
+    return execute_sql(conn, STATEMENTS[name], params, key=name)
+
+
+def execute_sql(conn, sql, params=(), key=None):
+    """
+    Runs a statement whose text is built at run time (e.g. by store_search).
+    Its prepared cursor is cached under the SQL text, so every call with
+    the same shape of query reuses the same server-side statement.
+    """
+    cursor = prepared_cursor(conn, key or sql)
+    cursor.execute(sql, tuple(params))
+    return cursor
+
+
+def fetch_all(conn, name, params=()):
+    """
+    Runs the named query and returns all of its rows.
+    """
+    timer = querystats.Timer(STATEMENTS[name], params)
+    try:
+        rows = execute(conn, name, params).fetchall()
+    except Exception:
+        timer.finish(error=True)
+        raise
+    timer.fetched(rows)
+    timer.finish(conn)
+    return rows
+
+
+def fetch_one(conn, name, params=()):
+    """
+    Runs the named query and returns its first row, or None if there are
+    no rows.
+    """
+    # read the whole result so the cursor can be reused right away
+    rows = fetch_all(conn, name, params)
+    return rows[0] if rows else None
+
+
+def fetch_value(conn, name, params=()):
+    """
+    Runs the named query and returns the first column of its first row,
+    or None if there are no rows.
+    """
+    row = fetch_one(conn, name, params)
+    return row[0] if row else None
+
+
+def stream(conn, name, params=(), batch_size=100):
+    """
+    Runs the named query and yields its rows as they arrive from the server
+    instead of reading the whole result into memory first. Rows the caller
+    does not consume are discarded when the generator is closed, so the
+    connection is always left ready for the next statement.
+    """
+    return stream_sql(conn, STATEMENTS[name], params, batch_size, key=name)
+
+
+def stream_sql(conn, sql, params=(), batch_size=100, key=None):
+    """
+    Same as stream, for a statement built at run time.
+    """
+    timer = querystats.Timer(sql, params)
+    try:
+        cursor = execute_sql(conn, sql, params, key)
+    except Exception:
+        timer.finish(error=True)
+        raise
+    timer.pause()
+    return _stream(conn, cursor, batch_size, timer)
+
+
+def _stream(conn, cursor, batch_size, timer):
+    # only the time spent executing and fetching is counted, not the time
+    # the caller spends between rows
+    finished = False
+    try:
+        while True:
+            timer.resume()
+            rows = cursor.fetchmany(batch_size)
+            timer.pause()
+            if not rows:
+                finished = True
+                return
+            timer.fetched(rows)
+            yield from rows
+    finally:
+        timer.resume()
+        if not finished:
+            # drain the rows the caller stopped reading
+            cursor.fetchall()
+        timer.finish(conn)
@@ -0,0 +1,168 @@
+"""
+Composable search over store inventories. Any mix of store, price range,
+discount range, clothing type, size, color, gender, aesthetic and sort order
+is compiled into a single parameterized query that the composite indexes in
+setup.sql can serve, and results are paged with keyset pagination.
+"""
+import statements as stmts
+from cache import query_cache
+
+# Number of rows shown per page
+PAGE_SIZE = 20
+
+SEARCH_COLUMNS = ['store_name', 'clothing_id', 'price', 'discount',
+                  'clothing_type', 'size', 'gender', 'color', 'brand',
+                  'description', 'image_url', 'aesthetic']
+
+# Filters that are compared for equality, and the column they apply to
+EQUALITY_FILTERS = {
+    'store_name': 's.store_name',
+    'clothing_type': 'c.clothing_type',
+    'size': 'c.size',
+    'color': 'c.color',
+    'gender': 'c.gender',
+    'aesthetic': 'c.aesthetic',
+}
+
+# Filters that bound a range, and the column and comparison they use
+RANGE_FILTERS = {
+    'min_price': ('s.price', '>='),
+    'max_price': ('s.price', '<='),
+    'min_discount': ('s.discount', '>='),
+    'max_discount': ('s.discount', '<='),
+}
+
+# Sort orders: (columns, direction). store_name and clothing_id are always
+# appended so every row has a unique position to resume the next page from.
+SORT_ORDERS = {
+    'id': ([], 'ASC'),
+    'price': (['s.price'], 'ASC'),
+    'price_desc': (['s.price'], 'DESC'),
+    'discount': (['s.discount'], 'ASC'),
+    'discount_desc': (['s.discount'], 'DESC'),
+}
+
+# Position of each sort column within SEARCH_COLUMNS
+_COLUMN_INDEX = {
+    's.store_name': 0,
+    's.clothing_id': 1,
+    's.price': 2,
+    's.discount': 3,
+}
+
+
+def build_search(filters, sort='id', after=None, limit=PAGE_SIZE):
+    """
+    Compiles a dictionary of search filters into (sql, params). Filters
+    that are missing or None are left out of the query. `after` is the sort
+    key of the last row of the previous page (see sort_key), or None for
+    the first page.
+    """
+    if sort not in SORT_ORDERS:
+        raise ValueError('Unknown sort order: ' + sort)
+    where, params = filter_conditions(filters)
+
+    key_columns, direction = _key_columns(sort)
+    if after is not None:
+        condition, key_params = _after_condition(key_columns, direction,
+                                                 after)
+        where.append(condition)
+        params.extend(key_params)
+
+    sql = """SELECT s.store_name, s.clothing_id, s.price, s.discount,
+        c.clothing_type, c.size, c.gender, c.color, c.brand, c.description,
+        c.image_url, c.aesthetic
+        FROM store_closet AS s JOIN clothes AS c
+            ON c.clothing_id = s.clothing_id"""
+    if where:
+        sql += '\n        WHERE ' + ' AND '.join(where)
+    sql += '\n        ORDER BY ' + ', '.join(col + ' ' + direction
+                                         for col in key_columns)
+    sql += '\n        LIMIT %s'
+    params.append(limit)
+    return sql, params
+
+
+def filter_conditions(filters):
+    """
+    Returns the WHERE conditions (on clothes AS c and store_closet AS s)
+    and their parameters for a dictionary of search filters.
+    """
+    unknown = set(filters) - set(EQUALITY_FILTERS) - set(RANGE_FILTERS)
+    if unknown:
+        raise ValueError('Unknown search filter(s): ' +
+                         ', '.join(sorted(unknown)))
+    where = []
+    params = []
+    for name, column in EQUALITY_FILTERS.items():
+        if filters.get(name) is not None:
+            where.append(column + ' = %s')
+            params.append(filters[name])
+    for name, (column, op) in RANGE_FILTERS.items():
+        if filters.get(name) is not None:
+            where.append(column + ' ' + op + ' %s')
+            params.append(filters[name])
+    return where, params
+
+
+def sort_key(row, sort='id'):
+    """
+    Returns the values of a result row that the next page resumes after.
+    """
+    key_columns, _ = _key_columns(sort)
+    return tuple(row[_COLUMN_INDEX[col]] for col in key_columns)
+
+
+def search_store(conn, filters, sort='id', after=None, limit=PAGE_SIZE):
+    """
+    Yields one page of search results as they arrive from the server.
+    """
+    sql, params = build_search(filters, sort, after, limit)
+    return stmts.stream_sql(conn, sql, params)
+
+
+def iter_search_pages(conn, filters, sort='id', page_size=PAGE_SIZE):
+    """
+    Yields successive pages (lists of rows) of search results, fetching
+    each page only when it is asked for. Pages are cached until the store
+    they come from changes.
+    """
+    if filters.get('store_name') is not None:
+        tags = [('store', filters['store_name'])]
+    else:
+        tags = [('all_stores',)]
+    after = None
+    while True:
+        sql, params = build_search(filters, sort, after, page_size)
+        page = query_cache.get_or_load(
+            sql, params,
+            lambda: list(stmts.stream_sql(conn, sql, params)), tags)
+        if not page:
+            return
+        yield page
+        if len(page) < page_size:
+            return
+        after = sort_key(page[-1], sort)
+
+
+def _key_columns(sort):
+    columns, direction = SORT_ORDERS[sort]
+    return columns + ['s.store_name', 's.clothing_id'], direction
+
+
+def _after_condition(key_columns, direction, after):
+    """
+    Builds the keyset condition "row comes after `after`" in the given
+    sort direction, expanded into ORs of equalities so that MySQL can use
+    a range scan on the leading index column.
+    """
+    op = '>' if direction == 'ASC' else '<'
+    terms = []
+    params = []
+    for i, column in enumerate(key_columns):
+        parts = [col + ' = %s' for col in key_columns[:i]]
+        parts.append(column + ' ' + op + ' %s')
+        terms.append('(' + ' AND '.join(parts) + ')')
+        params.extend(after[:i])
+        params.append(after[i])
+    return '(' + ' OR '.join(terms) + ')', params
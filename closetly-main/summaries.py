@@ -0,0 +1,207 @@
+"""
+Dashboards of store inventories and personal closets, read from summary
+tables (store_summary, store_type_summary and closet_summary) instead of
+computed with scans of store_closet, personal_closet and clothes. The
+triggers in setup-routines.sql (setup-sqlite.sql on SQLite) adjust the one
+summary row each write to store_closet or personal_closet touches, so
+every write path keeps them current: selling, adding and removing store
+items, repricing and markdowns, and changes to a closet's wears,
+cleanliness or sharing. A dashboard is then one or two primary key
+lookups, however big the closets grow.
+
+Writes that get past the triggers (changing the clothing type or size of
+an item in clothes, or loading rows with the triggers dropped) leave the
+summaries behind. check reports every summary that differs from the
+closets and rebuild recomputes them all:
+
+    $ python3 summaries.py --check
+    $ python3 summaries.py --rebuild --db sqlite:/tmp/closetly.db
+
+The dashboards, check and rebuild are coroutines taking a Db (see db.py);
+from blocking code use db.call(conn, summaries.store_dashboard, ...).
+"""
+import time
+
+import backends
+import db
+import pool
+from statements import STATEMENTS
+
+# Each summary table, the number of key columns it starts with, and the
+# query that computes its rows from the closets
+SUMMARIES = [
+    ('store_summary', 1,
+     """SELECT store_name, COUNT(*), SUM(price), SUM(original_price),
+         SUM(discount), SUM(discount > 0)
+     FROM store_closet
+     GROUP BY store_name"""),
+    ('store_type_summary', 3,
+     """SELECT s.store_name, c.clothing_type, c.size, COUNT(*)
+     FROM store_closet AS s JOIN clothes AS c
+         ON c.clothing_id = s.clothing_id
+     GROUP BY s.store_name, c.clothing_type, c.size"""),
+    ('closet_summary', 1,
+     """SELECT user_id, COUNT(*), SUM(IFNULL(num_wears, 0)),
+         SUM(IFNULL(is_clean, 0)), SUM(shared)
+     FROM personal_closet
+     GROUP BY user_id"""),
+]
+
+# Largest difference between two sums of prices that is not drift (SQLite
+# adds prices up in floating point)
+TOLERANCE = 0.005
+
+
+def _money(value):
+    return round(float(value or 0), 2)
+
+
+def _store_totals(row):
+    items, retail_value, full_value, discount_total, discounted = row
+    return {
+        'items': items,
+        'retail_value': _money(retail_value),
+        'full_value': _money(full_value),
+        'average_discount': (round(float(discount_total) / items, 1)
+                             if items else 0.0),
+        'discounted_items': discounted,
+    }
+
+
+async def store_dashboard(db, store_name):
+    """
+    Returns the totals of a store's inventory (items, value at retail and
+    at full price, average discount and items on sale) and its items by
+    clothing type and size, most first.
+    """
+    row = await db.fetch_one(STATEMENTS['store_summary'], (store_name,))
+    by_type = await db.fetch_all(STATEMENTS['store_type_summary'],
+                                 (store_name,))
+    dashboard = {'store_name': store_name}
+    dashboard.update(_store_totals(row or (0, 0, 0, 0, 0)))
+    dashboard['by_type'] = [
+        {'clothing_type': clothing_type, 'size': size, 'items': items}
+        for clothing_type, size, items in by_type]
+    return dashboard
+
+
+async def store_dashboards(db):
+    """
+    Returns the totals of every store that has items, by store name.
+    """
+    rows = await db.fetch_all(STATEMENTS['all_store_summaries'])
+    return [dict(store_name=row[0], **_store_totals(row[1:]))
+            for row in rows]
+
+
+async def closet_dashboard(db, user_id):
+    """
+    Returns how a user's personal closet is used: its pieces, how often
+    they have been worn, and how many are clean, dirty and shared.
+    """
+    row = await db.fetch_one(STATEMENTS['closet_summary'], (user_id,))
+    items, wears, clean, shared = row or (0, 0, 0, 0)
+    return {
+        'user_id': user_id,
+        'items': items,
+        'total_wears': int(wears),
+        'average_wears': round(int(wears) / items, 1) if items else 0.0,
+        'clean': clean,
+        'dirty': items - clean,
+        'shared': shared,
+    }
+
+
+async def rebuild(db):
+    """
+    Recomputes every summary from the closets, in one transaction. Returns
+    the seconds it took.
+    """
+    start = time.perf_counter()
+    async with db.transaction():
+        for table, _, query in SUMMARIES:
+            await db.execute('DELETE FROM ' + table, prepared=False)
+            await db.execute('INSERT INTO ' + table + ' ' + query,
+                             prepared=False)
+    return time.perf_counter() - start
+
+
+def _differs(stored, computed):
+    return any(abs(float(a or 0) - float(b or 0)) > TOLERANCE
+               for a, b in zip(stored, computed))
+
+
+async def check(db):
+    """
+    Compares every summary with the closets and returns (table, key) for
+    each summary row that differs. Rows the triggers have counted down to
+    zero are the same as no row.
+    """
+    drifted = []
+    for table, key_columns, query in SUMMARIES:
+        computed = {row[:key_columns]: row[key_columns:]
+                    for row in await db.fetch_all(query, prepared=False)}
+        stored = {row[:key_columns]: row[key_columns:]
+                  for row in await db.fetch_all('SELECT * FROM ' + table,
+                                                prepared=False)}
+        for key in sorted(set(computed) | set(stored), key=str):
+            values = stored.get(key) or computed.get(key)
+            zeros = (0,) * len(values)
+            if _differs(stored.get(key, zeros), computed.get(key, zeros)):
+                drifted.append((table, key))
+    return drifted
+
+
+def main():
+    run_command('summaries', 'summary', 'closets', rebuild, check,
+                lambda row: row[0] + ' ' + ', '.join(map(str, row[1])))
+
+
+def run_command(plural, singular, source, rebuild_fn, check_fn, describe):
+    """
+    Runs the --check/--rebuild command line shared by this module and
+    prices.py. plural and singular name the derived rows, source names
+    what they are computed from, and describe(row) names a row returned
+    by check_fn.
+    """
+    # only needed when run as a script, not when the app imports this
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Check or rebuild the ' + plural + '.')
+    parser.add_argument('--rebuild', action='store_true',
+                        help='recompute every ' + singular + ' from the ' +
+                             source)
+    parser.add_argument('--check', action='store_true',
+                        help='list the ' + plural + ' that differ from the ' +
+                             source + ' (the default)')
+    parser.add_argument('--db', metavar='BACKEND',
+                        help="'mysql' or 'sqlite:PATH' (default: "
+                             "$CLOSETLY_DB, else mysql)")
+    args = parser.parse_args()
+    spec = args.db or backends.configured()
+    try:
+        backends.parse(spec)
+    except ValueError as err:
+        parser.error(str(err))
+
+    conn = backends.connect(spec, *pool.ROLE_CREDENTIALS['appadmin'])
+    try:
+        if args.rebuild:
+            seconds = db.call(conn, rebuild_fn)
+            print('Rebuilt the ' + plural + ' in ' +
+                  str(round(seconds * 1000, 1)) + ' ms.')
+        if args.check or not args.rebuild:
+            drifted = db.call(conn, check_fn)
+            for row in drifted:
+                print(describe(row) + ' differs from the ' + source)
+            if drifted:
+                raise SystemExit(str(len(drifted)) + ' ' + plural +
+                                 ' differ; run with --rebuild to '
+                                 'recompute them.')
+            print('Every ' + singular + ' matches the ' + source + '.')
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
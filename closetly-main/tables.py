@@ -0,0 +1,105 @@
+"""
+Plain-text tables for the command-line app. Rows are printed as they
+arrive: the column widths are worked out from the header and the first
+SAMPLE_ROWS rows, and every later row is printed at once in those widths.
+Numbers are right-aligned and values too wide for their column are cut
+short with '...'.
+
+    tables.print_table(rows, ['clothing_id', 'clothing_type', 'size'])
+
+Rows may be tuples/lists in column order or dicts keyed by column name,
+and any iterable works, e.g. a stream of rows from the server.
+"""
+import numbers
+import sys
+
+# Widest a column gets, in characters
+MAX_WIDTH = 30
+# Rows read before the column widths are fixed
+SAMPLE_ROWS = 50
+# Space between columns
+GAP = '  '
+
+
+def _text(value):
+    if value is None:
+        return ''
+    return str(value)
+
+
+def _is_number(value):
+    # numbers.Number covers Decimal without importing decimal
+    return isinstance(value, numbers.Number) and not isinstance(value, bool)
+
+
+class TableWriter:
+    """
+    Prints a table one row at a time. The first SAMPLE_ROWS rows are held
+    back to size the columns; close() prints any rows still held back.
+    """
+
+    def __init__(self, columns, out=None, max_width=MAX_WIDTH,
+                 sample_rows=SAMPLE_ROWS):
+        self.columns = list(columns)
+        self.out = out or sys.stdout
+        self.max_width = max_width
+        self.sample_rows = sample_rows
+        self.count = 0
+        self._held = []
+        self._widths = None
+
+    def write(self, row):
+        if isinstance(row, dict):
+            row = [row.get(column) for column in self.columns]
+        self.count += 1
+        if self._widths is None:
+            self._held.append(row)
+            if len(self._held) >= self.sample_rows:
+                self._flush()
+            return
+        self._print(row)
+
+    def close(self):
+        """
+        Prints the rows still held back (or just the header, if there were
+        no rows) and returns the number of rows written.
+        """
+        if self._widths is None:
+            self._flush()
+        return self.count
+
+    def _flush(self):
+        widths = [len(column) for column in self.columns]
+        for row in self._held:
+            for i, value in enumerate(row):
+                widths[i] = max(widths[i], len(_text(value)))
+        self._widths = [min(width, self.max_width) for width in widths]
+        self.out.write(GAP.join(self._cell(column, i, False)
+                                for i, column in enumerate(self.columns))
+                       .rstrip() + '\n')
+        for row in self._held:
+            self._print(row)
+        self._held = []
+
+    def _cell(self, value, i, right):
+        text = _text(value)
+        width = self._widths[i]
+        if len(text) > width:
+            text = text[:max(width - 3, 0)] + '...'[:width]
+        return text.rjust(width) if right else text.ljust(width)
+
+    def _print(self, row):
+        self.out.write(GAP.join(self._cell(value, i, _is_number(value))
+                                for i, value in enumerate(row))
+                       .rstrip() + '\n')
+
+
+def print_table(rows, columns, out=None, max_width=MAX_WIDTH):
+    """
+    Prints rows as a table under the given column names, as they arrive.
+    Returns the number of rows printed.
+    """
+    writer = TableWriter(columns, out, max_width)
+    for row in rows:
+        writer.write(row)
+    return writer.close()
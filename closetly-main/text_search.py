@@ -0,0 +1,196 @@
+"""
+Keyword search over the descriptions, brands and aesthetics of every
+piece of clothing, with ranked results and facet counts. Words are looked
+up in a full-text index (FULLTEXT ft_clothes_text in setup.sql, or the
+clothes_text FTS5 table on the stand-in), so a search never scans the
+catalog. Both indexes are kept up to date by the database itself as
+clothes are added, changed or removed, and store prices come straight
+from store_closet, so sold items drop out of the price facets at once.
+
+Results are ranked by relevance and can be narrowed by the same filters
+as store_search. The facet counts (clothing type, size, color, store and
+price bucket) of every match come from one GROUP BY over the matches,
+which are folded into the separate facets here.
+
+search() is a coroutine taking a Db (see db.py).
+"""
+import re
+
+from store_search import filter_conditions
+
+# Number of results shown per page
+PAGE_SIZE = 20
+# Deepest result a search pages to; relevance past this is noise
+MAX_RESULTS = 1000
+
+TEXT_COLUMNS = ['clothing_id', 'clothing_type', 'size', 'gender', 'color',
+                'brand', 'description', 'aesthetic', 'store_name', 'price',
+                'discount', 'score']
+
+# Facets counted for every search, in the order of the GROUP BY columns
+FACETS = ['clothing_type', 'size', 'color', 'store_name', 'price']
+# Upper bounds (in USD) of the price buckets; the last bucket is open
+PRICE_BUCKETS = [25, 50, 100, 200]
+# Store and price facet of items that are not for sale in a store
+NOT_FOR_SALE = 'not for sale'
+
+# An item's price is its listing in the store that carries it
+_STORE_JOIN = """LEFT JOIN store_closet AS s
+            ON s.store_name = c.store_name AND s.clothing_id = c.clothing_id"""
+_MYSQL_MATCH = """MATCH (c.description, c.brand, c.aesthetic)
+            AGAINST (%s IN BOOLEAN MODE)"""
+
+
+def bucket_labels():
+    """
+    Returns the label of each price bucket, e.g. 'under $25', '$25-$50',
+    '$200 and up'.
+    """
+    labels = ['under $' + str(PRICE_BUCKETS[0])]
+    for low, high in zip(PRICE_BUCKETS, PRICE_BUCKETS[1:]):
+        labels.append('$' + str(low) + '-$' + str(high))
+    labels.append('$' + str(PRICE_BUCKETS[-1]) + ' and up')
+    return labels
+
+
+def _bucket_sql():
+    cases = ' '.join('WHEN s.price < ' + str(bound) + ' THEN ' + str(i)
+                     for i, bound in enumerate(PRICE_BUCKETS))
+    return 'CASE WHEN s.price IS NULL THEN NULL ' + cases + ' ELSE ' + \
+        str(len(PRICE_BUCKETS)) + ' END'
+
+
+def words(text):
+    """
+    Returns the lowercased words of a search, raising ValueError if there
+    are none.
+    """
+    found = re.findall(r'\w+', str(text).lower())
+    if not found:
+        raise ValueError('Enter some words to search for.')
+    return found
+
+
+def _match(text, on_standin):
+    """
+    Returns (table searched, its clothing_id column, WHERE condition, score
+    expression, params of the condition, params of the score) that find the
+    clothes matching every word of a search.
+    """
+    terms = words(text)
+    if on_standin:
+        # each word is quoted so FTS5 never reads it as syntax
+        query = ' '.join('"' + term + '"' for term in terms)
+        return ('clothes_text', 'clothes_text.rowid', 'clothes_text MATCH %s',
+                '-bm25(clothes_text)', [query], [])
+    # boolean mode: every word must match, and rarer words and more
+    # mentions still rank higher
+    query = ' '.join('+' + term for term in terms)
+    return ('clothes AS c', 'c.clothing_id', _MYSQL_MATCH, _MYSQL_MATCH,
+            [query], [query])
+
+
+def _matches_from(table, key):
+    """
+    Returns the FROM clause joining the matches in the searched table to
+    clothes (as c) and their store listing (as s).
+    """
+    if table == 'clothes AS c':
+        return table + '\n        ' + _STORE_JOIN
+    return table + """ JOIN clothes AS c ON c.clothing_id = """ + key + \
+        '\n        ' + _STORE_JOIN
+
+
+def build_text_search(text, filters=None, offset=0, limit=PAGE_SIZE,
+                      on_standin=False):
+    """
+    Compiles a search into (sql, params) returning one page of results
+    (TEXT_COLUMNS), most relevant first. Without filters, the matches are
+    ranked in the full-text index alone and only the page of them is
+    joined to clothes and store_closet.
+    """
+    if not 0 <= offset < MAX_RESULTS:
+        raise ValueError('Results past the first ' + str(MAX_RESULTS) +
+                         ' are not shown; narrow the search instead.')
+    limit = min(limit, MAX_RESULTS - offset)
+    table, key, condition, score, params, score_params = _match(text,
+                                                                on_standin)
+    where, filter_params = filter_conditions(filters or {})
+    columns = """SELECT c.clothing_id, c.clothing_type, c.size, c.gender,
+            c.color, c.brand, c.description, c.aesthetic, s.store_name,
+            s.price, s.discount, """
+    if not where:
+        sql = columns + """m.score
+        FROM (SELECT """ + key + ' AS clothing_id, ' + score + """ AS score
+              FROM """ + table + """
+              WHERE """ + condition + """
+              ORDER BY score DESC, clothing_id
+              LIMIT %s OFFSET %s) AS m
+            JOIN clothes AS c ON c.clothing_id = m.clothing_id
+            """ + _STORE_JOIN + """
+        ORDER BY m.score DESC, c.clothing_id"""
+        return sql, score_params + params + [limit, offset]
+    sql = columns + score + """ AS score
+        FROM """ + _matches_from(table, key) + """
+        WHERE """ + ' AND '.join([condition] + where) + """
+        ORDER BY score DESC, c.clothing_id
+        LIMIT %s OFFSET %s"""
+    return sql, score_params + params + filter_params + [limit, offset]
+
+
+def build_facets(text, filters=None, on_standin=False):
+    """
+    Compiles the facet counts of a search into (sql, params). Each row is
+    one combination of (clothing_type, size, color, store_name, price
+    bucket index) and how many matches have it.
+    """
+    table, key, condition, _, params, _ = _match(text, on_standin)
+    where, filter_params = filter_conditions(filters or {})
+    sql = """SELECT c.clothing_type, c.size, c.color, s.store_name,
+            """ + _bucket_sql() + """ AS bucket, COUNT(*)
+        FROM """ + _matches_from(table, key) + """
+        WHERE """ + ' AND '.join([condition] + where) + """
+        GROUP BY c.clothing_type, c.size, c.color, s.store_name, bucket"""
+    return sql, params + filter_params
+
+
+def fold_facets(rows):
+    """
+    Folds the rows of a facet query into {facet: [(value, count)]}, most
+    common value first, and the total number of matches.
+    """
+    labels = bucket_labels()
+    counts = {facet: {} for facet in FACETS}
+    total = 0
+    for row in rows:
+        clothing_type, size, color, store_name, bucket, count = row
+        values = [clothing_type, size, color,
+                  NOT_FOR_SALE if store_name is None else store_name,
+                  NOT_FOR_SALE if bucket is None else labels[int(bucket)]]
+        for facet, value in zip(FACETS, values):
+            counts[facet][value] = counts[facet].get(value, 0) + count
+        total += count
+    return ({facet: sorted(counted.items(), key=lambda kv: (-kv[1],
+                                                              str(kv[0])))
+             for facet, counted in counts.items()}, total)
+
+
+async def search(db, text, filters=None, offset=0, limit=PAGE_SIZE,
+                 facets=True):
+    """
+    Returns {'items': [rows of TEXT_COLUMNS], 'facets': {facet: [(value,
+    count)]}, 'total': number of matches} for one page of a search. Facets
+    and total are left out if facets is False, e.g. for later pages.
+    """
+    # imported here so the app starts without loading sqlite3
+    import standin
+    on_standin = standin.is_standin(db.conn)
+    # not prepared: the filters change the SQL text from search to search
+    sql, params = build_text_search(text, filters, offset, limit,
+                                    on_standin)
+    result = {'items': await db.fetch_all(sql, params, prepared=False)}
+    if facets:
+        sql, params = build_facets(text, filters, on_standin)
+        result['facets'], result['total'] = fold_facets(
+            await db.fetch_all(sql, params, prepared=False))
+    return result
@@ -0,0 +1,79 @@
+"""
+Signed login tokens. A token carries a logged-in user's Session and the
+time it expires, signed with HMAC-SHA256, so checking one needs no
+database lookup and no shared state: every process holding the same key
+accepts the tokens the others handed out.
+
+    signer = tokens.Signer()
+    token = signer.sign(session, 3600)
+    signer.verify(token)  # (Session, expiry), or None if forged/expired
+
+The key comes from CLOSETLY_TOKEN_KEY, so several API servers (or one that
+restarts) can share it. Without it each process makes up its own key, and
+its tokens stop working when it exits.
+"""
+import base64
+import hashlib
+import hmac
+import json
+import os
+import time
+
+from service import Session
+
+# Environment variable holding the signing key
+KEY_VARIABLE = 'CLOSETLY_TOKEN_KEY'
+# Bytes in a key made up by a process
+KEY_BYTES = 32
+
+
+def _encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def _decode(text):
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+
+class Signer:
+    """
+    Signs Sessions into tokens and checks tokens, with one key.
+    """
+
+    def __init__(self, key=None):
+        if key is None:
+            key = os.environ.get(KEY_VARIABLE) or os.urandom(KEY_BYTES)
+        if isinstance(key, str):
+            key = key.encode('utf-8')
+        self._key = key
+
+    def _signature(self, payload):
+        return hmac.new(self._key, payload.encode('ascii'),
+                        hashlib.sha256).digest()
+
+    def sign(self, session, ttl):
+        """
+        Returns a token for the session that is valid for ttl seconds.
+        """
+        expires = int(time.time() + ttl)
+        payload = _encode(json.dumps(list(session) + [expires],
+                                     separators=(',', ':')).encode('utf-8'))
+        return payload + '.' + _encode(self._signature(payload))
+
+    def verify(self, token):
+        """
+        Returns (Session, expiry as a Unix time) for a token this key
+        signed that has not expired yet, or None.
+        """
+        payload, _, signature = (token or '').partition('.')
+        try:
+            # a non-ASCII token raises ValueError too
+            if not hmac.compare_digest(_decode(signature),
+                                       self._signature(payload)):
+                return None
+        except ValueError:
+            return None
+        *fields, expires = json.loads(_decode(payload))
+        if expires <= time.time():
+            return None
+        return Session(*fields), expires
@@ -0,0 +1,248 @@
+"""
+Multi-threaded load test of logging wears. Each client thread has its own
+connection and keeps logging outfits of random pieces of random closets
+(popular closets far more often), while a roller thread adds the logged
+wears up every --interval seconds, the way the API does (see wears.py). At
+the end it checks that num_wears grew by exactly the number of wears
+logged, and reports wears logged per second and p50/p95/p99 latency for
+each number of concurrent clients.
+
+With --direct it also runs the way wears used to be counted for
+comparison: an UPDATE of the piece's personal_closet row for every wear,
+which makes clients logging the same popular pieces wait on each other's
+row locks.
+
+Usage:
+    $ python3 wear_loadtest.py --scale 100000
+    $ python3 wear_loadtest.py --clients 1,8,64 --seconds 10 --direct
+    $ python3 wear_loadtest.py --standin /tmp/closetly.db
+
+Load tests against MySQL replace the contents of the closetly database.
+The stand-in must be a file (not ':memory:') so every client can open it,
+and SQLite lets only one client write at a time.
+"""
+import argparse
+import random
+import threading
+import time
+
+import benchmark
+import datagen
+import db
+import standin
+import wears
+
+# Numbers of concurrent clients measured by default
+CLIENT_COUNTS = [1, 8, 64]
+# Most pieces in one logged outfit
+MAX_OUTFIT = 4
+# Closets sampled for the clients to log wears in
+CLOSETS = 1000
+
+DIRECT_WEAR = """UPDATE personal_closet
+    SET num_wears = IFNULL(num_wears, 0) + 1, is_clean = 0
+    WHERE user_id = %s AND clothing_id = %s"""
+
+
+def sample_closets(conn):
+    """
+    Returns [(user_id, [clothing_id, ...])] for up to CLOSETS closets.
+    """
+    cursor = conn.cursor()
+    cursor.execute('SELECT user_id, clothing_id FROM personal_closet ' +
+                   'LIMIT ' + str(CLOSETS * 20))
+    closets = {}
+    for user_id, clothing_id in cursor.fetchall():
+        closets.setdefault(user_id, []).append(clothing_id)
+    cursor.close()
+    return list(closets.items())[:CLOSETS]
+
+
+def total_wears(conn):
+    cursor = conn.cursor()
+    cursor.execute('SELECT SUM(IFNULL(num_wears, 0)) FROM personal_closet')
+    total = int(cursor.fetchall()[0][0] or 0)
+    cursor.close()
+    return total
+
+
+def log_outfit(conn, user_id, clothing_ids):
+    """
+    Logs the wears and returns how many were logged.
+    """
+    return len(db.call(conn, wears.log_outfit, user_id, clothing_ids))
+
+
+def direct_outfit(conn, user_id, clothing_ids):
+    """
+    Counts the wears the old way, one row UPDATE each.
+    """
+    cursor = conn.cursor()
+    for clothing_id in clothing_ids:
+        cursor.execute(DIRECT_WEAR, (user_id, clothing_id))
+    conn.commit()
+    cursor.close()
+    return len(clothing_ids)
+
+
+class Client(threading.Thread):
+    """
+    One client: a connection that logs outfits until told to stop.
+    """
+
+    def __init__(self, connect, log, closets, stop, seed):
+        threading.Thread.__init__(self, daemon=True)
+        self._connect = connect
+        self._log = log
+        self._closets = closets
+        self._done = stop
+        self._rng = random.Random(seed)
+        self.latencies = []
+        self.wears = 0
+        self.error = None
+
+    def run(self):
+        conn = self._connect()
+        rng = self._rng
+        # the first closets are picked far more often
+        weights = [1 / (i + 1) for i in range(len(self._closets))]
+        try:
+            while not self._done.is_set():
+                user_id, pieces = rng.choices(self._closets, weights)[0]
+                outfit = rng.sample(pieces,
+                                    min(len(pieces),
+                                        rng.randint(1, MAX_OUTFIT)))
+                start = time.perf_counter()
+                self.wears += self._log(conn, user_id, outfit)
+                self.latencies.append(time.perf_counter() - start)
+        except Exception as e:
+            self.error = e
+        finally:
+            conn.close()
+
+
+class Roller(threading.Thread):
+    """
+    Adds the logged wears up every `interval` seconds until told to stop.
+    """
+
+    def __init__(self, connect, interval, stop):
+        threading.Thread.__init__(self, daemon=True)
+        self._connect = connect
+        self._interval = interval
+        self._done = stop
+        self.rollups = []
+        self.error = None
+
+    def run(self):
+        conn = self._connect()
+        try:
+            while not self._done.wait(self._interval):
+                start = time.perf_counter()
+                added = db.call(conn, wears.roll_up_all)
+                self.rollups.append((added, time.perf_counter() - start))
+        except Exception as e:
+            self.error = e
+        finally:
+            conn.close()
+
+
+def run_clients(connect, log, closets, clients, seconds, interval, seed):
+    """
+    Runs `clients` client threads (and a roller, unless interval is None)
+    for `seconds`. Returns (summary of the latencies, wears logged,
+    roll-ups as (wears, seconds), errors).
+    """
+    stop = threading.Event()
+    threads = [Client(connect, log, closets, stop, seed + i)
+               for i in range(clients)]
+    roller = Roller(connect, interval, stop) if interval else None
+    start = time.perf_counter()
+    for thread in threads + ([roller] if roller else []):
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads + ([roller] if roller else []):
+        thread.join()
+    elapsed = time.perf_counter() - start
+    latencies = [s for thread in threads for s in thread.latencies]
+    errors = [thread.error for thread in threads if thread.error]
+    if roller and roller.error:
+        errors.append(roller.error)
+    return (benchmark.summarize(latencies, elapsed),
+            sum(thread.wears for thread in threads),
+            roller.rollups if roller else [], errors)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test logging wears.')
+    datagen.add_size_arguments(parser)
+    parser.add_argument('--clients', default=','.join(map(str, CLIENT_COUNTS)),
+                        help='comma-separated numbers of concurrent clients '
+                             '(default 1,8,64)')
+    parser.add_argument('--seconds', type=float, default=10,
+                        help='seconds to run each number of clients '
+                             '(default 10)')
+    parser.add_argument('--interval', type=float,
+                        default=wears.ROLLUP_INTERVAL,
+                        help='seconds between roll-ups (default ' +
+                             str(wears.ROLLUP_INTERVAL) + ')')
+    parser.add_argument('--direct', action='store_true',
+                        help='also time updating num_wears for every wear')
+    args = parser.parse_args()
+    if args.standin == ':memory:':
+        parser.error('the stand-in must be a file for several clients')
+
+    conn = datagen.connect(args.standin)
+    print('Generating data...')
+    datagen.populate(conn, datagen.sizes_from_args(args), args.seed)
+    closets = sample_closets(conn)
+
+    def connect():
+        if args.standin:
+            return standin.connect(args.standin, create_schema=False)
+        return datagen.connect()
+
+    paths = [('log', log_outfit, args.interval)]
+    if args.direct:
+        paths.append(('direct', direct_outfit, None))
+
+    print('path'.ljust(8) + 'clients'.rjust(8) + 'wears'.rjust(10) +
+          'wears/s'.rjust(10) + 'p50 ms'.rjust(9) + 'p95 ms'.rjust(9) +
+          'p99 ms'.rjust(9) + 'roll-ups'.rjust(10))
+    failed = False
+    for name, log, interval in paths:
+        for clients in [int(n) for n in args.clients.split(',')]:
+            before = total_wears(conn)
+            summary, logged, rollups, errors = run_clients(
+                connect, log, closets, clients, args.seconds, interval,
+                args.seed)
+            # whatever the roller had not got to yet
+            db.call(conn, wears.roll_up_all)
+            counted = total_wears(conn) - before
+            print(name.ljust(8) + str(clients).rjust(8) +
+                  str(logged).rjust(10) +
+                  str(int(logged / args.seconds)).rjust(10) +
+                  ('%.2f' % summary['p50_ms']).rjust(9) +
+                  ('%.2f' % summary['p95_ms']).rjust(9) +
+                  ('%.2f' % summary['p99_ms']).rjust(9) +
+                  str(len(rollups)).rjust(10))
+            if rollups:
+                slowest = max(seconds for _, seconds in rollups)
+                print('  largest roll-up: ' +
+                      str(max(added for added, _ in rollups)) +
+                      ' wears; slowest: %.1f ms' % (slowest * 1000))
+            for e in errors[:3]:
+                print('  client error: ' + str(e))
+            if counted != logged:
+                print('  num_wears grew by ' + str(counted) + ', not ' +
+                      str(logged))
+            failed = failed or counted != logged or bool(errors)
+    conn.close()
+    if failed:
+        raise SystemExit('Some wears were lost or counted twice.')
+    print('Every logged wear was counted exactly once.')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,165 @@
+"""
+Wear tracking. Wearing pieces of one's personal closet is recorded by
+appending rows to wear_log and nothing else, so logging a wear never
+updates (or waits on a lock of) the piece's personal_closet row, and any
+number of users can log wears at once. roll_up then adds the logged wears
+up in set-based batches: one UPDATE adds each piece's new wears to
+personal_closet.num_wears (and marks it as worn, so no longer clean), and
+one UPDATE marks the collaborative closet's copies of pieces worn more than
+USED_AFTER_WEARS times as used. That replaces the condition_update trigger,
+which ran a collab_closet UPDATE for every wear.
+
+The API rolls up every ROLLUP_INTERVAL seconds; the app only logs wears,
+leaving them to that scheduled roll-up. Anything else that logs wears, or
+an app running without the API, can roll them up with
+
+    $ python3 wears.py [--db sqlite:PATH]
+
+The operations are coroutines taking a Db (see db.py); from blocking code
+use db.call(conn, wears.log_outfit, ...).
+"""
+import backends
+import db
+import pool
+from statements import STATEMENTS
+
+# Shared pieces worn more than this many times are no longer 'new'
+USED_AFTER_WEARS = 50
+# Most logged wears (by wear_id) one roll-up transaction adds up; the rest
+# are left to the next one
+ROLLUP_BATCH = 10000
+# Seconds between the API's roll-ups
+ROLLUP_INTERVAL = 5
+# Most pieces logged at once
+MAX_PIECES = 1000
+
+
+def _day(worn_on):
+    """
+    Returns a day given as a date or 'YYYY-MM-DD' (today if None) as
+    'YYYY-MM-DD', raising ValueError if it is not a date.
+    """
+    # imported here so starting the app does not wait for it
+    import datetime
+    if worn_on is None:
+        worn_on = datetime.date.today()
+    elif not isinstance(worn_on, datetime.date):
+        try:
+            worn_on = datetime.date.fromisoformat(str(worn_on))
+        except ValueError:
+            raise ValueError('Days are written YYYY-MM-DD.')
+    return worn_on.isoformat()
+
+
+async def record(db, wears):
+    """
+    Logs wears given as (user_id, clothing_id, worn_on) tuples, with one
+    multi-row INSERT. The pieces are not checked against the closets (see
+    log_outfit). Returns the number of wears logged.
+    """
+    rows = [(int(user_id), int(clothing_id), _day(worn_on))
+            for user_id, clothing_id, worn_on in wears]
+    if rows:
+        async with db.transaction():
+            await db.executemany(STATEMENTS['log_wear'], rows)
+    return len(rows)
+
+
+async def log_outfit(db, user_id, clothing_ids, worn_on=None):
+    """
+    Logs that a user wore pieces of their personal closet on a day (today
+    by default). Returns the clothing IDs logged; IDs that are not in the
+    user's closet are skipped.
+    """
+    clothing_ids = list(dict.fromkeys(int(i) for i in clothing_ids))
+    if not clothing_ids:
+        raise ValueError('Give the clothing IDs of the pieces worn.')
+    if len(clothing_ids) > MAX_PIECES:
+        raise ValueError('At most ' + str(MAX_PIECES) + ' pieces can be ' +
+                         'logged at once.')
+    worn_on = _day(worn_on)
+    owned = await in_closet(db, user_id, clothing_ids)
+    logged = [clothing_id for clothing_id in clothing_ids
+              if clothing_id in owned]
+    await record(db, [(user_id, clothing_id, worn_on)
+                      for clothing_id in logged])
+    return logged
+
+
+async def in_closet(db, user_id, clothing_ids):
+    """
+    Returns the set of the clothing IDs that are in a user's personal
+    closet.
+    """
+    clothing_ids = sorted(set(clothing_ids))
+    # a plain read, which takes no locks on the closet
+    sql = 'SELECT clothing_id FROM personal_closet WHERE user_id = %s ' + \
+          'AND clothing_id IN (' + ', '.join(['%s'] * len(clothing_ids)) + ')'
+    return {row[0] for row in await db.fetch_all(sql,
+                                                 [user_id] + clothing_ids)}
+
+
+async def roll_up(db, batch=ROLLUP_BATCH):
+    """
+    Adds up to `batch` logged wears up into the closets, in one
+    transaction, and returns how many it added up (0 once there are none
+    left). Concurrent roll-ups never add a wear up twice: each claims its
+    wears by setting their rollup_id.
+    """
+    first = await db.fetch_value(STATEMENTS['first_pending_wear'])
+    if first is None:
+        return 0
+    async with db.transaction():
+        started = await db.execute(STATEMENTS['start_wear_rollup'])
+        rollup_id = started.lastrowid
+        claimed = await db.execute(STATEMENTS['claim_wears'],
+                                   (rollup_id, first + batch))
+        await db.execute(STATEMENTS['add_wears'], (rollup_id, rollup_id))
+        await db.execute(STATEMENTS['wear_out_collab'],
+                         (rollup_id, USED_AFTER_WEARS))
+        await db.execute(STATEMENTS['finish_wear_rollup'],
+                         (claimed.rowcount, rollup_id))
+    return claimed.rowcount
+
+
+async def roll_up_all(db, batch=ROLLUP_BATCH):
+    """
+    Rolls up batches until every logged wear is added up. Returns the
+    number of wears added up.
+    """
+    total = 0
+    while True:
+        added = await roll_up(db, batch)
+        if not added:
+            return total
+        total += added
+
+
+def main():
+    # only needed when run as a script, not when the app imports this
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Add the logged wears up into the closets.')
+    parser.add_argument('--batch', type=int, default=ROLLUP_BATCH,
+                        help='most wears per transaction (default ' +
+                             str(ROLLUP_BATCH) + ')')
+    parser.add_argument('--db', metavar='BACKEND',
+                        help="'mysql' or 'sqlite:PATH' (default: "
+                             "$CLOSETLY_DB, else mysql)")
+    args = parser.parse_args()
+    spec = args.db or backends.configured()
+    try:
+        backends.parse(spec)
+    except ValueError as err:
+        parser.error(str(err))
+
+    conn = backends.connect(spec, *pool.ROLE_CREDENTIALS['appadmin'])
+    try:
+        print('Added up ' + str(db.call(conn, roll_up_all, args.batch)) +
+              ' wears.')
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()